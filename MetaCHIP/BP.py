@@ -21,6 +21,7 @@ import re
 import sys
 import copy
 import glob
+import shlex
 import shutil
 import platform
 import warnings
@@ -28,7 +29,6 @@ import argparse
 import itertools
 import subprocess
 import numpy as np
-import multiprocessing as mp
 from time import sleep
 from ete3 import Tree
 from Bio import SeqIO, AlignIO, Align
@@ -36,7 +36,7 @@ from Bio.Seq import Seq
 from Bio.Alphabet import IUPAC
 from Bio.SeqRecord import SeqRecord
 from Bio.Graphics import GenomeDiagram
-from Bio.SeqFeature import FeatureLocation
+from Bio.SeqFeature import SeqFeature, FeatureLocation
 from Bio.Graphics.GenomeDiagram import CrossLink
 from reportlab.lib import colors
 from reportlab.lib.units import cm
@@ -47,6 +47,23 @@ import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.pyplot as plt
 from MetaCHIP.MetaCHIP_config import config_dict
+from MetaCHIP.best_match import get_BM_hits_worker, concatenate_multi_rank_BM_hits, get_rank_BM_hits, get_BM_candidates, get_query_to_subjects, get_genome_sort_rank
+from MetaCHIP.candidate_table import create_candidate_table, find_candidates, save_candidate_table, load_candidate_table, get_bidirection_free_order, match_category_list
+from MetaCHIP.candidate_table import set_validated_direction, combine_candidate_tables, get_occurrence_strings, get_direction_strings, read_candidate_table_txt
+from MetaCHIP.contig_match import get_contig_match_hits, classify_contig_matches
+from MetaCHIP.annotation_index import build_annotation_index_from_gbk, load_annotation_index, get_flanking_window, read_contig_sequence
+from MetaCHIP.id_table import get_id_table, add_grouping_to_id_table, get_genome_group_array, get_gene_ids, get_genome_of_genes, get_gene_names, get_gene_name
+from MetaCHIP.tool_runner import set_tool_runner_settings, parse_tool_timeouts, get_tool_run_summary, run_tool
+from MetaCHIP.tool_runner import run_required_tool, sort_file_lines, copy_to_folder, move_to_folder, remove_path
+from MetaCHIP.thread_budget import acquire_threads, release_threads, get_fasttree_env
+from MetaCHIP.worker_pool import get_worker_pool, publish_worker_context, get_worker_context, release_worker_context
+from MetaCHIP.job_executor import get_executor_settings, check_executor_settings, run_tasks
+from MetaCHIP.hit_store import update_hit_store_genomes
+from MetaCHIP.compressed_io import open_file, concatenate_text_files
+from MetaCHIP.protein_store import get_protein_store, open_protein_store, write_protein_sequences
+from MetaCHIP.checkpoint_manifest import open_checkpoint_manifest, get_unit_hash, get_finished_unit, record_finished_unit
+from MetaCHIP.result_cache import set_result_cache_settings, get_tool_unit_hash, get_cached_result, store_cached_result, trim_result_cache
+from MetaCHIP.identity_histogram import save_identity_histograms, get_histogram_percentile, get_histogram_identities
 # from PIL import Image
 
 
@@ -93,16 +110,18 @@ def force_create_folder(folder_to_create):
     os.mkdir(folder_to_create)
 
 
+def create_missing_folder(folder_to_create):
+    if not os.path.isdir(folder_to_create):
+        os.mkdir(folder_to_create)
+
+
 def rm_folder_file(target_re):
     target_list = glob.glob(target_re)
 
     for target in target_list:
 
-        if os.path.isdir(target) is True:
-            os.system('rm -r %s' % target)
-
-        elif os.path.isfile(target) is True:
-            os.system('rm %s' % target)
+        if (os.path.isdir(target) is True) or (os.path.isfile(target) is True):
+            remove_path(target)
 
 
 def unique_list_elements(list_input):
@@ -186,26 +205,32 @@ def get_group_index_list():
     return group_index_list
 
 
-def index_grouping_file(input_file, output_file):
+def get_grouping_index_list(input_file):
 
-    output_grouping_with_index = open(output_file, 'w')
+    # genomes are indexed within their group in file order, e.g. A_1,genome
+    grouping_index_list = []
     current_group = ''
     current_index = 1
     for each_genome in open(input_file):
         each_genome_split = each_genome.strip().split(',')
         group_id = each_genome_split[0]
         genome_id = each_genome_split[1]
-        if current_group == '':
-            current_group = group_id
-            current_index = 1
-            output_grouping_with_index.write('%s_%s,%s\n' % (group_id, current_index, genome_id))
-        elif current_group == group_id:
+        if current_group == group_id:
             current_index += 1
-            output_grouping_with_index.write('%s_%s,%s\n' % (group_id, current_index, genome_id))
-        elif current_group != group_id:
+        else:
             current_group = group_id
             current_index = 1
-            output_grouping_with_index.write('%s_%s,%s\n' % (group_id, current_index, genome_id))
+        grouping_index_list.append(('%s_%s' % (group_id, current_index), genome_id))
+
+    return grouping_index_list
+
+
+def index_grouping_file(input_file, output_file):
+
+    output_grouping_with_index = open(output_file, 'w')
+    for group_index, genome_id in get_grouping_index_list(input_file):
+        output_grouping_with_index.write('%s,%s\n' % (group_index, genome_id))
+    output_grouping_with_index.close()
 
 
 def cluster_2_grouping_file(cluster_file, grouping_file):
@@ -222,7 +247,7 @@ def cluster_2_grouping_file(cluster_file, grouping_file):
             t1_handle.write('%s,%s\n' % (cluster_id, genome_id))
     t1_handle.close()
 
-    os.system('cat %s | sort > %s' % (t1, t1_sorted))
+    sort_file_lines(t1, t1_sorted)
     group_index_list = get_group_index_list()
     grouping_file_handle = open(grouping_file, 'w')
 
@@ -259,36 +284,6 @@ def uniq_list(input_list):
     return output_list
 
 
-def get_qualigied_blast_hits(pwd_blast_results, align_len_cutoff, cover_cutoff, genome_name_list, pwd_qual_iden_file):
-
-    out_temp = open(pwd_qual_iden_file, 'w')
-    for match in open(pwd_blast_results):
-        match_split = match.strip().split('\t')
-        query = match_split[0]
-        subject = match_split[1]
-        align_len = int(match_split[3])
-        query_len = int(match_split[12])
-        subject_len = int(match_split[13])
-        query_bin_name = '_'.join(query.split('_')[:-1])
-        subject_bin_name = '_'.join(subject.split('_')[:-1])
-        coverage_q = float(align_len) * 100 / float(query_len)
-        coverage_s = float(align_len) * 100 / float(subject_len)
-
-        # first filter with alignment length
-        if align_len >= int(align_len_cutoff):
-
-            # then remove within genome hits
-            if query_bin_name != subject_bin_name:
-
-                # then coverage cutoff
-                if (coverage_q >= int(cover_cutoff)) and (coverage_s >= int(cover_cutoff)):
-
-                    # only work on genomes with clear taxonomic classification
-                    if (query_bin_name in genome_name_list) and (subject_bin_name in genome_name_list):
-                        out_temp.write(match)
-    out_temp.close()
-
-
 def plot_identity_list(identity_list, identity_cut_off, title, output_foler):
     identity_list = sorted(identity_list)
 
@@ -348,372 +343,6 @@ def plot_identity_list(identity_list, identity_cut_off, title, output_foler):
     plt.close()
 
 
-def get_hits_group(input_file_name, output_file_name):
-    matches_2 = open(input_file_name)
-    output_2_file = open(output_file_name, 'w')
-    current_gene = ''
-    group_member = []
-    for match in matches_2:
-        match_split = match.strip().split('\t')
-        query_2 = match_split[0]
-        target_2 = match_split[1]
-        if current_gene == '':
-            current_gene = query_2
-            group_member.append(target_2)
-        else:
-            if query_2 == current_gene:
-                if target_2 not in group_member:
-                    group_member.append(target_2)
-                else:
-                    pass
-            else:
-                output_2_file.write('%s\t%s' % (current_gene, '\t'.join(group_member)) + '\n')
-                current_gene = query_2
-                group_member = []
-                group_member.append(target_2)
-    output_2_file.write('%s\t%s' % (current_gene, '\t'.join(group_member)) + '\n')
-    output_2_file.close()
-
-
-def get_candidates(targets_group_file, gene_with_g_file_name, gene_only_name_file_name, group_pair_iden_cutoff_dict):
-
-    output_1 = open(gene_with_g_file_name, 'w')
-    output_2 = open(gene_only_name_file_name, 'w')
-
-    for group in open(targets_group_file):
-        group_split = group.strip().split('\t')
-        query = group_split[0]
-        query_split = query.split('|')
-        query_gene_name = query_split[1]
-        query_sg = query_split[0]
-        query_g = query_sg.split('_')[0]
-        subjects_list = group_split[1:]
-
-        # if only one non-self subject was found, no matter which group it comes from, ignored
-        if len(subjects_list) == 1:
-            pass
-
-        # if more than 1 non-self subject was found:
-        elif len(subjects_list) > 1:
-            # get the number of subjects from self-group and non_self_group
-            self_group_subject_list = []
-            non_self_group_subject_list = []
-            #print(non_self_group_subject_list)
-            for each_subject in subjects_list:
-
-                #print(each_subject)
-                #each_subject_g = each_subject[0]
-                each_subject_g = each_subject.split('|')[0].split('_')[0]
-                if each_subject_g == query_g:
-                    self_group_subject_list.append(each_subject)
-                else:
-                    non_self_group_subject_list.append(each_subject)
-
-
-            # if only the self-match was found in self-group, all matched from other groups, if any, will be ignored
-            if len(self_group_subject_list) == 0:
-                pass
-
-            # if no non-self-group subjects was found, ignored
-            elif (len(self_group_subject_list) > 0) and (len(non_self_group_subject_list) == 0):
-                pass
-
-            # if both non-self self-group subjects and non-self-group subject exist:
-            elif (len(self_group_subject_list) > 0) and (len(non_self_group_subject_list) > 0):
-                # get the number the groups
-                non_self_group_subject_list_uniq = []
-                for each_g in non_self_group_subject_list:
-                    each_g_group = each_g.split('|')[0].split('_')[0]
-                    if each_g_group not in non_self_group_subject_list_uniq:
-                        non_self_group_subject_list_uniq.append(each_g_group)
-
-                # if all non-self-group subjects come from the same group
-                if len(non_self_group_subject_list_uniq) == 1:
-
-                    # get the maximum and average identity from self-group
-                    sg_maximum = 0
-                    sg_sum = 0
-                    sg_subject_number = 0
-                    for each_sg_subject in self_group_subject_list:
-                        each_sg_subject_iden = float(each_sg_subject.split('|')[2])
-                        if each_sg_subject_iden > sg_maximum:
-                            sg_maximum = each_sg_subject_iden
-                        sg_sum += each_sg_subject_iden
-                        sg_subject_number += 1
-                    sg_average = sg_sum/float(sg_subject_number)
-
-                    # get the maximum and average identity from non-self-group
-                    nsg_maximum = 0
-                    nsg_maximum_gene = ''
-                    nsg_sum = 0
-                    nsg_subject_number = 0
-                    for each_nsg_subject in non_self_group_subject_list:
-                        each_nsg_subject_iden = float(each_nsg_subject.split('|')[2])
-                        if each_nsg_subject_iden > nsg_maximum:
-                            nsg_maximum = each_nsg_subject_iden
-                            nsg_maximum_gene = each_nsg_subject
-                        nsg_sum += each_nsg_subject_iden
-                        nsg_subject_number += 1
-                    nsg_average = nsg_sum/float(nsg_subject_number)
-
-                    # if the average non-self-group identity > average self-group identity,
-                    # Subject with maximum identity from this group will be considered as a HGT donor.
-                    if nsg_average > sg_average:
-                        # filter with obtained identity cut-off:
-                        candidate_g = nsg_maximum_gene.split('|')[0].split('_')[0]
-                        candidate_iden = float(nsg_maximum_gene.split('|')[2])
-                        qg_sg = '%s_%s' % (query_g, candidate_g)
-                        qg_sg_iden_cutoff = group_pair_iden_cutoff_dict[qg_sg]
-                        if candidate_iden >= qg_sg_iden_cutoff:
-                            output_1.write('%s\t%s\n' % (query, nsg_maximum_gene))
-                            output_2.write('%s\t%s\n' % (query_gene_name, nsg_maximum_gene.split('|')[1]))
-
-                # if non-self-group subjects come from different groups
-                elif len(non_self_group_subject_list_uniq) > 1:
-                    # get average/maximum for self-group
-                    sg_maximum = 0
-                    sg_sum = 0
-                    sg_subject_number = 0
-                    for each_sg_subject in self_group_subject_list:
-                        each_sg_subject_iden = float(each_sg_subject.split('|')[2])
-                        if each_sg_subject_iden > sg_maximum:
-                            sg_maximum = each_sg_subject_iden
-                        sg_sum += each_sg_subject_iden
-                        sg_subject_number += 1
-                    sg_average = sg_sum/float(sg_subject_number)
-
-                    # get average/maximum for each non-self-group
-                    nsg_average_dict = {}
-                    nsg_maximum_dict = {}
-                    nsg_maximum_gene_name_dict = {}
-                    for each_nsg in non_self_group_subject_list_uniq:
-                        nsg_maximum = 0
-                        nsg_maximum_gene = ''
-                        nsg_sum = 0
-                        nsg_subject_number = 0
-                        for each_nsg_subject in non_self_group_subject_list:
-                            #print(non_self_group_subject_list)
-                            each_nsg_subject_iden = float(each_nsg_subject.split('|')[2])
-                            #print(each_nsg_subject)
-                            #print(each_nsg_subject[0])
-                            each_nsg_subject_group = each_nsg_subject.split('|')[0].split('_')[0]
-                            if each_nsg_subject_group == each_nsg:
-                                if each_nsg_subject_iden > nsg_maximum:
-                                    nsg_maximum = each_nsg_subject_iden
-                                    nsg_maximum_gene = each_nsg_subject
-                                nsg_sum += each_nsg_subject_iden
-                                nsg_subject_number += 1
-                        nsg_average = nsg_sum / float(nsg_subject_number)
-                        nsg_average_dict[each_nsg] = nsg_average
-                        nsg_maximum_dict[each_nsg] = nsg_maximum
-                        nsg_maximum_gene_name_dict[each_nsg] = nsg_maximum_gene
-
-                    # get the group with maximum average group identity
-                    maximum_average = sg_average
-                    maximum_average_g = group[0]
-                    for each_g in nsg_average_dict:
-                        if nsg_average_dict[each_g] > maximum_average:
-                            maximum_average = nsg_average_dict[each_g]
-                            maximum_average_g = each_g
-
-                    # if the maximum average identity group is the self-group, ignored
-                    if maximum_average_g == group[0]:
-                        pass
-
-                    # if self-group average identity is not the maximum,
-                    # Group with maximum average identity will be considered as the candidate donor group,
-                    # Subject with maximum identity from the candidate donor group will be considered as a HGT donor.
-                    elif maximum_average_g != group[0]:
-                        # filter with obtained identity cut-off:
-                        candidate_g = nsg_maximum_gene_name_dict[maximum_average_g].split('|')[0].split('_')[0]
-                        candidate_iden = float(nsg_maximum_gene_name_dict[maximum_average_g].split('|')[2])
-                        qg_sg = '%s_%s' % (query_g, candidate_g)
-                        qg_sg_iden_cutoff = group_pair_iden_cutoff_dict[qg_sg]
-                        if candidate_iden >= qg_sg_iden_cutoff:
-                            output_1.write('%s\t%s\n' % (query, nsg_maximum_gene_name_dict[maximum_average_g]))
-                            output_2.write('%s\t%s\n' % (query_gene_name, nsg_maximum_gene_name_dict[maximum_average_g].split('|')[1]))
-    output_1.close()
-    output_2.close()
-
-
-def check_match_direction(blast_hit_splitted):
-    query_start = int(blast_hit_splitted[6])
-    query_end = int(blast_hit_splitted[7])
-    subject_start = int(blast_hit_splitted[8])
-    subject_end = int(blast_hit_splitted[9])
-    query_direction = query_end - query_start
-    subject_direction = subject_end - subject_start
-
-    same_match_direction = True
-    if ((query_direction > 0) and (subject_direction < 0)) or ((query_direction < 0) and (subject_direction > 0)):
-        same_match_direction = False
-
-    return same_match_direction
-
-
-def check_full_lenght_and_end_match(qualified_ctg_match_list, identity_cutoff):
-
-    ######################################## check full length match ########################################
-
-    query_len = int(qualified_ctg_match_list[0][12])
-    subject_len = int(qualified_ctg_match_list[0][13])
-
-    # get position list of matched regions
-    query_matched_region_list = []
-    subject_matched_region_list = []
-    for ctg_match in qualified_ctg_match_list:
-        query_start = int(ctg_match[6])
-        query_end = int(ctg_match[7])
-        subject_start = int(ctg_match[8])
-        subject_end = int(ctg_match[9])
-        query_matched_region = sorted([query_start, query_end])
-        subject_matched_region = sorted([subject_start, subject_end])
-        query_matched_region_list.append(query_matched_region)
-        subject_matched_region_list.append(subject_matched_region)
-
-    # get total length of query matched regions
-    query_matched_len_total = 0
-    current_query_end = 0
-    for query_matched in sorted(query_matched_region_list):
-
-        if query_matched_len_total == 0:
-            query_matched_len_total = query_matched[1] - query_matched[0] + 1
-            current_query_end = query_matched[1]
-
-        elif query_matched[0] > current_query_end:
-            query_matched_len_total += query_matched[1] - query_matched[0] + 1
-
-        elif query_matched[0] < current_query_end:
-            if query_matched[1] > current_query_end:
-                query_matched_len_total += query_matched[1] - current_query_end
-
-        elif query_matched[0] == current_query_end:
-            query_matched_len_total += query_matched[1] - current_query_end
-
-    # get total length of subject matched regions
-    subject_matched_len_total = 0
-    current_subject_end = 0
-    for subject_matched in sorted(subject_matched_region_list):
-
-        if subject_matched_len_total == 0:
-            subject_matched_len_total = subject_matched[1] - subject_matched[0] + 1
-            current_subject_end = subject_matched[1]
-
-        elif subject_matched[0] > current_subject_end:
-            subject_matched_len_total += subject_matched[1] - subject_matched[0] + 1
-
-        elif subject_matched[0] < current_subject_end:
-            if subject_matched[1] > current_subject_end:
-                subject_matched_len_total += subject_matched[1] - current_subject_end
-
-        elif subject_matched[0] == current_subject_end:
-            subject_matched_len_total += subject_matched[1] - current_subject_end
-
-
-    # get total coverage for query and subject
-    query_cov_total = query_matched_len_total/float(query_len)
-    subject_cov_total = subject_matched_len_total/float(subject_len)
-
-    # get match category
-    match_category = 'normal'
-    best_hit_end_gap_len = 200
-    gap_cutoff_for_concatenating = 300
-
-    # full length match: coverage cutoff 90%
-    if (query_cov_total >= 0.9) or (subject_cov_total >= 0.9):
-        match_category = 'full_length_match'
-
-
-    ######################################## check end match ########################################
-
-    else:
-
-        # read in best hit information
-        best_hit = qualified_ctg_match_list[0]
-        best_hit_identity = float(best_hit[2])
-        best_hit_query_start = int(best_hit[6])
-        best_hit_query_end = int(best_hit[7])
-        best_hit_subject_start = int(best_hit[8])
-        best_hit_subject_end = int(best_hit[9])
-        query_len = int(best_hit[12])
-        subject_len = int(best_hit[13])
-        best_hit_same_direction = check_match_direction(best_hit)
-
-        # concatenate continuously matched blocks with gap less than 200bp
-        matched_block_query_start = best_hit_query_start
-        matched_block_query_end = best_hit_query_end
-        matched_block_subject_start = best_hit_subject_start
-        matched_block_subject_end = best_hit_subject_end
-
-        if best_hit_identity >= identity_cutoff:
-
-            for matched_block in qualified_ctg_match_list[1:]:
-
-                current_block_identity = float(matched_block[2])
-                current_block_direction = check_match_direction(matched_block)
-
-                # if identity difference <= 1 and has same match direction with the best hit
-                if (-6 <= (best_hit_identity - current_block_identity) <= 6) and (current_block_direction == best_hit_same_direction):
-
-                    current_query_start = int(matched_block[6])
-                    current_query_end = int(matched_block[7])
-                    current_subject_start = int(matched_block[8])
-                    current_subject_end = int(matched_block[9])
-
-                    if best_hit_same_direction is True:
-
-                        # situation 1
-                        if ((current_query_start >= matched_block_query_start) and (current_query_end <= matched_block_query_end)) and ((current_subject_start >= matched_block_subject_start) and (current_subject_end <= matched_block_subject_end)):
-                            pass  # do nothing
-
-                        # situation 2
-                        if ((current_query_start > matched_block_query_start) and (current_query_end > matched_block_query_end)) and ((current_subject_start > matched_block_subject_start) and (current_subject_end > matched_block_subject_end)) and (-gap_cutoff_for_concatenating <= (current_query_start - matched_block_query_end) <= gap_cutoff_for_concatenating) and (-gap_cutoff_for_concatenating <= (current_subject_start - matched_block_subject_end) <= gap_cutoff_for_concatenating):
-                            matched_block_query_end = current_query_end
-                            matched_block_subject_end = current_subject_end
-
-                        # situation 3
-                        if ((current_query_start < matched_block_query_start) and (current_query_end < matched_block_query_end)) and ((current_subject_start < matched_block_subject_start) and (current_subject_end < matched_block_subject_end)) and (-gap_cutoff_for_concatenating <= (matched_block_query_start - current_query_end) <= gap_cutoff_for_concatenating) and (-gap_cutoff_for_concatenating <= (matched_block_subject_start - current_subject_end) <= gap_cutoff_for_concatenating):
-                            matched_block_query_start = current_query_start
-                            matched_block_subject_start = current_subject_start
-
-                    if best_hit_same_direction is False:
-
-                        # situation 1
-                        if ((current_query_start >= matched_block_query_start) and (current_query_end <= matched_block_query_end)) and ((current_subject_start <= matched_block_subject_start) and (current_subject_end >= matched_block_subject_end)):
-                            pass
-
-                        # situation 2
-                        if ((current_query_start > matched_block_query_start) and (current_query_end > matched_block_query_end)) and ((current_subject_start < matched_block_subject_start) and (current_subject_end < matched_block_subject_end)) and (-gap_cutoff_for_concatenating <= (current_query_start - matched_block_query_end) <= gap_cutoff_for_concatenating) and (-gap_cutoff_for_concatenating <= (matched_block_subject_end - current_subject_start) <= gap_cutoff_for_concatenating):
-                            matched_block_query_end = current_query_end
-                            matched_block_subject_end = current_subject_end
-
-                        # situation 3
-                        if ((current_query_start < matched_block_query_start) and (current_query_end < matched_block_query_end)) and ((current_subject_start > matched_block_subject_start) and (current_subject_end > matched_block_subject_end)) and (-gap_cutoff_for_concatenating <= (matched_block_query_start - current_query_end) <= gap_cutoff_for_concatenating) and (-gap_cutoff_for_concatenating <= (current_subject_end - matched_block_subject_start) <= gap_cutoff_for_concatenating):
-                            matched_block_query_start = current_query_start
-                            matched_block_subject_start = current_subject_start
-
-
-            ######################################## check end_match ########################################
-
-            # situation 1
-            if (best_hit_same_direction is True) and (query_len - matched_block_query_end <= best_hit_end_gap_len) and (matched_block_subject_start <= best_hit_end_gap_len):
-                match_category = 'end_match'
-
-            # situation 2
-            elif (best_hit_same_direction is True) and (matched_block_query_start <= best_hit_end_gap_len) and (subject_len - matched_block_subject_end <= best_hit_end_gap_len):
-                match_category = 'end_match'
-
-            # situation 3
-            elif (best_hit_same_direction is False) and (query_len - matched_block_query_end <= best_hit_end_gap_len) and (subject_len - matched_block_subject_start <= best_hit_end_gap_len):
-                match_category = 'end_match'
-
-            # situation 4
-            elif (best_hit_same_direction is False) and (matched_block_query_start <= best_hit_end_gap_len) and (matched_block_subject_end <= best_hit_end_gap_len):
-                match_category = 'end_match'
-
-    return match_category
-
-
 def set_contig_track_features(gene_contig, name_group_dict, candidate_list, HGT_iden, feature_set):
     # add features to feature set
     for feature in gene_contig.features:
@@ -756,231 +385,117 @@ def set_contig_track_features(gene_contig, name_group_dict, candidate_list, HGT_
                                     label_position="middle")
 
 
-def get_flanking_region(input_gbk_file, HGT_candidate, flanking_length):
-
-    wd, gbk_file = os.path.split(input_gbk_file)
-    new_gbk_file = '%s/%s_%sbp_temp.gbk' % (wd, HGT_candidate, flanking_length)
-    new_gbk_final_file = '%s/%s_%sbp.gbk' % (wd, HGT_candidate, flanking_length)
-    new_fasta_final_file = '%s/%s_%sbp.fasta' % (wd, HGT_candidate, flanking_length)
-
-    # get flanking range of candidate
-    input_gbk = SeqIO.parse(input_gbk_file, "genbank")
-    new_start = 0
-    new_end = 0
-    contig_length = 0
-    for record in input_gbk:
-        contig_length = len(record.seq)
-        for gene in record.features:
-            # get contig length
-            if gene.type == 'source':
-                pass
-            # get new start and end points
-            elif 'locus_tag' in gene.qualifiers:
-                if gene.qualifiers['locus_tag'][0] == HGT_candidate:
-                    # get new start point
-                    new_start = gene.location.start - flanking_length
-                    if new_start < 0:
-                        new_start = 0
-                    # get new end point
-                    new_end = gene.location.end + flanking_length
-                    if new_end > contig_length:
-                        new_end = contig_length
-
-    # get genes within flanking region
-    keep_gene_list = []
-    input_gbk = SeqIO.parse(input_gbk_file, "genbank")
-    for record in input_gbk:
-        for gene in record.features:
-            if 'locus_tag' in gene.qualifiers:
-                if (gene.location.start < new_start) and (gene.location.end >= new_start):
-                    keep_gene_list.append(gene.qualifiers['locus_tag'][0])
-                    new_start = gene.location.start
-                elif (gene.location.start > new_start) and (gene.location.end < new_end):
-                    keep_gene_list.append(gene.qualifiers['locus_tag'][0])
-                elif (gene.location.start <= new_end) and (gene.location.end > new_end):
-                    keep_gene_list.append(gene.qualifiers['locus_tag'][0])
-                    new_end = gene.location.end
-
-    # remove genes not in flanking region from gbk file
-    input_gbk = SeqIO.parse(input_gbk_file, "genbank")
-    new_gbk = open(new_gbk_file, 'w')
-    for record in input_gbk:
-        new_record_features = []
-        for gene in record.features:
-            if gene.type == 'source':
-                new_record_features.append(gene)
-            elif 'locus_tag' in gene.qualifiers:
-                if gene.qualifiers['locus_tag'][0] in keep_gene_list:
-                    new_record_features.append(gene)
-        record.features = new_record_features
-        SeqIO.write(record, new_gbk, 'genbank')
-    new_gbk.close()
-
-    # remove sequences not in flanking region
-    new_gbk_full_length = SeqIO.parse(new_gbk_file, "genbank")
-    new_gbk_final = open(new_gbk_final_file, 'w')
-    new_fasta_final = open(new_fasta_final_file, 'w')
-    for record in new_gbk_full_length:
-        # get new sequence
-        new_seq = record.seq[new_start:new_end]
-        new_contig_length = len(new_seq)
-        new_record = SeqRecord(new_seq,
-                               id=record.id,
-                               name=record.name,
-                               description=record.description,
-                               annotations=record.annotations)
-
-        # get new location
-        new_record_features_2 = []
-        for gene in record.features:
-            if gene.type == 'source':
-                gene_location_new = ''
-                if gene.location.strand == 1:
-                    gene_location_new = FeatureLocation(0, new_contig_length, strand=+1)
-                if gene.location.strand == -1:
-                    gene_location_new = FeatureLocation(0, new_contig_length, strand=-1)
-                gene.location = gene_location_new
-                new_record_features_2.append(gene)
-            elif 'locus_tag' in gene.qualifiers:
-                gene_location_new = ''
-                if gene.location.strand == 1:
-                    if gene.location.start - new_start < 0:
-                        gene_location_new = FeatureLocation(0,
-                                                            gene.location.end - new_start,
-                                                            strand=+1)
-                    else:
-                        gene_location_new = FeatureLocation(gene.location.start - new_start,
-                                                            gene.location.end - new_start,
-                                                            strand=+1)
-                if gene.location.strand == -1:
-                    if gene.location.start - new_start < 0:
-                        gene_location_new = FeatureLocation(0,
-                                                            gene.location.end - new_start,
-                                                            strand=-1)
-                    else:
-                        gene_location_new = FeatureLocation(gene.location.start - new_start,
-                                                            gene.location.end - new_start,
-                                                            strand=-1)
-                gene.location = gene_location_new
-                new_record_features_2.append(gene)
-        new_record.features = new_record_features_2
-        SeqIO.write(new_record, new_gbk_final, 'genbank')
-        SeqIO.write(new_record, new_fasta_final, 'fasta')
-
-    new_gbk_final.close()
-    new_fasta_final.close()
-    os.system('rm %s' % new_gbk_file)
-
-
-def get_gbk_blast_act2(arguments_list):
-
-    match = arguments_list[0]
-    pwd_gbk_folder = arguments_list[1]
-    flanking_length = arguments_list[2]
-    aln_len_cutoff = arguments_list[3]
-    name_to_group_number_dict = arguments_list[4]
-    path_to_output_act_folder = arguments_list[5]
-    pwd_normal_plot_folder = arguments_list[6]
-    pwd_at_ends_plot_folder = arguments_list[7]
-    pwd_full_contig_match_plot_folder = arguments_list[8]
-    pwd_blastn_exe = arguments_list[9]
-    keep_temp = arguments_list[10]
-    candidates_2_contig_match_category_dict = arguments_list[11]
-    end_match_iden_cutoff = arguments_list[12]
-    No_Eb_Check = arguments_list[13]
-    flk_plot_fmt = 'SVG'
+def get_flanking_region(pwd_prodigal_output_folder, HGT_candidate, flanking_length, output_folder, keep_temp):
+
+    genome_name = '_'.join(HGT_candidate.split('_')[:-1])
+    gene_number = int(HGT_candidate.split('_')[-1])
+    pwd_genome_idx_file = '%s/%s.idx' % (pwd_prodigal_output_folder, genome_name)
+    pwd_genome_seq_file = '%s/%s.seq' % (pwd_prodigal_output_folder, genome_name)
+    full_length_fasta_file = '%s/%s.fasta' % (output_folder, HGT_candidate)
+    new_gbk_final_file = '%s/%s_%sbp.gbk' % (output_folder, HGT_candidate, flanking_length)
+    new_fasta_final_file = '%s/%s_%sbp.fasta' % (output_folder, HGT_candidate, flanking_length)
+
+    # get flanking range and genes within it from the annotation index
+    annotation_index = load_annotation_index(pwd_genome_idx_file)
+    flanking_window = get_flanking_window(annotation_index, gene_number, flanking_length)
+    contig_index = flanking_window['contig_index']
+    contig_name = flanking_window['contig_name']
+    new_start = flanking_window['start']
+    new_end = flanking_window['end']
+    contig_seq = read_contig_sequence(pwd_genome_seq_file, annotation_index, contig_index)
+
+    # get new location
+    new_record = SeqRecord(Seq(contig_seq[new_start:new_end]), id=contig_name, name=contig_name, description='')
+    for gene_row in flanking_window['kept_gene_row'].tolist():
+        gene_start = int(annotation_index['gene_start'][gene_row])
+        gene_end = int(annotation_index['gene_end'][gene_row])
+        gene_strand = int(annotation_index['gene_strand'][gene_row])
+        locus_tag = '%s_%s' % (genome_name, "{:0>5}".format(int(annotation_index['gene_number'][gene_row])))
+        gene_location_new = FeatureLocation(max(gene_start - new_start, 0), gene_end - new_start, strand=gene_strand)
+        new_record.features.append(SeqFeature(gene_location_new, type='CDS', qualifiers={'locus_tag': [locus_tag]}))
+
+    # export contig and flanking region sequences
+    if keep_temp == 1:
+        full_length_fasta_handle = open(full_length_fasta_file, 'w')
+        full_length_fasta_handle.write('>%s\n%s\n' % (contig_name, contig_seq))
+        full_length_fasta_handle.close()
+        new_fasta_final = open(new_fasta_final_file, 'w')
+        new_fasta_final.write('>%s\n%s\n' % (contig_name, contig_seq[new_start:new_end]))
+        new_fasta_final.close()
+        SeqIO.write(new_record, new_gbk_final_file, 'genbank')
+
+    gene_row = flanking_window['gene_row']
+    gene_location = [HGT_candidate, int(annotation_index['gene_start'][gene_row]), int(annotation_index['gene_end'][gene_row]), int(annotation_index['gene_strand'][gene_row]), flanking_window['contig_length']]
+
+    return new_record, gene_location, contig_seq
+
+
+def build_annotation_index_worker(argument_list):
+    build_annotation_index_from_gbk(argument_list[0], argument_list[1], argument_list[2])
+
+
+def get_batch_blastn_jobs(query_seq_dict, subject_seq_dict, pair_set, max_search_space_ratio):
+
+    # blastn aligns all queries of a job to all its subjects, pairs are packed into jobs (largest search space first,
+    # into the first job with room) while the search space of a job (query letters x subject letters) stays within
+    # max_search_space_ratio times the summed search space of its pairs, e.g. up to 4 pairs of similar length per job,
+    # a short pair can join a long one at little extra cost
+    batch_job_list = []
+    for each_pair in sorted(pair_set, key=lambda i: (-len(query_seq_dict[i[0]]) * len(subject_seq_dict[i[1]]), i)):
+        pair_search_space = len(query_seq_dict[each_pair[0]]) * len(subject_seq_dict[each_pair[1]])
+        for batch_job in batch_job_list:
+            job_query_set = batch_job[0] | set([each_pair[0]])
+            job_subject_set = batch_job[1] | set([each_pair[1]])
+            job_search_space = sum([len(query_seq_dict[i]) for i in job_query_set]) * sum([len(subject_seq_dict[i]) for i in job_subject_set])
+            if job_search_space <= max_search_space_ratio * (batch_job[2] + pair_search_space):
+                batch_job[0], batch_job[1], batch_job[2] = job_query_set, job_subject_set, batch_job[2] + pair_search_space
+                break
+        else:
+            batch_job_list.append([set([each_pair[0]]), set([each_pair[1]]), pair_search_space])
 
-    genes = match.strip().split('\t')[:-1]
-    current_HGT_iden = float("{0:.1f}".format(float(match.strip().split('\t')[-1])))
-    folder_name = '___'.join(genes)
-    os.mkdir('%s/%s' % (path_to_output_act_folder, folder_name))
+    return [[sorted(i[0]), sorted(i[1])] for i in batch_job_list]
 
-    gene_1 = genes[0]
-    gene_2 = genes[1]
-    genome_1 = '_'.join(gene_1.split('_')[:-1])
-    genome_2 = '_'.join(gene_2.split('_')[:-1])
-    pwd_genome_1_gbk = '%s/%s.gbk' % (pwd_gbk_folder, genome_1)
-    pwd_genome_2_gbk = '%s/%s.gbk' % (pwd_gbk_folder, genome_2)
 
-    dict_value_list = []
-    # Extract gbk and fasta files for gene 1
-    for genome_1_record in SeqIO.parse(pwd_genome_1_gbk, 'genbank'):
-        for gene_1_f in genome_1_record.features:
-            if 'locus_tag' in gene_1_f.qualifiers:
-                if gene_1 in gene_1_f.qualifiers["locus_tag"]:
-                    dict_value_list.append([gene_1, int(gene_1_f.location.start), int(gene_1_f.location.end), gene_1_f.location.strand, len(genome_1_record.seq)])
-                    pwd_gene_1_gbk_file = '%s/%s/%s.gbk' % (path_to_output_act_folder, folder_name, gene_1)
-                    pwd_gene_1_fasta_file = '%s/%s/%s.fasta' % (path_to_output_act_folder, folder_name, gene_1)
-                    SeqIO.write(genome_1_record, pwd_gene_1_gbk_file, 'genbank')
-                    SeqIO.write(genome_1_record, pwd_gene_1_fasta_file, 'fasta')
-                    # get flanking regions
-                    get_flanking_region(pwd_gene_1_gbk_file, gene_1, flanking_length)
-
-    # Extract gbk and fasta files for gene 2
-    for genome_2_record in SeqIO.parse(pwd_genome_2_gbk, 'genbank'):
-        for gene_2_f in genome_2_record.features:
-            if 'locus_tag' in gene_2_f.qualifiers:
-                if gene_2 in gene_2_f.qualifiers["locus_tag"]:
-                    dict_value_list.append([gene_2, int(gene_2_f.location.start), int(gene_2_f.location.end), gene_2_f.location.strand, len(genome_2_record.seq)])
-                    pwd_gene_2_gbk_file = '%s/%s/%s.gbk' % (path_to_output_act_folder, folder_name, gene_2)
-                    pwd_gene_2_fasta_file = '%s/%s/%s.fasta' % (path_to_output_act_folder, folder_name, gene_2)
-                    SeqIO.write(genome_2_record, pwd_gene_2_gbk_file, 'genbank')
-                    SeqIO.write(genome_2_record, pwd_gene_2_fasta_file, 'fasta')
-                    # get flanking regions
-                    get_flanking_region(pwd_gene_2_gbk_file, gene_2, flanking_length)
-
-    # Run Blast
-    prefix_c =              '%s/%s'                 % (path_to_output_act_folder, folder_name)
-    query_c =               '%s/%s_%sbp.fasta'      % (prefix_c, gene_1, flanking_length)
-    query_c_full_len =      '%s/%s.fasta'           % (prefix_c, gene_1)
-    subject_c =             '%s/%s_%sbp.fasta'      % (prefix_c, gene_2, flanking_length)
-    subject_c_full_len =    '%s/%s.fasta'           % (prefix_c, gene_2)
-    output_c =              '%s/%s.txt'             % (prefix_c, folder_name)
-    output_c_full_len =     '%s/%s_full_length.txt' % (prefix_c, folder_name)
+def run_pairwise_blastn_batch(pwd_blastn_exe, query_seq_dict, subject_seq_dict, pair_set, blastn_parameters, pwd_batch_prefix, max_search_space_ratio=4):
 
-    parameters_c_n =          '-evalue 1e-5 -outfmt 6 -task blastn'
-    parameters_c_n_full_len = '-evalue 1e-5 -outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore qlen slen" -task blastn'
-    command_blast =           '%s -query %s -subject %s -out %s %s' % (pwd_blastn_exe, query_c, subject_c, output_c, parameters_c_n)
-    command_blast_full_len =  '%s -query %s -subject %s -out %s %s' % (pwd_blastn_exe, query_c_full_len, subject_c_full_len, output_c_full_len, parameters_c_n_full_len)
-    os.system(command_blast)
+    # pairs of a batch are aligned in a few blastn jobs (see get_batch_blastn_jobs), sequences are named by gene,
+    # subjects given with -subject are evaluated separately (as with a single subject), hits of query-subject
+    # combinations not in pair_set are dropped
+    batch_job_list = get_batch_blastn_jobs(query_seq_dict, subject_seq_dict, pair_set, max_search_space_ratio)
 
+    pwd_batch_query = '%s_query.fasta' % pwd_batch_prefix
+    pwd_batch_subject = '%s_subject.fasta' % pwd_batch_prefix
+    pwd_batch_output = '%s_blastn.txt' % pwd_batch_prefix
+    pair_to_hits_dict = {each_pair: [] for each_pair in pair_set}
+    for query_id_list, subject_id_list in batch_job_list:
+        for pwd_batch_fasta, seq_dict, seq_id_list in [[pwd_batch_query, query_seq_dict, query_id_list], [pwd_batch_subject, subject_seq_dict, subject_id_list]]:
+            batch_fasta_handle = open(pwd_batch_fasta, 'w')
+            for seq_id in seq_id_list:
+                batch_fasta_handle.write('>%s\n%s\n' % (seq_id, seq_dict[seq_id]))
+            batch_fasta_handle.close()
 
-    ############################## check whether full length or end match ##############################
+        blastn_exit_status = run_tool([pwd_blastn_exe, '-query', pwd_batch_query, '-subject', pwd_batch_subject, '-out', pwd_batch_output] + shlex.split(blastn_parameters))
+        if blastn_exit_status != 0:
+            batch_pair_list = sorted([i for i in pair_set if (i[0] in query_id_list) and (i[1] in subject_id_list)])
+            raise RuntimeError('blastn exited with status %s for %s, candidates: %s' % (blastn_exit_status, pwd_batch_prefix, ','.join(['%s___%s' % i for i in batch_pair_list])))
 
-    # get match category
-    if No_Eb_Check is True:
-        match_category = 'normal'
-        candidates_2_contig_match_category_dict[folder_name] = match_category
-    else:
+        # split hits back to pairs, hits order within each pair is kept
+        for blast_hit in open(pwd_batch_output):
+            blast_hit_split = blast_hit.strip().split('\t')
+            if (blast_hit_split[0], blast_hit_split[1]) in pair_set:
+                pair_to_hits_dict[(blast_hit_split[0], blast_hit_split[1])].append(blast_hit_split)
 
-        # run blast
-        os.system(command_blast_full_len)
+        os.remove(pwd_batch_query)
+        os.remove(pwd_batch_subject)
+        os.remove(pwd_batch_output)
 
-        # get qualified_ctg_match_list
-        min_ctg_match_aln_len = 100
-        qualified_ctg_match_list = []
-        for blast_hit in open(output_c_full_len):
-            blast_hit_split = blast_hit.strip().split('\t')
-            align_len = int(blast_hit_split[3])
-            if align_len >= min_ctg_match_aln_len:
-                qualified_ctg_match_list.append(blast_hit_split)
+    return pair_to_hits_dict
 
-        if len(qualified_ctg_match_list) == 0:
-            match_category = 'normal'
-            candidates_2_contig_match_category_dict[folder_name] = match_category
-        else:
-            match_category = check_full_lenght_and_end_match(qualified_ctg_match_list, end_match_iden_cutoff)
-            candidates_2_contig_match_category_dict[folder_name] = match_category
 
+def plot_flanking_regions(genes, folder_name, current_HGT_iden, matche_pair_list, dict_value_list, flanking_hit_list, name_to_group_number_dict, pwd_plot_folder, flk_plot_fmt):
 
     ############################## prepare for flanking plot ##############################
 
-    # read in gbk files
-    matche_pair_list = []
-    for each_gene in genes:
-        path_to_gbk_file = '%s/%s/%s_%sbp.gbk' % (path_to_output_act_folder, folder_name, each_gene, flanking_length)
-        gene_contig = SeqIO.read(path_to_gbk_file, "genbank")
-        matche_pair_list.append(gene_contig)
     bin_record_list = []
     bin_record_list.append(matche_pair_list)
 
@@ -1041,12 +556,8 @@ def get_gbk_blast_act2(arguments_list):
 
         ####################################### add crosslink from blast results #######################################
 
-        path_to_blast_result = '%s/%s/%s.txt' % (path_to_output_act_folder, folder_name, folder_name)
-        blast_results = open(path_to_blast_result)
-
         # parse blast results
-        for each_line in blast_results:
-            each_line_split = each_line.split('\t')
+        for each_line_split in flanking_hit_list:
             query = each_line_split[0]
             identity = float(each_line_split[2])
             alignment_len = int(each_line_split[3])
@@ -1089,173 +600,182 @@ def get_gbk_blast_act2(arguments_list):
                      end=max_len)
 
 
-        diagram.write('%s/%s.%s' % (path_to_output_act_folder, folder_name, flk_plot_fmt), flk_plot_fmt)
+        diagram.write('%s/%s.%s' % (pwd_plot_folder, folder_name, flk_plot_fmt), flk_plot_fmt)
+
+
+def flanking_plot_worker(argument_list):
+
+    pair_metadata = argument_list[0]
+    flanking_hit_list = argument_list[1]
+    pwd_prodigal_output_folder = argument_list[2]
+    flanking_length = argument_list[3]
+    name_to_group_number_dict = get_worker_context(argument_list[4])
+    pwd_plot_folder = argument_list[5]
+    flk_plot_fmt = 'SVG'
+
+    genes = pair_metadata[:2]
+    folder_name = '___'.join(genes)
+    current_HGT_iden = float("{0:.1f}".format(float(pair_metadata[2])))
+
+    # flanking regions are fetched again from the annotation index
+    dict_value_list = []
+    matche_pair_list = []
+    for each_gene in genes:
+        flanking_record, gene_location, contig_seq = get_flanking_region(pwd_prodigal_output_folder, each_gene, flanking_length, pwd_plot_folder, 0)
+        matche_pair_list.append(flanking_record)
+        dict_value_list.append(gene_location)
+
+    plot_flanking_regions(genes, folder_name, current_HGT_iden, matche_pair_list, dict_value_list, flanking_hit_list, name_to_group_number_dict, pwd_plot_folder, flk_plot_fmt)
+
+
+def plot_flanking_regions_of_candidates(candidate_pair_set, pwd_flanking_region_pairs_file, pwd_flanking_region_hits_file, pwd_prodigal_output_folder,
+                                        flanking_length, name_to_group_number_dict, pwd_op_act_folder, num_threads):
+
+    # plot candidates in candidate_pair_set (all candidates if None) with stored match category and flanking region hits
+    match_category_to_folder_dict = {'normal':            '%s/1_Plots_normal'             % pwd_op_act_folder,
+                                     'end_match':         '%s/2_Plots_end_match'          % pwd_op_act_folder,
+                                     'full_length_match': '%s/3_Plots_full_length_match'  % pwd_op_act_folder}
+    for pwd_plot_folder in match_category_to_folder_dict.values():
+        if not os.path.isdir(pwd_plot_folder):
+            os.makedirs(pwd_plot_folder)
 
+    pair_to_hits_dict = {}
+    for flanking_hit in open(pwd_flanking_region_hits_file):
+        if not flanking_hit.startswith('Gene_1\t'):
+            flanking_hit_split = flanking_hit.strip().split('\t')
+            gene_pair = (flanking_hit_split[0], flanking_hit_split[1])
+            if (candidate_pair_set is None) or (gene_pair in candidate_pair_set):
+                if gene_pair not in pair_to_hits_dict:
+                    pair_to_hits_dict[gene_pair] = []
+                pair_to_hits_dict[gene_pair].append(flanking_hit_split[2:])
 
-    # move plot to corresponding folder
-    if match_category == 'end_match':
-        os.system('mv %s/%s.%s %s/' % (path_to_output_act_folder, folder_name, flk_plot_fmt, pwd_at_ends_plot_folder))
-    elif match_category == 'full_length_match':
-        os.system('mv %s/%s.%s %s/' % (path_to_output_act_folder, folder_name, flk_plot_fmt, pwd_full_contig_match_plot_folder))
+    flanking_plot_context_key = publish_worker_context(name_to_group_number_dict, '%s/flanking_plot_worker_context.pkl' % pwd_op_act_folder)
+    list_for_multiple_arguments_flanking_plot = []
+    for flanking_pair in open(pwd_flanking_region_pairs_file):
+        if not flanking_pair.startswith('Gene_1\t'):
+            flanking_pair_split = flanking_pair.strip().split('\t')
+            gene_pair = (flanking_pair_split[0], flanking_pair_split[1])
+            if (candidate_pair_set is None) or (gene_pair in candidate_pair_set):
+                list_for_multiple_arguments_flanking_plot.append([flanking_pair_split, pair_to_hits_dict.get(gene_pair, []), pwd_prodigal_output_folder, flanking_length,
+                                                                  flanking_plot_context_key, match_category_to_folder_dict[flanking_pair_split[3]]])
+
+    get_worker_pool(num_threads).map(flanking_plot_worker, list_for_multiple_arguments_flanking_plot)
+    release_worker_context(flanking_plot_context_key)
+
+    return len(list_for_multiple_arguments_flanking_plot)
+
+
+def check_flanking_regions_worker(arguments_list):
+
+    match_list = arguments_list[0]
+    pwd_gbk_folder = arguments_list[1]
+    flanking_length = arguments_list[2]
+    path_to_output_act_folder = arguments_list[3]
+    pwd_blastn_exe = arguments_list[4]
+    keep_temp = arguments_list[5]
+    end_match_iden_cutoff = arguments_list[6]
+    No_Eb_Check = arguments_list[7]
+
+    # get flanking regions and contig sequences of all candidates in current batch, plots are drawn in a separate stage
+    candidate_list = []
+    flanking_seq_dict = {}
+    contig_seq_dict = {}
+    for match in match_list:
+        genes = match.strip().split('\t')[:-1]
+        current_HGT_iden = match.strip().split('\t')[-1]
+        folder_name = '___'.join(genes)
+        os.mkdir('%s/%s' % (path_to_output_act_folder, folder_name))
+
+        contig_name_list = []
+        for each_gene in genes:
+            flanking_record, gene_location, contig_seq = get_flanking_region(pwd_gbk_folder, each_gene, flanking_length, '%s/%s' % (path_to_output_act_folder, folder_name), keep_temp)
+            contig_name_list.append(flanking_record.id)
+            flanking_seq_dict[each_gene] = str(flanking_record.seq)
+            contig_seq_dict[each_gene] = contig_seq
+        candidate_list.append([genes, folder_name, current_HGT_iden, contig_name_list])
+
+    # Run Blast, flanking regions and full length contigs of the candidates in current batch are
+    # each aligned in a few blastn jobs of bounded search space
+    pair_set = set([(i[0][0], i[0][1]) for i in candidate_list])
+    query_gene_set = set([i[0] for i in pair_set])
+    subject_gene_set = set([i[1] for i in pair_set])
+    pwd_batch_prefix = '%s/%s/batch' % (path_to_output_act_folder, candidate_list[0][1])
+
+    parameters_c_n =          '-evalue 1e-5 -outfmt 6 -task blastn'
+    parameters_c_n_full_len = '-evalue 1e-5 -outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore qlen slen" -task blastn'
+    flanking_hits_dict = run_pairwise_blastn_batch(pwd_blastn_exe,
+                                                   {i: flanking_seq_dict[i] for i in query_gene_set},
+                                                   {i: flanking_seq_dict[i] for i in subject_gene_set},
+                                                   pair_set, parameters_c_n, '%s_flanking' % pwd_batch_prefix)
+    full_len_hits_dict = {}
+    if No_Eb_Check is False:
+        full_len_hits_dict = run_pairwise_blastn_batch(pwd_blastn_exe,
+                                                       {i: contig_seq_dict[i] for i in query_gene_set},
+                                                       {i: contig_seq_dict[i] for i in subject_gene_set},
+                                                       pair_set, parameters_c_n_full_len, '%s_full_length' % pwd_batch_prefix)
+
+    # match category of all candidates in current batch
+    contig_hit_list_list = [full_len_hits_dict.get((i[0][0], i[0][1]), []) for i in candidate_list]
+    if No_Eb_Check is True:
+        batch_match_category_list = ['normal'] * len(candidate_list)
     else:
-        os.system('mv %s/%s.%s %s/' % (path_to_output_act_folder, folder_name, flk_plot_fmt, pwd_normal_plot_folder))
-
-
-    # # remove temporary folder
-    # if keep_temp == 0:
-    #     # shutil.rmtree('%s/%s' % (path_to_output_act_folder, folder_name), ignore_errors=True)
-    #     # if os.path.isdir('%s/%s' % (path_to_output_act_folder, folder_name)):
-    #     #     shutil.rmtree('%s/%s' % (path_to_output_act_folder, folder_name), ignore_errors=True)
-    #     #     if os.path.isdir('%s/%s' % (path_to_output_act_folder, folder_name)):
-    #     #         shutil.rmtree('%s/%s' % (path_to_output_act_folder, folder_name), ignore_errors=True)
-    #     #         if os.path.isdir('%s/%s' % (path_to_output_act_folder, folder_name)):
-    #     #             shutil.rmtree('%s/%s' % (path_to_output_act_folder, folder_name), ignore_errors=True)
-    #     #             if os.path.isdir('%s/%s' % (path_to_output_act_folder, folder_name)):
-    #     #                 shutil.rmtree('%s/%s' % (path_to_output_act_folder, folder_name), ignore_errors=True)
-    #     os.system('rm %s/%s/*' % (path_to_output_act_folder, folder_name))
-    #     os.system('rm -r %s/%s' % (path_to_output_act_folder, folder_name))
-
-
-def remove_bidirection(input_file, candidate2identity_dict, output_file):
-    input = open(input_file)
-    output = open(output_file, 'w')
-
-    # get overall list
-    overall = []
-    for each in input:
-        overall.append(each.strip())
-
-    # get overlap list
-    tmp_list = []
-    overlap_list = []
-    for each in overall:
-        each_split = each.split('\t')
-        each_reverse = '%s\t%s' % (each_split[1], each_split[0])
-        tmp_list.append(each)
-        if each_reverse in tmp_list:
-            overlap_list.append(each)
-
-    # get non-overlap list
-    non_overlap_list = []
-    for each in overall:
-        each_split = each.split('\t')
-        each_reverse = '%s\t%s' % (each_split[1], each_split[0])
-        if (each not in overlap_list) and (each_reverse not in overlap_list):
-            non_overlap_list.append(each)
-
-    # get output
-    for each in non_overlap_list:
-        each_split = each.split('\t')
-        each_concatenated = '%s___%s' % (each_split[0], each_split[1])
-        output.write('%s\t%s\n' % (each, candidate2identity_dict[each_concatenated]))
-    for each in overlap_list:
-        each_concatenated = '%s___%s' % (each.split('\t')[0], each.split('\t')[1])
-        output.write('%s\t%s\n' % (each, candidate2identity_dict[each_concatenated]))
-    output.close()
-
-
-def export_HGT_query_to_subjects(pwd_BM_HGTs, pwd_blast_subjects_in_one_line, pwd_query_to_subjects_file):
-
-    HGT_candidates = set()
-    for HGT_pair in open(pwd_BM_HGTs):
-        HGT_pair_split = HGT_pair.strip().split('\t')
-        gene_1 = HGT_pair_split[0]
-        gene_2 = HGT_pair_split[1]
-        HGT_candidates.add(gene_1)
-        HGT_candidates.add(gene_2)
-
-    query_subjects_dict = {}
-    for each_gene in open(pwd_blast_subjects_in_one_line):
-        each_gene_split = each_gene.strip().split('\t')
-        query = each_gene_split[0].split('|')[1]
-        subjects = [i.split('|')[1] for i in each_gene_split[1:]]
-        if query in HGT_candidates:
-            query_subjects_dict[query] = subjects
+        contig_match_hits = get_contig_match_hits(contig_hit_list_list, min_align_len=100)
+        batch_match_category_list = classify_contig_matches(contig_match_hits, len(candidate_list), end_match_iden_cutoff)[0].tolist()
+
+    flanking_region_metadata_list = []
+    for (genes, folder_name, current_HGT_iden, contig_name_list), match_category, contig_hit_list in zip(candidate_list, batch_match_category_list, contig_hit_list_list):
+        gene_1 = genes[0]
+        gene_2 = genes[1]
+
+        # flanking region hits named by contig, as used for plotting
+        flanking_hit_list = [contig_name_list + blast_hit_split[2:] for blast_hit_split in flanking_hits_dict[(gene_1, gene_2)]]
+
+        flanking_region_metadata_list.append([gene_1, gene_2, current_HGT_iden, match_category, flanking_hit_list, contig_hit_list])
+
+    return flanking_region_metadata_list
+
+
+def write_candidate_table_txt(candidate_table, id_table, group_name_array, pwd_output_file, with_direction=True):
+
+    # HGTs_BM.txt and HGTs_PG.txt (with_direction)
+    gene_1_list = get_gene_names(id_table, candidate_table['gene_1'])
+    gene_2_list = get_gene_names(id_table, candidate_table['gene_2'])
+    genome_name_array = id_table['genome_name']
+    gene_1_genome_list = genome_name_array[get_genome_of_genes(id_table, candidate_table['gene_1'])].tolist() if len(gene_1_list) > 0 else []
+    gene_2_genome_list = genome_name_array[get_genome_of_genes(id_table, candidate_table['gene_2'])].tolist() if len(gene_2_list) > 0 else []
+    direction_list = get_direction_strings(candidate_table, gene_1_genome_list, gene_2_genome_list)
+
+    output_file_handle = open(pwd_output_file, 'w')
+    if with_direction is True:
+        output_file_handle.write('Gene_1\tGene_2\tGene_1_group\tGene_2_group\tIdentity\tend_match\tfull_length_match\tDirection\n')
+    else:
+        output_file_handle.write('Gene_1\tGene_2\tGene_1_group\tGene_2_group\tIdentity\tend_match\tfull_length_match\n')
+    for row in range(len(gene_1_list)):
+        match_category = int(candidate_table['match_category'][row])
+        for_out = '%s\t%s\t%s\t%s\t%s\t%s\t%s' % (gene_1_list[row], gene_2_list[row],
+                                                 group_name_array[candidate_table['group_1'][row]], group_name_array[candidate_table['group_2'][row]],
+                                                 float(candidate_table['identity'][row]),
+                                                 'yes' if match_category == 1 else 'no',
+                                                 'yes' if match_category == 2 else 'no')
+        if with_direction is True:
+            for_out += '\t%s' % direction_list[row]
+        output_file_handle.write(for_out + '\n')
+    output_file_handle.close()
+
+
+def export_HGT_query_to_subjects(candidate_table, BM_hits, id_table, pwd_query_to_subjects_file):
+
+    HGT_candidates = set(candidate_table['gene_1'].tolist()) | set(candidate_table['gene_2'].tolist())
+
+    query_subjects_dict = get_query_to_subjects(BM_hits, HGT_candidates)
 
     pwd_query_to_subjects_file_handle = open(pwd_query_to_subjects_file, 'w')
     for each in query_subjects_dict:
-        for_out = '%s\t%s\n' % (each, ','.join(query_subjects_dict[each]))
+        for_out = '%s\t%s\n' % (get_gene_name(id_table, each), ','.join(get_gene_names(id_table, query_subjects_dict[each])))
         pwd_query_to_subjects_file_handle.write(for_out)
     pwd_query_to_subjects_file_handle.close()
 
 
-def filter_blast_results_worker(argument_list):
-    pwd_blast_results = argument_list[0]
-    align_len_cutoff = argument_list[1]
-    cover_cutoff = argument_list[2]
-    genome_name_list = argument_list[3]
-    pwd_qualified_iden_file = argument_list[4]
-
-    get_qualigied_blast_hits(pwd_blast_results, align_len_cutoff, cover_cutoff, genome_name_list, pwd_qualified_iden_file)
-
-
-def get_g2g_identities_worker(argument_list):
-    pwd_qualified_iden_file = argument_list[0]
-    name_to_group_number_dict = argument_list[1]
-    pwd_qualified_iden_file_g2g = argument_list[2]
-
-    qualified_identities_g_g = open(pwd_qualified_iden_file_g2g, 'w')
-    for each_identity in open(pwd_qualified_iden_file):
-        each_identity_split = each_identity.strip().split('\t')
-        query = each_identity_split[0]
-        subject = each_identity_split[1]
-        identity = float(each_identity_split[2])
-        query_genome_name = '_'.join(query.split('_')[:-1])
-        subject_genome_name = '_'.join(subject.split('_')[:-1])
-        query_group = name_to_group_number_dict[query_genome_name].split('_')[0]
-        subject_group = name_to_group_number_dict[subject_genome_name].split('_')[0]
-        paired_group_list = [query_group, subject_group]
-
-        # query and subjects name sorted by alphabet order here
-        paired_group_list_sorted = sorted(paired_group_list)
-        g_g = '%s_%s' % (paired_group_list_sorted[0], paired_group_list_sorted[1])
-        qualified_identities_g_g.write('%s\t%s\n' % (g_g, identity))
-
-    qualified_identities_g_g.close()
-
-
-def get_HGT_worker(argument_list):
-    pwd_qualified_iden_file = argument_list[0]
-    name_to_group_number_dict = argument_list[1]
-    pwd_qual_idens_with_group = argument_list[2]
-    pwd_qual_idens_subjects_in_one_line = argument_list[3]
-    pwd_hgt_candidates_with_group = argument_list[4]
-    pwd_hgt_candidates_only_gene = argument_list[5]
-    group_pair_iden_cutoff_dict = argument_list[6]
-
-
-    file_path, file_basename, file_extension = sep_path_basename_ext(pwd_qual_idens_with_group)
-    pwd_qual_idens_with_group_tmp = '%s/%s_tmp.%s' % (file_path, file_basename, file_extension)
-
-    qualified_matches_with_group = open(pwd_qual_idens_with_group_tmp, 'w')
-    for qualified_identity in open(pwd_qualified_iden_file):
-        qualified_identity_split = qualified_identity.strip().split('\t')
-        query = qualified_identity_split[0]
-        query_split = query.split('_')
-        query_bin = '_'.join(query_split[:-1])
-        subject = qualified_identity_split[1]
-        subject_split = subject.split('_')
-        subject_bin = '_'.join(subject_split[:-1])
-        identity = float(qualified_identity_split[2])
-        file_write = '%s|%s\t%s|%s|%s\n' % (
-            name_to_group_number_dict[query_bin], query, name_to_group_number_dict[subject_bin], subject, str(identity))
-        qualified_matches_with_group.write(file_write)
-    qualified_matches_with_group.close()
-
-    # sort
-    os.system('cat %s | sort > %s' % (pwd_qual_idens_with_group_tmp, pwd_qual_idens_with_group))
-    os.system('rm %s' % pwd_qual_idens_with_group_tmp)
-
-    # put subjects in one line
-    get_hits_group(pwd_qual_idens_with_group, pwd_qual_idens_subjects_in_one_line)
-
-    # get HGT candidates
-    get_candidates(pwd_qual_idens_subjects_in_one_line,
-                   pwd_hgt_candidates_with_group,
-                   pwd_hgt_candidates_only_gene,
-                   group_pair_iden_cutoff_dict)
-
-
 def subset_tree(tree_file_in, leaf_node_list, tree_file_out):
     tree_in = Tree(tree_file_in, format=0)
     tree_in.prune(leaf_node_list, preserve_branch_length=True)
@@ -1266,7 +786,7 @@ def get_species_tree_alignment(tmp_folder, path_to_prokka, path_to_hmm, pwd_hmms
 
     # Tests for presence of the tmp folder and deletes it
     if os.path.exists(tmp_folder):
-        os.system('rm -r ' + tmp_folder)
+        remove_path(tmp_folder)
     os.mkdir(tmp_folder)
 
     # List all prokka dirs in the target folder
@@ -1277,7 +797,7 @@ def get_species_tree_alignment(tmp_folder, path_to_prokka, path_to_hmm, pwd_hmms
     print('Running hmmsearch...')
     for f in prokka_files:
         # call hmmsearch
-        os.system('%s -o /dev/null --domtblout %s/%s_hmmout.tbl %s %s/%s/%s.faa' % (pwd_hmmsearch_exe, tmp_folder, f, path_to_hmm, path_to_prokka, f, f))
+        run_required_tool([pwd_hmmsearch_exe, '-o', os.devnull, '--domtblout', '%s/%s_hmmout.tbl' % (tmp_folder, f), path_to_hmm, '%s/%s/%s.faa' % (path_to_prokka, f, f)])
 
         # Reading the protein file in a dictionary
         proteinSequence = {}
@@ -1335,7 +855,8 @@ def get_species_tree_alignment(tmp_folder, path_to_prokka, path_to_hmm, pwd_hmms
     for f in fastaFiles:
         fastaFile1 = '%s/%s' % (tmp_folder, f)
         fastaFile2 = fastaFile1.replace('.fasta', '_aligned.fasta')
-        os.system(pwd_mafft_exe + ' --quiet --maxiterate 1000 --globalpair ' + fastaFile1 + ' > ' + fastaFile2 + ' ; rm ' + fastaFile1)
+        run_required_tool([pwd_mafft_exe, '--quiet', '--maxiterate', '1000', '--globalpair', fastaFile1], pwd_stdout_file=fastaFile2)
+        os.remove(fastaFile1)
 
 
 def get_species_tree_newick(tmp_folder, each_subset, pwd_fasttree_exe, tree_folder, tree_name):
@@ -1373,7 +894,7 @@ def get_species_tree_newick(tmp_folder, each_subset, pwd_fasttree_exe, tree_fold
     file_out.close()
 
     # calling fasttree for tree calculation
-    os.system('%s -quiet %s > %s 2>/dev/null' % (pwd_fasttree_exe, pwd_alignment_file, pwd_newick_file))
+    run_required_tool([pwd_fasttree_exe, '-quiet', pwd_alignment_file], pwd_stdout_file=pwd_newick_file, pwd_stderr_file=os.devnull)
 
     # draw species tree
     #species_tree = Phylo.read('phylogenticTree.phy', 'newick')
@@ -1638,24 +1159,45 @@ def get_ctg_match_cate_and_identity_distribution_plot(pwd_candidates_file_ET, pw
     plt.clf()
 
 
+def get_stored_tree_result(tree_key, pwd_output_file_dict, pwd_tree_store_folder):
+
+    # gene trees and reconciliations are looked up in the tree store of the project (shared by ranks),
+    # then in the result cache shared by projects
+    stored_result = get_cached_result(tree_key, pwd_output_file_dict, pwd_tree_store_folder)
+    if stored_result is None:
+        stored_result = get_cached_result(tree_key, pwd_output_file_dict)
+        if stored_result is not None:
+            store_cached_result(tree_key, pwd_output_file_dict, stored_result, pwd_tree_store_folder)
+
+    return stored_result
+
+
+def store_tree_result(tree_key, pwd_output_file_dict, unit_result, pwd_tree_store_folder):
+    store_cached_result(tree_key, pwd_output_file_dict, unit_result, pwd_tree_store_folder)
+    store_cached_result(tree_key, pwd_output_file_dict, unit_result)
+
+
 def extract_gene_tree_seq_worker(argument_list):
 
     each_to_process =               argument_list[0]
     pwd_tree_folder =               argument_list[1]
-    pwd_combined_faa_file_subset =  argument_list[2]
+    pwd_protein_store_files =       argument_list[2]
     pwd_blastp_exe =                argument_list[3]
     pwd_mafft_exe =                 argument_list[4]
     pwd_fasttree_exe =              argument_list[5]
-    genome_to_group_dict =          argument_list[6]
-    genome_name_list =              argument_list[7]
-    HGT_query_to_subjects_dict =    argument_list[8]
-    pwd_SCG_tree_all =              argument_list[9]
+    pwd_SCG_tree_all =              argument_list[6]
+    worker_context =                get_worker_context(argument_list[7])
+    id_table =                      worker_context['id_table']
+    genome_group_array =            worker_context['genome_group_array']
+    HGT_query_to_subjects_dict =    worker_context['HGT_query_to_subjects_dict']
+    extractable_gene_array =        worker_context['extractable_gene_array']
+    checkpoint_manifest_key =       argument_list[8]
+    pwd_tree_store_folder =         argument_list[9]
 
     gene_1 = each_to_process[0]
     gene_2 = each_to_process[1]
-    HGT_genome_1 = '_'.join(gene_1.split('_')[:-1])
-    HGT_genome_2 = '_'.join(gene_2.split('_')[:-1])
-    paired_groups = [genome_to_group_dict[HGT_genome_1], genome_to_group_dict[HGT_genome_2]]
+    gene_1_id, gene_2_id = get_gene_ids(id_table, [gene_1, gene_2]).tolist()
+    paired_groups = genome_group_array[get_genome_of_genes(id_table, [gene_1_id, gene_2_id])]
 
 
     each_to_process_concate = '___'.join(each_to_process)
@@ -1672,138 +1214,154 @@ def extract_gene_tree_seq_worker(argument_list):
 
     ################################################## Get gene tree ###################################################
 
-    current_gene_member_BM = set()
-    current_gene_member_BM.add(gene_1)
-    current_gene_member_BM.add(gene_2)
-
-    if gene_1 in HGT_query_to_subjects_dict:
-        for gene_1_subject in HGT_query_to_subjects_dict[gene_1]:
-            current_gene_member_BM.add(gene_1_subject)
-    if gene_2 in HGT_query_to_subjects_dict:
-        for gene_2_subject in HGT_query_to_subjects_dict[gene_2]:
-            current_gene_member_BM.add(gene_2_subject)
-
-    current_gene_member_grouped = []
-    for gene_member in current_gene_member_BM:
-        gene_member_genome = '_'.join(gene_member.split('_')[:-1])
-        if gene_member_genome in genome_name_list:
-            current_gene_member_grouped.append(gene_member)
-
-    current_gene_member_grouped_from_paired_group = []
-    for gene_member in current_gene_member_grouped:
-        current_gene_genome = '_'.join(gene_member.split('_')[:-1])
-        current_genome_group = genome_to_group_dict[current_gene_genome]
-        if current_genome_group in paired_groups:
-            current_gene_member_grouped_from_paired_group.append(gene_member)
+    # gene members are integer ids (see id_table.py), genomes without grouping have group -1
+    current_gene_member_BM = set([gene_1_id, gene_2_id])
+    current_gene_member_BM.update(HGT_query_to_subjects_dict.get(gene_1_id, []))
+    current_gene_member_BM.update(HGT_query_to_subjects_dict.get(gene_2_id, []))
+    current_gene_member_BM = np.array(sorted(current_gene_member_BM), dtype=np.int64)
+    current_gene_member_group = genome_group_array[get_genome_of_genes(id_table, current_gene_member_BM)]
+
+    current_gene_member_grouped = current_gene_member_BM[current_gene_member_group >= 0]
+    current_gene_member_grouped_from_paired_group = current_gene_member_BM[np.isin(current_gene_member_group, paired_groups)]
 
     # genes to extract
     if len(current_gene_member_grouped_from_paired_group) < 3:
-        genes_to_extract_list = current_gene_member_grouped
+        genes_to_extract_array = current_gene_member_grouped
     else:
-        genes_to_extract_list = current_gene_member_grouped_from_paired_group
-
-    # get sequences of othorlog group to build gene tree
-    output_handle = open(gene_tree_seq, "w")
-    extracted_gene_set = set()
-    for seq_record in SeqIO.parse(pwd_combined_faa_file_subset, 'fasta'):
-        # if seq_record.id in current_gene_member:
-        if seq_record.id in genes_to_extract_list:
-            output_handle.write('>%s\n' % seq_record.id)
-            output_handle.write('%s\n' % str(seq_record.seq))
-            extracted_gene_set.add(seq_record.id)
-    output_handle.close()
-
-    if (gene_1 in extracted_gene_set) and (gene_2 in extracted_gene_set):
-        self_seq_handle = open(self_seq, 'w')
-        non_self_seq_handle = open(non_self_seq, 'w')
-        non_self_seq_num = 0
-        for each_seq in SeqIO.parse(gene_tree_seq, 'fasta'):
-            each_seq_genome_id = '_'.join(each_seq.id.split('_')[:-1])
-            if each_seq.id in each_to_process:
-                SeqIO.write(each_seq, self_seq_handle, 'fasta')
-            elif each_seq_genome_id not in [HGT_genome_1, HGT_genome_2]:
-                SeqIO.write(each_seq, non_self_seq_handle, 'fasta')
-                non_self_seq_num += 1
-        self_seq_handle.close()
-        non_self_seq_handle.close()
-
-
-        # run blast
-        genome_subset = set()
-        if non_self_seq_num > 0:
-            os.system('%s -query %s -subject %s -outfmt 6 -out %s' % (pwd_blastp_exe, self_seq, non_self_seq, blast_output))
-            os.system('cat %s | sort > %s' % (blast_output, blast_output_sorted))
-
-            # get best match from each genome
-            current_query_subject_genome = ''
-            current_bit_score = 0
-            current_best_match = ''
-            best_match_list = []
-            for each_hit in open(blast_output_sorted):
-                each_hit_split = each_hit.strip().split('\t')
-                query = each_hit_split[0]
-                subject = each_hit_split[1]
-                subject_genome = '_'.join(subject.split('_')[:-1])
-                query_subject_genome = '%s___%s' % (query, subject_genome)
-                bit_score = float(each_hit_split[11])
-                if current_query_subject_genome == '':
-                    current_query_subject_genome = query_subject_genome
-                    current_bit_score = bit_score
-                    current_best_match = subject
-                elif current_query_subject_genome == query_subject_genome:
-                    if bit_score > current_bit_score:
-                        current_bit_score = bit_score
-                        current_best_match = subject
-                elif current_query_subject_genome != query_subject_genome:
-                    best_match_list.append(current_best_match)
-                    current_query_subject_genome = query_subject_genome
-                    current_bit_score = bit_score
-                    current_best_match = subject
-            best_match_list.append(current_best_match)
-
-            # export sequences
-            gene_tree_seq_all = best_match_list + each_to_process
-            gene_tree_seq_uniq_handle = open(gene_tree_seq_uniq, 'w')
-            for each_seq2 in SeqIO.parse(gene_tree_seq, 'fasta'):
-                if each_seq2.id in gene_tree_seq_all:
-                    gene_tree_seq_uniq_handle.write('>%s\n' % each_seq2.id)
-                    gene_tree_seq_uniq_handle.write('%s\n' % str(each_seq2.seq))
-            gene_tree_seq_uniq_handle.close()
-
-            cmd_mafft = '%s --quiet %s > %s' % (pwd_mafft_exe, gene_tree_seq_uniq, pwd_seq_file_1st_aln)
-            for each_gene in SeqIO.parse(gene_tree_seq_uniq, 'fasta'):
-                each_gene_genome = '_'.join(str(each_gene.id).split('_')[:-1])
-                genome_subset.add(each_gene_genome)
-        else:
-            cmd_mafft = '%s --quiet %s > %s' % (pwd_mafft_exe, gene_tree_seq, pwd_seq_file_1st_aln)
-            for each_gene in SeqIO.parse(gene_tree_seq, 'fasta'):
-                each_gene_genome = '_'.join(str(each_gene.id).split('_')[:-1])
-                genome_subset.add(each_gene_genome)
+        genes_to_extract_array = current_gene_member_grouped_from_paired_group
+
+    # get sequences of othorlog group to build gene tree, genes not in the subjects of candidate genes are ignored
+    genes_to_extract_array = np.sort(genes_to_extract_array[np.isin(genes_to_extract_array, extractable_gene_array)])
+    protein_store = open_protein_store(pwd_protein_store_files[0], pwd_protein_store_files[1])
+    extracted_gene_list = write_protein_sequences(protein_store, genes_to_extract_array.tolist(), get_gene_names(id_table, genes_to_extract_array), gene_tree_seq)
+    extracted_gene_set = set(extracted_gene_list)
+
+    # gene tree from a previous run with the same member sequences and species tree
+    unit_name = 'gene_tree:%s' % each_to_process_concate
+    unit_hash = get_unit_hash(['gene_tree', os.path.basename(pwd_mafft_exe), os.path.basename(pwd_fasttree_exe)], [gene_tree_seq, pwd_SCG_tree_all])
+    if get_finished_unit(checkpoint_manifest_key, unit_name, unit_hash, [pwd_gene_tree_newick, pwd_species_tree_newick]) is not None:
+        os.remove(gene_tree_seq)
+        return
 
-        # run mafft
-        os.system(cmd_mafft)
+    if (gene_1_id in extracted_gene_set) and (gene_2_id in extracted_gene_set):
 
-        # remove columns in alignment
-        # remove_low_cov_and_consensus_columns(pwd_seq_file_1st_aln, 50, 25, pwd_seq_file_2nd_aln)
+        # alignment and gene tree of the same member sequences from another rank, a previous run or project
+        tree_key = get_tool_unit_hash([pwd_blastp_exe, pwd_mafft_exe, pwd_fasttree_exe], ['gene_tree', gene_1, gene_2], [gene_tree_seq])
+        cached_file_dict = {'gene_tree.1.aln': pwd_seq_file_1st_aln, 'gene_tree.newick': pwd_gene_tree_newick}
+        cached_genome_subset = get_stored_tree_result(tree_key, cached_file_dict, pwd_tree_store_folder)
+        if cached_genome_subset is not None:
+            genome_subset = set(cached_genome_subset)
+        else:
+            genome_subset, failed_tool_cmd = get_gene_tree(gene_1_id, gene_2_id, each_to_process, extracted_gene_list, id_table, protein_store, pwd_blastp_exe, pwd_mafft_exe, pwd_fasttree_exe,
+                                                           [gene_tree_seq, gene_tree_seq_uniq, self_seq, non_self_seq, blast_output, blast_output_sorted, pwd_seq_file_1st_aln, pwd_gene_tree_newick])
 
-        # run fasttree
-        # cmd_fasttree = '%s -quiet %s > %s 2>/dev/null' % (pwd_fasttree_exe, pwd_seq_file_2nd_aln, pwd_gene_tree_newick)
-        cmd_fasttree = '%s -quiet %s > %s 2>/dev/null' % (pwd_fasttree_exe, pwd_seq_file_1st_aln, pwd_gene_tree_newick)
-        os.system(cmd_fasttree)
+            # candidates without gene tree are not assessed by Ranger-DTL, the failed command is reported
+            if failed_tool_cmd is not None:
+                remove_path(pwd_gene_tree_newick)
+                remove_path(pwd_species_tree_newick)
+                os.remove(gene_tree_seq)
+                return [each_to_process_concate, failed_tool_cmd]
+            store_tree_result(tree_key, cached_file_dict, sorted(genome_subset), pwd_tree_store_folder)
 
         # Get species tree
         subset_tree(pwd_SCG_tree_all, genome_subset, pwd_species_tree_newick)
+        record_finished_unit(checkpoint_manifest_key, unit_name, unit_hash)
+
+    # remove temp files
+    os.remove(gene_tree_seq)
+
+
+def get_gene_tree(gene_1_id, gene_2_id, each_to_process, extracted_gene_list, id_table, protein_store, pwd_blastp_exe, pwd_mafft_exe, pwd_fasttree_exe, pwd_file_list):
+
+    # returns genomes in the gene tree and the first failed tool command (None if all tools finished),
+    # no tool is run after a failed one
+    gene_tree_seq, gene_tree_seq_uniq, self_seq, non_self_seq, blast_output, blast_output_sorted, pwd_seq_file_1st_aln, pwd_gene_tree_newick = pwd_file_list
+
+    extracted_gene_genome_array = get_genome_of_genes(id_table, extracted_gene_list)
+    self_gene_list = [i for i in extracted_gene_list if i in [gene_1_id, gene_2_id]]
+    non_self_gene_list = np.array(extracted_gene_list)[~np.isin(extracted_gene_genome_array, get_genome_of_genes(id_table, [gene_1_id, gene_2_id]))].tolist()
+    write_protein_sequences(protein_store, self_gene_list, get_gene_names(id_table, self_gene_list), self_seq)
+    write_protein_sequences(protein_store, non_self_gene_list, get_gene_names(id_table, non_self_gene_list), non_self_seq)
+    non_self_seq_num = len(non_self_gene_list)
+
+
+    # run blast
+    genome_subset = set()
+    if non_self_seq_num > 0:
+        cmd_blastp = [pwd_blastp_exe, '-query', self_seq, '-subject', non_self_seq, '-outfmt', '6', '-out', blast_output]
+        if run_tool(cmd_blastp) != 0:
+            for pwd_tmp_file in [self_seq, non_self_seq, blast_output]:
+                remove_path(pwd_tmp_file)
+            return genome_subset, ' '.join(cmd_blastp)
+        sort_file_lines(blast_output, blast_output_sorted)
+
+        # get best match from each genome
+        current_query_subject_genome = ''
+        current_bit_score = 0
+        current_best_match = ''
+        best_match_list = []
+        for each_hit in open(blast_output_sorted):
+            each_hit_split = each_hit.strip().split('\t')
+            query = each_hit_split[0]
+            subject = each_hit_split[1]
+            subject_genome = '_'.join(subject.split('_')[:-1])
+            query_subject_genome = '%s___%s' % (query, subject_genome)
+            bit_score = float(each_hit_split[11])
+            if current_query_subject_genome == '':
+                current_query_subject_genome = query_subject_genome
+                current_bit_score = bit_score
+                current_best_match = subject
+            elif current_query_subject_genome == query_subject_genome:
+                if bit_score > current_bit_score:
+                    current_bit_score = bit_score
+                    current_best_match = subject
+            elif current_query_subject_genome != query_subject_genome:
+                best_match_list.append(current_best_match)
+                current_query_subject_genome = query_subject_genome
+                current_bit_score = bit_score
+                current_best_match = subject
+        best_match_list.append(current_best_match)
+
+        # export sequences
+        gene_tree_seq_all = set(best_match_list + each_to_process)
+        uniq_gene_list = [i for i, j in zip(extracted_gene_list, get_gene_names(id_table, extracted_gene_list)) if j in gene_tree_seq_all]
+        write_protein_sequences(protein_store, uniq_gene_list, get_gene_names(id_table, uniq_gene_list), gene_tree_seq_uniq)
+
+        cmd_mafft = [pwd_mafft_exe, '--quiet', gene_tree_seq_uniq]
+        genome_subset.update(id_table['genome_name'][get_genome_of_genes(id_table, uniq_gene_list)].tolist())
+    else:
+        cmd_mafft = [pwd_mafft_exe, '--quiet', gene_tree_seq]
+        genome_subset.update(id_table['genome_name'][extracted_gene_genome_array].tolist())
+
+    # run mafft, with more threads for the last gene trees
+    failed_tool_cmd = None
+    thread_num = acquire_threads()
+    cmd_mafft = cmd_mafft[:1] + ['--thread', str(thread_num)] + cmd_mafft[1:]
+    if run_tool(cmd_mafft, pwd_stdout_file=pwd_seq_file_1st_aln) != 0:
+        failed_tool_cmd = ' '.join(cmd_mafft)
+
+    # remove columns in alignment
+    # remove_low_cov_and_consensus_columns(pwd_seq_file_1st_aln, 50, 25, pwd_seq_file_2nd_aln)
+
+    # run fasttree
+    # cmd_fasttree = '%s -quiet %s > %s 2>/dev/null' % (pwd_fasttree_exe, pwd_seq_file_2nd_aln, pwd_gene_tree_newick)
+    cmd_fasttree = [pwd_fasttree_exe, '-quiet', pwd_seq_file_1st_aln]
+    if (failed_tool_cmd is None) and (run_tool(cmd_fasttree, pwd_stdout_file=pwd_gene_tree_newick, pwd_stderr_file=os.devnull, env=get_fasttree_env(pwd_fasttree_exe, thread_num)) != 0):
+        failed_tool_cmd = ' '.join(cmd_fasttree)
+    release_threads(thread_num)
+
+    # remove temp files
+    os.remove(self_seq)
+    # os.remove(pwd_seq_file_1st_aln)
+    # os.remove(pwd_seq_file_2nd_aln)
+    if non_self_seq_num > 0:
+        os.remove(non_self_seq)
+        os.remove(blast_output)
+        os.remove(blast_output_sorted)
+        os.remove(gene_tree_seq_uniq)
+
+    return genome_subset, failed_tool_cmd
 
-        # remove temp files
-        os.remove(self_seq)
-        os.remove(gene_tree_seq)
-        # os.remove(pwd_seq_file_1st_aln)
-        # os.remove(pwd_seq_file_2nd_aln)
-        if non_self_seq_num > 0:
-            os.remove(non_self_seq)
-            os.remove(blast_output)
-            os.remove(blast_output_sorted)
-            os.remove(gene_tree_seq_uniq)
 
 
 def Ranger_worker(argument_list):
@@ -1812,6 +1370,8 @@ def Ranger_worker(argument_list):
     pwd_tree_folder = argument_list[2]
     pwd_ranger_exe = argument_list[3]
     pwd_ranger_outputs_folder = argument_list[4]
+    checkpoint_manifest_key = argument_list[5]
+    pwd_tree_store_folder = argument_list[6]
 
     # define Ranger-DTL input file name
     each_paired_tree_concate = '___'.join(each_paired_tree)
@@ -1829,6 +1389,13 @@ def Ranger_worker(argument_list):
         pwd_ranger_outputs = '%s/%s' % (pwd_ranger_outputs_folder, ranger_outputs_file_name)
         # pwd_ranger_outputs_bootstrap = '%s/%s' % (pwd_ranger_outputs_folder, ranger_outputs_file_name_bootstrap)
 
+        # reconciliation from a previous run with the same trees
+        ranger_parameters = '-q -D 2 -T 3 -L 1'
+        unit_name = 'ranger:%s' % each_paired_tree_concate
+        unit_hash = get_unit_hash(['ranger', ranger_parameters], [pwd_species_tree_newick, pwd_gene_tree_newick])
+        if get_finished_unit(checkpoint_manifest_key, unit_name, unit_hash, [pwd_ranger_outputs]) is not None:
+            return
+
         # pwd_current_ranger_outputs_folder = '%s/%s' % (pwd_ranger_outputs_folder, each_paired_tree_concate_short)
 
         # read in species tree
@@ -1904,10 +1471,16 @@ def Ranger_worker(argument_list):
         # create ranger_outputs_folder
         # force_create_folder(pwd_current_ranger_outputs_folder)
 
+        # reconciliation of the same gene tree and species leaf set at another rank, by a previous run or project
+        tree_key = get_tool_unit_hash([pwd_ranger_exe], ['ranger', ranger_parameters], [pwd_ranger_inputs])
+        if get_stored_tree_result(tree_key, {'ranger_output.txt': pwd_ranger_outputs}, pwd_tree_store_folder) is not None:
+            record_finished_unit(checkpoint_manifest_key, unit_name, unit_hash)
+            return
+
         # run Ranger-DTL
-        ranger_parameters = '-q -D 2 -T 3 -L 1'
-        ranger_cmd = '%s %s -i %s -o %s' % (pwd_ranger_exe, ranger_parameters, pwd_ranger_inputs, pwd_ranger_outputs)
-        os.system(ranger_cmd)
+        if run_tool([pwd_ranger_exe] + ranger_parameters.split() + ['-i', pwd_ranger_inputs, '-o', pwd_ranger_outputs]) == 0:
+            record_finished_unit(checkpoint_manifest_key, unit_name, unit_hash)
+            store_tree_result(tree_key, {'ranger_output.txt': pwd_ranger_outputs}, True, pwd_tree_store_folder)
 
     # # run ranger with 100 bootstrap
     # ranger_bootstrap = 1
@@ -1923,15 +1496,124 @@ def Ranger_worker(argument_list):
     #
     # AggregateRanger_cmd = '%s %s/%s_bootstrap > %s' % (pwd_AggregateRanger_exe, each_paired_tree_concate_short, each_paired_tree_concate, ranger_outputs_file_name_bootstrap)
     # os.system(AggregateRanger_cmd)
-    # os.system('rm -r %s' % each_paired_tree_concate_short)
+    # remove_path(each_paired_tree_concate_short)
     # os.chdir(current_wd)
 
 
-def BM(args, config_dict):
+def find_grouping_file(MetaCHIP_wd, output_prefix, grouping_level, pwd_log_file, keep_quiet):
+
+    grouping_file_re = '%s/%s_%s*_grouping.txt' % (MetaCHIP_wd, output_prefix, grouping_level)
+    grouping_file_list = [os.path.basename(file_name) for file_name in glob.glob(grouping_file_re)]
+
+    if len(grouping_file_list) == 0:
+        report_and_log(('No grouping file detected, please specify with "-g" option'), pwd_log_file, keep_quiet)
+        exit()
+
+    elif len(grouping_file_list) > 1:
+        report_and_log(('Multiple grouping file detected, please specify with "-g" option'), pwd_log_file, keep_quiet)
+        exit()
+
+    detected_grouping_file = grouping_file_list[0]
+    pwd_grouping_file = '%s/%s' % (MetaCHIP_wd, detected_grouping_file)
+    group_num = get_group_num_from_grouping_file(pwd_grouping_file)
+    report_and_log(('Found grouping file %s, input genomes were clustered into %s groups' % (detected_grouping_file, group_num)), pwd_log_file, keep_quiet)
+
+    return pwd_grouping_file, group_num
+
+
+def get_BM_hits_of_ranks(MetaCHIP_wd, output_prefix, grouping_file_dict, align_len_cutoff, cover_cutoff, num_threads, pwd_worker_context_file, pwd_log_file, keep_quiet):
+
+    # blastn results of each genome are streamed only once for all ranks (grouping key --> grouping file),
+    # returns the id table, qualified hits of genomes grouped at any rank and, for each rank, the index of
+    # its BM hits in them (sorted as in get_BM_hits_worker) and its identity histograms
+    pwd_prodigal_output_folder = '%s/%s_all_prodigal_output' % (MetaCHIP_wd, output_prefix)
+    pwd_blast_result_folder =    '%s/%s_all_blastn_results'  % (MetaCHIP_wd, output_prefix)
+    pwd_hit_store_folder =       '%s/%s_all_blastn_hits'     % (MetaCHIP_wd, output_prefix)
+    pwd_id_table_file =          '%s/%s_id_table.npz'        % (MetaCHIP_wd, output_prefix)
+
+    grouping_key_list = sorted(grouping_file_dict)
+    genome_name_set = set()
+    name_to_group_number_dict_list = []
+    for grouping_key in grouping_key_list:
+        name_to_group_number_dict = {genome_id: group_index for group_index, genome_id in get_grouping_index_list(grouping_file_dict[grouping_key])}
+        genome_name_set.update(name_to_group_number_dict)
+        name_to_group_number_dict_list.append(name_to_group_number_dict)
+
+    # integer ids of genes, genomes and groups, the id table is rebuilt if genomes were added after it was written
+    id_table = get_id_table(pwd_id_table_file, pwd_prodigal_output_folder, sorted(genome_name_set))
+    genome_group_array_list = []
+    group_name_array_list = []
+    genome_sort_rank_list = []
+    for grouping_key, name_to_group_number_dict in zip(grouping_key_list, name_to_group_number_dict_list):
+        add_grouping_to_id_table(id_table, grouping_key, grouping_file_dict[grouping_key])
+        genome_group_array, group_name_array = get_genome_group_array(id_table, grouping_key)
+        genome_group_array_list.append(genome_group_array)
+        group_name_array_list.append(group_name_array)
+        genome_sort_rank_list.append(get_genome_sort_rank(id_table, name_to_group_number_dict))
+
+    blast_result_file_re = '%s/*_blastn.tab' % pwd_blast_result_folder
+    blast_result_file_list = [os.path.basename(file_name) for file_name in glob.glob(blast_result_file_re)]
+    if len(blast_result_file_list) == 0:
+        report_and_log(('No blast results detected, program exited!'), pwd_log_file, keep_quiet)
+        exit()
+
+    # read-only objects shared by all workers, blastn results missing in the hit store are converted by the workers
+    BM_worker_context_key = publish_worker_context({'id_table':                id_table,
+                                                    'genome_group_array_list': genome_group_array_list,
+                                                    'group_name_array_list':   group_name_array_list,
+                                                    'genome_sort_rank_list':   genome_sort_rank_list,
+                                                    'hit_store_genomes':       update_hit_store_genomes(pwd_hit_store_folder, id_table)}, pwd_worker_context_file)
+
+    list_for_multiple_arguments_get_BM_hits = []
+    for blast_result_file in sorted(blast_result_file_list):
+        genome_name = blast_result_file.split('_blastn')[0]
+        if genome_name in genome_name_set:
+            pwd_blast_result_file = '%s/%s' % (pwd_blast_result_folder, blast_result_file)
+            list_for_multiple_arguments_get_BM_hits.append([pwd_blast_result_file, pwd_hit_store_folder, genome_name, align_len_cutoff, cover_cutoff, BM_worker_context_key])
+
+    # qualified hits are kept in memory, identity histograms of all genomes are merged for each rank
+    pool = get_worker_pool(num_threads)
+    BM_hits_worker_output_list = pool.map(get_BM_hits_worker, list_for_multiple_arguments_get_BM_hits)
+    release_worker_context(BM_worker_context_key)
+    qualified_hits, rank_hit_index_list, rank_histogram_dict_list = concatenate_multi_rank_BM_hits(BM_hits_worker_output_list, len(grouping_key_list))
+
+    return {'id_table': id_table,
+            'hits':     qualified_hits,
+            'rank':     dict(zip(grouping_key_list, zip(rank_hit_index_list, rank_histogram_dict_list)))}
+
+
+def get_BM_hits_of_detection_ranks(args, config_dict):
+
+    # with multiple level prediction (e.g. -r pcofg), blastn results are parsed once before running BM at each rank
+    output_prefix =     args['p']
+    detection_ranks =   args['r']
+    cover_cutoff =      args['cov']
+    align_len_cutoff =  args['al']
+    num_threads =       args['t']
+    keep_quiet =        args['quiet']
+
+    MetaCHIP_wd =      '%s_MetaCHIP_wd'      % output_prefix
+    pwd_log_folder =   '%s/%s_log_files'     % (MetaCHIP_wd, output_prefix)
+    pwd_log_file =     '%s/%s_%s_BM_%s.log'  % (pwd_log_folder, output_prefix, detection_ranks, datetime.now().strftime('%Y-%m-%d_%Hh-%Mm-%Ss_%f'))
+    pwd_worker_context_file = '%s/%s_%s_BM_worker_context.pkl' % (MetaCHIP_wd, output_prefix, detection_ranks)
+
+    grouping_file_dict = {}
+    for grouping_level in detection_ranks:
+        pwd_grouping_file, group_num = find_grouping_file(MetaCHIP_wd, output_prefix, grouping_level, pwd_log_file, keep_quiet)
+        grouping_file_dict['%s%s' % (grouping_level, group_num)] = pwd_grouping_file
+
+    report_and_log(('Filtering blast matches of all ranks with the following criteria: Query genome != Subject genome, Alignment length >= %sbp and coverage >= %s%s' % (align_len_cutoff, cover_cutoff, '%')), pwd_log_file, keep_quiet)
+    BM_hits_of_ranks = get_BM_hits_of_ranks(MetaCHIP_wd, output_prefix, grouping_file_dict, align_len_cutoff, cover_cutoff, num_threads, pwd_worker_context_file, pwd_log_file, keep_quiet)
+    report_and_log(('Qualified blast matches of %s ranks obtained: %s' % (len(grouping_file_dict), len(BM_hits_of_ranks['hits']['query']))), pwd_log_file, keep_quiet)
+
+    return BM_hits_of_ranks
+
+
+def BM(args, config_dict, BM_hits_of_ranks=None):
 
     def do(plot_identity):
-        current_group_pair_identities_array = np.array(current_group_pair_identities)
-        current_group_pair_identity_cut_off = np.percentile(current_group_pair_identities_array, identity_percentile)
+        current_group_pair_hit_num = int(current_group_pair_histogram.sum())
+        current_group_pair_identity_cut_off = get_histogram_percentile(current_group_pair_histogram, identity_percentile)
         current_group_pair_identity_cut_off = float("{0:.2f}".format(current_group_pair_identity_cut_off))
         current_group_pair_name_split = current_group_pair_name.split('_')
         current_group_pair_name_swapped = '%s_%s' % (current_group_pair_name_split[1], current_group_pair_name_split[0])
@@ -1943,20 +1625,17 @@ def BM(args, config_dict):
                 '%s\t%s\n' % (current_group_pair_name, current_group_pair_identity_cut_off))
 
         # check length
-        if len(current_group_pair_identities) >= minimum_plot_number:
-            if current_group_pair_name == current_group_pair_name_swapped:
-                if plot_identity is True:
+        if current_group_pair_hit_num >= minimum_plot_number:
+            if plot_identity is True:
+                current_group_pair_identities = get_histogram_identities(current_group_pair_histogram)
+                if current_group_pair_name == current_group_pair_name_swapped:
                     plot_identity_list(current_group_pair_identities, 'None', current_group_pair_name, pwd_iden_distrib_plot_folder)
-            else:
-                if plot_identity is True:
+                else:
                     plot_identity_list(current_group_pair_identities, current_group_pair_identity_cut_off, current_group_pair_name, pwd_iden_distrib_plot_folder)
 
-            #report_and_log(("Plotting identity distribution (%dth): %s" % (ploted_group, current_group_pair_name)), pwd_log_file, keep_quiet)
-
         else:
             with open(pwd_unploted_groups_file, 'a') as unploted_groups_handle:
-                unploted_groups_handle.write('%s\t%s\n' % (current_group_pair_name, len(current_group_pair_identities)))
-            #report_and_log(("Plotting identity distribution (%dth): %s, blast hits < %d, skipped" % (ploted_group, current_group_pair_name, minimum_plot_number)), pwd_log_file, keep_quiet)
+                unploted_groups_handle.write('%s\t%s\n' % (current_group_pair_name, current_group_pair_hit_num))
 
     output_prefix =             args['p']
     grouping_level =            args['r']
@@ -1968,9 +1647,16 @@ def BM(args, config_dict):
     end_match_identity_cutoff = args['ei']
     num_threads =               args['t']
     No_Eb_Check =               args['NoEbCheck']
+    flanking_batch_size =       args['flk_batch']
+    no_flanking_plot =          args['noplot']
+    plot_all_flanking_regions = args['plot_all']
     plot_identity =             args['plot_iden']
     keep_quiet =                args['quiet']
     keep_temp =                 args['tmp']
+    tool_timeout_str =          args['timeout']
+    resume =                    args['resume']
+    pwd_cache_folder =          args['cache']
+    cache_size_gb =             args['cache_size']
 
 
     # get path to current script
@@ -1988,28 +1674,15 @@ def BM(args, config_dict):
     MetaCHIP_wd =   '%s_MetaCHIP_wd'      % output_prefix
     pwd_log_folder = '%s/%s_log_files'    % (MetaCHIP_wd, output_prefix)
     pwd_log_file =  '%s/%s_%s_BM_%s.log'  % (pwd_log_folder, output_prefix, grouping_level, datetime.now().strftime('%Y-%m-%d_%Hh-%Mm-%Ss_%f'))
+    pwd_tool_run_log = '%s/%s_tool_runs.txt' % (pwd_log_folder, output_prefix)
 
+    # wall time, CPU time, peak RSS and exit status of external tools are recorded in the tool run log
+    set_tool_runner_settings(pwd_tool_run_log, parse_tool_timeouts(tool_timeout_str))
+    set_result_cache_settings(pwd_cache_folder, cache_size_gb)
 
-    pwd_grouping_file = ''
-    group_num = 0
-    if grouping_file is None:
-
-        grouping_file_re = '%s/%s_%s*_grouping.txt' % (MetaCHIP_wd, output_prefix, grouping_level)
-        grouping_file_list = [os.path.basename(file_name) for file_name in glob.glob(grouping_file_re)]
-
-        if len(grouping_file_list) == 1:
-            detected_grouping_file = grouping_file_list[0]
-            pwd_grouping_file = '%s/%s' % (MetaCHIP_wd, detected_grouping_file)
-            group_num = get_group_num_from_grouping_file(pwd_grouping_file)
-            report_and_log(('Found grouping file %s, input genomes were clustered into %s groups' % (detected_grouping_file, group_num)), pwd_log_file, keep_quiet)
-
-        elif len(grouping_file_list) == 0:
-            report_and_log(('No grouping file detected, please specify with "-g" option'), pwd_log_file, keep_quiet)
-            exit()
 
-        else:
-            report_and_log(('Multiple grouping file detected, please specify with "-g" option'), pwd_log_file, keep_quiet)
-            exit()
+    if grouping_file is None:
+        pwd_grouping_file, group_num = find_grouping_file(MetaCHIP_wd, output_prefix, grouping_level, pwd_log_file, keep_quiet)
 
     else:  # with provided grouping file
         pwd_grouping_file = grouping_file
@@ -2021,29 +1694,22 @@ def BM(args, config_dict):
     MetaCHIP_op_folder = '%s_%s%s_HGTs_ip%s_al%sbp_c%s_ei%s_f%skbp' % (output_prefix, grouping_level, group_num, str(identity_percentile), str(align_len_cutoff), str(cover_cutoff), str(end_match_identity_cutoff), flanking_length_kbp)
 
 
-    blast_result_folder =                               '%s_all_blastn_results'                           % (output_prefix)
     combined_ffn_file =                                 '%s_all_combined_ffn.fasta'                       % (output_prefix)
     prodigal_output_folder =                            '%s_all_prodigal_output'                          % (output_prefix)
-    blast_result_filtered_folder =                      '%s_%s%s_blastn_results_filtered'                 % (output_prefix, grouping_level, group_num)
-    blast_result_filtered_folder_g2g =                  '%s_%s%s_1_blastn_results_filtered_g2g'           % (output_prefix, grouping_level, group_num)
-    blast_result_filtered_folder_with_group =           '%s_%s%s_2_blastn_results_filtered_with_group'    % (output_prefix, grouping_level, group_num)
-    blast_result_filtered_folder_in_one_line =          '%s_%s%s_3_blastn_results_filtered_in_one_line'   % (output_prefix, grouping_level, group_num)
-    op_candidates_only_gene_folder_name =               '%s_%s%s_4_HGTs_only_id'                          % (output_prefix, grouping_level, group_num)
-    op_candidates_with_group_folder_name =              '%s_%s%s_5_HGTs_with_group'                       % (output_prefix, grouping_level, group_num)
     iden_distrib_plot_folder =                          '%s_%s%s_identity_distribution'                   % (output_prefix, grouping_level, group_num)
-    qual_idens_file =                                   '%s_%s%s_blastn_results_filtered.tab'             % (output_prefix, grouping_level, group_num)
-    qual_idens_file_gg =                                '%s_%s%s_qualified_iden_gg.txt'                   % (output_prefix, grouping_level, group_num)
-    qual_idens_file_gg_sorted =                         '%s_%s%s_qualified_iden_gg_sorted.txt'            % (output_prefix, grouping_level, group_num)
-    subjects_in_one_line_filename =                     '%s_%s%s_subjects_in_one_line.txt'                % (output_prefix, grouping_level, group_num)
     HGT_query_to_subjects_filename =                    '%s_%s%s_HGT_query_to_subjects.txt'               % (output_prefix, grouping_level, group_num)
     group_pair_iden_cutoff_file_name =                  '%s_%s%s_identity_cutoff.txt'                     % (output_prefix, grouping_level, group_num)
-    op_candidates_with_group_file_name =                '%s_%s%s_HGTs_with_group.txt'                     % (output_prefix, grouping_level, group_num)
-    op_candidates_only_gene_file_name =                 '%s_%s%s_HGTs_only_id.txt'                        % (output_prefix, grouping_level, group_num)
-    op_candidates_only_gene_file_name_uniq =            '%s_%s%s_HGTs_uniq.txt'                           % (output_prefix, grouping_level, group_num)
+    group_pair_iden_histogram_file_name =               '%s_%s%s_identity_histograms.npz'                 % (output_prefix, grouping_level, group_num)
     op_candidates_BM =                                  '%s_%s%s_HGTs_BM.txt'                             % (output_prefix, grouping_level, group_num)
+    candidate_table_file_name =                         '%s_%s%s_HGT_candidates.npz'                      % (output_prefix, grouping_level, group_num)
     op_candidates_seq_nc =                              '%s_%s%s_HGTs_BM_nc.fasta'                        % (output_prefix, grouping_level, group_num)
     op_act_folder_name =                                '%s_%s%s_Flanking_region_plots'                   % (output_prefix, grouping_level, group_num)
+    flanking_region_pairs_file_name =                   '%s_%s%s_flanking_region_pairs.txt'               % (output_prefix, grouping_level, group_num)
+    flanking_region_hits_file_name =                    '%s_%s%s_flanking_region_hits.txt'                % (output_prefix, grouping_level, group_num)
+    contig_match_hits_file_name =                       '%s_%s%s_contig_match_hits.txt'                   % (output_prefix, grouping_level, group_num)
+    BM_worker_context_file_name =                       '%s_%s%s_BM_worker_context.pkl'                   % (output_prefix, grouping_level, group_num)
     grouping_file_with_id_filename =                    '%s_%s%s_grouping_with_id.txt'                    % (output_prefix, grouping_level, group_num)
+    checkpoint_manifest_file_name =                     '%s_%s%s_BP_checkpoints.txt'                      % (output_prefix, grouping_level, group_num)
     unploted_groups_file =                              '0_unploted_groups.txt'
     normal_folder_name =                                '1_Plots_normal'
     end_match_folder_name =                             '2_Plots_end_match'
@@ -2052,28 +1718,21 @@ def BM(args, config_dict):
     pwd_MetaCHIP_op_folder =                       '%s/%s'       % (MetaCHIP_wd, MetaCHIP_op_folder)
     pwd_prodigal_output_folder =                   '%s/%s'       % (MetaCHIP_wd, prodigal_output_folder)
     pwd_combined_ffn_file =                        '%s/%s'       % (MetaCHIP_wd, combined_ffn_file)
-    pwd_blast_result_folder =                      '%s/%s'       % (MetaCHIP_wd, blast_result_folder)
-    pwd_blast_result_filtered_folder =             '%s/%s'       % (MetaCHIP_wd, blast_result_filtered_folder)
-    pwd_qualified_iden_file =                      '%s/%s'       % (MetaCHIP_wd, qual_idens_file)
-    pwd_blast_result_filtered_folder_g2g =         '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, blast_result_filtered_folder_g2g)
-    pwd_blast_result_filtered_folder_with_group =  '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, blast_result_filtered_folder_with_group)
-    pwd_blast_result_filtered_folder_in_one_line = '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, blast_result_filtered_folder_in_one_line)
     pwd_iden_distrib_plot_folder =                 '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, iden_distrib_plot_folder)
-    pwd_qual_iden_file_gg =                        '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, qual_idens_file_gg)
-    pwd_qual_iden_file_gg_sorted =                 '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, qual_idens_file_gg_sorted)
     pwd_unploted_groups_file =                     '%s/%s/%s/%s' % (MetaCHIP_wd, MetaCHIP_op_folder, iden_distrib_plot_folder, unploted_groups_file)
-    pwd_subjects_in_one_line =                     '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, subjects_in_one_line_filename)
     pwd_HGT_query_to_subjects_file =               '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, HGT_query_to_subjects_filename)
     pwd_group_pair_iden_cutoff_file =              '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, group_pair_iden_cutoff_file_name)
-    pwd_op_candidates_with_group_file =            '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, op_candidates_with_group_file_name)
-    pwd_op_candidates_only_gene_file =             '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, op_candidates_only_gene_file_name)
-    pwd_op_candidates_with_group_folder =          '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, op_candidates_with_group_folder_name)
-    pwd_op_candidates_only_gene_folder =           '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, op_candidates_only_gene_folder_name)
-    pwd_op_candidates_only_gene_file_uniq =        '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, op_candidates_only_gene_file_name_uniq)
+    pwd_group_pair_iden_histogram_file =           '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, group_pair_iden_histogram_file_name)
     pwd_op_candidates_BM =                         '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, op_candidates_BM)
+    pwd_candidate_table_file =                     '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, candidate_table_file_name)
     pwd_op_candidates_seq_nc =                     '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, op_candidates_seq_nc)
     pwd_op_act_folder =                            '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, op_act_folder_name)
+    pwd_flanking_region_pairs_file =               '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, flanking_region_pairs_file_name)
+    pwd_flanking_region_hits_file =                '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, flanking_region_hits_file_name)
+    pwd_contig_match_hits_file =                   '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, contig_match_hits_file_name)
+    pwd_BM_worker_context_file =                   '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, BM_worker_context_file_name)
     pwd_grouping_file_with_id =                    '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, grouping_file_with_id_filename)
+    pwd_checkpoint_manifest =                      '%s/%s/%s'    % (MetaCHIP_wd, MetaCHIP_op_folder, checkpoint_manifest_file_name)
     pwd_normal_folder =                            '%s/%s/%s/%s' % (MetaCHIP_wd, MetaCHIP_op_folder, op_act_folder_name, normal_folder_name)
     pwd_end_match_folder =                         '%s/%s/%s/%s' % (MetaCHIP_wd, MetaCHIP_op_folder, op_act_folder_name, end_match_folder_name)
     pwd_full_length_match_folder =                 '%s/%s/%s/%s' % (MetaCHIP_wd, MetaCHIP_op_folder, op_act_folder_name, full_length_match_folder_name)
@@ -2081,8 +1740,15 @@ def BM(args, config_dict):
 
     ####################################################################################################################
 
-    # create outputs folder
-    force_create_folder(pwd_MetaCHIP_op_folder)
+    # create outputs folder, finished units of work in it are kept for resume
+    if resume is True:
+        create_missing_folder(pwd_MetaCHIP_op_folder)
+        remove_path(pwd_iden_distrib_plot_folder)
+        remove_path(pwd_op_act_folder)
+        report_and_log(('Resuming from finished units recorded in: %s' % checkpoint_manifest_file_name), pwd_log_file, keep_quiet)
+    else:
+        force_create_folder(pwd_MetaCHIP_op_folder)
+    checkpoint_manifest_key = open_checkpoint_manifest(pwd_checkpoint_manifest, resume, ['flanking'])
 
     # index grouping file
     index_grouping_file(pwd_grouping_file, pwd_grouping_file_with_id)
@@ -2100,84 +1766,21 @@ def BM(args, config_dict):
         name_to_group_number_dict[bin_name] = bin_group_number
         name_to_group_dict[bin_name] = bin_group
 
-
-    ############################################### filter blastn results ##############################################
-
-    # check whether previous filter results exist
-    filter_blastn_results = 0
-    if os.path.isdir(pwd_blast_result_filtered_folder) is True:
-        blast_result_filtered_file_re = '%s/*_filtered.tab' % pwd_blast_result_filtered_folder
-        blast_result_filtered_file_list = [os.path.basename(file_name) for file_name in glob.glob(blast_result_filtered_file_re)]
-        if len(blast_result_filtered_file_list) != len(genome_name_list):
-            report_and_log(('A difference in numbers between the filtered blast results and qualified genomes were found, will re-run the blast results filter step for all qualified genomes'), pwd_log_file, keep_quiet)
-            filter_blastn_results = 1
-    else:
-        filter_blastn_results = 1
-
-    # filter blast results if filtered blast results not exist
-    if filter_blastn_results == 0:
-        report_and_log(('Filtered blastn results at specified taxonomic rank detected from folder %s. HGT analysis will be performed based on these files.' % blast_result_filtered_folder), pwd_log_file, keep_quiet)
-
-    else:
+    # qualified blast hits of the current rank, parsed before for all ranks with multiple level prediction
+    grouping_key = '%s%s' % (grouping_level, group_num)
+    if (BM_hits_of_ranks is None) or (grouping_key not in BM_hits_of_ranks['rank']):
         report_and_log(('Filtering blast matches with the following criteria: Query genome != Subject genome, Alignment length >= %sbp and coverage >= %s%s' % (align_len_cutoff, cover_cutoff, '%')), pwd_log_file, keep_quiet)
+        BM_hits_of_ranks = get_BM_hits_of_ranks(MetaCHIP_wd, output_prefix, {grouping_key: pwd_grouping_file_with_id}, align_len_cutoff, cover_cutoff, num_threads, pwd_BM_worker_context_file, pwd_log_file, keep_quiet)
 
-        # create folder
-        force_create_folder(pwd_blast_result_filtered_folder)
-
-        # filter blastn results with multiprocessing
-        blast_result_file_re = '%s/*_blastn.tab' % pwd_blast_result_folder
-        blast_result_file_list = [os.path.basename(file_name) for file_name in glob.glob(blast_result_file_re)]
-        if len(blast_result_file_list) == 0:
-            report_and_log(('No blast results detected, program exited!'), pwd_log_file, keep_quiet)
-            exit()
-
-        list_for_multiple_arguments_filter_blast_results = []
-        for blast_result_file in blast_result_file_list:
-            genome_name = blast_result_file.split('_blastn')[0]
-            if genome_name in genome_name_list:
-                pwd_blast_result_file = '%s/%s' % (pwd_blast_result_folder, blast_result_file)
-                blast_result_filtered_file = '%s_filtered.tab' % ('.'.join(blast_result_file.split('.')[:-1]))
-                pwd_blast_result_filtered_file = '%s/%s' % (pwd_blast_result_filtered_folder, blast_result_filtered_file)
-                list_for_multiple_arguments_filter_blast_results.append([pwd_blast_result_file, align_len_cutoff, cover_cutoff, genome_name_list, pwd_blast_result_filtered_file])
-
-        # filter_blast_results with multiprocessing
-        pool = mp.Pool(processes=num_threads)
-        pool.map(filter_blast_results_worker, list_for_multiple_arguments_filter_blast_results)
-        pool.close()
-        pool.join()
+    # integer ids of genes, genomes and groups
+    id_table = BM_hits_of_ranks['id_table']
+    add_grouping_to_id_table(id_table, grouping_key, pwd_grouping_file_with_id)
+    genome_group_array, group_name_array = get_genome_group_array(id_table, grouping_key)
+    rank_hit_index, group_pair_identity_histogram_dict = BM_hits_of_ranks['rank'][grouping_key]
+    BM_hits = get_rank_BM_hits(BM_hits_of_ranks['hits'], rank_hit_index, id_table, genome_group_array)
 
-
-    # combine qualified blast hits
-    report_and_log(('Combining filtered blastn results'), pwd_log_file, keep_quiet)
-    os.system('cat %s/*_blastn_filtered.tab > %s' % (pwd_blast_result_filtered_folder, pwd_qualified_iden_file))
-
-
-    ########################################### get group-to-group identities ##########################################
-
-    report_and_log(('Get group-to-group identities with %s cores' % num_threads), pwd_log_file, keep_quiet)
-
-    # create folder
-    force_create_folder(pwd_blast_result_filtered_folder_g2g)
-
-    # get file list
-    blast_result_filtered_file_re = '%s/*_filtered.tab' % pwd_blast_result_filtered_folder
-    blast_result_filtered_file_list = [os.path.basename(file_name) for file_name in glob.glob(blast_result_filtered_file_re)]
-
-    list_for_multiple_arguments_get_g2g_identities = []
-    for filtered_blast_result in blast_result_filtered_file_list:
-        pwd_filtered_blast_result = '%s/%s' % (pwd_blast_result_filtered_folder, filtered_blast_result)
-        pwd_filtered_blast_result_g2g = '%s/%s_g2g.tab' % (pwd_blast_result_filtered_folder_g2g, filtered_blast_result.split('.tab')[0])
-        list_for_multiple_arguments_get_g2g_identities.append([pwd_filtered_blast_result, name_to_group_number_dict, pwd_filtered_blast_result_g2g])
-
-    # get group-to-group identities with multiprocessing
-    pool = mp.Pool(processes=num_threads)
-    pool.map(get_g2g_identities_worker, list_for_multiple_arguments_get_g2g_identities)
-    pool.close()
-    pool.join()
-
-    # combine g2g_files and sort it
-    os.system('cat %s/*_g2g.tab > %s' % (pwd_blast_result_filtered_folder_g2g, pwd_qual_iden_file_gg))
-    os.system('cat %s | sort > %s' % (pwd_qual_iden_file_gg, pwd_qual_iden_file_gg_sorted))
+    # kept as an output, histograms of runs on subsets of the query genomes can be merged (merge_identity_histogram_files)
+    save_identity_histograms(group_pair_identity_histogram_dict, pwd_group_pair_iden_histogram_file)
 
 
     ############ plot identity distribution between groups and get cutoff according to specified percentile ############
@@ -2189,95 +1792,41 @@ def BM(args, config_dict):
     # get identities for each group pair, plot identity distribution and generate group_pair to identity dict
     with open(pwd_unploted_groups_file, 'a') as unploted_groups_handle:
         unploted_groups_handle.write('Group\tHits_number\n')
-    current_group_pair_name = ''
-    current_group_pair_identities = []
     group_pair_iden_cutoff_dict = {}
-    ploted_group = 1
     minimum_plot_number = 10
     group_pair_iden_cutoff_file = open(pwd_group_pair_iden_cutoff_file, 'w')
-    for each_identity_g in open(pwd_qual_iden_file_gg_sorted):
-        each_identity_g_split = each_identity_g.strip().split('\t')
-        group_pair = each_identity_g_split[0]
-        identity = float(each_identity_g_split[1])
-        group_pair_split = group_pair.split('_')
-        group_pair_swapped = '%s_%s' % (group_pair_split[1], group_pair_split[0])
-        if current_group_pair_name == '':
-            current_group_pair_name = group_pair
-            current_group_pair_identities.append(identity)
-        else:
-            if (group_pair == current_group_pair_name) or (group_pair_swapped == current_group_pair_name):
-                current_group_pair_identities.append(identity)
-            else:
-                # get group_pair to identity dict and identity cut off for defined percentile
-                do(plot_identity)
-                ploted_group += 1
-                # restore current_group_pair_name and current_group_pair_identities for next group pair
-                current_group_pair_name = group_pair
-                current_group_pair_identities = []
-                current_group_pair_identities.append(identity)
-
-    # for the last group
-    do(plot_identity)
+    for current_group_pair_name in sorted(group_pair_identity_histogram_dict):
+        current_group_pair_histogram = group_pair_identity_histogram_dict[current_group_pair_name]
+        do(plot_identity)
     group_pair_iden_cutoff_file.close()
 
 
-    ############################### add group to blast hits and put subjects in one line ###############################
+    ##################################################### get HGT candidates ####################################################
 
-    report_and_log(('Analyzing Blast hits to get HGT candidates with %s cores' % num_threads), pwd_log_file, keep_quiet)
+    report_and_log(('Analyzing Blast hits to get HGT candidates'), pwd_log_file, keep_quiet)
 
-    # create folder
-    force_create_folder(pwd_blast_result_filtered_folder_with_group)
-    force_create_folder(pwd_blast_result_filtered_folder_in_one_line)
-    force_create_folder(pwd_op_candidates_with_group_folder)
-    force_create_folder(pwd_op_candidates_only_gene_folder)
-
-    list_for_multiple_arguments_get_HGT = []
-    for filtered_blast_result in blast_result_filtered_file_list:
-        genome_id = filtered_blast_result.split('_blastn_filtered.tab')[0]
-        pwd_filtered_blast_result = '%s/%s' % (pwd_blast_result_filtered_folder, filtered_blast_result)
-        pwd_filtered_blast_result_with_group =  '%s/%s_with_group_sorted.tab'    % (pwd_blast_result_filtered_folder_with_group, filtered_blast_result.split('.tab')[0])
-        pwd_filtered_blast_result_in_one_line = '%s/%s_subjects_in_one_line.tab' % (pwd_blast_result_filtered_folder_in_one_line, filtered_blast_result.split('.tab')[0])
-        pwd_hgt_candidates_with_group =         '%s/%s_HGTs_with_group.txt'      % (pwd_op_candidates_with_group_folder, genome_id)
-        pwd_hgt_candidates_only_gene =          '%s/%s_HGTs_only_gene.txt'       % (pwd_op_candidates_only_gene_folder, genome_id)
-
-        list_for_multiple_arguments_get_HGT.append([pwd_filtered_blast_result,
-                                                    name_to_group_number_dict,
-                                                    pwd_filtered_blast_result_with_group,
-                                                    pwd_filtered_blast_result_in_one_line,
-                                                    pwd_hgt_candidates_with_group,
-                                                    pwd_hgt_candidates_only_gene,
-                                                    group_pair_iden_cutoff_dict])
-
-    # add group to blast hits with multiprocessing
-    pool = mp.Pool(processes=num_threads)
-    pool.map(get_HGT_worker, list_for_multiple_arguments_get_HGT)
-    pool.close()
-    pool.join()
+    HGT_candidate_query, HGT_candidate_subject, HGT_candidate_identity = get_BM_candidates(BM_hits, group_name_array, group_pair_iden_cutoff_dict)
 
 
     ################################ remove bidirection and add identity to output file ################################
 
-    # combine pwd_op_candidates_with_group_file and pwd_op_candidates_only_gene_file
-    os.system('cat %s/*_HGTs_with_group.txt > %s' % (pwd_op_candidates_with_group_folder, pwd_op_candidates_with_group_file))
-    os.system('cat %s/*_HGTs_only_gene.txt > %s'  % (pwd_op_candidates_only_gene_folder, pwd_op_candidates_only_gene_file))
-
-
-    # remove bidirection and add identity to output file
-    candidate2identity_dict = {}
-    for each_candidate_pair in open(pwd_op_candidates_with_group_file):
-        each_candidate_pair_split = each_candidate_pair.strip().split('\t')
-        recipient_gene = each_candidate_pair_split[0].split('|')[1]
-        donor_gene = each_candidate_pair_split[1].split('|')[1]
-        identity = float(each_candidate_pair_split[1].split('|')[2])
-        candidate2identity_key = '%s___%s' % (recipient_gene, donor_gene)
-        candidate2identity_dict[candidate2identity_key] = identity
+    # candidates predicted in both directions are kept once
+    candidate_order = get_bidirection_free_order(HGT_candidate_query, HGT_candidate_subject)
+    HGT_candidate_query = HGT_candidate_query[candidate_order]
+    HGT_candidate_subject = HGT_candidate_subject[candidate_order]
+    candidate_table = create_candidate_table(HGT_candidate_query, HGT_candidate_subject, HGT_candidate_identity[candidate_order],
+                                             genome_group_array[get_genome_of_genes(id_table, HGT_candidate_query)],
+                                             genome_group_array[get_genome_of_genes(id_table, HGT_candidate_subject)])
 
-    remove_bidirection(pwd_op_candidates_only_gene_file, candidate2identity_dict, pwd_op_candidates_only_gene_file_uniq)
+    # gene names for flanking region check
+    HGT_candidate_gene_1_list = get_gene_names(id_table, candidate_table['gene_1'])
+    HGT_candidate_gene_2_list = get_gene_names(id_table, candidate_table['gene_2'])
+    HGT_candidate_list_uniq = [[gene_1, gene_2, identity] for gene_1, gene_2, identity in zip(HGT_candidate_gene_1_list, HGT_candidate_gene_2_list, candidate_table['identity'].tolist())]
 
 
-    ############################################### plot flanking region ###############################################
+    ############################################### check flanking region ##############################################
 
-    report_and_log(('Plotting flanking regions with %s cores' % num_threads), pwd_log_file, keep_quiet)
+    report_and_log(('Checking flanking regions with %s cores' % num_threads), pwd_log_file, keep_quiet)
 
     # create folder to hold ACT output
     os.makedirs(pwd_op_act_folder)
@@ -2285,20 +1834,83 @@ def BM(args, config_dict):
     os.makedirs(pwd_end_match_folder)
     os.makedirs(pwd_full_length_match_folder)
 
-    # initialize manager.dict
-    manager = mp.Manager()
-    candidates_2_contig_match_category_dict_mp = manager.dict()
+    # prepare annotation index for genomes annotated before it was introduced
+    list_for_multiple_arguments_annotation_index = []
+    for genome_name in sorted(set(['_'.join(i.split('_')[:-1]) for each_candidate in HGT_candidate_list_uniq for i in each_candidate[:2]])):
+        pwd_genome_idx_file = '%s/%s.idx' % (pwd_prodigal_output_folder, genome_name)
+        if not os.path.isfile(pwd_genome_idx_file):
+            list_for_multiple_arguments_annotation_index.append(['%s/%s.gbk' % (pwd_prodigal_output_folder, genome_name), pwd_genome_idx_file, '%s/%s.seq' % (pwd_prodigal_output_folder, genome_name)])
+    if len(list_for_multiple_arguments_annotation_index) > 0:
+        get_worker_pool(num_threads).map(build_annotation_index_worker, list_for_multiple_arguments_annotation_index)
+
+    # candidates checked by a previous run with the same annotation and parameters are not checked again
+    finished_flanking_region_metadata_list = []
+    unit_hash_dict = {}
+    match_list = []
+    for each_candidate in HGT_candidate_list_uniq:
+        unit_name = 'flanking:%s___%s' % (each_candidate[0], each_candidate[1])
+        unit_hash_dict[unit_name] = get_unit_hash([each_candidate[2], flanking_length, end_match_identity_cutoff, No_Eb_Check],
+                                                  ['%s/%s.gbk' % (pwd_prodigal_output_folder, '_'.join(i.split('_')[:-1])) for i in each_candidate[:2]])
+        finished_flanking_region_metadata = get_finished_unit(checkpoint_manifest_key, unit_name, unit_hash_dict[unit_name])
+        if finished_flanking_region_metadata is None:
+            match_list.append('%s\t%s\t%s\n' % (each_candidate[0], each_candidate[1], each_candidate[2]))
+        else:
+            finished_flanking_region_metadata_list.append(finished_flanking_region_metadata)
+    if len(finished_flanking_region_metadata_list) > 0:
+        report_and_log(('Flanking regions of %s candidates were checked by a previous run' % len(finished_flanking_region_metadata_list)), pwd_log_file, keep_quiet)
 
+    # candidates are processed in batches, with one blastn job for each batch
     list_for_multiple_arguments_flanking_regions = []
-    for match in open(pwd_op_candidates_only_gene_file_uniq):
-        list_for_multiple_arguments_flanking_regions.append([match, pwd_prodigal_output_folder, flanking_length, align_len_cutoff, name_to_group_number_dict, pwd_op_act_folder,
-                                                             pwd_normal_folder, pwd_end_match_folder, pwd_full_length_match_folder, pwd_blastn_exe, keep_temp,
-                                                             candidates_2_contig_match_category_dict_mp, end_match_identity_cutoff, No_Eb_Check])
-
-    pool_flanking_regions = mp.Pool(processes=num_threads)
-    pool_flanking_regions.map(get_gbk_blast_act2, list_for_multiple_arguments_flanking_regions)
-    pool_flanking_regions.close()
-    pool_flanking_regions.join()
+    for match_list_start in range(0, len(match_list), flanking_batch_size):
+        list_for_multiple_arguments_flanking_regions.append([match_list[match_list_start:(match_list_start + flanking_batch_size)], pwd_prodigal_output_folder, flanking_length, pwd_op_act_folder,
+                                                             pwd_blastn_exe, keep_temp, end_match_identity_cutoff, No_Eb_Check])
+
+    # results of each batch are written out as soon as it is finished, match category, flanking region hits and contig match hits of each
+    # candidate are stored, plots can be generated from them later and match categories re-computed with tuning_full_length_and_end_match.py
+    flanking_region_pairs_handle = open(pwd_flanking_region_pairs_file, 'w')
+    flanking_region_hits_handle = open(pwd_flanking_region_hits_file, 'w')
+    contig_match_hits_handle = open(pwd_contig_match_hits_file, 'w')
+    flanking_region_pairs_handle.write('Gene_1\tGene_2\tIdentity\tMatch_category\n')
+    flanking_region_hits_handle.write('Gene_1\tGene_2\tqseqid\tsseqid\tpident\tlength\tmismatch\tgapopen\tqstart\tqend\tsstart\tsend\tevalue\tbitscore\n')
+    contig_match_hits_handle.write('Gene_1\tGene_2\tqseqid\tsseqid\tpident\tlength\tmismatch\tgapopen\tqstart\tqend\tsstart\tsend\tevalue\tbitscore\tqlen\tslen\n')
+    checked_gene_1_list = []
+    checked_gene_2_list = []
+    checked_match_category_list = []
+    reported_percentage = 0
+    flanking_region_metadata_list_iter = itertools.chain([finished_flanking_region_metadata_list],
+                                                         get_worker_pool(num_threads).imap_unordered(check_flanking_regions_worker, list_for_multiple_arguments_flanking_regions))
+    for flanking_region_metadata_list in flanking_region_metadata_list_iter:
+        for gene_1, gene_2, identity, match_category, flanking_hit_list, contig_hit_list in flanking_region_metadata_list:
+            checked_gene_1_list.append(gene_1)
+            checked_gene_2_list.append(gene_2)
+            checked_match_category_list.append(match_category_list.index(match_category))
+            flanking_region_pairs_handle.write('%s\t%s\t%s\t%s\n' % (gene_1, gene_2, identity, match_category))
+            for flanking_hit_split in flanking_hit_list:
+                flanking_region_hits_handle.write('%s\t%s\t%s\n' % (gene_1, gene_2, '\t'.join(flanking_hit_split)))
+            for contig_hit_split in contig_hit_list:
+                contig_match_hits_handle.write('%s\t%s\t%s\n' % (gene_1, gene_2, '\t'.join(contig_hit_split)))
+            unit_name = 'flanking:%s___%s' % (gene_1, gene_2)
+            if flanking_region_metadata_list is not finished_flanking_region_metadata_list:
+                record_finished_unit(checkpoint_manifest_key, unit_name, unit_hash_dict[unit_name], [gene_1, gene_2, identity, match_category, flanking_hit_list, contig_hit_list])
+
+        # report progress every 10%
+        checked_percentage = len(checked_gene_1_list) * 100 // max(len(HGT_candidate_list_uniq), 1)
+        if checked_percentage // 10 > reported_percentage // 10:
+            report_and_log(('Flanking regions checked for %s/%s candidates (%s%s)' % (len(checked_gene_1_list), len(HGT_candidate_list_uniq), checked_percentage, '%')), pwd_log_file, keep_quiet)
+            reported_percentage = checked_percentage
+    flanking_region_pairs_handle.close()
+    flanking_region_hits_handle.close()
+    contig_match_hits_handle.close()
+
+    # add match category to candidate table
+    checked_rows = find_candidates(candidate_table, get_gene_ids(id_table, checked_gene_1_list), get_gene_ids(id_table, checked_gene_2_list))
+    candidate_table['match_category'][checked_rows] = checked_match_category_list
+
+    # plot flanking regions of all candidates, by default only PG validated HGTs are plotted at the end of PG
+    if (plot_all_flanking_regions is True) and (no_flanking_plot is False):
+        report_and_log(('Plotting flanking regions with %s cores' % num_threads), pwd_log_file, keep_quiet)
+        plot_flanking_regions_of_candidates(None, pwd_flanking_region_pairs_file, pwd_flanking_region_hits_file, pwd_prodigal_output_folder,
+                                            flanking_length, name_to_group_number_dict, pwd_op_act_folder, num_threads)
 
     # remove temporary folder
     if keep_temp == 0:
@@ -2310,46 +1922,15 @@ def BM(args, config_dict):
         #os.system('rm -r %s/*___*' % pwd_op_act_folder)
 
 
-    # convert mp.dict to normal dict
-    candidates_2_contig_match_category_dict = {each_key: each_value for each_key, each_value in candidates_2_contig_match_category_dict_mp.items()}
-
-
     ################################################ get BM output file ################################################
 
-    # add at_end information to output file
-    BM_output_file_handle = open(pwd_op_candidates_BM, 'w')
-    BM_output_file_handle.write('Gene_1\tGene_2\tGene_1_group\tGene_2_group\tIdentity\tend_match\tfull_length_match\n')
-    for each_candidate in open(pwd_op_candidates_only_gene_file_uniq):
-        each_candidate_split = each_candidate.strip().split('\t')
-        recipient_gene = each_candidate_split[0]
-        recipient_genome = '_'.join(recipient_gene.split('_')[:-1])
-        recipient_genome_group_id = name_to_group_number_dict[recipient_genome]
-        recipient_genome_group = recipient_genome_group_id.split('_')[0]
-        donor_gene = each_candidate_split[1]
-        donor_genome = '_'.join(donor_gene.split('_')[:-1])
-        donor_genome_group_id = name_to_group_number_dict[donor_genome]
-        donor_genome_group = donor_genome_group_id.split('_')[0]
-        identity = each_candidate_split[2]
-        concatenated = '%s___%s' % (recipient_gene, donor_gene)
-
-        end_match_value = 'no'
-        if candidates_2_contig_match_category_dict[concatenated] == 'end_match':
-            end_match_value = 'yes'
-
-        full_length_match_value = 'no'
-        if candidates_2_contig_match_category_dict[concatenated] == 'full_length_match':
-            full_length_match_value = 'yes'
-
-        # write to output files
-        BM_output_file_handle.write('%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (recipient_gene, donor_gene, recipient_genome_group, donor_genome_group, identity, end_match_value, full_length_match_value))
-    BM_output_file_handle.close()
+    save_candidate_table(candidate_table, pwd_candidate_table_file)
+    write_candidate_table_txt(candidate_table, id_table, group_name_array, pwd_op_candidates_BM, with_direction=False)
 
 
     ####################################### export gene clusters for PG approach #######################################
 
-    os.system('cat %s/*_in_one_line.tab > %s' % (pwd_blast_result_filtered_folder_in_one_line, pwd_subjects_in_one_line))
-
-    export_HGT_query_to_subjects(pwd_op_candidates_BM, pwd_subjects_in_one_line, pwd_HGT_query_to_subjects_file)
+    export_HGT_query_to_subjects(candidate_table, BM_hits, id_table, pwd_HGT_query_to_subjects_file)
 
 
     ################################### export nc and aa sequence of predicted HGTs ####################################
@@ -2357,20 +1938,14 @@ def BM(args, config_dict):
     report_and_log(('Extracting nc sequences for BM predicted HGTs'), pwd_log_file, keep_quiet)
 
     # get qualified HGT candidates
-    HGT_candidates_qualified = set()
-    for each_candidate_2 in open(pwd_op_candidates_BM):
-        if not each_candidate_2.startswith('Gene_1\tGene_2\tGene_1_group'):
-            each_candidate_2_split = each_candidate_2.strip().split('\t')
-            end_match = each_candidate_2_split[5]
-            full_length_match = each_candidate_2_split[6]
-            if (end_match == 'no') and (full_length_match == 'no'):
-                HGT_candidates_qualified.add(each_candidate_2_split[0])
-                HGT_candidates_qualified.add(each_candidate_2_split[1])
+    normal_candidate = candidate_table['match_category'] == 0
+    HGT_candidates_qualified = set(get_gene_names(id_table, np.r_[candidate_table['gene_1'][normal_candidate], candidate_table['gene_2'][normal_candidate]]))
 
     candidates_seq_nc_handle = open(pwd_op_candidates_seq_nc, 'w')
-    for each_seq in SeqIO.parse(pwd_combined_ffn_file, 'fasta'):
-        if each_seq.id in HGT_candidates_qualified:
-            SeqIO.write(each_seq, candidates_seq_nc_handle, 'fasta')
+    with open_file(pwd_combined_ffn_file) as combined_ffn_handle:
+        for each_seq in SeqIO.parse(combined_ffn_handle, 'fasta'):
+            if each_seq.id in HGT_candidates_qualified:
+                SeqIO.write(each_seq, candidates_seq_nc_handle, 'fasta')
     candidates_seq_nc_handle.close()
 
 
@@ -2378,24 +1953,11 @@ def BM(args, config_dict):
 
     if keep_temp is False:
         report_and_log(('Deleting temporary files'), pwd_log_file, keep_quiet)
-        os.remove(pwd_qualified_iden_file)
-        os.remove(pwd_qual_iden_file_gg)
-        os.remove(pwd_qual_iden_file_gg_sorted)
-        os.remove(pwd_subjects_in_one_line)
-        os.remove(pwd_op_candidates_only_gene_file_uniq)
-        os.remove(pwd_op_candidates_with_group_file)
-        os.remove(pwd_op_candidates_only_gene_file)
         os.remove(pwd_unploted_groups_file)
         os.remove(pwd_group_pair_iden_cutoff_file)
 
         # os.remove(pwd_HGT_query_to_subjects_file) need this file in the PG approach
-        os.system('rm -r %s' % pwd_blast_result_filtered_folder_g2g)
-        os.system('rm -r %s' % pwd_blast_result_filtered_folder_with_group)
-        os.system('rm -r %s' % pwd_blast_result_filtered_folder_in_one_line)
-        os.system('rm -r %s' % pwd_op_candidates_only_gene_folder)
-        os.system('rm -r %s' % pwd_op_candidates_with_group_folder)
-        os.system('rm -r %s' % pwd_iden_distrib_plot_folder)
-        os.system('rm -r %s' % pwd_blast_result_filtered_folder)
+        remove_path(pwd_iden_distrib_plot_folder)
 
     # report
     report_and_log(('Done for Best-match approach!'), pwd_log_file, keep_quiet)
@@ -2412,8 +1974,20 @@ def PG(args, config_dict):
     identity_percentile =       args['ip']
     end_match_identity_cutoff = args['ei']
     num_threads =               args['t']
+    no_flanking_plot =          args['noplot']
+    plot_all_flanking_regions = args['plot_all']
     keep_quiet =                args['quiet']
     keep_temp =                 args['tmp']
+    tool_timeout_str =          args['timeout']
+    resume =                    args['resume']
+    pwd_cache_folder =          args['cache']
+    cache_size_gb =             args['cache_size']
+    job_executor =              args['executor']
+    pwd_js_header =             args['js_header']
+    submit_cmd =                args['submit']
+    job_num =                   args['jobs']
+    job_timeout =               args['job_timeout']
+    flanking_length = flanking_length_kbp * 1000
 
     # read in config file
     pwd_ranger_exe = config_dict['ranger_linux']
@@ -2439,6 +2013,16 @@ def PG(args, config_dict):
     MetaCHIP_wd =       '%s_MetaCHIP_wd'        % output_prefix
     pwd_log_folder =    '%s/%s_log_files'       % (MetaCHIP_wd, output_prefix)
     pwd_log_file =      '%s/%s_%s_PG_%s.log'    % (pwd_log_folder, output_prefix, grouping_level, datetime.now().strftime('%Y-%m-%d_%Hh-%Mm-%Ss_%f'))
+    pwd_tool_run_log =  '%s/%s_tool_runs.txt'   % (pwd_log_folder, output_prefix)
+    set_tool_runner_settings(pwd_tool_run_log, parse_tool_timeouts(tool_timeout_str))
+    set_result_cache_settings(pwd_cache_folder, cache_size_gb)
+
+    # gene trees and Ranger-DTL runs are run by the executor
+    executor_setting_dict = get_executor_settings(job_executor, pwd_js_header, submit_cmd, job_num, num_threads, output_prefix, job_timeout)
+    executor_setting_error = check_executor_settings(executor_setting_dict)
+    if executor_setting_error is not None:
+        report_and_log(executor_setting_error, pwd_log_file, keep_quiet=False)
+        exit()
 
 
     pwd_grouping_file = ''
@@ -2472,14 +2056,18 @@ def PG(args, config_dict):
     MetaCHIP_op_folder = '%s_%s%s_HGTs_ip%s_al%sbp_c%s_ei%s_f%skbp' % (output_prefix, grouping_level, group_num, str(identity_percentile), str(align_len_cutoff), str(cover_cutoff), str(end_match_identity_cutoff), flanking_length_kbp)
 
     prodigal_output_folder =                            '%s_all_prodigal_output'                      % (output_prefix)
+    id_table_file =                                     '%s_id_table.npz'                             % (output_prefix)
     genome_size_file_name =                             '%s_all_genome_size.txt'                      % (output_prefix)
-    combined_faa_file =                                 '%s_all_combined_faa.fasta'                   % (output_prefix)
+    protein_store_seq_file =                            '%s_protein_store.seq'                        % (output_prefix)
+    protein_store_index_file =                          '%s_protein_store.idx'                        % (output_prefix)
+    tree_store_folder =                                 '%s_PG_tree_store'                            % (output_prefix)
     tree_folder =                                       '%s_%s%s_PG_tree_folder'                      % (output_prefix, grouping_level, group_num)
     ranger_inputs_folder_name =                         '%s_%s%s_PG_Ranger_input'                     % (output_prefix, grouping_level, group_num)
     ranger_outputs_folder_name =                        '%s_%s%s_PG_Ranger_output'                    % (output_prefix, grouping_level, group_num)
     candidates_file_name =                              '%s_%s%s_HGTs_BM.txt'                         % (output_prefix, grouping_level, group_num)
     candidates_seq_file_name =                          '%s_%s%s_HGTs_BM_nc.fasta'                    % (output_prefix, grouping_level, group_num)
     candidates_file_name_ET =                           '%s_%s%s_HGTs_PG.txt'                         % (output_prefix, grouping_level, group_num)
+    candidate_table_file_name =                         '%s_%s%s_HGT_candidates.npz'                  % (output_prefix, grouping_level, group_num)
     candidates_file_name_ET_validated =                 '%s_%s%s_HGTs_PG_validated.txt'               % (output_prefix, grouping_level, group_num)
     candidates_file_name_ET_validated_STAT_png =        '%s_%s%s_HGTs_PG_validated_stats.png'         % (output_prefix, grouping_level, group_num)
     candidates_file_name_ET_validated_STAT_group_txt =  '%s_%s%s_HGTs_PG_validated_group_stats.txt'   % (output_prefix, grouping_level, group_num)
@@ -2487,14 +2075,18 @@ def PG(args, config_dict):
     candidates_file_name_ET_validated_fasta_nc =        '%s_%s%s_HGTs_PG_nc.fasta'                    % (output_prefix, grouping_level, group_num)
     candidates_file_name_ET_validated_fasta_aa =        '%s_%s%s_HGTs_PG_aa.fasta'                    % (output_prefix, grouping_level, group_num)
     flanking_region_plot_folder_name =                  '%s_%s%s_Flanking_region_plots'               % (output_prefix, grouping_level, group_num)
+    flanking_region_pairs_file_name =                   '%s_%s%s_flanking_region_pairs.txt'           % (output_prefix, grouping_level, group_num)
+    flanking_region_hits_file_name =                    '%s_%s%s_flanking_region_hits.txt'            % (output_prefix, grouping_level, group_num)
     newick_tree_file =                                  '%s_%s%s_species_tree.newick'                 % (output_prefix, grouping_level, group_num)
     grouping_file_with_id_filename =                    '%s_%s%s_grouping_with_id.txt'                % (output_prefix, grouping_level, group_num)
-    combined_faa_file_subset =                          '%s_%s%s_combined_subset.faa'                 % (output_prefix, grouping_level, group_num)
     plot_identity_distribution_BM =                     '%s_%s%s_plot_HGT_identity_BM.png'            % (output_prefix, grouping_level, group_num)
     plot_identity_distribution_PG =                     '%s_%s%s_plot_HGT_identity_PG.png'            % (output_prefix, grouping_level, group_num)
     plot_at_ends_number =                               '%s_%s%s_plot_ctg_match_category.png'         % (output_prefix, grouping_level, group_num)
     plot_circos =                                       '%s_%s%s_plot_circos_PG.png'                  % (output_prefix, grouping_level, group_num)
     HGT_query_to_subjects_filename =                    '%s_%s%s_HGT_query_to_subjects.txt'           % (output_prefix, grouping_level, group_num)
+    PG_worker_context_file_name =                       '%s_%s%s_PG_worker_context.pkl'               % (output_prefix, grouping_level, group_num)
+    PG_job_folder_name =                                '%s_%s%s_PG_jobs'                             % (output_prefix, grouping_level, group_num)
+    checkpoint_manifest_file_name =                     '%s_%s%s_BP_checkpoints.txt'                  % (output_prefix, grouping_level, group_num)
 
     normal_folder_name =                                '1_Plots_normal'
     normal_folder_name_PG_validated =                   '1_Plots_normal_PG_validated'
@@ -2509,6 +2101,7 @@ def PG(args, config_dict):
     pwd_candidates_file =                               '%s/%s'                                       % (pwd_MetaCHIP_op_folder, candidates_file_name)
     pwd_candidates_seq_file =                           '%s/%s'                                       % (pwd_MetaCHIP_op_folder, candidates_seq_file_name)
     pwd_candidates_file_ET =                            '%s/%s'                                       % (pwd_MetaCHIP_op_folder, candidates_file_name_ET)
+    pwd_candidate_table_file =                          '%s/%s'                                       % (pwd_MetaCHIP_op_folder, candidate_table_file_name)
     pwd_candidates_file_ET_validated =                  '%s/%s'                                       % (pwd_MetaCHIP_op_folder, candidates_file_name_ET_validated)
     pwd_candidates_file_ET_validated_STAT_png =         '%s/%s'                                       % (pwd_MetaCHIP_op_folder, candidates_file_name_ET_validated_STAT_png)
     pwd_candidates_file_ET_validated_STAT_group_txt =   '%s/%s'                                       % (pwd_MetaCHIP_op_folder, candidates_file_name_ET_validated_STAT_group_txt)
@@ -2520,7 +2113,8 @@ def PG(args, config_dict):
     pwd_plot_at_ends_number =                           '%s/%s'                                       % (pwd_MetaCHIP_op_folder, plot_at_ends_number)
     pwd_plot_circos =                                   '%s/%s'                                       % (pwd_MetaCHIP_op_folder, plot_circos)
     pwd_flanking_region_plot_folder =                   '%s/%s'                                       % (pwd_MetaCHIP_op_folder, flanking_region_plot_folder_name)
-    pwd_combined_faa_file =                             '%s/%s'                                       % (pwd_MetaCHIP_op_folder, combined_faa_file)
+    pwd_flanking_region_pairs_file =                    '%s/%s'                                       % (pwd_MetaCHIP_op_folder, flanking_region_pairs_file_name)
+    pwd_flanking_region_hits_file =                     '%s/%s'                                       % (pwd_MetaCHIP_op_folder, flanking_region_hits_file_name)
     pwd_1_normal_folder =                               '%s/%s'                                       % (pwd_flanking_region_plot_folder, normal_folder_name)
     pwd_1_normal_folder_PG_validated =                  '%s/%s'                                       % (pwd_flanking_region_plot_folder, normal_folder_name_PG_validated)
     pwd_2_at_ends_folder =                              '%s/%s'                                       % (pwd_flanking_region_plot_folder, at_ends_folder_name)
@@ -2530,37 +2124,29 @@ def PG(args, config_dict):
     pwd_ranger_inputs_folder =                          '%s/%s'                                       % (pwd_MetaCHIP_op_folder, ranger_inputs_folder_name)
     pwd_ranger_outputs_folder =                         '%s/%s'                                       % (pwd_MetaCHIP_op_folder, ranger_outputs_folder_name)
     pwd_tree_folder =                                   '%s/%s'                                       % (pwd_MetaCHIP_op_folder, tree_folder)
-    pwd_combined_faa_file_subset =                      '%s/%s'                                       % (pwd_MetaCHIP_op_folder, combined_faa_file_subset)
     pwd_genome_size_file =                              '%s/%s'                                       % (MetaCHIP_wd, genome_size_file_name)
     pwd_newick_tree_file =                              '%s/%s'                                       % (MetaCHIP_wd, newick_tree_file)
     pwd_grouping_file_with_id =                         '%s/%s/%s'                                    % (MetaCHIP_wd, MetaCHIP_op_folder, grouping_file_with_id_filename)
     pwd_HGT_query_to_subjects_file =                    '%s/%s/%s'                                    % (MetaCHIP_wd, MetaCHIP_op_folder, HGT_query_to_subjects_filename)
+    pwd_PG_worker_context_file =                        '%s/%s'                                       % (pwd_MetaCHIP_op_folder, PG_worker_context_file_name)
+    pwd_PG_job_folder =                                 '%s/%s'                                       % (pwd_MetaCHIP_op_folder, PG_job_folder_name)
+    pwd_checkpoint_manifest =                           '%s/%s'                                       % (pwd_MetaCHIP_op_folder, checkpoint_manifest_file_name)
+    pwd_id_table_file =                                 '%s/%s'                                       % (MetaCHIP_wd, id_table_file)
+    pwd_protein_store_seq_file =                        '%s/%s'                                       % (MetaCHIP_wd, protein_store_seq_file)
+    pwd_protein_store_index_file =                      '%s/%s'                                       % (MetaCHIP_wd, protein_store_index_file)
+    pwd_tree_store_folder =                             '%s/%s'                                       % (MetaCHIP_wd, tree_store_folder)
 
     ###################################### store ortholog information into dictionary ######################################
 
-    # create folders
-    force_create_folder(pwd_tree_folder)
-
-    # get list of match pair list
-    candidates_list = []
-    candidates_list_genes = set()
-    for match_group in open(pwd_candidates_file):
-        if not match_group.startswith('Gene_1'):
-            match_group_split = match_group.strip().split('\t')
-            end_match = match_group_split[5]
-            full_length_match = match_group_split[6]
-            if (end_match == 'no') and (full_length_match == 'no'):
-                candidates_list.append(match_group_split[:2])
-                candidates_list_genes.add(match_group_split[0])
-                candidates_list_genes.add(match_group_split[1])
-
-    if candidates_list == []:
-        report_and_log(('No HGT detected by BM approach, program exited!'), pwd_log_file, keep_quiet=False)
-        exit()
-
-    # for report and log
-    report_and_log(('Get gene/genome member in gene/species tree for each BM predicted HGT'), pwd_log_file, keep_quiet)
+    # create folders, gene trees of finished candidates are kept for resume
+    if resume is True:
+        create_missing_folder(pwd_tree_folder)
+    else:
+        force_create_folder(pwd_tree_folder)
+    checkpoint_manifest_key = open_checkpoint_manifest(pwd_checkpoint_manifest, resume, ['gene_tree', 'ranger'])
 
+    # gene trees and reconciliations keyed by their member sequences and trees, shared by all ranks of the project
+    create_missing_folder(pwd_tree_store_folder)
 
     # get bin_record_list and genome name list
     bin_record_list = []
@@ -2584,10 +2170,36 @@ def PG(args, config_dict):
         bin_group_list.append(bin_group)
         bin_group_without_underscore_list.append(bin_group_without_underscore)
 
+    # integer ids of genes, genomes and groups
+    id_table = get_id_table(pwd_id_table_file, pwd_prodigal_output_folder, genome_name_list)
+    grouping_key = '%s%s' % (grouping_level, group_num)
+    add_grouping_to_id_table(id_table, grouping_key, pwd_grouping_file_with_id)
+    genome_group_array, group_name_array = get_genome_group_array(id_table, grouping_key)
+
+    # BM candidates, from HGTs_BM.txt for BM outputs produced before the candidate table was introduced
+    if os.path.isfile(pwd_candidate_table_file):
+        candidate_table = load_candidate_table(pwd_candidate_table_file)
+    else:
+        candidate_table = read_candidate_table_txt(pwd_candidates_file, id_table, grouping_level, [0, 1, 4, 5, 6, None])
+        candidate_table['group_1'][:] = genome_group_array[get_genome_of_genes(id_table, candidate_table['gene_1'])]
+        candidate_table['group_2'][:] = genome_group_array[get_genome_of_genes(id_table, candidate_table['gene_2'])]
+
+    # get list of match pair list
+    normal_candidate_rows = np.flatnonzero(candidate_table['match_category'] == 0)
+    candidates_list = [list(i) for i in zip(get_gene_names(id_table, candidate_table['gene_1'][normal_candidate_rows]), get_gene_names(id_table, candidate_table['gene_2'][normal_candidate_rows]))]
+    candidates_list_genes = set([i for each_candidate in candidates_list for i in each_candidate])
+
+    if candidates_list == []:
+        report_and_log(('No HGT detected by BM approach, program exited!'), pwd_log_file, keep_quiet=False)
+        exit()
+
+    # for report and log
+    report_and_log(('Get gene/genome member in gene/species tree for each BM predicted HGT'), pwd_log_file, keep_quiet)
+
 
     ###################################################### Get dicts #######################################################
 
-    # get HGT_query_to_subjects dict
+    # get HGT_query_to_subjects dict, keyed by integer gene ids
     HGT_query_to_subjects_dict = {}
     gene_id_overall = set()
     for each_candidate in open(pwd_HGT_query_to_subjects_file):
@@ -2595,62 +2207,67 @@ def PG(args, config_dict):
         query = each_candidate_split[0]
         subjects = each_candidate_split[1].split(',')
         if query in candidates_list_genes:
-            HGT_query_to_subjects_dict[query] = subjects
-            for each_subject in subjects:
-                gene_id_overall.add(each_subject)
+            subject_ids = get_gene_ids(id_table, subjects).tolist()
+            HGT_query_to_subjects_dict[int(get_gene_ids(id_table, [query])[0])] = subject_ids
+            gene_id_overall.update(subject_ids)
+    gene_id_overall = np.array(sorted(gene_id_overall), dtype=np.int64)
 
 
-    ################################# Prepare subset of faa_file for building gene tree ####################################
+    ###################################### Prepare protein store for building gene tree #####################################
 
     # for report and log
-    report_and_log(('Prepare subset of %s for building gene tree' % combined_faa_file), pwd_log_file, keep_quiet)
-
-    # uniq gene id list
-    gene_id_uniq_set = set()
-    for each_gene in gene_id_overall:
-        gene_id_uniq_set.add(each_gene)
-
-    # get combined_faa_file file
-    os.system('cat %s/*.faa > %s' % (pwd_prodigal_output_folder, pwd_combined_faa_file))
+    report_and_log(('Prepare protein store for building gene tree'), pwd_log_file, keep_quiet)
 
-    # prepare combined_ffn file subset to speed up
-    pwd_combined_faa_file_subset_handle = open(pwd_combined_faa_file_subset, 'w')
-    for each_gene in SeqIO.parse(pwd_combined_faa_file, 'fasta'):
-        if each_gene.id in gene_id_uniq_set:
-            pwd_combined_faa_file_subset_handle.write('>%s\n' % each_gene.id)
-            pwd_combined_faa_file_subset_handle.write('%s\n' % str(each_gene.seq))
-    pwd_combined_faa_file_subset_handle.close()
+    # protein sequences of all genes, shared by all ranks and read by workers through memory mapping
+    get_protein_store(pwd_prodigal_output_folder, id_table, pwd_id_table_file, pwd_protein_store_seq_file, pwd_protein_store_index_file)
 
 
     ################################## Extract gene sequences, run mafft and fasttree ##################################
 
     # for report and log
-    report_and_log(('Get species/gene tree for %s BM approach identified HGTs with %s cores' % (len(candidates_list), num_threads)), pwd_log_file, keep_quiet)
+    if job_executor == 'local':
+        report_and_log(('Get species/gene tree for %s BM approach identified HGTs with %s cores' % (len(candidates_list), num_threads)), pwd_log_file, keep_quiet)
+    else:
+        report_and_log(('Get species/gene tree for %s BM approach identified HGTs with %s jobs of %s cores (%s executor)' % (len(candidates_list), min(job_num, len(candidates_list)), num_threads, job_executor)), pwd_log_file, keep_quiet)
+    create_missing_folder(pwd_PG_job_folder)
+
+    # read-only objects shared by all workers
+    PG_worker_context_key = publish_worker_context({'id_table':                   id_table,
+                                                    'genome_group_array':         genome_group_array,
+                                                    'HGT_query_to_subjects_dict': HGT_query_to_subjects_dict,
+                                                    'extractable_gene_array':     gene_id_overall}, pwd_PG_worker_context_file)
 
     # put multiple arguments in list
     list_for_multiple_arguments_extract_gene_tree_seq = []
     for each_to_extract in candidates_list:
         list_for_multiple_arguments_extract_gene_tree_seq.append([each_to_extract,
                                                                   pwd_tree_folder,
-                                                                  pwd_combined_faa_file_subset,
+                                                                  [pwd_protein_store_seq_file, pwd_protein_store_index_file],
                                                                   pwd_blastp_exe,
                                                                   pwd_mafft_exe,
                                                                   pwd_fasttree_exe,
-                                                                  name_to_group_dict,
-                                                                  genome_name_list,
-                                                                  HGT_query_to_subjects_dict,
-                                                                  pwd_newick_tree_file])
-    pool = mp.Pool(processes=num_threads)
-    pool.map(extract_gene_tree_seq_worker, list_for_multiple_arguments_extract_gene_tree_seq)
-    pool.close()
-    pool.join()
+                                                                  pwd_newick_tree_file,
+                                                                  PG_worker_context_key,
+                                                                  checkpoint_manifest_key,
+                                                                  pwd_tree_store_folder])
+    failed_gene_tree_list = [i for i in run_tasks('gene_tree', extract_gene_tree_seq_worker, list_for_multiple_arguments_extract_gene_tree_seq, pwd_PG_job_folder, executor_setting_dict) if i is not None]
+    release_worker_context(PG_worker_context_key)
+    if len(failed_gene_tree_list) > 0:
+        report_and_log(('Gene tree failed for %s candidates, they were not assessed by Ranger-DTL:\n%s' % (len(failed_gene_tree_list), '\n'.join(['%s: %s' % tuple(i) for i in failed_gene_tree_list]))), pwd_log_file, keep_quiet)
 
 
     ##################################################### Run Ranger-DTL ###################################################
 
     # prepare folders
     force_create_folder(pwd_ranger_inputs_folder)
-    force_create_folder(pwd_ranger_outputs_folder)
+    if resume is True:
+        create_missing_folder(pwd_ranger_outputs_folder)
+    else:
+        force_create_folder(pwd_ranger_outputs_folder)
+
+    # reconciliations of previous runs are not used for candidates whose gene tree failed
+    for failed_candidate, failed_tool_cmd in failed_gene_tree_list:
+        remove_path('%s/%s_ranger_output.txt' % (pwd_ranger_outputs_folder, failed_candidate))
 
     # for report and log
     report_and_log(('Running Ranger-DTL2 with dated mode'), pwd_log_file, keep_quiet)
@@ -2658,12 +2275,10 @@ def PG(args, config_dict):
     # put multiple arguments in list
     list_for_multiple_arguments_Ranger = []
     for each_paired_tree in candidates_list:
-        list_for_multiple_arguments_Ranger.append([each_paired_tree, pwd_ranger_inputs_folder, pwd_tree_folder, pwd_ranger_exe, pwd_ranger_outputs_folder])
+        list_for_multiple_arguments_Ranger.append([each_paired_tree, pwd_ranger_inputs_folder, pwd_tree_folder, pwd_ranger_exe, pwd_ranger_outputs_folder, checkpoint_manifest_key, pwd_tree_store_folder])
 
-    pool = mp.Pool(processes=num_threads)
-    pool.map(Ranger_worker, list_for_multiple_arguments_Ranger)
-    pool.close()
-    pool.join()
+    run_tasks('Ranger', Ranger_worker, list_for_multiple_arguments_Ranger, pwd_PG_job_folder, executor_setting_dict)
+    remove_path(pwd_PG_job_folder)
 
 
     ########################################### parse Ranger-DTL prediction result #########################################
@@ -2671,13 +2286,13 @@ def PG(args, config_dict):
     # for report and log
     report_and_log(('Parsing Ranger prediction results'), pwd_log_file, keep_quiet)
 
-    candidate_2_predictions_dict = {}
-    candidate_2_possible_direction_dict = {}
+    validated_direction_list = []
     for each_ranger_prediction in candidates_list:
         each_ranger_prediction_concate = '___'.join(each_ranger_prediction)
         ranger_out_file_name = each_ranger_prediction_concate + '_ranger_output.txt'
         pwd_ranger_result = '%s/%s' % (pwd_ranger_outputs_folder, ranger_out_file_name)
 
+        validated_direction = 0
         if os.path.isfile(pwd_ranger_result) == True:
 
             # parse prediction result
@@ -2699,19 +2314,17 @@ def PG(args, config_dict):
                         predicted_transfer = donor_p + '-->' + recipient_p
                         predicted_transfers.append(predicted_transfer)
 
-            candidate_2_predictions_dict[each_ranger_prediction_concate] = predicted_transfers
-
             # get two possible transfer situation
-            candidate_split_gene = each_ranger_prediction_concate.split('___')
-            candidate_split_gene_only_genome = []
-            for each_candidate in candidate_split_gene:
-                each_candidate_genome = '_'.join(each_candidate.split('_')[:-1])
-                candidate_split_gene_only_genome.append(each_candidate_genome)
-
+            candidate_split_gene_only_genome = ['_'.join(each_candidate.split('_')[:-1]) for each_candidate in each_ranger_prediction]
             possible_hgt_1 = '%s-->%s' % (candidate_split_gene_only_genome[0], candidate_split_gene_only_genome[1])
             possible_hgt_2 = '%s-->%s' % (candidate_split_gene_only_genome[1], candidate_split_gene_only_genome[0])
-            possible_hgts = [possible_hgt_1, possible_hgt_2]
-            candidate_2_possible_direction_dict[each_ranger_prediction_concate] = possible_hgts
+            for each_prediction in predicted_transfers:
+                if each_prediction == possible_hgt_1:
+                    validated_direction = 1
+                elif each_prediction == possible_hgt_2:
+                    validated_direction = 2
+
+        validated_direction_list.append(validated_direction)
 
 
     #################################################### combine results ###################################################
@@ -2719,43 +2332,24 @@ def PG(args, config_dict):
     # for report and log
     report_and_log(('Add Ranger-DTL predicted direction to HGT_candidates.txt'), pwd_log_file, keep_quiet)
 
-    # add results to output file of best blast match approach
-    combined_output_handle = open(pwd_candidates_file_ET, 'w')
-    #combined_output_validated_handle = open(pwd_candidates_file_ET_validated, 'w')
-    combined_output_validated_header = 'Gene_1\tGene_2\tGene_1_group\tGene_2_group\tIdentity\tend_match\tfull_length_match\tDirection\n'
-    #combined_output_validated_handle.write(combined_output_validated_header)
-    combined_output_handle.write(combined_output_validated_header)
-    validated_candidate_list = []
-    for match_group in open(pwd_candidates_file):
-        if not match_group.startswith('Gene_1'):
-            match_group_split = match_group.strip().split('\t')
-            recipient_gene = match_group_split[0]
-            donor_gene = match_group_split[1]
-            recipient_genome_id = match_group_split[2]
-            donor_genome_id = match_group_split[3]
-            identity = match_group_split[4]
-            end_break = match_group_split[5]
-            Ctg_align = match_group_split[6]
-            concatenated = '%s___%s' % (recipient_gene, donor_gene)
-            possible_direction = []
-            if concatenated in candidate_2_possible_direction_dict:
-                possible_direction = candidate_2_possible_direction_dict[concatenated]
-
-            validated_prediction = 'NA'
-            if concatenated in candidate_2_predictions_dict:
-                for each_prediction in candidate_2_predictions_dict[concatenated]:
-                    if each_prediction in possible_direction:
-                        validated_prediction = each_prediction
-
-            if (Ctg_align == 'no') and (end_break == 'no') and (validated_prediction != 'NA'):
-                if recipient_gene not in validated_candidate_list:
-                    validated_candidate_list.append(recipient_gene)
-                if donor_gene not in validated_candidate_list:
-                    validated_candidate_list.append(donor_gene)
-                #combined_output_validated_handle.write('%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (recipient_gene, donor_gene, recipient_genome_id, donor_genome_id, identity, end_break, Ctg_align, validated_prediction))
-            combined_output_handle.write('%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (recipient_gene, donor_gene, recipient_genome_id, donor_genome_id, identity, end_break, Ctg_align, validated_prediction))
-    combined_output_handle.close()
-    #combined_output_validated_handle.close()
+    # add results to candidate table and output file of best blast match approach
+    set_validated_direction(candidate_table, normal_candidate_rows, validated_direction_list, grouping_level)
+    save_candidate_table(candidate_table, pwd_candidate_table_file)
+    write_candidate_table_txt(candidate_table, id_table, group_name_array, pwd_candidates_file_ET, with_direction=True)
+
+    validated_rows = np.flatnonzero((candidate_table['match_category'] == 0) & (candidate_table['direction'] > 0))
+    validated_candidate_pair_set = set(zip(get_gene_names(id_table, candidate_table['gene_1'][validated_rows]), get_gene_names(id_table, candidate_table['gene_2'][validated_rows])))
+
+
+    ################################### plot flanking regions of PG validated HGTs ####################################
+
+    if (no_flanking_plot is False) and (plot_all_flanking_regions is False):
+        if os.path.isfile(pwd_flanking_region_pairs_file) is False:
+            report_and_log(('Flanking region information not found, skipped plotting'), pwd_log_file, keep_quiet)
+        elif len(validated_candidate_pair_set) > 0:
+            report_and_log(('Plotting flanking regions of %s PG validated HGTs with %s cores' % (len(validated_candidate_pair_set), num_threads)), pwd_log_file, keep_quiet)
+            plot_flanking_regions_of_candidates(validated_candidate_pair_set, pwd_flanking_region_pairs_file, pwd_flanking_region_hits_file, pwd_prodigal_output_folder,
+                                                flanking_length, name_to_group_number_dict, pwd_flanking_region_plot_folder, num_threads)
 
     # export sequence of validated candidates
     # combined_output_validated_fasta_nc_handle = open(pwd_candidates_file_ET_validated_fasta_nc, 'w')
@@ -2828,235 +2422,147 @@ def PG(args, config_dict):
     # remove tmp files
     if keep_temp is False:
 
-        os.remove(pwd_combined_faa_file)
-        os.remove(pwd_combined_faa_file_subset)
         os.remove(pwd_candidates_seq_file)
         os.remove(pwd_HGT_query_to_subjects_file)
         os.remove(pwd_grouping_file_with_id)
         os.remove(pwd_candidates_file)
-        os.system('rm -r %s' % pwd_ranger_inputs_folder)
-        os.system('rm -r %s' % pwd_ranger_outputs_folder)
-        os.system('rm -r %s' % pwd_tree_folder)
+        remove_path(pwd_ranger_inputs_folder)
+        remove_path(pwd_ranger_outputs_folder)
+        remove_path(pwd_tree_folder)
+
+    # least recently used entries are removed if the result cache grew over its size limit
+    removed_cache_entry_num, removed_cache_size = trim_result_cache()
+    if removed_cache_entry_num > 0:
+        report_and_log(('Removed %s entries (%.1fMB) from result cache' % (removed_cache_entry_num, removed_cache_size / 1024.0 / 1024.0)), pwd_log_file, keep_quiet)
 
     # for report and log
+    for tool_run_summary in get_tool_run_summary(pwd_tool_run_log):
+        report_and_log(tool_run_summary, pwd_log_file, True)
     report_and_log(('Done for Phylogenetic approach!'), pwd_log_file, keep_quiet)
 
 
-def combine_PG_output(PG_output_file_list_with_path, output_prefix, detection_ranks, combined_PG_output_normal):
+def plot_flanking_regions_of_HGTs(args, config_dict):
 
-    HGT_identity_dict = {}
-    HGT_end_match_dict = {}
-    HGT_full_length_match_dict = {}
-    HGT_direction_dict = {}
-    HGT_occurence_dict = {}
-    HGT_concatenated_list = []
-    for pwd_PG_output_file in PG_output_file_list_with_path:
-        file_path, file_name = os.path.split(pwd_PG_output_file)
-        taxon_rank = file_name[len(output_prefix) + 1]
-        if taxon_rank in detection_ranks:
-            for PG_HGT in open(pwd_PG_output_file):
-                if not PG_HGT.startswith('Gene_1'):
-                    PG_HGT_split = PG_HGT.strip().split('\t')
-
-                    gene_1 = PG_HGT_split[0]
-                    gene_2 = PG_HGT_split[1]
-                    identity = float(PG_HGT_split[4])
-                    end_match = PG_HGT_split[5]
-                    full_length_match = PG_HGT_split[6]
-                    direction = PG_HGT_split[7]
-                    concatenated = '%s___%s' % (gene_1, gene_2)
-
-                    if concatenated not in HGT_concatenated_list:
-                        HGT_concatenated_list.append(concatenated)
-
-                    # store in dict
-                    if concatenated not in HGT_identity_dict:
-                        HGT_identity_dict[concatenated] = identity
-
-                    if concatenated not in HGT_end_match_dict:
-                        HGT_end_match_dict[concatenated] = end_match
-
-                    if concatenated not in HGT_full_length_match_dict:
-                        HGT_full_length_match_dict[concatenated] = full_length_match
-
-                    if direction != 'NA':
-                        if concatenated not in HGT_direction_dict:
-                            HGT_direction_dict[concatenated] = [direction]
-                        else:
-                            HGT_direction_dict[concatenated].append(direction)
-
-                    if direction != 'NA':
-                        if concatenated not in HGT_occurence_dict:
-                            HGT_occurence_dict[concatenated] = [taxon_rank]
-                        else:
-                            HGT_occurence_dict[concatenated].append(taxon_rank)
-
-
-    detection_ranks_all = ['d', 'p', 'c', 'o', 'f', 'g', 's']
-    detection_ranks_list = []
-    for each_rank in detection_ranks_all:
-        if each_rank in detection_ranks:
-            detection_ranks_list.append(each_rank)
-
-
-    HGT_occurence_dict_0_1_format = {}
-    for each_HGT in HGT_occurence_dict:
-        occurence_str = ''
-        for each_level in detection_ranks_list:
-            if each_level in HGT_occurence_dict[each_HGT]:
-                occurence_str += '1'
-            else:
-                occurence_str += '0'
-        HGT_occurence_dict_0_1_format[each_HGT] = occurence_str
-
-
-    combined_output_handle_normal = open(combined_PG_output_normal, 'w')
-
-    combined_output_handle_normal.write('Gene_1\tGene_2\tIdentity\toccurence(%s)\tend_match\tfull_length_match\tdirection\n' % detection_ranks)
+    output_prefix =             args['p']
+    grouping_level =            args['r']
+    grouping_file =             args['g']
+    cover_cutoff =              args['cov']
+    align_len_cutoff =          args['al']
+    flanking_length_kbp =       args['flk']
+    identity_percentile =       args['ip']
+    end_match_identity_cutoff = args['ei']
+    num_threads =               args['t']
+    plot_all_flanking_regions = args['all']
+    keep_quiet =                args['quiet']
 
-    for concatenated_HGT in sorted(HGT_concatenated_list):
-        concatenated_HGT_split = concatenated_HGT.split('___')
+    flanking_length = flanking_length_kbp * 1000
+    warnings.filterwarnings("ignore")
 
-        concatenated_HGT_direction = 'NA'
-        if concatenated_HGT in HGT_direction_dict:
+    if grouping_level is None:
+        grouping_level = 'x'
 
-            concatenated_HGT_direction_list = HGT_direction_dict[concatenated_HGT]
-            concatenated_HGT_direction_list_uniq = unique_list_elements(concatenated_HGT_direction_list)
+    MetaCHIP_wd =   '%s_MetaCHIP_wd'        % output_prefix
+    pwd_log_folder = '%s/%s_log_files'      % (MetaCHIP_wd, output_prefix)
+    pwd_log_file =  '%s/%s_%s_plot_%s.log'  % (pwd_log_folder, output_prefix, grouping_level, datetime.now().strftime('%Y-%m-%d_%Hh-%Mm-%Ss_%f'))
 
-            if len(concatenated_HGT_direction_list_uniq) == 1:
-                concatenated_HGT_direction = concatenated_HGT_direction_list[0]
-            else:
-                concatenated_HGT_direction = 'both'
-                for HGT_direction in concatenated_HGT_direction_list_uniq:
-                    HGT_direction_freq = (concatenated_HGT_direction_list.count(HGT_direction)) * 100 / float(len(concatenated_HGT_direction_list))
-                    if HGT_direction_freq > 50:
-                        concatenated_HGT_direction = HGT_direction + '(' + str(float("{0:.2f}".format(HGT_direction_freq))) + '%)'
-
-        if concatenated_HGT in HGT_occurence_dict_0_1_format:
-            occurence_formatted = HGT_occurence_dict_0_1_format[concatenated_HGT]
+    group_num = 0
+    if grouping_file is None:
+        grouping_file_re = '%s/%s_%s*_grouping.txt' % (MetaCHIP_wd, output_prefix, grouping_level)
+        grouping_file_list = [os.path.basename(file_name) for file_name in glob.glob(grouping_file_re)]
+        if len(grouping_file_list) == 1:
+            pwd_grouping_file = '%s/%s' % (MetaCHIP_wd, grouping_file_list[0])
+        elif len(grouping_file_list) == 0:
+            report_and_log(('No grouping file detected, please specify with "-g" option'), pwd_log_file, keep_quiet)
+            exit()
         else:
-            occurence_formatted = '0'*len(detection_ranks_list)
-
-        for_out = '%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (concatenated_HGT_split[0],
-                                                    concatenated_HGT_split[1],
-                                                    HGT_identity_dict[concatenated_HGT],
-                                                    occurence_formatted,
-                                                    HGT_end_match_dict[concatenated_HGT],
-                                                    HGT_full_length_match_dict[concatenated_HGT],
-                                                    concatenated_HGT_direction)
-
-        if (HGT_end_match_dict[concatenated_HGT] == 'no') and (HGT_full_length_match_dict[concatenated_HGT] == 'no') and (concatenated_HGT_direction != 'NA') and (concatenated_HGT_direction != 'both'):
-            combined_output_handle_normal.write(for_out)
-
-    combined_output_handle_normal.close()
-
+            report_and_log(('Multiple grouping file detected, please specify with "-g" option'), pwd_log_file, keep_quiet)
+            exit()
+    else:
+        pwd_grouping_file = grouping_file
+    group_num = get_group_num_from_grouping_file(pwd_grouping_file)
 
-def combine_PG_output_for_CMLP(PG_output_file_list_with_path, output_prefix, detection_ranks, combined_PG_output_normal):
+    MetaCHIP_op_folder = '%s_%s%s_HGTs_ip%s_al%sbp_c%s_ei%s_f%skbp' % (output_prefix, grouping_level, group_num, str(identity_percentile), str(align_len_cutoff), str(cover_cutoff), str(end_match_identity_cutoff), flanking_length_kbp)
 
-    HGT_identity_dict = {}
-    HGT_end_match_dict = {}
-    HGT_full_length_match_dict = {}
-    HGT_direction_dict = {}
-    HGT_occurence_dict = {}
-    HGT_concatenated_list = []
-    for pwd_PG_output_file in PG_output_file_list_with_path:
-        file_path, file_name = os.path.split(pwd_PG_output_file)
-        taxon_rank = file_name[len(output_prefix) + 1]
-        if taxon_rank in detection_ranks:
-            for PG_HGT in open(pwd_PG_output_file):
-                if not PG_HGT.startswith('Gene_1'):
-                    PG_HGT_split = PG_HGT.strip().split('\t')
+    prodigal_output_folder =                            '%s_all_prodigal_output'                      % (output_prefix)
+    candidates_file_name_ET =                           '%s_%s%s_HGTs_PG.txt'                         % (output_prefix, grouping_level, group_num)
+    flanking_region_plot_folder_name =                  '%s_%s%s_Flanking_region_plots'               % (output_prefix, grouping_level, group_num)
+    flanking_region_pairs_file_name =                   '%s_%s%s_flanking_region_pairs.txt'           % (output_prefix, grouping_level, group_num)
+    flanking_region_hits_file_name =                    '%s_%s%s_flanking_region_hits.txt'            % (output_prefix, grouping_level, group_num)
+    grouping_file_with_id_filename =                    '%s_%s%s_grouping_with_id.txt'                % (output_prefix, grouping_level, group_num)
 
-                    gene_1 = PG_HGT_split[0]
-                    gene_2 = PG_HGT_split[1]
-                    identity = float(PG_HGT_split[2])
-                    end_match = PG_HGT_split[3]
-                    full_length_match = PG_HGT_split[4]
-                    direction = PG_HGT_split[5]
-                    concatenated = '%s___%s' % (gene_1, gene_2)
+    pwd_MetaCHIP_op_folder =                            '%s/%s'                                       % (MetaCHIP_wd, MetaCHIP_op_folder)
+    pwd_prodigal_output_folder =                        '%s/%s'                                       % (MetaCHIP_wd, prodigal_output_folder)
+    pwd_candidates_file_ET =                            '%s/%s'                                       % (pwd_MetaCHIP_op_folder, candidates_file_name_ET)
+    pwd_flanking_region_plot_folder =                   '%s/%s'                                       % (pwd_MetaCHIP_op_folder, flanking_region_plot_folder_name)
+    pwd_flanking_region_pairs_file =                    '%s/%s'                                       % (pwd_MetaCHIP_op_folder, flanking_region_pairs_file_name)
+    pwd_flanking_region_hits_file =                     '%s/%s'                                       % (pwd_MetaCHIP_op_folder, flanking_region_hits_file_name)
+    pwd_grouping_file_with_id =                         '%s/%s'                                       % (pwd_MetaCHIP_op_folder, grouping_file_with_id_filename)
 
-                    if concatenated not in HGT_concatenated_list:
-                        HGT_concatenated_list.append(concatenated)
+    for pwd_required_file in [pwd_flanking_region_pairs_file, pwd_flanking_region_hits_file]:
+        if os.path.isfile(pwd_required_file) is False:
+            report_and_log(('%s not found, please run BM first' % pwd_required_file), pwd_log_file, keep_quiet)
+            exit()
 
-                    # store in dict
-                    if concatenated not in HGT_identity_dict:
-                        HGT_identity_dict[concatenated] = identity
+    # group index id of genomes (e.g. A_1)
+    grouping_file_with_id_created = False
+    if os.path.isfile(pwd_grouping_file_with_id) is False:
+        index_grouping_file(pwd_grouping_file, pwd_grouping_file_with_id)
+        grouping_file_with_id_created = True
+    name_to_group_number_dict = {}
+    for each_bin in open(pwd_grouping_file_with_id):
+        each_bin_split = each_bin.strip().split(',')
+        name_to_group_number_dict[each_bin_split[1]] = each_bin_split[0]
+    if grouping_file_with_id_created is True:
+        os.remove(pwd_grouping_file_with_id)
 
-                    if concatenated not in HGT_end_match_dict:
-                        HGT_end_match_dict[concatenated] = end_match
+    # plot all candidates or PG validated HGTs only
+    candidate_pair_set = None
+    if plot_all_flanking_regions is False:
+        if os.path.isfile(pwd_candidates_file_ET) is False:
+            report_and_log(('%s not found, please run PG first or plot all candidates with "-all"' % pwd_candidates_file_ET), pwd_log_file, keep_quiet)
+            exit()
+        candidate_pair_set = set()
+        for each_HGT in open(pwd_candidates_file_ET):
+            if not each_HGT.startswith('Gene_1'):
+                each_HGT_split = each_HGT.strip().split('\t')
+                if (each_HGT_split[5] == 'no') and (each_HGT_split[6] == 'no') and (each_HGT_split[7] != 'NA'):
+                    candidate_pair_set.add((each_HGT_split[0], each_HGT_split[1]))
 
-                    if concatenated not in HGT_full_length_match_dict:
-                        HGT_full_length_match_dict[concatenated] = full_length_match
+    report_and_log(('Plotting flanking regions with %s cores' % num_threads), pwd_log_file, keep_quiet)
+    plotted_num = plot_flanking_regions_of_candidates(candidate_pair_set, pwd_flanking_region_pairs_file, pwd_flanking_region_hits_file, pwd_prodigal_output_folder,
+                                                      flanking_length, name_to_group_number_dict, pwd_flanking_region_plot_folder, num_threads)
+    report_and_log(('Flanking regions of %s candidates plotted to %s' % (plotted_num, pwd_flanking_region_plot_folder)), pwd_log_file, keep_quiet)
 
-                    if direction != 'NA':
-                        if concatenated not in HGT_direction_dict:
-                            HGT_direction_dict[concatenated] = [direction]
-                        else:
-                            HGT_direction_dict[concatenated].append(direction)
 
-                    if direction != 'NA':
-                        if concatenated not in HGT_occurence_dict:
-                            HGT_occurence_dict[concatenated] = [taxon_rank]
-                        else:
-                            HGT_occurence_dict[concatenated].append(taxon_rank)
+def get_candidate_tables_of_ranks(pwd_candidate_table_file_list, pwd_candidate_txt_list, id_table, detection_rank_list, column_index_list):
 
+    # candidate table of each rank, read from text outputs if produced before the candidate table was introduced
+    candidate_table_list = []
+    for pwd_candidate_table_file, pwd_candidate_txt, detection_rank in zip(pwd_candidate_table_file_list, pwd_candidate_txt_list, detection_rank_list):
+        if os.path.isfile(pwd_candidate_table_file):
+            candidate_table_list.append(load_candidate_table(pwd_candidate_table_file))
+        else:
+            candidate_table_list.append(read_candidate_table_txt(pwd_candidate_txt, id_table, detection_rank, column_index_list))
 
-    detection_ranks_all = ['d', 'p', 'c', 'o', 'f', 'g', 's']
-    detection_ranks_list = []
-    for each_rank in detection_ranks_all:
-        if each_rank in detection_ranks:
-            detection_ranks_list.append(each_rank)
+    return candidate_table_list
 
 
-    HGT_occurence_dict_0_1_format = {}
-    for each_HGT in HGT_occurence_dict:
-        occurence_str = ''
-        for each_level in detection_ranks_list:
-            if each_level in HGT_occurence_dict[each_HGT]:
-                occurence_str += '1'
-            else:
-                occurence_str += '0'
-        HGT_occurence_dict_0_1_format[each_HGT] = occurence_str
+def combine_PG_output(candidate_table_list, id_table, detection_ranks, combined_PG_output_normal):
 
+    combined_table = combine_candidate_tables(candidate_table_list)
+    gene_1_list = get_gene_names(id_table, combined_table['gene_1'])
+    gene_2_list = get_gene_names(id_table, combined_table['gene_2'])
+    genome_name_array = id_table['genome_name']
+    gene_1_genome_list = genome_name_array[get_genome_of_genes(id_table, combined_table['gene_1'])].tolist() if len(gene_1_list) > 0 else []
+    gene_2_genome_list = genome_name_array[get_genome_of_genes(id_table, combined_table['gene_2'])].tolist() if len(gene_2_list) > 0 else []
+    occurence_list = get_occurrence_strings(combined_table, detection_ranks)
+    direction_list = get_direction_strings(combined_table, gene_1_genome_list, gene_2_genome_list)
 
     combined_output_handle_normal = open(combined_PG_output_normal, 'w')
-
     combined_output_handle_normal.write('Gene_1\tGene_2\tIdentity\toccurence(%s)\tend_match\tfull_length_match\tdirection\n' % detection_ranks)
-
-    for concatenated_HGT in sorted(HGT_concatenated_list):
-        concatenated_HGT_split = concatenated_HGT.split('___')
-
-        concatenated_HGT_direction = 'NA'
-        if concatenated_HGT in HGT_direction_dict:
-
-            concatenated_HGT_direction_list = HGT_direction_dict[concatenated_HGT]
-            concatenated_HGT_direction_list_uniq = unique_list_elements(concatenated_HGT_direction_list)
-
-            if len(concatenated_HGT_direction_list_uniq) == 1:
-                concatenated_HGT_direction = concatenated_HGT_direction_list[0]
-            else:
-                concatenated_HGT_direction = 'both'
-                for HGT_direction in concatenated_HGT_direction_list_uniq:
-                    HGT_direction_freq = (concatenated_HGT_direction_list.count(HGT_direction)) * 100 / float(len(concatenated_HGT_direction_list))
-                    if HGT_direction_freq > 50:
-                        concatenated_HGT_direction = HGT_direction + '(' + str(float("{0:.2f}".format(HGT_direction_freq))) + '%)'
-
-        if concatenated_HGT in HGT_occurence_dict_0_1_format:
-            occurence_formatted = HGT_occurence_dict_0_1_format[concatenated_HGT]
-        else:
-            occurence_formatted = '0'*len(detection_ranks_list)
-
-        for_out = '%s\t%s\t%s\t%s\t%s\t%s\t%s\n' % (concatenated_HGT_split[0],
-                                                    concatenated_HGT_split[1],
-                                                    HGT_identity_dict[concatenated_HGT],
-                                                    occurence_formatted,
-                                                    HGT_end_match_dict[concatenated_HGT],
-                                                    HGT_full_length_match_dict[concatenated_HGT],
-                                                    concatenated_HGT_direction)
-
-        if (HGT_end_match_dict[concatenated_HGT] == 'no') and (HGT_full_length_match_dict[concatenated_HGT] == 'no') and (concatenated_HGT_direction != 'NA') and (concatenated_HGT_direction != 'both'):
-            combined_output_handle_normal.write(for_out)
-
+    for row in sorted(range(len(gene_1_list)), key=lambda i: '%s___%s' % (gene_1_list[i], gene_2_list[i])):
+        if (combined_table['match_category'][row] == 0) and (direction_list[row] != 'NA') and (direction_list[row] != 'both'):
+            combined_output_handle_normal.write('%s\t%s\t%s\t%s\tno\tno\t%s\n' % (gene_1_list[row], gene_2_list[row], float(combined_table['identity'][row]), occurence_list[row], direction_list[row]))
     combined_output_handle_normal.close()
 
 
@@ -3152,7 +2658,7 @@ def Get_circlize_plot(multi_level_detection, output_prefix, pwd_candidates_file_
 
     tmp1.close()
 
-    os.system('cat %s | sort > %s' % (pwd_cir_plot_t1, pwd_cir_plot_t1_sorted))
+    sort_file_lines(pwd_cir_plot_t1, pwd_cir_plot_t1_sorted)
 
     current_t = ''
     count = 0
@@ -3198,14 +2704,17 @@ def Get_circlize_plot(multi_level_detection, output_prefix, pwd_candidates_file_
     if len(all_group_id) == 1:
         print('Too less group (1), plot skipped')
     elif 1 < len(all_group_id) <= 200:
-        os.system('Rscript %s -m %s -p %s' % (circos_HGT_R, pwd_cir_plot_matrix_filename, pwd_plot_circos))
+        circos_cmd = ['Rscript', circos_HGT_R, '-m', pwd_cir_plot_matrix_filename, '-p', pwd_plot_circos]
+        circos_exit_status = run_tool(circos_cmd)
+        if circos_exit_status != 0:
+            print('Rscript exited with status %s, plot skipped: %s' % (circos_exit_status, ' '.join(circos_cmd)))
     else:
         print('Too many groups (>200), plot skipped')
 
     # rm tmp files
-    os.system('rm %s' % pwd_cir_plot_t1)
-    os.system('rm %s' % pwd_cir_plot_t1_sorted)
-    os.system('rm %s' % pwd_cir_plot_t1_sorted_count)
+    remove_path(pwd_cir_plot_t1)
+    remove_path(pwd_cir_plot_t1_sorted)
+    remove_path(pwd_cir_plot_t1_sorted_count)
 
 
 def Get_circlize_plot_customized_grouping(multi_level_detection, output_prefix, pwd_candidates_file_PG_normal_txt, genome_to_group_dict, circos_HGT_R, pwd_plot_circos, pwd_MetaCHIP_op_folder):
@@ -3248,7 +2757,7 @@ def Get_circlize_plot_customized_grouping(multi_level_detection, output_prefix,
 
     tmp1.close()
 
-    os.system('cat %s | sort > %s' % (pwd_cir_plot_t1, pwd_cir_plot_t1_sorted))
+    sort_file_lines(pwd_cir_plot_t1, pwd_cir_plot_t1_sorted)
 
     current_t = ''
     count = 0
@@ -3292,12 +2801,15 @@ def Get_circlize_plot_customized_grouping(multi_level_detection, output_prefix,
 
     # get plot with R
     if len(all_group_id) > 1:
-        os.system('Rscript %s -m %s -p %s' % (circos_HGT_R, pwd_cir_plot_matrix_filename, pwd_plot_circos))
+        circos_cmd = ['Rscript', circos_HGT_R, '-m', pwd_cir_plot_matrix_filename, '-p', pwd_plot_circos]
+        circos_exit_status = run_tool(circos_cmd)
+        if circos_exit_status != 0:
+            print('Rscript exited with status %s, plot skipped: %s' % (circos_exit_status, ' '.join(circos_cmd)))
 
     # rm tmp files
-    os.system('rm %s' % pwd_cir_plot_t1)
-    os.system('rm %s' % pwd_cir_plot_t1_sorted)
-    os.system('rm %s' % pwd_cir_plot_t1_sorted_count)
+    remove_path(pwd_cir_plot_t1)
+    remove_path(pwd_cir_plot_t1_sorted)
+    remove_path(pwd_cir_plot_t1_sorted_count)
 
 
 def combine_multiple_level_predictions(args, config_dict):
@@ -3313,11 +2825,14 @@ def combine_multiple_level_predictions(args, config_dict):
 
     circos_HGT_R =              config_dict['circos_HGT_R']
 
+    pwd_prodigal_output_folder = '%s_MetaCHIP_wd/%s_all_prodigal_output'  % (output_prefix, output_prefix)
+    pwd_id_table_file =          '%s_MetaCHIP_wd/%s_id_table.npz'         % (output_prefix, output_prefix)
+
 
     # cat ffn and faa files from prodigal output folder
     pwd_combined_ffn = '%s_MetaCHIP_wd/combined_%s.ffn' % (output_prefix, datetime.now().strftime('%Y-%m-%d_%Hh-%Mm-%Ss_%f'))
 
-    os.system('cat %s_MetaCHIP_wd/%s_all_prodigal_output/*.ffn > %s' % (output_prefix, output_prefix, pwd_combined_ffn))
+    concatenate_text_files(sorted(glob.glob('%s_MetaCHIP_wd/%s_all_prodigal_output/*.ffn' % (output_prefix, output_prefix))), pwd_combined_ffn)
 
     if grouping_file is not None:
 
@@ -3376,7 +2891,7 @@ def combine_multiple_level_predictions(args, config_dict):
 
         for each_flk_plot in flanking_plot_file_list:
             pwd_each_flk_plot = '%s/%s_x%s_Flanking_region_plots/1_Plots_normal/%s' % (pwd_MetaCHIP_op_folder, output_prefix, group_num, each_flk_plot)
-            os.system('mv %s %s/%s_x%s_Flanking_region_plots/' % (pwd_each_flk_plot, pwd_MetaCHIP_op_folder, output_prefix, group_num))
+            move_to_folder(pwd_each_flk_plot, '%s/%s_x%s_Flanking_region_plots' % (pwd_MetaCHIP_op_folder, output_prefix, group_num))
 
         ###################################### Get_circlize_plot #######################################
 
@@ -3393,9 +2908,9 @@ def combine_multiple_level_predictions(args, config_dict):
 
         # remove tmp files
         os.remove(pwd_detected_HGT_PG_txt)
-        os.system('rm -r %s/%s_x%s_Flanking_region_plots/1_Plots_normal'            % (pwd_MetaCHIP_op_folder, output_prefix, group_num))
-        os.system('rm -r %s/%s_x%s_Flanking_region_plots/2_Plots_end_match'         % (pwd_MetaCHIP_op_folder, output_prefix, group_num))
-        os.system('rm -r %s/%s_x%s_Flanking_region_plots/3_Plots_full_length_match' % (pwd_MetaCHIP_op_folder, output_prefix, group_num))
+        remove_path('%s/%s_x%s_Flanking_region_plots/1_Plots_normal'            % (pwd_MetaCHIP_op_folder, output_prefix, group_num))
+        remove_path('%s/%s_x%s_Flanking_region_plots/2_Plots_end_match'         % (pwd_MetaCHIP_op_folder, output_prefix, group_num))
+        remove_path('%s/%s_x%s_Flanking_region_plots/3_Plots_full_length_match' % (pwd_MetaCHIP_op_folder, output_prefix, group_num))
 
     else:
         detection_rank_list = args['r']
@@ -3455,7 +2970,7 @@ def combine_multiple_level_predictions(args, config_dict):
 
             for each_flk_plot in flanking_plot_file_list:
                 pwd_each_flk_plot = '%s/%s_%s%s_Flanking_region_plots/1_Plots_normal/%s' % (pwd_MetaCHIP_op_folder, output_prefix, detection_rank_list, group_num, each_flk_plot)
-                os.system('mv %s %s/%s_%s%s_Flanking_region_plots/' % (pwd_each_flk_plot, pwd_MetaCHIP_op_folder, output_prefix, detection_rank_list, group_num))
+                move_to_folder(pwd_each_flk_plot, '%s/%s_%s%s_Flanking_region_plots' % (pwd_MetaCHIP_op_folder, output_prefix, detection_rank_list, group_num))
 
             ###################################### Get_circlize_plot #######################################
 
@@ -3484,9 +2999,9 @@ def combine_multiple_level_predictions(args, config_dict):
 
             # remove tmp files
             os.remove(pwd_detected_HGT_PG_txt)
-            os.system('rm -r %s/%s_%s%s_Flanking_region_plots/1_Plots_normal'               % (pwd_MetaCHIP_op_folder, output_prefix, detection_rank_list, group_num))
-            os.system('rm -r %s/%s_%s%s_Flanking_region_plots/2_Plots_end_match'            % (pwd_MetaCHIP_op_folder, output_prefix, detection_rank_list, group_num))
-            os.system('rm -r %s/%s_%s%s_Flanking_region_plots/3_Plots_full_length_match'    % (pwd_MetaCHIP_op_folder, output_prefix, detection_rank_list, group_num))
+            remove_path('%s/%s_%s%s_Flanking_region_plots/1_Plots_normal'               % (pwd_MetaCHIP_op_folder, output_prefix, detection_rank_list, group_num))
+            remove_path('%s/%s_%s%s_Flanking_region_plots/2_Plots_end_match'            % (pwd_MetaCHIP_op_folder, output_prefix, detection_rank_list, group_num))
+            remove_path('%s/%s_%s%s_Flanking_region_plots/3_Plots_full_length_match'    % (pwd_MetaCHIP_op_folder, output_prefix, detection_rank_list, group_num))
 
 
         # for multiple level detection
@@ -3498,6 +3013,7 @@ def combine_multiple_level_predictions(args, config_dict):
             multi_level_detection = True
 
             pwd_detected_HGT_txt_list = []
+            pwd_candidate_table_file_list = []
             pwd_flanking_plot_folder_list = []
             for detection_rank in detection_rank_list:
 
@@ -3511,9 +3027,11 @@ def combine_multiple_level_predictions(args, config_dict):
 
                 group_num = int(MetaCHIP_op_folder[len(output_prefix)+1:].split('_')[0][1:])
                 pwd_detected_HGT_txt        = '%s_MetaCHIP_wd/%s/%s_%s%s_HGTs_PG.txt' % (output_prefix, MetaCHIP_op_folder, output_prefix, detection_rank, group_num)
+                pwd_candidate_table_file    = '%s_MetaCHIP_wd/%s/%s_%s%s_HGT_candidates.npz' % (output_prefix, MetaCHIP_op_folder, output_prefix, detection_rank, group_num)
                 pwd_flanking_plot_folder    = '%s_MetaCHIP_wd/%s/%s_%s%s_Flanking_region_plots' % (output_prefix, MetaCHIP_op_folder, output_prefix, detection_rank, group_num)
 
                 pwd_detected_HGT_txt_list.append(pwd_detected_HGT_txt)
+                pwd_candidate_table_file_list.append(pwd_candidate_table_file)
                 pwd_flanking_plot_folder_list.append(pwd_flanking_plot_folder)
 
 
@@ -3532,7 +3050,9 @@ def combine_multiple_level_predictions(args, config_dict):
 
             # combine prediction
             force_create_folder(pwd_combined_prediction_folder)
-            combine_PG_output(pwd_detected_HGT_txt_list, output_prefix, detection_rank_list, pwd_detected_HGT_txt_combined)
+            id_table = get_id_table(pwd_id_table_file, pwd_prodigal_output_folder, [])
+            candidate_table_list = get_candidate_tables_of_ranks(pwd_candidate_table_file_list, pwd_detected_HGT_txt_list, id_table, detection_rank_list, [0, 1, 4, 5, 6, 7])
+            combine_PG_output(candidate_table_list, id_table, detection_rank_list, pwd_detected_HGT_txt_combined)
 
 
             ############################################### extract sequences ##############################################
@@ -3581,19 +3101,19 @@ def combine_multiple_level_predictions(args, config_dict):
 
                 for flanking_plot in flanking_plot_list:
                     pwd_flanking_plot = '%s/1_Plots_normal/%s' % (flanking_plot_folder, flanking_plot)
-                    os.system('cp %s %s/' % (pwd_flanking_plot, pwd_flanking_plot_folder_combined_tmp))
+                    copy_to_folder(pwd_flanking_plot, pwd_flanking_plot_folder_combined_tmp)
 
                 # os.system('cp %s/1_Plots_normal/* %s/' % (flanking_plot_folder, pwd_flanking_plot_folder_combined_tmp))
 
             for plot_file in plot_file_list:
                 pwd_plot_file = '%s/%s' % (pwd_flanking_plot_folder_combined_tmp, plot_file)
-                os.system('mv %s %s/' % (pwd_plot_file, pwd_flanking_plot_folder_combined))
+                move_to_folder(pwd_plot_file, pwd_flanking_plot_folder_combined)
 
             # remove folder for each level detection
             # for flanking_plot_folder in pwd_flanking_plot_folder_list:
             #     each_level_op_folder = '/'.join(flanking_plot_folder.split('/')[:-1])
             #     os.system('mv %s/* %s_MetaCHIP_wd/' % (each_level_op_folder, output_prefix))
-            #     os.system('rm -r %s' % each_level_op_folder)
+            #     remove_path(each_level_op_folder)
 
 
             ###################################### Get_circlize_plot #######################################
@@ -3619,7 +3139,7 @@ def combine_multiple_level_predictions(args, config_dict):
             ###################################### remove tmp files #######################################
 
             # remove tmp files
-            os.system('rm -r %s' % pwd_flanking_plot_folder_combined_tmp)
+            remove_path(pwd_flanking_plot_folder_combined_tmp)
 
 
     os.remove(pwd_combined_ffn)
@@ -3637,19 +3157,23 @@ def CMLP(args, config_dict):
 
     circos_HGT_R =              config_dict['circos_HGT_R']
 
+    pwd_prodigal_output_folder = '%s_MetaCHIP_wd/%s_all_prodigal_output'  % (output_prefix, output_prefix)
+    pwd_id_table_file =          '%s_MetaCHIP_wd/%s_id_table.npz'         % (output_prefix, output_prefix)
+
     time_format = '[%Y-%m-%d %H:%M:%S]'
     print('%s Combine multiple level predictions' % (datetime.now().strftime(time_format)))
 
     # cat ffn and faa files from prodigal output folder
     print('%s get combined.ffn file' % (datetime.now().strftime(time_format)))
     pwd_combined_ffn = '%s_MetaCHIP_wd/combined_%s.ffn' % (output_prefix, datetime.now().strftime('%Y-%m-%d_%Hh-%Mm-%Ss_%f'))
-    os.system('cat %s_MetaCHIP_wd/%s_all_prodigal_output/*.ffn > %s' % (output_prefix, output_prefix, pwd_combined_ffn))
+    concatenate_text_files(sorted(glob.glob('%s_MetaCHIP_wd/%s_all_prodigal_output/*.ffn' % (output_prefix, output_prefix))), pwd_combined_ffn)
 
 
 
     multi_level_detection = True
 
     pwd_detected_HGT_txt_list = []
+    pwd_candidate_table_file_list = []
     pwd_flanking_plot_folder_list = []
     for detection_rank in detection_rank_list:
 
@@ -3663,9 +3187,11 @@ def CMLP(args, config_dict):
 
         group_num = int(MetaCHIP_op_folder[len(output_prefix)+1:].split('_')[0][1:])
         pwd_detected_HGT_txt        = '%s_MetaCHIP_wd/%s/%s_%s_detected_HGTs.txt'       % (output_prefix, MetaCHIP_op_folder, output_prefix, detection_rank)
+        pwd_candidate_table_file    = '%s_MetaCHIP_wd/%s/%s_%s%s_HGT_candidates.npz'    % (output_prefix, MetaCHIP_op_folder, output_prefix, detection_rank, group_num)
         pwd_flanking_plot_folder    = '%s_MetaCHIP_wd/%s/%s_%s%s_Flanking_region_plots' % (output_prefix, MetaCHIP_op_folder, output_prefix, detection_rank, group_num)
 
         pwd_detected_HGT_txt_list.append(pwd_detected_HGT_txt)
+        pwd_candidate_table_file_list.append(pwd_candidate_table_file)
         pwd_flanking_plot_folder_list.append(pwd_flanking_plot_folder)
 
 
@@ -3684,7 +3210,9 @@ def CMLP(args, config_dict):
 
     # combine prediction
     force_create_folder(pwd_combined_prediction_folder)
-    combine_PG_output_for_CMLP(pwd_detected_HGT_txt_list, output_prefix, detection_rank_list, pwd_detected_HGT_txt_combined)
+    id_table = get_id_table(pwd_id_table_file, pwd_prodigal_output_folder, [])
+    candidate_table_list = get_candidate_tables_of_ranks(pwd_candidate_table_file_list, pwd_detected_HGT_txt_list, id_table, detection_rank_list, [0, 1, 2, 3, 4, 5])
+    combine_PG_output(candidate_table_list, id_table, detection_rank_list, pwd_detected_HGT_txt_combined)
 
 
     ############################################### extract sequences ##############################################
@@ -3737,13 +3265,13 @@ def CMLP(args, config_dict):
 
         for flanking_plot in flanking_plot_list:
             pwd_flanking_plot = '%s/%s' % (flanking_plot_folder, flanking_plot)
-            os.system('cp %s %s/' % (pwd_flanking_plot, pwd_flanking_plot_folder_combined_tmp))
+            copy_to_folder(pwd_flanking_plot, pwd_flanking_plot_folder_combined_tmp)
 
         # os.system('cp %s/1_Plots_normal/* %s/' % (flanking_plot_folder, pwd_flanking_plot_folder_combined_tmp))
 
     for plot_file in plot_file_list:
         pwd_plot_file = '%s/%s' % (pwd_flanking_plot_folder_combined_tmp, plot_file)
-        os.system('mv %s %s/' % (pwd_plot_file, pwd_flanking_plot_folder_combined))
+        move_to_folder(pwd_plot_file, pwd_flanking_plot_folder_combined)
 
 
     ###################################### Get_circlize_plot #######################################
@@ -3772,7 +3300,7 @@ def CMLP(args, config_dict):
 
     # remove tmp files
     print('%s remove tmp files' % (datetime.now().strftime(time_format)))
-    os.system('rm -r %s' % pwd_flanking_plot_folder_combined_tmp)
+    remove_path(pwd_flanking_plot_folder_combined_tmp)
     os.remove(pwd_combined_ffn)
 
 
@@ -3792,9 +3320,21 @@ if __name__ == '__main__':
     parser.add_argument('-t',             required=False, type=int,     default=1,      help='number of threads, default: 1')
     parser.add_argument('-plot_iden',     required=False, action="store_true",          help='plot identity distribution')
     parser.add_argument('-NoEbCheck',     required=False, action="store_true",          help='disable end break and contig match check for fast processing, not recommend for metagenome-assembled genomes (MAGs)')
+    parser.add_argument('-flk_batch',     required=False, type=int,     default=20,     help='number of candidates checked together, their flanking regions and contigs are packed into blastn jobs of at most 4 times the search space of one job per candidate, default: 20')
+    parser.add_argument('-plot_all',      required=False, action="store_true",          help='plot flanking regions of all BM candidates, default: PG validated HGTs only')
+    parser.add_argument('-noplot',        required=False, action="store_true",          help='do not plot flanking regions, plots can be generated later with "MetaCHIP plot"')
     parser.add_argument('-force',         required=False, action="store_true",          help='overwrite previous results')
     parser.add_argument('-quiet',         required=False, action="store_true",          help='Do not report progress')
     parser.add_argument('-tmp',           required=False, action="store_true",          help='keep temporary files')
+    parser.add_argument('-timeout',       required=False, default=None,                 help='timeout of external tools in seconds, e.g. blastn=86400,mafft=3600')
+    parser.add_argument('-resume',        required=False, action="store_true",          help='skip flanking region checks, gene trees and Ranger-DTL runs finished by a previous run')
+    parser.add_argument('-cache',         required=False, default=None,                 help='folder of the result cache shared by runs')
+    parser.add_argument('-cache_size',    required=False, type=float, default=50,       help='size limit of the result cache in GB, default: 50')
+    parser.add_argument('-executor',      required=False, default='local',              help='run gene trees and Ranger-DTL with local (default), batch (job scheduler) or local_batch (job scripts run locally)')
+    parser.add_argument('-js_header',     required=False, default=None,                 help='job script header for batch executors, {job_name}, {cores} and {array} are replaced')
+    parser.add_argument('-submit',        required=False, default='qsub',               help='command to submit job scripts, default: qsub')
+    parser.add_argument('-jobs',          required=False, type=int,     default=50,     help='number of jobs (array elements) per stage for batch executors, default: 50')
+    parser.add_argument('-job_timeout',   required=False, type=float,   default=None,   help='seconds after submission until an unfinished batch job is resubmitted (e.g. deleted while queued), jobs killed while running are detected without it, default: no limit')
 
     args = vars(parser.parse_args())
 
@@ -3804,13 +3344,14 @@ if __name__ == '__main__':
         PG(args, config_dict)
 
     else:
+        BM_hits_of_ranks = get_BM_hits_of_detection_ranks(args, config_dict)
         for detection_rank_BM_PG in detection_rank_list_BP:
             current_rank_args_BM_PG = copy.deepcopy(args)
             current_rank_args_BM_PG['r'] = detection_rank_BM_PG
             current_rank_args_BM_PG['quiet'] = True
 
             print('Detect HGT at level: %s' % detection_rank_BM_PG)
-            BM(current_rank_args_BM_PG, config_dict)
+            BM(current_rank_args_BM_PG, config_dict, BM_hits_of_ranks)
             PG(current_rank_args_BM_PG, config_dict)
 
     combine_multiple_level_predictions(args, config_dict)
@@ -17,6 +17,7 @@ config_dict = {'prodigal'        : 'prodigal',
                'blastn'          : 'blastn',
                'makeblastdb'     : 'makeblastdb',
                'fasttree'        : 'FastTree',
+               'zstd'            : 'zstd',
                'ranger_mac'      : '%s/Ranger-DTL-Dated.mac'   % config_file_path,  # do not edit this line
                'ranger_linux'    : '%s/Ranger-DTL-Dated.linux' % config_file_path,  # do not edit this line
                'path_to_hmm'     : '%s/MetaCHIP_phylo.hmm'     % config_file_path,  # do not edit this line
@@ -21,6 +21,7 @@ from __future__ import division
 
 import os
 import re
+import shlex
 import glob
 import shutil
 import argparse
@@ -39,8 +40,20 @@ from Bio.SeqFeature import SeqFeature, FeatureLocation
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.pyplot as plt
-import multiprocessing as mp
 from MetaCHIP.MetaCHIP_config import config_dict
+from MetaCHIP.annotation_index import save_annotation_index
+from MetaCHIP.id_table import create_id_table, save_id_table, load_id_table, add_grouping_to_id_table, get_genome_gene_num_dict, get_gene_num_from_ffn
+from MetaCHIP.worker_pool import get_worker_pool, publish_worker_context, release_worker_context
+from MetaCHIP.compressed_io import check_compression, open_file, compress_file, decompress_file, get_file_compression, get_plain_file, concatenate_text_files
+from MetaCHIP.hit_store import update_hit_store_genomes, is_current_hit_store_partition, write_hit_store_partition_worker
+from MetaCHIP.blastn_prefilter import get_minimizers_worker, create_prefilter_context, prefilter_query_worker, get_prefilter_recall
+from MetaCHIP.job_executor import get_executor_settings, check_executor_settings, run_tasks_worker
+from MetaCHIP.task_graph import create_task_graph, add_task, run_task_graph
+from MetaCHIP.checkpoint_manifest import open_checkpoint_manifest, get_unit_hash, get_finished_unit, record_finished_unit
+from MetaCHIP.result_cache import set_result_cache_settings, get_cache_key, get_cached_result, store_cached_result, trim_result_cache
+from MetaCHIP.thread_budget import start_thread_budget, add_thread_budget_jobs, acquire_threads, release_threads, get_fasttree_env
+from MetaCHIP.tool_runner import set_tool_runner_settings, parse_tool_timeouts, get_tool_run_summary, run_tool
+from MetaCHIP.tool_runner import run_required_tool, remove_path
 
 
 def report_and_log(message_for_report, log_file, keep_quiet):
@@ -78,6 +91,11 @@ def force_create_folder(folder_to_create):
     os.mkdir(folder_to_create)
 
 
+def create_missing_folder(folder_to_create):
+    if not os.path.isdir(folder_to_create):
+        os.mkdir(folder_to_create)
+
+
 def remove_empty_element(list_in):
 
     list_out = []
@@ -291,7 +309,7 @@ def remove_low_cov_and_consensus_columns(alignment_file_in, minimal_cov, min_con
     alignment_file_out_handle.close()
 
 
-def prodigal_parser(seq_file, sco_file, prefix, output_folder):
+def prodigal_parser(seq_file, sco_file, prefix, output_folder, compression=None):
 
     bin_ffn_file =     '%s.ffn' % prefix
     bin_faa_file =     '%s.faa' % prefix
@@ -299,6 +317,8 @@ def prodigal_parser(seq_file, sco_file, prefix, output_folder):
     pwd_bin_ffn_file = '%s/%s'  % (output_folder, bin_ffn_file)
     pwd_bin_faa_file = '%s/%s'  % (output_folder, bin_faa_file)
     pwd_bin_gbk_file = '%s/%s'  % (output_folder, bin_gbk_file)
+    pwd_bin_idx_file = '%s/%s.idx' % (output_folder, prefix)
+    pwd_bin_seq_file = '%s/%s.seq' % (output_folder, prefix)
 
     # get sequence id list
     id_to_sequence_dict = {}
@@ -337,11 +357,12 @@ def prodigal_parser(seq_file, sco_file, prefix, output_folder):
     seq_to_transl_table_dict[current_seq_id] = current_transl_table
 
 
-    bin_gbk_file_handle = open(pwd_bin_gbk_file, 'w')
-    bin_ffn_file_handle = open(pwd_bin_ffn_file, 'w')
-    bin_faa_file_handle = open(pwd_bin_faa_file, 'w')
+    bin_gbk_file_handle = open_file(pwd_bin_gbk_file, 'w', compression)
+    bin_ffn_file_handle = open_file(pwd_bin_ffn_file, 'w', compression)
+    bin_faa_file_handle = open_file(pwd_bin_faa_file, 'w', compression)
     gene_index = 1
-    for seq_id in sequence_id_list:
+    gene_coordinate_list = []
+    for contig_index, seq_id in enumerate(sequence_id_list):
 
         # create SeqRecord
         current_sequence = Seq(id_to_sequence_dict[seq_id])
@@ -412,6 +433,7 @@ def prodigal_parser(seq_file, sco_file, prefix, output_folder):
 
             # Append Feature to SeqRecord
             current_SeqRecord.features.append(current_feature)
+            gene_coordinate_list.append([gene_index, contig_index, int(cds_start), int(cds_end), current_strand or 0])
             gene_index += 1
 
         # export to gbk file
@@ -421,13 +443,18 @@ def prodigal_parser(seq_file, sco_file, prefix, output_folder):
     bin_ffn_file_handle.close()
     bin_faa_file_handle.close()
 
+    # binary index for fetching flanking regions without parsing the gbk file
+    save_annotation_index(pwd_bin_idx_file, pwd_bin_seq_file, sequence_id_list, [id_to_sequence_dict[i] for i in sequence_id_list], gene_coordinate_list)
+
+    # return the number of genes, locus tags were numbered from 1
+    return gene_index - 1
+
 
 def sep_combined_hmm(combined_hmm_file, hmm_profile_sep_folder, hmmfetch_exe, pwd_hmmstat_exe):
 
     # extract hmm profile id from phylo.hmm
     pwd_phylo_hmm_stat_txt = '%s/phylo.hmm.stat.txt' % hmm_profile_sep_folder
-    hmmstat_cmd = '%s %s > %s' % (pwd_hmmstat_exe, combined_hmm_file, pwd_phylo_hmm_stat_txt)
-    os.system(hmmstat_cmd)
+    run_required_tool([pwd_hmmstat_exe, combined_hmm_file], pwd_stdout_file=pwd_phylo_hmm_stat_txt)
 
     # get hmm profile id file
     hmm_id_list = []
@@ -442,8 +469,11 @@ def sep_combined_hmm(combined_hmm_file, hmm_profile_sep_folder, hmmfetch_exe, pw
                 hmm_id_list.append(each_profile_split_no_space[2])
 
     for each_hmm_id in hmm_id_list:
-        hmmfetch_cmd = '%s %s %s > %s/%s.hmm' % (hmmfetch_exe, combined_hmm_file, each_hmm_id, hmm_profile_sep_folder, each_hmm_id)
-        os.system(hmmfetch_cmd)
+        run_required_tool([hmmfetch_exe, combined_hmm_file, each_hmm_id], pwd_stdout_file='%s/%s.hmm' % (hmm_profile_sep_folder, each_hmm_id))
+
+
+def sep_combined_hmm_worker(argument_list):
+    sep_combined_hmm(argument_list[0], argument_list[1], argument_list[2], argument_list[3])
 
 
 def prodigal_worker(argument_list):
@@ -453,26 +483,50 @@ def prodigal_worker(argument_list):
     pwd_prodigal_exe = argument_list[2]
     nonmeta_mode = argument_list[3]
     pwd_prodigal_output_folder = argument_list[4]
+    checkpoint_manifest_key = argument_list[5]
+    compression = argument_list[6]
 
     # prepare command (according to Prokka)
     input_genome_basename, input_genome_ext = os.path.splitext(input_genome)
     pwd_input_genome = '%s/%s' % (input_genome_folder, input_genome)
     pwd_output_sco = '%s/%s.sco' % (pwd_prodigal_output_folder, input_genome_basename)
 
-    prodigal_cmd_meta = '%s -f sco -q -c -m -g 11 -p meta -i %s -o %s' % (
-    pwd_prodigal_exe, pwd_input_genome, pwd_output_sco)
-    prodigal_cmd_nonmeta = '%s -f sco -q -c -m -g 11 -i %s -o %s' % (
-    pwd_prodigal_exe, pwd_input_genome, pwd_output_sco)
+    # annotation from a previous run with the same genome sequence
+    unit_name = 'prodigal:%s' % input_genome_basename
+    unit_hash = get_unit_hash(['prodigal', nonmeta_mode], [pwd_input_genome])
+    unit_output_list = ['%s/%s.%s' % (pwd_prodigal_output_folder, input_genome_basename, i) for i in ['ffn', 'faa', 'gbk', 'idx', 'seq']]
+    finished_gene_num = get_finished_unit(checkpoint_manifest_key, unit_name, unit_hash, unit_output_list)
+    if finished_gene_num is not None:
+        return input_genome_basename, finished_gene_num
+
+    # annotation of the same genome sequence by a previous run or project
+    cache_key = get_cache_key([pwd_prodigal_exe], ['prodigal', input_genome_basename, nonmeta_mode], [pwd_input_genome])
+    cached_file_dict = dict(zip(['ffn', 'faa', 'gbk', 'idx', 'seq'], unit_output_list))
+    cached_gene_num = get_cached_result(cache_key, cached_file_dict)
+    if cached_gene_num is not None:
+        record_finished_unit(checkpoint_manifest_key, unit_name, unit_hash, cached_gene_num)
+        return input_genome_basename, cached_gene_num
+
+    prodigal_cmd_meta = [pwd_prodigal_exe, '-f', 'sco', '-q', '-c', '-m', '-g', '11', '-p', 'meta', '-i', pwd_input_genome, '-o', pwd_output_sco]
+    prodigal_cmd_nonmeta = [pwd_prodigal_exe, '-f', 'sco', '-q', '-c', '-m', '-g', '11', '-i', pwd_input_genome, '-o', pwd_output_sco]
 
     if nonmeta_mode is True:
         prodigal_cmd = prodigal_cmd_nonmeta
     else:
         prodigal_cmd = prodigal_cmd_meta
 
-    os.system(prodigal_cmd)
+    # a failed (or timed out) run stops PI, partial annotations are not used, genomes annotated before are kept for -resume
+    prodigal_exit_status = run_tool(prodigal_cmd)
+    if prodigal_exit_status != 0:
+        remove_path(pwd_output_sco)
+        raise RuntimeError('Prodigal exited with status %s for %s: %s' % (prodigal_exit_status, input_genome, ' '.join(prodigal_cmd)))
 
     # prepare ffn, faa and gbk files from prodigal output
-    prodigal_parser(pwd_input_genome, pwd_output_sco, input_genome_basename, pwd_prodigal_output_folder)
+    gene_num = prodigal_parser(pwd_input_genome, pwd_output_sco, input_genome_basename, pwd_prodigal_output_folder, compression)
+    record_finished_unit(checkpoint_manifest_key, unit_name, unit_hash, gene_num)
+    store_cached_result(cache_key, cached_file_dict, gene_num)
+
+    return input_genome_basename, gene_num
 
 
 def copy_annotaion_worker(argument_list):
@@ -483,7 +537,8 @@ def copy_annotaion_worker(argument_list):
     pwd_gbk_folder = argument_list[4]
 
     #os.system('cp %s/%s.ffn %s' % (pwd_prodigal_output_folder, genome, pwd_ffn_folder))  # may not need
-    os.system('cp %s/%s.faa %s' % (pwd_prodigal_output_folder, genome, pwd_faa_folder))  # for usearch
+    if os.path.isfile('%s/%s.faa' % (pwd_prodigal_output_folder, genome)):
+        decompress_file('%s/%s.faa' % (pwd_prodigal_output_folder, genome), '%s/%s.faa' % (pwd_faa_folder, genome))  # for usearch and hmmsearch
     #os.system('cp %s/%s.gbk %s' % (pwd_prodigal_output_folder, genome, pwd_gbk_folder))  # may not need
 
 
@@ -494,10 +549,24 @@ def hmmsearch_worker(argument_list):
     pwd_hmmsearch_exe = argument_list[2]
     path_to_hmm = argument_list[3]
     pwd_faa_folder = argument_list[4]
+    checkpoint_manifest_key = argument_list[5]
 
-    # run hmmsearch
+    # genomes without annotation are skipped
     pwd_faa_file = '%s/%s.faa' % (pwd_faa_folder, faa_file_basename)
-    os.system('%s -o /dev/null --domtblout %s/%s_hmmout.tbl %s %s' % (pwd_hmmsearch_exe, pwd_SCG_tree_wd, faa_file_basename, path_to_hmm, pwd_faa_file))
+    if not os.path.isfile(pwd_faa_file):
+        return
+
+    # run hmmsearch, hmmsearch table from a previous run is reused if profiles and proteins did not change
+    pwd_hmmout_tbl = '%s/%s_hmmout.tbl' % (pwd_SCG_tree_wd, faa_file_basename)
+    unit_name = 'hmmsearch:%s' % faa_file_basename
+    unit_hash = get_unit_hash(['hmmsearch'], [path_to_hmm, pwd_faa_file])
+    if get_finished_unit(checkpoint_manifest_key, unit_name, unit_hash, [pwd_hmmout_tbl]) is None:
+        thread_num = acquire_threads()
+        try:
+            run_required_tool([pwd_hmmsearch_exe, '--cpu', thread_num, '-o', os.devnull, '--domtblout', pwd_hmmout_tbl, path_to_hmm, pwd_faa_file])
+        finally:
+            release_threads(thread_num)
+        record_finished_unit(checkpoint_manifest_key, unit_name, unit_hash)
 
     # Reading the protein file in a dictionary
     proteinSequence = {}
@@ -511,7 +580,6 @@ def hmmsearch_worker(argument_list):
     hmm_pos1 = 0
     hmm_pos2 = 0
     hmm_score = 0
-    pwd_hmmout_tbl = pwd_SCG_tree_wd + '/' + faa_file_basename + '_hmmout.tbl'
     with open(pwd_hmmout_tbl, 'r') as tbl:
         for line in tbl:
             if line[0] == "#": continue
@@ -596,14 +664,112 @@ def hmmalign_worker(argument_list):
     pwd_aln_out_tmp = '%s/%s_aligned_tmp.fasta' % (pwd_SCG_tree_wd, fastaFile_basename)
     pwd_aln_out =     '%s/%s_aligned.fasta'     % (pwd_SCG_tree_wd, fastaFile_basename)
 
-    hmmalign_cmd = '%s --trim --outformat PSIBLAST %s %s > %s ; rm %s' % (pwd_hmmalign_exe, pwd_hmm_file, pwd_seq_in, pwd_aln_out_tmp, pwd_seq_in)
-    os.system(hmmalign_cmd)
+    run_required_tool([pwd_hmmalign_exe, '--trim', '--outformat', 'PSIBLAST', pwd_hmm_file, pwd_seq_in], pwd_stdout_file=pwd_aln_out_tmp)
+    remove_path(pwd_seq_in)
 
     # convert alignment format
     convert_hmmalign_output(pwd_aln_out_tmp, pwd_aln_out)
 
     # remove tmp alignment
-    os.system('rm %s' % pwd_aln_out_tmp)
+    remove_path(pwd_aln_out_tmp)
+
+
+def species_tree_worker(argument_list):
+
+    faa_file_basename_list = argument_list[0]
+    pwd_SCG_tree_wd = argument_list[1]
+    pwd_combined_alignment_file_tmp = argument_list[2]
+    pwd_combined_alignment_file = argument_list[3]
+    minimal_cov_in_msa = argument_list[4]
+    min_consensus_in_msa = argument_list[5]
+    pwd_fasttree_exe = argument_list[6]
+    pwd_newick_tree_file = argument_list[7]
+
+    # concatenating the single alignments
+    concatAlignment = {}
+    for element in faa_file_basename_list:
+        concatAlignment[element] = ''
+
+    # Reading all single alignment files and append them to the concatenated alignment
+    files = os.listdir(pwd_SCG_tree_wd)
+    fastaFiles = [i for i in files if i.endswith('.fasta')]
+    for faa_file_basename in fastaFiles:
+        fastaFile = pwd_SCG_tree_wd + '/' + faa_file_basename
+        proteinSequence = {}
+        alignmentLength = 0
+        for seq_record_2 in SeqIO.parse(fastaFile, 'fasta'):
+            proteinName = seq_record_2.id
+            proteinSequence[proteinName] = str(seq_record_2.seq)
+            alignmentLength = len(proteinSequence[proteinName])
+
+        for element in faa_file_basename_list:
+            if element in proteinSequence.keys():
+                concatAlignment[element] += proteinSequence[element]
+            else:
+                concatAlignment[element] += '-' * alignmentLength
+
+    # writing alignment to file
+    file_out = open(pwd_combined_alignment_file_tmp, 'w')
+    for element in faa_file_basename_list:
+        file_out.write('>' + element + '\n' + concatAlignment[element] + '\n')
+    file_out.close()
+
+    # remove columns with low coverage and low consensus
+    remove_low_cov_and_consensus_columns(pwd_combined_alignment_file_tmp, minimal_cov_in_msa, min_consensus_in_msa, pwd_combined_alignment_file)
+
+    # calling fasttree for tree calculation, with the cores left by blastn
+    thread_num = acquire_threads()
+    try:
+        run_required_tool([pwd_fasttree_exe, '-quiet', pwd_combined_alignment_file], pwd_stdout_file=pwd_newick_tree_file, pwd_stderr_file=os.devnull, env=get_fasttree_env(pwd_fasttree_exe, thread_num))
+    finally:
+        release_threads(thread_num)
+
+
+def makeblastdb_worker(argument_list):
+
+    pwd_ffn_file_list = argument_list[0]
+    pwd_combined_ffn_file = argument_list[1]
+    pwd_blast_db = argument_list[2]
+    pwd_makeblastdb_exe = argument_list[3]
+    pwd_db_ffn_file_list = argument_list[4]
+    count_letters = argument_list[5]
+    compression = argument_list[6]
+
+    # the combined ffn file has all genomes (written by the task of the first volume),
+    # the blast db (volume) only genomes not in other volumes, uncompressed for makeblastdb
+    if pwd_ffn_file_list is not None:
+        concatenate_text_files(pwd_ffn_file_list, pwd_combined_ffn_file, compression)
+    concatenate_text_files(pwd_db_ffn_file_list, pwd_blast_db)
+    run_required_tool([pwd_makeblastdb_exe, '-in', pwd_blast_db, '-dbtype', 'nucl', '-parse_seqids', '-logfile', os.devnull])
+
+    # number of letters in the volume, searches against db shards need the size of the whole db
+    if count_letters is False:
+        return None
+    letter_num = 0
+    for each_line in open(pwd_blast_db):
+        if not each_line.startswith('>'):
+            letter_num += len(each_line.strip())
+
+    return letter_num
+
+
+def read_blast_db_genomes(pwd_blast_db_genome_file):
+
+    # genome --> blast db volume it was added to
+    blast_db_genome_dict = {}
+    for each_line in open(pwd_blast_db_genome_file):
+        each_line_split = each_line.strip().split('\t')
+        if len(each_line_split) == 2:
+            blast_db_genome_dict[each_line_split[0]] = each_line_split[1]
+
+    return blast_db_genome_dict
+
+
+def write_blast_db_genomes(blast_db_genome_dict, pwd_blast_db_genome_file):
+    with open('%s.tmp' % pwd_blast_db_genome_file, 'w') as blast_db_genome_handle:
+        for genome in sorted(blast_db_genome_dict):
+            blast_db_genome_handle.write('%s\t%s\n' % (genome, blast_db_genome_dict[genome]))
+    os.rename('%s.tmp' % pwd_blast_db_genome_file, pwd_blast_db_genome_file)
 
 
 def get_qualified_gene_cluster(UCLUST_output, min_gene_num, seq_file_prefix, cluster_to_gene_file):
@@ -627,25 +793,194 @@ def get_qualified_gene_cluster(UCLUST_output, min_gene_num, seq_file_prefix, clu
     output_file_handle.close()
 
 
+def get_blast_db_str(pwd_blast_db_list):
+
+    # blast db volumes are given to blastn as a quoted, space separated list
+    if len(pwd_blast_db_list) == 1:
+        return pwd_blast_db_list[0]
+    return '"%s"' % ' '.join(pwd_blast_db_list)
+
+
+def get_blastn_unit(query_file, pwd_query_folder, pwd_blast_db_list, blast_parameters, pwd_blastn_exe, checkpoint_manifest_key, pwd_seqidlist_file_list=()):
+
+    # blastn of a query genome against the blast db (restricted to the subjects of its seqidlists with -prefilter),
+    # recorded once its results were reassembled
+    pwd_input_file_list = ['%s/%s' % (pwd_query_folder, query_file)] + pwd_blast_db_list + list(pwd_seqidlist_file_list)
+    unit_hash = get_unit_hash(['blastn', blast_parameters], pwd_input_file_list)
+    cache_key = get_cache_key([pwd_blastn_exe], ['blastn', blast_parameters], pwd_input_file_list)
+
+    return [checkpoint_manifest_key, 'blastn:%s' % query_file, unit_hash, cache_key]
+
+
+def is_finished_blastn_unit(blastn_unit, pwd_blast_result_file):
+
+    # blastn results from a previous run with the same query, database and parameters are kept
+    checkpoint_manifest_key, unit_name, unit_hash, cache_key = blastn_unit
+    if get_finished_unit(checkpoint_manifest_key, unit_name, unit_hash, [pwd_blast_result_file]) is not None:
+        return True
+
+    # or by a previous run or project on the same genomes
+    if get_cached_result(cache_key, {'blastn.tab': pwd_blast_result_file}) is not None:
+        record_finished_unit(checkpoint_manifest_key, unit_name, unit_hash)
+        return True
+
+    return False
+
+
+def record_blastn_unit(blastn_unit, pwd_blast_result_file):
+    checkpoint_manifest_key, unit_name, unit_hash, cache_key = blastn_unit
+    record_finished_unit(checkpoint_manifest_key, unit_name, unit_hash)
+    store_cached_result(cache_key, {'blastn.tab': pwd_blast_result_file})
+
+
+def get_max_target_seqs(blast_parameters):
+    blast_parameter_list = shlex.split(blast_parameters)
+    if '-max_target_seqs' in blast_parameter_list:
+        return int(blast_parameter_list[blast_parameter_list.index('-max_target_seqs') + 1])
+    return 500
+
+
+def write_query_chunk(pwd_query_file, chunk_index, chunk_num, pwd_chunk_file):
+
+    # sequences are assigned to chunks by the position of their header in the (uncompressed) query file,
+    # chunks have similar size in bytes, returns the number of sequences in the chunk
+    query_file_size = os.path.getsize(pwd_query_file)
+    query_line_list = None
+    if get_file_compression(pwd_query_file) is not None:
+        with open_file(pwd_query_file) as query_handle:
+            query_line_list = [i.encode() for i in query_handle]
+        query_file_size = sum([len(i) for i in query_line_list])
+    seq_num = 0
+    in_chunk = False
+    with open(pwd_query_file, 'rb') as query_handle, open(pwd_chunk_file, 'wb') as chunk_handle:
+        line_offset = 0
+        for each_line in (query_handle if query_line_list is None else query_line_list):
+            if each_line.startswith(b'>'):
+                in_chunk = (line_offset * chunk_num // max(query_file_size, 1)) == chunk_index
+                if in_chunk is True:
+                    seq_num += 1
+            if in_chunk is True:
+                chunk_handle.write(each_line)
+            line_offset += len(each_line)
+
+    return seq_num
+
+
 def parallel_blastn_worker(argument_list):
     query_file = argument_list[0]
     pwd_query_folder = argument_list[1]
-    pwd_blast_db = argument_list[2]
-    pwd_blast_result_folder = argument_list[3]
+    pwd_blast_db_list = argument_list[2]
+    pwd_blast_output_file = argument_list[3]
     blast_parameters = argument_list[4]
     pwd_blastn_exe = argument_list[5]
-
-    pwd_blast_result_file = '%s/%s_blastn.tab' % (pwd_blast_result_folder, '.'.join(query_file.split('.')[:-1]))
-    blastn_cmd = '%s -query %s/%s -db %s -out %s %s' % (pwd_blastn_exe,
-                                                        pwd_query_folder,
-                                                        query_file,
-                                                        pwd_blast_db,
-                                                        pwd_blast_result_file,
-                                                        blast_parameters)
-    os.system(blastn_cmd)
-
-
-def create_blastn_job_script(blastn_wd, job_script_folder, job_script_file_name, blastn_js_header, cmd, qsub_on):
+    blastn_unit = argument_list[6]
+    query_chunk = argument_list[7]
+    blast_db_size = argument_list[8]
+    compression = argument_list[9]
+
+    # a chunk of the query genome (or the decompressed query genome) is written next to its output
+    pwd_query_file = '%s.query' % pwd_blast_output_file
+    if query_chunk is not None:
+        if write_query_chunk('%s/%s' % (pwd_query_folder, query_file), query_chunk[0], query_chunk[1], pwd_query_file) == 0:
+            open(pwd_blast_output_file, 'w').close()
+            os.remove(pwd_query_file)
+            return
+    else:
+        pwd_query_file = get_plain_file('%s/%s' % (pwd_query_folder, query_file), pwd_query_file)
+
+    blastn_cmd = [pwd_blastn_exe, '-query', pwd_query_file, '-db', ' '.join(pwd_blast_db_list), '-out', pwd_blast_output_file] + shlex.split(blast_parameters)
+
+    # e-values of hits against a db shard are calculated with the size of the whole db
+    if blast_db_size is not None:
+        if '-dbsize' in blastn_cmd:
+            del blastn_cmd[blastn_cmd.index('-dbsize'):(blastn_cmd.index('-dbsize') + 2)]
+        blastn_cmd += ['-dbsize', blast_db_size]
+
+    # more threads for the last genomes, the number of threads in blast_parameters is replaced
+    if '-num_threads' in blastn_cmd:
+        del blastn_cmd[blastn_cmd.index('-num_threads'):(blastn_cmd.index('-num_threads') + 2)]
+
+    thread_num = acquire_threads()
+    blastn_exit_status = run_tool(blastn_cmd + ['-num_threads', thread_num])
+    release_threads(thread_num)
+    if pwd_query_file == '%s.query' % pwd_blast_output_file:
+        os.remove(pwd_query_file)
+
+    # output of a failed (or timed out) search is removed, query chunks of a genome are only
+    # reassembled if all of them finished
+    if blastn_exit_status != 0:
+        remove_path(pwd_blast_output_file)
+        query_chunk_str = '' if query_chunk is None else ' (query chunk %s of %s)' % (query_chunk[0] + 1, query_chunk[1])
+        raise RuntimeError('blastn exited with status %s for %s%s against %s' % (blastn_exit_status, query_file, query_chunk_str, ','.join([os.path.basename(i) for i in pwd_blast_db_list])))
+    if blastn_unit is not None:
+        compress_file(pwd_blast_output_file, compression)
+        record_blastn_unit(blastn_unit, pwd_blast_output_file)
+
+
+def reassemble_blastn_worker(argument_list):
+    chunk_output_file_list = argument_list[0]
+    pwd_blast_result_file = argument_list[1]
+    max_target_seqs = argument_list[2]
+    blastn_unit = argument_list[3]
+    compression = argument_list[4]
+
+    # outputs of each query chunk (one per db shard) are joined in chunk order, hits of a query against
+    # all shards are cut to the best max_target_seqs subjects, as in a search against the whole db
+    missing_output_file_list = [i for j in chunk_output_file_list for i in j if not os.path.isfile(i)]
+    if len(missing_output_file_list) > 0:
+        raise RuntimeError('blastn results of query chunks not found, %s not reassembled: %s' % (os.path.basename(pwd_blast_result_file), ','.join([os.path.basename(i) for i in missing_output_file_list])))
+    with open_file('%s.tmp' % pwd_blast_result_file, 'w', compression) as blast_result_handle:
+        for shard_output_file_list in chunk_output_file_list:
+            if max_target_seqs is None:
+                for pwd_shard_output_file in shard_output_file_list:
+                    with open(pwd_shard_output_file) as shard_output_handle:
+                        shutil.copyfileobj(shard_output_handle, blast_result_handle)
+                continue
+
+            query_to_hits_dict = {}
+            query_list = []
+            for pwd_shard_output_file in shard_output_file_list:
+                for each_hit in open(pwd_shard_output_file):
+                    each_hit_split = each_hit.strip().split('\t')
+                    if len(each_hit_split) < 12:
+                        continue
+                    if each_hit_split[0] not in query_to_hits_dict:
+                        query_to_hits_dict[each_hit_split[0]] = {}
+                        query_list.append(each_hit_split[0])
+                    query_to_hits_dict[each_hit_split[0]].setdefault(each_hit_split[1], []).append(each_hit)
+
+            for query in query_list:
+                subject_to_hits_dict = query_to_hits_dict[query]
+                best_subject_list = sorted(subject_to_hits_dict, key=lambda i: (min([float(j.split('\t')[10]) for j in subject_to_hits_dict[i]]), -max([float(j.split('\t')[11]) for j in subject_to_hits_dict[i]])))
+                for subject in best_subject_list[:max_target_seqs]:
+                    blast_result_handle.writelines(subject_to_hits_dict[subject])
+    os.rename('%s.tmp' % pwd_blast_result_file, pwd_blast_result_file)
+    record_blastn_unit(blastn_unit, pwd_blast_result_file)
+
+    for shard_output_file_list in chunk_output_file_list:
+        for pwd_shard_output_file in shard_output_file_list:
+            os.remove(pwd_shard_output_file)
+
+
+def merge_blastn_results_worker(argument_list):
+    pwd_blast_result_file = argument_list[0]
+    pwd_added_blast_result_file = argument_list[1]
+    add_manifest_key = argument_list[2]
+    pwd_added_blast_db = argument_list[3]
+    compression = argument_list[4]
+
+    # hits against added genomes are appended once, the merged copy replaces previous results
+    unit_name = 'blastn_merge:%s' % os.path.basename(pwd_blast_result_file)
+    unit_hash = get_unit_hash(['blastn_merge', os.path.basename(pwd_added_blast_db)], [pwd_added_blast_db])
+    if get_finished_unit(add_manifest_key, unit_name, unit_hash) is not None:
+        return
+
+    concatenate_text_files([pwd_blast_result_file, pwd_added_blast_result_file], '%s.tmp' % pwd_blast_result_file, compression)
+    os.rename('%s.tmp' % pwd_blast_result_file, pwd_blast_result_file)
+    record_finished_unit(add_manifest_key, unit_name, unit_hash)
+
+
+def create_blastn_job_script(blastn_wd, job_script_folder, job_script_file_name, blastn_js_header, cmd):
 
     # Prepare header
     header_module_lines = read_in_job_script_header(blastn_js_header)
@@ -657,12 +992,6 @@ def create_blastn_job_script(blastn_wd, job_script_folder, job_script_file_name,
     output_file_handle.write('%s\n' % cmd)
     output_file_handle.close()
 
-    if qsub_on is True:
-        current_wd = os.getcwd()
-        os.chdir(job_script_folder)
-        os.system('qsub %s' % job_script_file_name)
-        os.chdir(current_wd)
-
 
 def read_in_job_script_header(job_script_header_example):
 
@@ -692,6 +1021,20 @@ def PI(args, config_dict):
     qsub_on =               args['qsub']
     noblast =               args['noblast']
     keep_tmp =              args['tmp']
+    tool_timeout_str =      args['timeout']
+    resume =                args['resume']
+    pwd_cache_folder =      args['cache']
+    cache_size_gb =         args['cache_size']
+    add_genomes =           args['add']
+    blastn_shard_num =      args['blastn_shards']
+    job_executor =          args['executor']
+    submit_cmd =            args['submit']
+    job_num =               args['jobs']
+    job_timeout =           args['job_timeout']
+    blastn_prefilter =      args['prefilter']
+    prefilter_seed_num =    args['prefilter_seeds']
+    prefilter_recall_num =  args['prefilter_recall']
+    compression =           args['compress']
 
     # read in config file
     path_to_hmm =           config_dict['path_to_hmm']
@@ -714,6 +1057,44 @@ def PI(args, config_dict):
         print('%s %s' % ((datetime.now().strftime('[%Y-%m-%d %H:%M:%S]')), "'-qsub_on' specified, please provide job script header with '-blastn_js_header'"))
         exit()
 
+    # with -qsub, job scripts are submitted by the batch executor, which waits for them to finish
+    if qsub_on is True:
+        job_executor = 'batch'
+    executor_setting_dict = get_executor_settings(job_executor, blastn_js_header, submit_cmd, job_num, num_threads, output_prefix, job_timeout)
+    executor_setting_error = check_executor_settings(executor_setting_dict)
+    if executor_setting_error is not None:
+        print('%s %s' % ((datetime.now().strftime('[%Y-%m-%d %H:%M:%S]')), executor_setting_error))
+        exit()
+
+    # otherwise job scripts of blastn are only written, to be submitted manually
+    write_blastn_js = (blastn_js_header is not None) and (job_executor == 'local')
+
+    if (add_genomes is True) and ((noblast is True) or (write_blastn_js is True)):
+        print('%s %s' % ((datetime.now().strftime('[%Y-%m-%d %H:%M:%S]')), "'-add' runs blastn for added genomes itself, it can not be used with '-noblast' or '-blastn_js_header'"))
+        exit()
+
+    if blastn_shard_num < 1:
+        print('%s %s' % ((datetime.now().strftime('[%Y-%m-%d %H:%M:%S]')), "'-blastn_shards' needs to be at least 1"))
+        exit()
+
+    if (blastn_prefilter is True) and ((noblast is True) or (write_blastn_js is True)):
+        print('%s %s' % ((datetime.now().strftime('[%Y-%m-%d %H:%M:%S]')), "'-prefilter' runs blastn itself, it can not be used with '-noblast' or '-blastn_js_header'"))
+        exit()
+
+    compression_error = check_compression(compression)
+    if compression_error is not None:
+        print('%s %s' % ((datetime.now().strftime('[%Y-%m-%d %H:%M:%S]')), compression_error))
+        exit()
+
+    # blastn commands for manual runs need uncompressed query files
+    if (compression is not None) and ((noblast is True) or (write_blastn_js is True)):
+        print('%s %s' % ((datetime.now().strftime('[%Y-%m-%d %H:%M:%S]')), "'-compress' can not be used with '-noblast' or '-blastn_js_header'"))
+        exit()
+
+    if (prefilter_seed_num < 1) or (prefilter_recall_num < 0):
+        print('%s %s' % ((datetime.now().strftime('[%Y-%m-%d %H:%M:%S]')), "'-prefilter_seeds' needs to be at least 1 and '-prefilter_recall' at least 0"))
+        exit()
+
     blastn_wd = os.getcwd()
     blast_parameters = '-evalue 1e-5 -outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore qlen slen" -task blastn -num_threads %s' % 1
 
@@ -743,6 +1124,10 @@ def PI(args, config_dict):
     MetaCHIP_wd =    '%s_MetaCHIP_wd'        % (output_prefix)
     pwd_log_folder = '%s/%s_log_files'       % (MetaCHIP_wd, output_prefix)
     pwd_log_file =   '%s/%s_%s_PI_%s.log'    % (pwd_log_folder, output_prefix, grouping_level, datetime.now().strftime('%Y-%m-%d_%Hh-%Mm-%Ss_%f'))
+    pwd_tool_run_log = '%s/%s_tool_runs.txt' % (pwd_log_folder, output_prefix)
+    pwd_checkpoint_manifest = '%s/%s_PI_checkpoints.txt' % (MetaCHIP_wd, output_prefix)
+    pwd_add_manifest = '%s/%s_PI_add_checkpoints.txt' % (MetaCHIP_wd, output_prefix)
+    pwd_blast_db_genome_file = '%s/%s_all_blastdb_genomes.txt' % (MetaCHIP_wd, output_prefix)
 
 
     # check whether input genome exist
@@ -758,10 +1143,26 @@ def PI(args, config_dict):
     # report running mode
     if grouping_only is True:
         report_and_log('running with grouping-only mode', pwd_log_file, keep_quiet)
+    elif add_genomes is True:
+        if not os.path.isfile(pwd_blast_db_genome_file):
+            print('%s %s' % ((datetime.now().strftime('[%Y-%m-%d %H:%M:%S]')), 'Genomes of previous runs not found in %s, please run PI without "-add" first' % MetaCHIP_wd))
+            exit()
+        create_missing_folder(pwd_log_folder)
+        report_and_log('Adding new genomes to: %s' % MetaCHIP_wd, pwd_log_file, keep_quiet)
+    elif resume is True:
+        create_missing_folder(MetaCHIP_wd)
+        create_missing_folder(pwd_log_folder)
+        report_and_log('Resuming from finished Prodigal, Hmmsearch and blastn runs recorded in: %s' % os.path.basename(pwd_checkpoint_manifest), pwd_log_file, keep_quiet)
     else:
         force_create_folder(MetaCHIP_wd)
         force_create_folder(pwd_log_folder)
 
+    # wall time, CPU time, peak RSS and exit status of external tools are recorded in the tool run log
+    set_tool_runner_settings(pwd_tool_run_log, parse_tool_timeouts(tool_timeout_str))
+
+    # outputs of Prodigal and blastn are reused from the result cache if provided
+    set_result_cache_settings(pwd_cache_folder, cache_size_gb)
+
 
     ############################################ read GTDB output into dict  ###########################################
 
@@ -877,8 +1278,13 @@ def PI(args, config_dict):
     blast_db_folder =                    '%s_all_blastdb'                       % (output_prefix)
     blast_results_file =                 '%s_all_all_vs_all_blastn.tab'         % (output_prefix)
     blast_result_folder =                '%s_all_blastn_results'                % (output_prefix)
+    hit_store_folder =                   '%s_all_blastn_hits'                   % (output_prefix)
     blast_cmd_file =                     '%s_all_blastn_commands.txt'           % (output_prefix)
+    id_table_file =                      '%s_id_table.npz'                      % (output_prefix)
     blast_job_scripts_folder =           '%s_all_blastn_job_scripts'            % (output_prefix)
+    blastn_prefilter_folder =            '%s_all_blastn_prefilter'              % (output_prefix)
+    prefilter_context_file =             '%s_all_blastn_prefilter_context.pkl'  % (output_prefix)
+    prefilter_recall_file =              '%s_all_blastn_prefilter_recall.txt'   % (output_prefix)
     grouping_file_name =                 '%s_%s%s_grouping.txt'                 % (output_prefix, grouping_level, group_num)
     grouping_plot_name =                 '%s_%s%s_grouping.png'                 % (output_prefix, grouping_level, group_num)
     excluded_genome_file_name =          '%s_%s%s_excluded_genomes.txt'         % (output_prefix, grouping_level, group_num)
@@ -916,8 +1322,14 @@ def PI(args, config_dict):
     pwd_hmm_profile_sep_folder =         '%s/%s/%s'                             % (MetaCHIP_wd, SCG_tree_wd, hmm_profile_sep_folder)
     pwd_newick_tree_file =               '%s/%s'                                % (MetaCHIP_wd, newick_tree_file)
     pwd_blast_result_folder =            '%s/%s'                                % (MetaCHIP_wd, blast_result_folder)
+    pwd_hit_store_folder =               '%s/%s'                                % (MetaCHIP_wd, hit_store_folder)
     pwd_blast_job_scripts_folder =       '%s/%s'                                % (MetaCHIP_wd, blast_job_scripts_folder)
     pwd_blast_cmd_file =                 '%s/%s'                                % (MetaCHIP_wd, blast_cmd_file)
+    pwd_id_table_file =                  '%s/%s'                                % (MetaCHIP_wd, id_table_file)
+    pwd_blastn_prefilter_folder =        '%s/%s'                                % (MetaCHIP_wd, blastn_prefilter_folder)
+    pwd_prefilter_context_file =         '%s/%s'                                % (MetaCHIP_wd, prefilter_context_file)
+    pwd_prefilter_recall_folder =        '%s/%s/recall'                         % (MetaCHIP_wd, blastn_prefilter_folder)
+    pwd_prefilter_recall_file =          '%s/%s'                                % (MetaCHIP_wd, prefilter_recall_file)
 
 
     ################################################### get grouping ###################################################
@@ -926,6 +1338,12 @@ def PI(args, config_dict):
         pwd_grouping_file = grouping_file
 
     else:
+
+        # grouping file of a previous run at the same rank may have a different number of groups
+        if add_genomes is True:
+            for previous_grouping_file in glob.glob('%s/%s_%s*_grouping.txt' % (MetaCHIP_wd, output_prefix, grouping_level)):
+                remove_path(previous_grouping_file)
+
         group_index_list = get_group_index_list()
         grouping_file_handle =                  open(pwd_grouping_file, 'w')
         excluded_genome_file_handle =           open(pwd_excluded_genome_file, 'w')
@@ -950,7 +1368,7 @@ def PI(args, config_dict):
         excluded_genome_file_handle.close()
 
         if ignored_genome_num == 0:
-            os.system('rm %s' % pwd_excluded_genome_file)
+            remove_path(pwd_excluded_genome_file)
 
         sleep(0.5)
         # for report and log
@@ -1050,164 +1468,387 @@ def PI(args, config_dict):
         report_and_log(('The size of input genomes exported to: %s' % genome_size_file_name), pwd_log_file, keep_quiet)
 
 
-    ######################################## run prodigal with multiprocessing #########################################
+    ############################ annotation, species tree and blastn as a per-genome task graph ##########################
+
+    # each genome goes through Prodigal, copying of its faa file and Hmmsearch on its own, the blast db is made once
+    # all genomes were annotated and blastn of each genome starts right after, while hmmalign and FastTree are running
+    force_create_folder(pwd_faa_folder)
+    if resume is True:
+
+        # hmmsearch tables are kept for resume, files derived from them are rewritten
+        create_missing_folder(pwd_SCG_tree_wd)
+        for SCG_tree_wd_file in os.listdir(pwd_SCG_tree_wd):
+            if not SCG_tree_wd_file.endswith('_hmmout.tbl'):
+                remove_path('%s/%s' % (pwd_SCG_tree_wd, SCG_tree_wd_file))
+    else:
+        force_create_folder(pwd_SCG_tree_wd)
+    force_create_folder(pwd_hmm_profile_sep_folder)
+
+    # finished units of work are recorded in the checkpoint manifest
+    checkpoint_manifest_key = open_checkpoint_manifest(pwd_checkpoint_manifest, resume, ['prodigal', 'hmmsearch', 'blastn'])
+
+    task_graph = create_task_graph()
+    prodigal_worker_output_list = []
+    prodigal_task_dict = {}
+    hmmsearch_task_list = []
 
     if grouping_only == False:
 
         # for report and log
-        report_and_log(('Running Prodigal with %s cores for all input genomes' % num_threads), pwd_log_file, keep_quiet)
+        report_and_log(('Running Prodigal, Hmmsearch and blastn with %s cores, each genome moves on once its previous step finished' % num_threads), pwd_log_file, keep_quiet)
 
-        # create prodigal output folder
-        force_create_folder(pwd_prodigal_output_folder)
+        # create prodigal output folder, outputs of finished units and previous genomes are kept for resume and -add
+        if (resume is True) or (add_genomes is True):
+            create_missing_folder(pwd_prodigal_output_folder)
+            create_missing_folder(pwd_blast_result_folder)
+            create_missing_folder(pwd_blast_db_folder)
+        else:
+            force_create_folder(pwd_prodigal_output_folder)
+            force_create_folder(pwd_blast_result_folder)
+            force_create_folder(pwd_blast_db_folder)
+            remove_path(pwd_hit_store_folder)
 
         # get input genome list
         input_genome_file_re = '%s/*.%s' % (input_genome_folder, file_extension)
         input_genome_file_name_list = [os.path.basename(file_name) for file_name in glob.glob(input_genome_file_re)]
+        input_genome_basename_list = sorted([os.path.splitext(i)[0] for i in input_genome_file_name_list])
+
+        # with -add, only genomes not in the blast db of previous runs are annotated and searched
+        blast_db_genome_dict = {}
+        if add_genomes is True:
+            blast_db_genome_dict = read_blast_db_genomes(pwd_blast_db_genome_file)
+            removed_genome_list = sorted(set(blast_db_genome_dict) - set(input_genome_basename_list))
+            if len(removed_genome_list) > 0:
+                report_and_log(('Genomes of previous runs not found in input folder, "-add" can not remove genomes: %s' % ','.join(removed_genome_list[:10])), pwd_log_file, keep_quiet)
+                exit()
+            unsearched_genome_list = [i for i in sorted(blast_db_genome_dict) if not os.path.isfile('%s/%s_blastn.tab' % (pwd_blast_result_folder, i))]
+            if len(unsearched_genome_list) > 0:
+                report_and_log(('Blastn results of previous genomes not found: %s' % ','.join(unsearched_genome_list[:10])), pwd_log_file, keep_quiet)
+                exit()
+            input_genome_file_name_list = [i for i in input_genome_file_name_list if os.path.splitext(i)[0] not in blast_db_genome_dict]
+            if len(input_genome_file_name_list) == 0:
+                report_and_log(('No new genomes found in %s, all of them were added before' % input_genome_folder), pwd_log_file, keep_quiet)
+                exit()
+            report_and_log(('Adding %s genomes to %s genomes of previous runs' % (len(input_genome_file_name_list), len(blast_db_genome_dict))), pwd_log_file, keep_quiet)
+
+            # genes of previous genomes are counted from the id table
+            previous_gene_num_dict = get_genome_gene_num_dict(load_id_table(pwd_id_table_file)) if os.path.isfile(pwd_id_table_file) else {}
+            for genome in sorted(blast_db_genome_dict):
+                if genome in previous_gene_num_dict:
+                    prodigal_worker_output_list.append((genome, previous_gene_num_dict[genome]))
+                else:
+                    prodigal_worker_output_list.append((genome, get_gene_num_from_ffn('%s/%s.ffn' % (pwd_prodigal_output_folder, genome))))
 
-        # prepare arguments for prodigal_worker
-        list_for_multiple_arguments_Prodigal = []
         for input_genome in input_genome_file_name_list:
-            list_for_multiple_arguments_Prodigal.append([input_genome, input_genome_folder, pwd_prodigal_exe, nonmeta_mode, pwd_prodigal_output_folder])
-
-        # run prodigal with multiprocessing
-        pool = mp.Pool(processes=num_threads)
-        pool.map(prodigal_worker, list_for_multiple_arguments_Prodigal)
-        pool.close()
-        pool.join()
-
-
-    ################ copy annotation files (with clear taxonomic classification) into separate folders #################
-
-    # for report and log
-    report_and_log(('Copying annotation files of qualified genomes to corresponding folders'), pwd_log_file, keep_quiet)
-
-    # create folder
-    #force_create_folder(pwd_ffn_folder)
-    force_create_folder(pwd_faa_folder)
-    #force_create_folder(pwd_gbk_folder)
-
-    # prepare arguments for copy_annotaion_worker
-    list_for_multiple_arguments_copy_annotaion = []
-    for genome in genomes_with_grouping:
-        list_for_multiple_arguments_copy_annotaion.append([genome,
-                                                           pwd_prodigal_output_folder,
-                                                           pwd_ffn_folder,
-                                                           pwd_faa_folder,
-                                                           pwd_gbk_folder])
+            input_genome_basename = os.path.splitext(input_genome)[0]
+            prodigal_task_dict[input_genome_basename] = 'prodigal_%s' % input_genome_basename
+            add_task(task_graph, prodigal_task_dict[input_genome_basename], prodigal_worker,
+                     [input_genome, input_genome_folder, pwd_prodigal_exe, nonmeta_mode, pwd_prodigal_output_folder, checkpoint_manifest_key, compression],
+                     callback=prodigal_worker_output_list.append)
+
+        # blast db is made from all genomes (split into shards of similar size with -blastn_shards), or added as a
+        # new volume with -add, the combined ffn file has all genomes
+        all_ffn_file_list = ['%s/%s.ffn' % (pwd_prodigal_output_folder, i) for i in sorted(set(blast_db_genome_dict) | set(prodigal_task_dict))]
+        if add_genomes is True:
+            blast_db_volume_list = ['%s_all_combined_ffn_add_%s.fasta' % (output_prefix, get_unit_hash(sorted(prodigal_task_dict))[:8])]
+
+            # volumes of genomes not in the blast db (e.g. from an interrupted -add with other genomes) are removed
+            blast_db_volume_set = set(blast_db_genome_dict.values()) | set(blast_db_volume_list)
+            for blast_db_file in os.listdir(pwd_blast_db_folder):
+                if len([i for i in blast_db_volume_set if blast_db_file.startswith(i)]) == 0:
+                    remove_path('%s/%s' % (pwd_blast_db_folder, blast_db_file))
+        elif min(blastn_shard_num, len(prodigal_task_dict)) > 1:
+            blast_db_volume_list = ['%s_all_combined_ffn_shard%s.fasta' % (output_prefix, i + 1) for i in range(min(blastn_shard_num, len(prodigal_task_dict)))]
+        else:
+            blast_db_volume_list = [combined_ffn_file]
+        pwd_blast_db_list = ['%s/%s' % (pwd_blast_db_folder, i) for i in blast_db_volume_list]
+        pwd_previous_blast_db_list = ['%s/%s' % (pwd_blast_db_folder, i) for i in sorted(set(blast_db_genome_dict.values()))]
+        blast_db_letter_num_list = []
+        minimizer_output_list = []
+        prefilter_output_dict = {}
+
+        def prodigal_finished(result):
+
+            report_and_log(('Prodigal finished for %s genomes' % len(prodigal_worker_output_list)), pwd_log_file, keep_quiet)
+
+            # genes, genomes and groups are encoded as integer ids in BM and PG
+            id_table = create_id_table(dict(prodigal_worker_output_list))
+            add_grouping_to_id_table(id_table, '%s%s' % (grouping_level, group_num), pwd_grouping_file)
+            save_id_table(id_table, pwd_id_table_file)
+            update_hit_store_genomes(pwd_hit_store_folder, id_table)
+
+            # new genomes are assigned to db volumes by size, the largest first to the smallest volume
+            volume_ffn_file_dict = {i: [] for i in pwd_blast_db_list}
+            volume_size_dict = {i: 0 for i in pwd_blast_db_list}
+            for genome in sorted(prodigal_task_dict, key=lambda i: -os.path.getsize('%s/%s.ffn' % (pwd_prodigal_output_folder, i))):
+                pwd_blast_db = min(pwd_blast_db_list, key=lambda i: (volume_size_dict[i], i))
+                volume_ffn_file_dict[pwd_blast_db].append('%s/%s.ffn' % (pwd_prodigal_output_folder, genome))
+                volume_size_dict[pwd_blast_db] += os.path.getsize('%s/%s.ffn' % (pwd_prodigal_output_folder, genome))
+                blast_db_genome_dict[genome] = os.path.basename(pwd_blast_db)
+
+            makeblastdb_task_list = []
+            for volume_index, pwd_blast_db in enumerate(pwd_blast_db_list):
+                makeblastdb_task_list.append('makeblastdb_%s' % os.path.basename(pwd_blast_db))
+                add_task(task_graph, makeblastdb_task_list[-1], makeblastdb_worker,
+                         [all_ffn_file_list if volume_index == 0 else None, pwd_combined_ffn_file, pwd_blast_db, pwd_makeblastdb_exe, sorted(volume_ffn_file_dict[pwd_blast_db]), len(pwd_blast_db_list) > 1, compression],
+                         callback=blast_db_letter_num_list.append)
+
+            # seeds of all genomes for the prefilter of blastn queries
+            minimizer_task_list = []
+            if blastn_prefilter is True:
+                for pwd_ffn_file in all_ffn_file_list:
+                    minimizer_task_list.append('minimizers_%s' % os.path.basename(pwd_ffn_file))
+                    add_task(task_graph, minimizer_task_list[-1], get_minimizers_worker, [pwd_ffn_file], callback=minimizer_output_list.append)
+            add_task(task_graph, 'makeblastdb', None, None, makeblastdb_task_list + minimizer_task_list, callback=makeblastdb_finished)
+
+        add_task(task_graph, 'prodigal_finished', None, None, sorted(prodigal_task_dict.values()), callback=prodigal_finished)
+
+        # added genomes are searched against all genomes and genomes of previous runs against the added genomes only,
+        # their hits are merged into previous results
+        ffn_file_list = ['%s.ffn' % i for i in sorted(prodigal_task_dict)]
+        previous_ffn_file_list = ['%s.ffn' % i for i in sorted(set(blast_db_genome_dict) - set(prodigal_task_dict))]
+        pwd_added_blast_result_folder = '%s_add' % pwd_blast_result_folder
+        pwd_blast_chunk_folder = '%s_chunks' % pwd_blast_result_folder
+        blast_job_list = [[i, pwd_previous_blast_db_list + pwd_blast_db_list, pwd_blast_result_folder] for i in ffn_file_list]
+        blast_job_list += [[i, pwd_blast_db_list, pwd_added_blast_result_folder] for i in previous_ffn_file_list]
+        pwd_blast_cmd_file_handle = open(pwd_blast_cmd_file, 'w')
+        for ffn_file, pwd_job_blast_db_list, pwd_job_result_folder in blast_job_list:
+            blastn_cmd = '%s -query %s/%s -db %s -out %s/%s %s' % (pwd_blastn_exe, pwd_prodigal_output_folder, ffn_file, get_blast_db_str(pwd_job_blast_db_list), pwd_job_result_folder, '%s_blastn.tab' % '.'.join(ffn_file.split('.')[:-1]), blast_parameters)
+            pwd_blast_cmd_file_handle.write('%s\n' % blastn_cmd)
+        pwd_blast_cmd_file_handle.close()
 
-    # copy annotaion files with multiprocessing
-    pool = mp.Pool(processes=num_threads)
-    pool.map(copy_annotaion_worker, list_for_multiple_arguments_copy_annotaion)
-    pool.close()
-    pool.join()
+        report_and_log(('Commands for running blastn exported to: %s' % blast_cmd_file), pwd_log_file, keep_quiet)
 
+        def makeblastdb_finished(result):
 
-    ########################################### get species tree (hmmsearch) ###########################################
+            if add_genomes is False:
+                write_blast_db_genomes(blast_db_genome_dict, pwd_blast_db_genome_file)
+            if (noblast is True) or (write_blastn_js is True):
+                return
 
-    # create wd
-    force_create_folder(pwd_SCG_tree_wd)
+            # searches of previous genomes are recorded in the manifest of the current -add until all hits were merged
+            add_manifest_key = None
+            if len(previous_ffn_file_list) > 0:
+                create_missing_folder(pwd_added_blast_result_folder)
+                add_manifest_key = open_checkpoint_manifest(pwd_add_manifest, True, [])
+            create_missing_folder(pwd_blast_chunk_folder)
 
-    # for report and log
-    report_and_log(('Running Hmmsearch with %s cores' % num_threads), pwd_log_file, keep_quiet)
+            # queries are split into chunks of similar size, searched against each db shard (with the size of the
+            # whole db for e-values as in an unsharded search) and reassembled into the blastn results of each genome
+            blast_db_size = sum(blast_db_letter_num_list) if len(pwd_blast_db_list) > 1 else None
+            query_chunk_size = max(sum([os.path.getsize('%s/%s' % (pwd_prodigal_output_folder, i[0])) for i in blast_job_list]) // (4 * num_threads), 1048576)
 
-    faa_file_re = '%s/*.faa' % pwd_faa_folder
-    faa_file_list = [os.path.basename(file_name) for file_name in glob.glob(faa_file_re)]
-    faa_file_list = sorted(faa_file_list)
+            def add_blastn_jobs(result):
 
-    faa_file_basename_list = []
-    for faa_file in faa_file_list:
-        faa_file_basename, faa_file_extension = os.path.splitext(faa_file)
-        faa_file_basename_list.append(faa_file_basename)
+                blastn_job_list = []
+                final_task_list = []
+                finished_genome_num = 0
+                recall_job_list = []
+                for ffn_file, pwd_job_blast_db_list, pwd_job_result_folder in blast_job_list:
+                    ffn_file_basename = '.'.join(ffn_file.split('.')[:-1])
+                    pwd_blast_result_file = '%s/%s_blastn.tab' % (pwd_job_result_folder, ffn_file_basename)
+
+                    # with prefilter, query genes with candidates are searched against the db restricted to their
+                    # candidate subjects, with the size of the whole db for e-values as in a search without prefilter
+                    pwd_query_folder = pwd_prodigal_output_folder
+                    shard_job_list = [[pwd_job_blast_db_list, blast_parameters]] if blast_db_size is None else [[[i], blast_parameters] for i in pwd_job_blast_db_list]
+                    job_blast_db_size = blast_db_size
+                    pwd_seqidlist_file_list = []
+                    if blastn_prefilter is True:
+                        pwd_query_folder = '%s/%s' % (pwd_blastn_prefilter_folder, os.path.basename(pwd_job_result_folder))
+                        pwd_seqidlist_file_list = ['%s/%s.seqidlist' % (pwd_query_folder, ffn_file_basename)]
+                        if blast_db_size is None:
+                            shard_job_list = [[pwd_job_blast_db_list, '%s -seqidlist %s' % (blast_parameters, pwd_seqidlist_file_list[0])]]
+                        else:
+
+                            # shards without candidate subjects are not searched
+                            shard_job_list = []
+                            for shard_index, pwd_shard_blast_db in enumerate(pwd_job_blast_db_list):
+                                pwd_shard_seqidlist_file = '%s/%s_shard%s.seqidlist' % (pwd_query_folder, ffn_file_basename, shard_index + 1)
+                                if os.path.getsize(pwd_shard_seqidlist_file) > 0:
+                                    shard_job_list.append([[pwd_shard_blast_db], '%s -seqidlist %s' % (blast_parameters, pwd_shard_seqidlist_file)])
+                        job_blast_db_size = sum([volume_letter_num_dict.get(os.path.basename(i), 0) for i in pwd_job_blast_db_list])
+
+                    blastn_unit = get_blastn_unit(ffn_file, pwd_query_folder, pwd_job_blast_db_list, blast_parameters, pwd_blastn_exe,
+                                                  checkpoint_manifest_key if pwd_job_result_folder == pwd_blast_result_folder else add_manifest_key, pwd_seqidlist_file_list)
+                    final_task = None
+                    if is_finished_blastn_unit(blastn_unit, pwd_blast_result_file) is True:
+                        finished_genome_num += 1
+                    elif (blastn_prefilter is True) and (prefilter_output_dict['%s/%s' % (pwd_query_folder, ffn_file)][2] == 0):
+
+                        # no candidate pairs
+                        open(pwd_blast_result_file, 'w').close()
+                        record_blastn_unit(blastn_unit, pwd_blast_result_file)
+                    else:
+                        ffn_file_size = os.path.getsize('%s/%s' % (pwd_query_folder, ffn_file))
+                        chunk_num = max(1, -(-ffn_file_size // query_chunk_size))
+                        if (chunk_num == 1) and (len(shard_job_list) == 1):
+                            final_task = 'blastn_%s_%s' % (os.path.basename(pwd_job_result_folder), ffn_file)
+                            blastn_job_list.append([ffn_file_size, final_task, [ffn_file, pwd_query_folder, shard_job_list[0][0], pwd_blast_result_file, shard_job_list[0][1], pwd_blastn_exe, blastn_unit, None, job_blast_db_size, compression]])
+                        else:
+                            chunk_output_file_list = []
+                            chunk_task_list = []
+                            for chunk_index in range(chunk_num):
+                                chunk_output_file_list.append([])
+                                for shard_index, (pwd_shard_db_list, shard_blast_parameters) in enumerate(shard_job_list):
+                                    chunk_output_file_name = '%s_%s_chunk%s_shard%s.tab' % (os.path.basename(pwd_job_result_folder), ffn_file_basename, chunk_index + 1, shard_index + 1)
+                                    chunk_output_file_list[-1].append('%s/%s' % (pwd_blast_chunk_folder, chunk_output_file_name))
+                                    chunk_task_list.append('blastn_%s' % chunk_output_file_name)
+                                    blastn_job_list.append([ffn_file_size // chunk_num, chunk_task_list[-1], [ffn_file, pwd_query_folder, pwd_shard_db_list, chunk_output_file_list[-1][-1], shard_blast_parameters, pwd_blastn_exe, None, [chunk_index, chunk_num], job_blast_db_size, None]])
+                            final_task = 'reassemble_%s_%s' % (os.path.basename(pwd_job_result_folder), ffn_file)
+                            add_task(task_graph, final_task, reassemble_blastn_worker,
+                                     [chunk_output_file_list, pwd_blast_result_file, get_max_target_seqs(blast_parameters) if len(shard_job_list) > 1 else None, blastn_unit, compression], chunk_task_list)
+
+                        # genomes sampled for the recall of the prefilter are also searched without it
+                        if (blastn_prefilter is True) and (len(recall_job_list) < prefilter_recall_num) and (pwd_job_result_folder == pwd_blast_result_folder):
+                            recall_job_list.append([ffn_file_basename, '%s/%s_blastn.tab' % (pwd_prefilter_recall_folder, ffn_file_basename), pwd_blast_result_file])
+                            blastn_job_list.append([os.path.getsize('%s/%s' % (pwd_prodigal_output_folder, ffn_file)), 'blastn_recall_%s' % ffn_file, [ffn_file, pwd_prodigal_output_folder, pwd_job_blast_db_list, recall_job_list[-1][1], blast_parameters, pwd_blastn_exe, None, None, None, None]])
+                            final_task_list.append('blastn_recall_%s' % ffn_file)
+
+                    # hits of previous genomes against added genomes
+                    if pwd_job_result_folder == pwd_added_blast_result_folder:
+                        add_task(task_graph, 'blastn_merge_%s' % ffn_file, merge_blastn_results_worker,
+                                 ['%s/%s_blastn.tab' % (pwd_blast_result_folder, ffn_file_basename), pwd_blast_result_file, add_manifest_key, pwd_blast_db_list[0], compression],
+                                 [] if final_task is None else [final_task])
+                        final_task = 'blastn_merge_%s' % ffn_file
+
+                    # blastn results are converted to the hit store read by BM
+                    pwd_main_blast_result_file = '%s/%s_blastn.tab' % (pwd_blast_result_folder, ffn_file_basename)
+                    if (final_task is not None) or (not is_current_hit_store_partition('%s/%s' % (pwd_hit_store_folder, ffn_file_basename), pwd_main_blast_result_file)):
+                        add_task(task_graph, 'hit_store_%s' % ffn_file, write_hit_store_partition_worker,
+                                 [pwd_main_blast_result_file, pwd_hit_store_folder, ffn_file_basename], [] if final_task is None else [final_task])
+                        final_task = 'hit_store_%s' % ffn_file
+                    if final_task is not None:
+                        final_task_list.append(final_task)
+
+                # largest jobs first, so that all cores (or jobs of the batch executor) are busy until the end
+                blastn_job_list = sorted(blastn_job_list, key=lambda i: -i[0])
+                if job_executor == 'local':
+                    for job_size, job_name, job_argument_list in blastn_job_list:
+                        add_task(task_graph, job_name, parallel_blastn_worker, job_argument_list)
+                    add_thread_budget_jobs(len(blastn_job_list))
+                else:
+
+                    # all jobs are submitted together, their tasks finish with the stage
+                    create_missing_folder(pwd_blast_job_scripts_folder)
+                    add_task(task_graph, 'blastn_jobs', run_tasks_worker, ['blastn', parallel_blastn_worker, [i[2] for i in blastn_job_list], pwd_blast_job_scripts_folder, executor_setting_dict])
+                    for job_size, job_name, job_argument_list in blastn_job_list:
+                        add_task(task_graph, job_name, None, None, ['blastn_jobs'])
+                report_and_log(('Running %s blastn jobs, results of %s genomes are reused' % (len(blastn_job_list), finished_genome_num)), pwd_log_file, keep_quiet)
+
+                def blastn_finished(result):
+
+                    # genomes of the current -add are in the blast db once all hits were merged
+                    if add_genomes is True:
+                        write_blast_db_genomes(blast_db_genome_dict, pwd_blast_db_genome_file)
+                        remove_path(pwd_added_blast_result_folder)
+                        remove_path(pwd_add_manifest)
+                    remove_path(pwd_blast_chunk_folder)
+                    report_and_log(('Blastn finished for all input genomes, blast results exported to: %s' % pwd_blast_result_folder), pwd_log_file, keep_quiet)
+
+                    # recall of the prefilter on gene pairs passing the default BM cutoffs
+                    if len(recall_job_list) > 0:
+                        recall_output_handle = open(pwd_prefilter_recall_file, 'w')
+                        recall_output_handle.write('Genome\tQualified_pairs\tRecovered_pairs\tRecall(%)\n')
+                        total_pair_num = 0
+                        total_recovered_pair_num = 0
+                        for genome_name, pwd_full_blast_result_file, pwd_prefiltered_blast_result_file in recall_job_list:
+                            pair_num, recovered_pair_num = get_prefilter_recall(pwd_full_blast_result_file, pwd_prefiltered_blast_result_file)
+                            recall_output_handle.write('%s\t%s\t%s\t%.2f\n' % (genome_name, pair_num, recovered_pair_num, recovered_pair_num * 100.0 / max(pair_num, 1)))
+                            total_pair_num += pair_num
+                            total_recovered_pair_num += recovered_pair_num
+                        recall_output_handle.write('Total\t%s\t%s\t%.2f\n' % (total_pair_num, total_recovered_pair_num, total_recovered_pair_num * 100.0 / max(total_pair_num, 1)))
+                        recall_output_handle.close()
+                        report_and_log(('Prefilter recovered %s of %s qualified gene pairs (%.2f%%) of %s sampled genomes, see %s' % (total_recovered_pair_num, total_pair_num, total_recovered_pair_num * 100.0 / max(total_pair_num, 1), len(recall_job_list), os.path.basename(pwd_prefilter_recall_file))), pwd_log_file, keep_quiet)
+                    if (blastn_prefilter is True) and (keep_tmp is False):
+                        remove_path(pwd_blastn_prefilter_folder)
+
+                add_task(task_graph, 'blastn_finished', None, None, final_task_list, callback=blastn_finished)
+
+            if blastn_prefilter is False:
+                add_blastn_jobs(None)
+                return
+
+            # candidate gene pairs of each query genome, with genomes in its blast db
+            prefilter_context, volume_letter_num_dict = create_prefilter_context(minimizer_output_list, load_id_table(pwd_id_table_file), blast_db_genome_dict)
+            prefilter_context_key = publish_worker_context(prefilter_context, pwd_prefilter_context_file)
+            create_missing_folder(pwd_blastn_prefilter_folder)
+            if prefilter_recall_num > 0:
+                create_missing_folder(pwd_prefilter_recall_folder)
+            prefilter_task_list = []
+            for ffn_file, pwd_job_blast_db_list, pwd_job_result_folder in blast_job_list:
+                ffn_file_basename = '.'.join(ffn_file.split('.')[:-1])
+                pwd_job_prefilter_folder = '%s/%s' % (pwd_blastn_prefilter_folder, os.path.basename(pwd_job_result_folder))
+                create_missing_folder(pwd_job_prefilter_folder)
+                shard_seqidlist_file_list = None
+                if blast_db_size is not None:
+                    shard_seqidlist_file_list = ['%s/%s_shard%s.seqidlist' % (pwd_job_prefilter_folder, ffn_file_basename, i + 1) for i in range(len(pwd_job_blast_db_list))]
+                prefilter_task_list.append('prefilter_%s_%s' % (os.path.basename(pwd_job_result_folder), ffn_file))
+                add_task(task_graph, prefilter_task_list[-1], prefilter_query_worker,
+                         ['%s/%s' % (pwd_prodigal_output_folder, ffn_file), '%s/%s' % (pwd_job_prefilter_folder, ffn_file), '%s/%s.seqidlist' % (pwd_job_prefilter_folder, ffn_file_basename),
+                          [os.path.basename(i) for i in pwd_job_blast_db_list], shard_seqidlist_file_list, prefilter_seed_num, prefilter_context_key],
+                         callback=lambda result: prefilter_output_dict.__setitem__(result[0], result[1]))
+
+            def prefilter_finished(result):
+                release_worker_context(prefilter_context_key)
+
+                # search space: query letters x db letters
+                prefilter_stat_list = [prefilter_output_dict['%s/%s/%s' % (pwd_blastn_prefilter_folder, os.path.basename(i[2]), i[0])] + [sum([volume_letter_num_dict.get(os.path.basename(j), 0) for j in i[1]])] for i in blast_job_list]
+                searched_space = sum([i[4] * i[5] for i in prefilter_stat_list])
+                full_search_space = sum([i[3] * i[6] for i in prefilter_stat_list])
+                report_and_log(('Prefilter kept %s of %s query genes with %s candidate gene pairs, %.2f%% of the blastn search space' % (sum([i[1] for i in prefilter_stat_list]), sum([i[0] for i in prefilter_stat_list]), sum([i[2] for i in prefilter_stat_list]), searched_space * 100.0 / max(full_search_space, 1))), pwd_log_file, keep_quiet)
+                add_blastn_jobs(result)
+
+            add_task(task_graph, 'prefilter', None, None, prefilter_task_list, callback=prefilter_finished)
 
-    # prepare arguments for hmmsearch_worker
-    list_for_multiple_arguments_hmmsearch = []
-    for faa_file_basename in faa_file_basename_list:
-        list_for_multiple_arguments_hmmsearch.append([faa_file_basename, pwd_SCG_tree_wd, pwd_hmmsearch_exe, path_to_hmm, pwd_faa_folder])
 
-    # run hmmsearch with multiprocessing
-    pool = mp.Pool(processes=num_threads)
-    pool.map(hmmsearch_worker, list_for_multiple_arguments_hmmsearch)
-    pool.close()
-    pool.join()
+    else:
 
+        # add grouping at current rank to id table
+        if os.path.isfile(pwd_id_table_file):
+            id_table = load_id_table(pwd_id_table_file)
+            add_grouping_to_id_table(id_table, '%s%s' % (grouping_level, group_num), pwd_grouping_file)
+            save_id_table(id_table, pwd_id_table_file)
 
-    ############################################# get species tree (hmmalign) #############################################
+        report_and_log(('Running Hmmsearch with %s cores' % num_threads), pwd_log_file, keep_quiet)
 
-    # for report and log
-    report_and_log(('Running Hmmalign with %s cores' % num_threads), pwd_log_file, keep_quiet)
+    # copy annotation files (with clear taxonomic classification) and run hmmsearch on them
+    for genome in sorted(genomes_with_grouping):
+        prodigal_task_list = [prodigal_task_dict[genome]] if genome in prodigal_task_dict else []
+        add_task(task_graph, 'copy_annotaion_%s' % genome, copy_annotaion_worker, [genome, pwd_prodigal_output_folder, pwd_ffn_folder, pwd_faa_folder, pwd_gbk_folder], prodigal_task_list)
+        hmmsearch_task_list.append('hmmsearch_%s' % genome)
+        add_task(task_graph, hmmsearch_task_list[-1], hmmsearch_worker, [genome, pwd_SCG_tree_wd, pwd_hmmsearch_exe, path_to_hmm, pwd_faa_folder, checkpoint_manifest_key], ['copy_annotaion_%s' % genome])
 
     # fetch combined hmm profiles
-    force_create_folder(pwd_hmm_profile_sep_folder)
-    sep_combined_hmm(path_to_hmm, pwd_hmm_profile_sep_folder, pwd_hmmfetch_exe, pwd_hmmstat_exe)
-
-    # Call hmmalign to align all single fasta files with hmms
-    files = os.listdir(pwd_SCG_tree_wd)
-    fastaFiles = [i for i in files if i.endswith('.fasta')]
-
-    # prepare arguments for hmmalign_worker
-    list_for_multiple_arguments_hmmalign = []
-    for fastaFile in fastaFiles:
-
-        fastaFiles_basename = '.'.join(fastaFile.split('.')[:-1])
-        list_for_multiple_arguments_hmmalign.append([fastaFiles_basename, pwd_SCG_tree_wd, pwd_hmm_profile_sep_folder, pwd_hmmalign_exe])
+    add_task(task_graph, 'sep_combined_hmm', sep_combined_hmm_worker, [path_to_hmm, pwd_hmm_profile_sep_folder, pwd_hmmfetch_exe, pwd_hmmstat_exe])
 
-    # run hmmalign with multiprocessing
-    pool = mp.Pool(processes=num_threads)
-    pool.map(hmmalign_worker, list_for_multiple_arguments_hmmalign)
-    pool.close()
-    pool.join()
+    def species_tree_finished(result):
+        report_and_log(('Species tree exported to: %s' % newick_tree_file), pwd_log_file, keep_quiet)
 
+    def hmmsearch_finished(result):
 
-    ################################### get species tree (Concatenating alignments) ####################################
-
-    # for report and log
-    report_and_log('Concatenating alignments', pwd_log_file, keep_quiet)
-
-    # concatenating the single alignments
-    concatAlignment = {}
-    for element in faa_file_basename_list:
-        concatAlignment[element] = ''
-
-    # Reading all single alignment files and append them to the concatenated alignment
-    files = os.listdir(pwd_SCG_tree_wd)
-    fastaFiles = [i for i in files if i.endswith('.fasta')]
-    for faa_file_basename in fastaFiles:
-        fastaFile = pwd_SCG_tree_wd + '/' + faa_file_basename
-        proteinSequence = {}
-        alignmentLength = 0
-        for seq_record_2 in SeqIO.parse(fastaFile, 'fasta'):
-            proteinName = seq_record_2.id
-            proteinSequence[proteinName] = str(seq_record_2.seq)
-            alignmentLength = len(proteinSequence[proteinName])
-
-        for element in faa_file_basename_list:
-            if element in proteinSequence.keys():
-                concatAlignment[element] += proteinSequence[element]
-            else:
-                concatAlignment[element] += '-' * alignmentLength
-
-    # writing alignment to file
-    file_out = open(pwd_combined_alignment_file_tmp, 'w')
-    for element in faa_file_basename_list:
-        file_out.write('>' + element + '\n' + concatAlignment[element] + '\n')
-    file_out.close()
-
-    # remove columns with low coverage and low consensus
-    report_and_log(('Removing columns from concatenated alignment represented by <%s%s of genomes and with an amino acid consensus <%s%s' % (minimal_cov_in_msa, '%', min_consensus_in_msa, '%')), pwd_log_file, keep_quiet)
-    remove_low_cov_and_consensus_columns(pwd_combined_alignment_file_tmp, minimal_cov_in_msa, min_consensus_in_msa, pwd_combined_alignment_file)
+        # for report and log
+        report_and_log(('Hmmsearch finished, running Hmmalign and FastTree'), pwd_log_file, keep_quiet)
 
+        faa_file_basename_list = sorted([os.path.splitext(os.path.basename(file_name))[0] for file_name in glob.glob('%s/*.faa' % pwd_faa_folder)])
 
-    ########################################### get species tree (fasttree) ############################################
+        # Call hmmalign to align all single fasta files with hmms
+        hmmalign_task_list = []
+        for fastaFile in [i for i in os.listdir(pwd_SCG_tree_wd) if i.endswith('.fasta')]:
+            fastaFiles_basename = '.'.join(fastaFile.split('.')[:-1])
+            hmmalign_task_list.append('hmmalign_%s' % fastaFiles_basename)
+            add_task(task_graph, hmmalign_task_list[-1], hmmalign_worker, [fastaFiles_basename, pwd_SCG_tree_wd, pwd_hmm_profile_sep_folder, pwd_hmmalign_exe])
 
-    # for report and log
-    report_and_log('Running FastTree', pwd_log_file, keep_quiet)
+        add_task(task_graph, 'species_tree', species_tree_worker,
+                 [faa_file_basename_list, pwd_SCG_tree_wd, pwd_combined_alignment_file_tmp, pwd_combined_alignment_file, minimal_cov_in_msa, min_consensus_in_msa, pwd_fasttree_exe, pwd_newick_tree_file],
+                 hmmalign_task_list, callback=species_tree_finished)
 
-    # calling fasttree for tree calculation
-    fasttree_cmd = '%s -quiet %s > %s 2>/dev/null' % (pwd_fasttree_exe, pwd_combined_alignment_file, pwd_newick_tree_file)
-    os.system(fasttree_cmd)
+    add_task(task_graph, 'hmmsearch_finished', None, None, hmmsearch_task_list + ['sep_combined_hmm'], callback=hmmsearch_finished)
 
-    # for report and log
-    report_and_log(('Species tree exported to: %s' % newick_tree_file), pwd_log_file, keep_quiet)
+    # hmmsearch, blastn and FastTree share the cores
+    pool = get_worker_pool(num_threads)
+    start_thread_budget(num_threads, len(hmmsearch_task_list) + 1)
+    run_task_graph(task_graph, pool)
 
 
     ################################################### run Usearch ####################################################
@@ -1240,55 +1881,19 @@ def PI(args, config_dict):
 
     if grouping_only == False:
 
-        # make blast db and run all vs all blastn
-        force_create_folder(pwd_blast_db_folder)
-        force_create_folder(pwd_blast_result_folder)
-
-        # run makeblastdb
-        os.system('cat %s/*.ffn > %s' % (pwd_prodigal_output_folder, pwd_combined_ffn_file))
-        os.system('cp %s %s' % (pwd_combined_ffn_file, pwd_blast_db_folder))
-        makeblastdb_cmd = '%s -in %s/%s -dbtype nucl -parse_seqids -logfile /dev/null' % (pwd_makeblastdb_exe, pwd_blast_db_folder, combined_ffn_file)
-        os.system(makeblastdb_cmd)
-
-        # prepare arguments list for parallel_blastn_worker
-        ffn_file_re = '%s/*.ffn' % pwd_prodigal_output_folder
-        ffn_file_list = [os.path.basename(file_name) for file_name in glob.glob(ffn_file_re)]
-        pwd_blast_db = '%s/%s' % (pwd_blast_db_folder, combined_ffn_file)
-
-        pwd_blast_cmd_file_handle = open(pwd_blast_cmd_file, 'w')
-        list_for_multiple_arguments_blastn = []
-        for ffn_file in ffn_file_list:
-
-            list_for_multiple_arguments_blastn.append([ffn_file, pwd_prodigal_output_folder, pwd_blast_db, pwd_blast_result_folder, blast_parameters, pwd_blastn_exe])
-            blastn_cmd = '%s -query %s/%s -db %s -out %s/%s %s' % (pwd_blastn_exe, pwd_prodigal_output_folder, ffn_file, pwd_blast_db, pwd_blast_result_folder, '%s_blastn.tab' % '.'.join(ffn_file.split('.')[:-1]), blast_parameters)
-            pwd_blast_cmd_file_handle.write('%s\n' % blastn_cmd)
-
-        pwd_blast_cmd_file_handle.close()
-
-        report_and_log(('Commands for running blastn exported to: %s' % blast_cmd_file), pwd_log_file, keep_quiet)
-
         if noblast is True:
             report_and_log(('All-vs-all blastn disabled, please run blastn with commands provided in: %s' % blast_cmd_file), pwd_log_file, keep_quiet)
-        else:
-            if blastn_js_header is not None:
 
-                # create job scripts folder
-                force_create_folder(pwd_blast_job_scripts_folder)
+        elif write_blastn_js is True:
 
-                for ffn_file in ffn_file_list:
-                    ffn_file_basename = '.'.join(ffn_file.split('.')[:-1])
-                    job_script_file_name = 'qsub_blastn_%s.sh' % ffn_file_basename
-                    blastn_cmd = '%s -query %s/%s -db %s -out %s/%s %s' % (pwd_blastn_exe, pwd_prodigal_output_folder, ffn_file, pwd_blast_db, pwd_blast_result_folder, '%s_blastn.tab' % ffn_file_basename, blast_parameters)
-                    create_blastn_job_script(blastn_wd, pwd_blast_job_scripts_folder, job_script_file_name, blastn_js_header, blastn_cmd, qsub_on)
+            # create job scripts folder
+            force_create_folder(pwd_blast_job_scripts_folder)
 
-            else:
-                report_and_log(('Running blastn for all input genomes with %s cores, blast results exported to: %s' % (num_threads, pwd_blast_result_folder)), pwd_log_file, keep_quiet)
-
-                # run blastn with multiprocessing
-                pool = mp.Pool(processes=num_threads)
-                pool.map(parallel_blastn_worker, list_for_multiple_arguments_blastn)
-                pool.close()
-                pool.join()
+            for ffn_file in ffn_file_list:
+                ffn_file_basename = '.'.join(ffn_file.split('.')[:-1])
+                job_script_file_name = 'qsub_blastn_%s.sh' % ffn_file_basename
+                blastn_cmd = '%s -query %s/%s -db %s -out %s/%s %s' % (pwd_blastn_exe, pwd_prodigal_output_folder, ffn_file, get_blast_db_str(pwd_previous_blast_db_list + pwd_blast_db_list), pwd_blast_result_folder, '%s_blastn.tab' % ffn_file_basename, blast_parameters)
+                create_blastn_job_script(blastn_wd, pwd_blast_job_scripts_folder, job_script_file_name, blastn_js_header, blastn_cmd)
 
 
     ############################################## remove temporary files ##############################################
@@ -1297,17 +1902,24 @@ def PI(args, config_dict):
     report_and_log(('Deleting temporary files'), pwd_log_file, keep_quiet)
 
     if keep_tmp is False:
-        os.system('rm -r %s' % pwd_faa_folder)
-        os.system('rm -r %s' % pwd_SCG_tree_wd)
+        remove_path(pwd_faa_folder)
+        remove_path(pwd_SCG_tree_wd)
         # os.remove(pwd_combined_faa_file)
         # os.system('rm -r %s' % pwd_blast_db_folder)
 
+    # least recently used entries are removed if the result cache grew over its size limit
+    removed_cache_entry_num, removed_cache_size = trim_result_cache()
+    if removed_cache_entry_num > 0:
+        report_and_log(('Removed %s entries (%.1fMB) from result cache' % (removed_cache_entry_num, removed_cache_size / 1024.0 / 1024.0)), pwd_log_file, keep_quiet)
+
 
     ############################################### for report and log file ##############################################
 
+    for tool_run_summary in get_tool_run_summary(pwd_tool_run_log):
+        report_and_log(tool_run_summary, pwd_log_file, True)
     report_and_log('PrepIn done!', pwd_log_file, keep_quiet)
 
-    if (grouping_only is False) and (blastn_js_header is not None) and (qsub_on is False):
+    if (grouping_only is False) and (write_blastn_js is True):
         report_and_log('Generated job scripts exported to %s, please submit them manually and start the BP step after all submitted jobs were finished' % pwd_blast_job_scripts_folder, pwd_log_file, False)
 
 
@@ -1328,9 +1940,23 @@ if __name__ == '__main__':
     parser.add_argument('-noblast',             required=False, action="store_true", help='not run all-vs-all blastn')
     parser.add_argument('-t',                   required=False, type=int, default=1, help='number of threads, default: 1')
     parser.add_argument('-blastn_js_header',    required=False,                      help='speed up all-against-all blastn with separated job script for each of the input genome, provide the job script header here')
-    parser.add_argument('-qsub',                required=False, action="store_true", help='specify to automatically submit generated job scripts, otherwise, submit them manually')
+    parser.add_argument('-blastn_shards',       required=False, type=int, default=1, help='split the blast db into shards of similar size, searched as separate jobs, default: 1')
+    parser.add_argument('-prefilter',           required=False, action="store_true", help='search query genes against candidate subjects sharing minimizer seeds only (needs BLAST+ 2.10 or later)')
+    parser.add_argument('-prefilter_seeds',     required=False, type=int, default=3, help='number of shared seeds for candidate gene pairs of -prefilter, default: 3')
+    parser.add_argument('-prefilter_recall',    required=False, type=int, default=2, help='number of genomes also searched without -prefilter to report its recall, default: 2')
+    parser.add_argument('-compress',            required=False, default=None,        help='compress prodigal outputs and blastn results, choose from gz and zst (needs zstd), default: no compression')
+    parser.add_argument('-qsub',                required=False, action="store_true", help='submit blastn job scripts and wait for them to finish (same as "-executor batch"), otherwise, submit them manually')
+    parser.add_argument('-executor',            required=False, default='local',    help='run blastn with local (default), batch (job scheduler, header from -blastn_js_header) or local_batch (job scripts run locally)')
+    parser.add_argument('-submit',              required=False, default='qsub',     help='command to submit job scripts, default: qsub')
+    parser.add_argument('-jobs',                required=False, type=int, default=50, help='number of blastn jobs (array elements) for batch executors, default: 50')
+    parser.add_argument('-job_timeout',         required=False, type=float, default=None, help='seconds after submission until an unfinished batch job is resubmitted (e.g. deleted while queued), jobs killed while running are detected without it, default: no limit')
     parser.add_argument('-quiet',               required=False, action="store_true", help='not report progress')
     parser.add_argument('-tmp',                 required=False, action="store_true", help='keep temporary files')
+    parser.add_argument('-timeout',             required=False, default=None,        help='timeout of external tools in seconds, e.g. blastn=86400,mafft=3600')
+    parser.add_argument('-resume',              required=False, action="store_true", help='skip Prodigal, Hmmsearch and blastn runs finished by a previous run')
+    parser.add_argument('-cache',               required=False, default=None,        help='folder of the result cache shared by runs')
+    parser.add_argument('-cache_size',          required=False, type=float, default=50, help='size limit of the result cache in GB, default: 50')
+    parser.add_argument('-add',                 required=False, action="store_true", help='add new genomes in input folder to a previous run, only searches involving them are run')
 
     args = vars(parser.parse_args())
 
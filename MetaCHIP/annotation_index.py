@@ -0,0 +1,139 @@
+import numpy as np
+from Bio import SeqIO
+from MetaCHIP.compressed_io import open_file
+
+
+# Each genome annotated by prodigal_parser gets two files in the prodigal output folder:
+# <genome>.seq  contig sequences concatenated without separators, a slice is read with one seek
+# <genome>.idx  npz with contig name/offset/length and the gene coordinates sorted by contig and start
+#
+# gene coordinates are kept as in the gbk files (FeatureLocation start and end), genes are identified by
+# the number of their locus tag (genome_00001 -> 1).
+
+
+def save_annotation_index(pwd_index_file, pwd_seq_file, contig_name_list, contig_seq_list, gene_coordinate_list):
+
+    # gene_coordinate_list: [[gene_number, contig_index, start, end, strand], ...]
+    contig_length = np.array([len(i) for i in contig_seq_list], dtype=np.int64)
+    contig_offset = np.r_[0, np.cumsum(contig_length)[:-1]].astype(np.int64)
+
+    with open(pwd_seq_file, 'w') as seq_file_handle:
+        for contig_seq in contig_seq_list:
+            seq_file_handle.write(contig_seq)
+
+    gene_coordinate_array = np.array(gene_coordinate_list, dtype=np.int64).reshape(-1, 5)
+    gene_order = np.lexsort((gene_coordinate_array[:, 2], gene_coordinate_array[:, 1]))
+    gene_coordinate_array = gene_coordinate_array[gene_order]
+
+    with open(pwd_index_file, 'wb') as index_file_handle:
+        np.savez(index_file_handle,
+                 contig_name=np.array(contig_name_list, dtype=str),
+                 contig_offset=contig_offset,
+                 contig_length=contig_length,
+                 gene_number=gene_coordinate_array[:, 0].astype(np.int32),
+                 gene_contig=gene_coordinate_array[:, 1].astype(np.int32),
+                 gene_start=gene_coordinate_array[:, 2],
+                 gene_end=gene_coordinate_array[:, 3],
+                 gene_strand=gene_coordinate_array[:, 4].astype(np.int8))
+
+
+def build_annotation_index_from_gbk(pwd_gbk_file, pwd_index_file, pwd_seq_file):
+
+    # for prodigal outputs produced before the index was introduced
+    contig_name_list = []
+    contig_seq_list = []
+    gene_coordinate_list = []
+    with open_file(pwd_gbk_file) as gbk_handle:
+        for contig_index, contig_record in enumerate(SeqIO.parse(gbk_handle, 'genbank')):
+            contig_name_list.append(contig_record.id)
+            contig_seq_list.append(str(contig_record.seq))
+            for gene in contig_record.features:
+                if 'locus_tag' in gene.qualifiers:
+                    gene_number = int(gene.qualifiers['locus_tag'][0].split('_')[-1])
+                    gene_coordinate_list.append([gene_number, contig_index, int(gene.location.start), int(gene.location.end), gene.location.strand])
+
+    save_annotation_index(pwd_index_file, pwd_seq_file, contig_name_list, contig_seq_list, gene_coordinate_list)
+
+
+def load_annotation_index(pwd_index_file):
+    with np.load(pwd_index_file) as index_npz:
+        annotation_index = {each_key: index_npz[each_key] for each_key in index_npz.files}
+    return annotation_index
+
+
+def get_gene_row(annotation_index, gene_number):
+
+    gene_number_array = annotation_index['gene_number']
+    gene_row = int(np.searchsorted(gene_number_array, gene_number))
+    if (gene_row == len(gene_number_array)) or (gene_number_array[gene_row] != gene_number):
+
+        # genes are not numbered in contig and start order
+        gene_row_list = np.flatnonzero(gene_number_array == gene_number)
+        if len(gene_row_list) == 0:
+            return None
+        gene_row = int(gene_row_list[0])
+
+    return gene_row
+
+
+def read_contig_sequence(pwd_seq_file, annotation_index, contig_index, start=0, end=None):
+
+    contig_length = int(annotation_index['contig_length'][contig_index])
+    if end is None:
+        end = contig_length
+    start = max(0, start)
+    end = min(end, contig_length)
+
+    with open(pwd_seq_file, 'rb') as seq_file_handle:
+        seq_file_handle.seek(int(annotation_index['contig_offset'][contig_index]) + start)
+        contig_seq = seq_file_handle.read(max(0, end - start))
+
+    return contig_seq.decode()
+
+
+def get_flanking_window(annotation_index, gene_number, flanking_length):
+
+    # same boundaries as extending the gene by flanking_length on both sides and then including genes
+    # overlapping the boundaries in gbk feature order, but only the genes around the window are visited
+    gene_row = get_gene_row(annotation_index, gene_number)
+    if gene_row is None:
+        return None
+
+    contig_index = int(annotation_index['gene_contig'][gene_row])
+    contig_length = int(annotation_index['contig_length'][contig_index])
+    new_start = max(int(annotation_index['gene_start'][gene_row]) - flanking_length, 0)
+    new_end = min(int(annotation_index['gene_end'][gene_row]) + flanking_length, contig_length)
+
+    # rows of genes on the same contig
+    contig_row_start = int(np.searchsorted(annotation_index['gene_contig'], contig_index, side='left'))
+    contig_row_end = int(np.searchsorted(annotation_index['gene_contig'], contig_index, side='right'))
+    gene_start_array = annotation_index['gene_start'][contig_row_start:contig_row_end]
+    gene_end_array = annotation_index['gene_end'][contig_row_start:contig_row_end]
+
+    # genes before the first one reaching new_start can not change the window
+    first_row = int(np.searchsorted(np.maximum.accumulate(gene_end_array), new_start, side='left'))
+
+    kept_row_list = []
+    for row in range(first_row, len(gene_start_array)):
+        gene_start = int(gene_start_array[row])
+        gene_end = int(gene_end_array[row])
+        if gene_start > new_end:
+            break
+        if (gene_start < new_start) and (gene_end >= new_start):
+            kept_row_list.append(contig_row_start + row)
+            new_start = gene_start
+        elif (gene_start > new_start) and (gene_end < new_end):
+            kept_row_list.append(contig_row_start + row)
+        elif (gene_start <= new_end) and (gene_end > new_end):
+            kept_row_list.append(contig_row_start + row)
+            new_end = gene_end
+
+    flanking_window = {'gene_row':      gene_row,
+                       'contig_index':  contig_index,
+                       'contig_name':   str(annotation_index['contig_name'][contig_index]),
+                       'contig_length': contig_length,
+                       'start':         new_start,
+                       'end':           new_end,
+                       'kept_gene_row': np.array(kept_row_list, dtype=np.int64)}
+
+    return flanking_window
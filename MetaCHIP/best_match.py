@@ -0,0 +1,221 @@
+import numpy as np
+from MetaCHIP.hit_store import is_current_hit_store_partition, write_hit_store_partition, read_qualified_hits
+from MetaCHIP.identity_histogram import get_identity_histograms, merge_identity_histograms
+from MetaCHIP.id_table import get_genome_of_genes
+from MetaCHIP.worker_pool import get_worker_context
+
+
+# qualified hits are kept as integer ids, see id_table.py
+BM_hit_column_list = ['query', 'subject', 'pident', 'query_group', 'subject_group']
+
+
+def empty_BM_hits():
+    return {'query':         np.array([], dtype=np.int32),
+            'subject':       np.array([], dtype=np.int32),
+            'pident':        np.array([], dtype=np.float64),
+            'query_group':   np.array([], dtype=np.int32),
+            'subject_group': np.array([], dtype=np.int32)}
+
+
+def concatenate_BM_hits(hits_list):
+
+    hits_list = [i for i in hits_list if len(i['query']) > 0]
+    if len(hits_list) == 0:
+        return empty_BM_hits()
+    if len(hits_list) == 1:
+        return hits_list[0]
+
+    return {each_column: np.concatenate([i[each_column] for i in hits_list]) for each_column in hits_list[0]}
+
+
+def concatenate_multi_rank_BM_hits(worker_output_list, rank_num):
+
+    # qualified hits of all genomes and, for each rank, the index of its hits in them with the merged identity histograms
+    base_hits = concatenate_BM_hits([i[0] for i in worker_output_list])
+    rank_hit_index_list = []
+    rank_histogram_dict_list = []
+    for rank_index in range(rank_num):
+        hit_index_list = []
+        hit_offset = 0
+        for base_hits_of_genome, rank_output_list in worker_output_list:
+            hit_index_list.append(rank_output_list[rank_index][0] + hit_offset)
+            hit_offset += len(base_hits_of_genome['query'])
+        rank_hit_index_list.append(np.concatenate(hit_index_list) if len(hit_index_list) > 0 else np.array([], dtype=np.int64))
+        rank_histogram_dict_list.append(merge_identity_histograms([i[1][rank_index][1] for i in worker_output_list]))
+
+    return base_hits, rank_hit_index_list, rank_histogram_dict_list
+
+
+def get_rank_BM_hits(base_hits, rank_hit_index, id_table, genome_group_array):
+
+    # BM hits of one rank, with group of query and subject genomes
+    hits = {'query':   base_hits['query'][rank_hit_index],
+            'subject': base_hits['subject'][rank_hit_index],
+            'pident':  base_hits['pident'][rank_hit_index]}
+    hits['query_group'] = genome_group_array[get_genome_of_genes(id_table, hits['query'])].astype(np.int32)
+    hits['subject_group'] = genome_group_array[get_genome_of_genes(id_table, hits['subject'])].astype(np.int32)
+
+    return hits
+
+
+def get_genome_sort_rank(id_table, name_to_group_number_dict):
+
+    # rank of genomes by their group index id (e.g. A_1), subjects are ordered by "group_id|subject"
+    genome_name_list = id_table['genome_name'].tolist()
+    genome_key_list = [name_to_group_number_dict.get(i, '') for i in genome_name_list]
+    genome_sort_rank = np.zeros(len(genome_name_list), dtype=np.int32)
+    genome_sort_rank[np.argsort(np.array(genome_key_list, dtype=str), kind='mergesort')] = np.arange(len(genome_name_list), dtype=np.int32)
+
+    return genome_sort_rank
+
+
+def get_group_pair_names(query_group_array, subject_group_array, group_name_array):
+
+    # group pair named by groups sorted in alphabet order, group names are sorted in id table
+    group_num = len(group_name_array)
+    group_pair_key = np.minimum(query_group_array, subject_group_array).astype(np.int64) * group_num + np.maximum(query_group_array, subject_group_array)
+    uniq_group_pair_key, group_pair_index = np.unique(group_pair_key, return_inverse=True)
+    uniq_group_pair_name = np.array(['%s_%s' % (group_name_array[i // group_num], group_name_array[i % group_num]) for i in uniq_group_pair_key.tolist()], dtype=str)
+
+    return uniq_group_pair_name[group_pair_index.reshape(-1)]
+
+
+def get_BM_hits_worker(argument_list):
+    pwd_blast_results = argument_list[0]
+    pwd_hit_store_folder = argument_list[1]
+    genome_name = argument_list[2]
+    align_len_cutoff = argument_list[3]
+    cover_cutoff = argument_list[4]
+    worker_context = get_worker_context(argument_list[5])
+    id_table = worker_context['id_table']
+    store_genome_table = worker_context['hit_store_genomes']
+    genome_group_array_list = worker_context['genome_group_array_list']
+    group_name_array_list = worker_context['group_name_array_list']
+    genome_sort_rank_list = worker_context['genome_sort_rank_list']
+
+    # blastn results of one genome are converted to the hit store once (see hit_store.py) and read once for all
+    # ranks, qualified hits are kept as integer ids, filtering by alignment length and coverage does not depend on rank
+    pwd_partition_folder = '%s/%s' % (pwd_hit_store_folder, genome_name)
+    if not is_current_hit_store_partition(pwd_partition_folder, pwd_blast_results):
+        write_hit_store_partition(pwd_blast_results, pwd_partition_folder, store_genome_table, genome_name)
+    qualified_hits = read_qualified_hits(pwd_hit_store_folder, genome_name, store_genome_table, id_table, align_len_cutoff, cover_cutoff)
+    query_array = qualified_hits['query']
+    subject_array = qualified_hits['subject']
+    query_genome_array = get_genome_of_genes(id_table, query_array)
+    subject_genome_array = get_genome_of_genes(id_table, subject_array)
+
+    # only work on genomes with clear taxonomic classification at one of the ranks at least
+    grouped = np.zeros(len(query_array), dtype=bool)
+    for genome_group_array in genome_group_array_list:
+        grouped |= (query_array >= 0) & (subject_array >= 0) & (genome_group_array[query_genome_array] >= 0) & (genome_group_array[subject_genome_array] >= 0)
+    hits = {'query':   query_array[grouped],
+            'subject': subject_array[grouped],
+            'pident':  qualified_hits['pident'][grouped]}
+    subject_genome_array = get_genome_of_genes(id_table, hits['subject'])
+
+    rank_output_list = []
+    for genome_group_array, group_name_array, genome_sort_rank in zip(genome_group_array_list, group_name_array_list, genome_sort_rank_list):
+        query_group_array = genome_group_array[get_genome_of_genes(id_table, hits['query'])]
+        subject_group_array = genome_group_array[subject_genome_array]
+        rank_hit_index = np.flatnonzero((query_group_array >= 0) & (subject_group_array >= 0))
+
+        # subjects of each query ordered by "group_id|subject"
+        if len(rank_hit_index) > 1:
+            rank_hit_index = rank_hit_index[np.lexsort((hits['subject'][rank_hit_index], genome_sort_rank[subject_genome_array[rank_hit_index]], hits['query'][rank_hit_index]))]
+
+        # partial identity histograms of each group pair
+        identity_histogram_dict = {}
+        if len(rank_hit_index) > 0:
+            identity_histogram_dict = get_identity_histograms(get_group_pair_names(query_group_array[rank_hit_index], subject_group_array[rank_hit_index], group_name_array), hits['pident'][rank_hit_index])
+        rank_output_list.append((rank_hit_index.astype(np.int64), identity_histogram_dict))
+
+    return hits, rank_output_list
+
+
+def get_segment_starts(sorted_key_array):
+    if len(sorted_key_array) == 0:
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.r_[True, sorted_key_array[1:] != sorted_key_array[:-1]])
+
+
+def get_BM_candidates(hits, group_name_array, group_pair_iden_cutoff_dict):
+
+    # hits of each query need to be consecutive and subjects ordered as in get_BM_hits_worker
+    # for each query with both self-group and non-self-group subjects, the non-self-group with the
+    # highest average identity is the candidate donor group if its average is higher than that of
+    # the self-group, its best subject is reported if the identity passes the group pair cutoff
+    hit_num = len(hits['query'])
+    empty_candidates = (np.array([], dtype=np.int32), np.array([], dtype=np.int32), np.array([], dtype=np.float64))
+    if hit_num == 0:
+        return empty_candidates
+
+    group_num = len(group_name_array)
+    query_group_index = hits['query_group'].astype(np.int64)
+    subject_group_index = hits['subject_group'].astype(np.int64)
+    identity_array = hits['pident']
+
+    # per query statistics of self-group subjects
+    query_starts = get_segment_starts(hits['query'])
+    query_start_mark = np.zeros(hit_num, dtype=np.int64)
+    query_start_mark[query_starts] = 1
+    query_ordinal = np.cumsum(query_start_mark) - 1
+    is_self_group = query_group_index == subject_group_index
+    sg_subject_number = np.add.reduceat(is_self_group.astype(np.int64), query_starts)
+    sg_sum = np.add.reduceat(np.where(is_self_group, identity_array, 0), query_starts)
+    sg_average = sg_sum / np.maximum(sg_subject_number, 1)
+
+    # per query and non-self-group statistics, stable sort keeps the subject order within groups
+    nsg_hit_index = np.flatnonzero(~is_self_group)
+    if len(nsg_hit_index) == 0:
+        return empty_candidates
+    nsg_key = query_ordinal[nsg_hit_index] * group_num + subject_group_index[nsg_hit_index]
+    nsg_order = np.argsort(nsg_key, kind='mergesort')
+    nsg_hit_index = nsg_hit_index[nsg_order]
+    nsg_key = nsg_key[nsg_order]
+    nsg_starts = get_segment_starts(nsg_key)
+    nsg_subject_number = np.diff(np.r_[nsg_starts, len(nsg_key)])
+    nsg_identity = identity_array[nsg_hit_index]
+    nsg_average = np.add.reduceat(nsg_identity, nsg_starts) / nsg_subject_number
+    nsg_maximum = np.maximum.reduceat(nsg_identity, nsg_starts)
+    nsg_first_hit = nsg_hit_index[nsg_starts]
+    nsg_query = nsg_key[nsg_starts] // group_num
+
+    # the first subject reaching the maximum identity of each group
+    segment_index = np.repeat(np.arange(len(nsg_starts)), nsg_subject_number)
+    at_maximum = np.flatnonzero(nsg_identity == nsg_maximum[segment_index])
+    nsg_maximum_hit = nsg_hit_index[at_maximum[np.unique(segment_index[at_maximum], return_index=True)[1]]]
+
+    # the group with highest average, ties go to the group seen first
+    group_order = np.lexsort((nsg_first_hit, -nsg_average, nsg_query))
+    best_group = group_order[np.r_[True, nsg_query[group_order][1:] != nsg_query[group_order][:-1]]]
+
+    best_query = nsg_query[best_group]
+    qualified = sg_subject_number[best_query] > 0
+    qualified &= nsg_average[best_group] > sg_average[best_query]
+
+    # filter with obtained identity cut-off
+    cutoff_matrix = np.full((group_num, group_num), np.nan)
+    for i in range(group_num):
+        for j in range(group_num):
+            qg_sg = '%s_%s' % (group_name_array[i], group_name_array[j])
+            if qg_sg in group_pair_iden_cutoff_dict:
+                cutoff_matrix[i, j] = group_pair_iden_cutoff_dict[qg_sg]
+    candidate_hit = nsg_maximum_hit[best_group]
+    with np.errstate(invalid='ignore'):
+        qualified &= identity_array[candidate_hit] >= cutoff_matrix[query_group_index[candidate_hit], subject_group_index[candidate_hit]]
+    candidate_hit = np.sort(candidate_hit[qualified])
+
+    return hits['query'][candidate_hit], hits['subject'][candidate_hit], identity_array[candidate_hit]
+
+
+def get_query_to_subjects(hits, query_set):
+
+    # query_set and returned dict are keyed by integer gene ids
+    query_to_subjects_dict = {}
+    query_starts = get_segment_starts(hits['query'])
+    query_ends = np.r_[query_starts[1:], len(hits['query'])].astype(np.int64)
+    for query, query_start, query_end in zip(hits['query'][query_starts].tolist(), query_starts.tolist(), query_ends.tolist()):
+        if query in query_set:
+            query_to_subjects_dict[query] = hits['subject'][query_start:query_end].tolist()
+
+    return query_to_subjects_dict
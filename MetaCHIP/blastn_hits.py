@@ -0,0 +1,173 @@
+import numpy as np
+from MetaCHIP.compressed_io import open_file
+
+
+# column layout of blastn -outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore qlen slen"
+blastn_column_list = ['qseqid', 'sseqid', 'pident', 'length', 'mismatch', 'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore', 'qlen', 'slen']
+
+blastn_column_type_dict = {'pident':   np.float64,
+                           'length':   np.int32,
+                           'mismatch': np.int32,
+                           'gapopen':  np.int32,
+                           'qstart':   np.int32,
+                           'qend':     np.int32,
+                           'sstart':   np.int32,
+                           'send':     np.int32,
+                           'evalue':   np.float64,
+                           'bitscore': np.float64,
+                           'qlen':     np.int32,
+                           'slen':     np.int32}
+
+
+def get_genome_names(gene_id_array):
+
+    # gene ids are locus tags (genome_00001), map each unique id only once
+    if len(gene_id_array) == 0:
+        return np.array([], dtype=gene_id_array.dtype)
+
+    uniq_id_array, uniq_id_index = np.unique(gene_id_array, return_inverse=True)
+    uniq_genome_array = np.char.rpartition(uniq_id_array, '_')[:, 0]
+
+    return uniq_genome_array[uniq_id_index.reshape(-1)]
+
+
+def empty_blastn_hits(keep_text=False):
+
+    hits = {}
+    for each_column in blastn_column_list:
+        hits[each_column] = np.array([], dtype=blastn_column_type_dict.get(each_column, str))
+    hits['query_genome'] = np.array([], dtype=str)
+    hits['subject_genome'] = np.array([], dtype=str)
+    if keep_text is True:
+        hits['text'] = np.empty((0, len(blastn_column_list)), dtype=str)
+
+    return hits
+
+
+def parse_blastn_lines(line_list, keep_text=False):
+
+    if len(line_list) == 0:
+        return empty_blastn_hits(keep_text)
+
+    # split the whole block at once, sequence ids never contain white spaces
+    token_array = np.array(''.join(line_list).split())
+    column_num = len(blastn_column_list)
+    if len(token_array) != len(line_list) * column_num:
+        print('Unexpected blastn output format, expect %s columns: %s' % (column_num, ' '.join(blastn_column_list)))
+        exit()
+    token_array = token_array.reshape(len(line_list), column_num)
+
+    hits = {}
+    for column_index, each_column in enumerate(blastn_column_list):
+        if each_column in blastn_column_type_dict:
+            hits[each_column] = token_array[:, column_index].astype(blastn_column_type_dict[each_column])
+        else:
+            hits[each_column] = token_array[:, column_index]
+
+    hits['query_genome'] = get_genome_names(hits['qseqid'])
+    hits['subject_genome'] = get_genome_names(hits['sseqid'])
+    if keep_text is True:
+        hits['text'] = token_array
+
+    return hits
+
+
+def subset_blastn_hits(hits, index_or_mask):
+    return {each_column: hits[each_column][index_or_mask] for each_column in hits}
+
+
+def concatenate_blastn_hits(hits_list, keep_text=False):
+
+    if len(hits_list) == 0:
+        return empty_blastn_hits(keep_text)
+    if len(hits_list) == 1:
+        return hits_list[0]
+
+    return {each_column: np.concatenate([i[each_column] for i in hits_list]) for each_column in hits_list[0]}
+
+
+def get_qualified_hit_mask(hits, align_len_cutoff, cover_cutoff, genome_name_list):
+
+    align_len = hits['length']
+
+    # first filter with alignment length
+    qualified_mask = align_len >= int(align_len_cutoff)
+
+    # then remove within genome hits
+    qualified_mask &= hits['query_genome'] != hits['subject_genome']
+
+    # then coverage cutoff
+    qualified_mask &= (align_len * 100.0 / hits['qlen']) >= int(cover_cutoff)
+    qualified_mask &= (align_len * 100.0 / hits['slen']) >= int(cover_cutoff)
+
+    # only work on genomes with clear taxonomic classification
+    if genome_name_list is not None:
+        genome_name_array = np.array(list(genome_name_list))
+        qualified_mask &= np.isin(hits['query_genome'], genome_name_array)
+        qualified_mask &= np.isin(hits['subject_genome'], genome_name_array)
+
+    return qualified_mask
+
+
+def collapse_duplicate_hsps(hits):
+
+    # keep only the first (best scoring) HSP of each query-subject pair, hits order is kept
+    hit_num = len(hits['qseqid'])
+    if hit_num < 2:
+        return hits
+
+    query_uniq_index = np.unique(hits['qseqid'], return_inverse=True)[1].reshape(-1).astype(np.int64)
+    subject_uniq, subject_uniq_index = np.unique(hits['sseqid'], return_inverse=True)
+    pair_key = query_uniq_index * len(subject_uniq) + subject_uniq_index.reshape(-1)
+    first_index = np.sort(np.unique(pair_key, return_index=True)[1])
+
+    if len(first_index) == hit_num:
+        return hits
+
+    return subset_blastn_hits(hits, first_index)
+
+
+def read_blastn_hits(pwd_blast_results, align_len_cutoff=None, cover_cutoff=None, genome_name_list=None, collapse_hsps=True, keep_text=False, chunk_size=200000):
+
+    # yield typed column arrays, each chunk holds all hits of the queries it covers,
+    # as blastn output is grouped by query
+    if genome_name_list is not None:
+        genome_name_list = set(genome_name_list)
+
+    def process(line_list):
+        hits = parse_blastn_lines(line_list, keep_text)
+        if align_len_cutoff is not None:
+            hits = subset_blastn_hits(hits, get_qualified_hit_mask(hits, align_len_cutoff, cover_cutoff, genome_name_list))
+        if collapse_hsps is True:
+            hits = collapse_duplicate_hsps(hits)
+        return hits
+
+    line_list = []
+    current_query = ''
+    with open_file(pwd_blast_results) as blast_results_handle:
+        for each_line in blast_results_handle:
+            if each_line.strip() == '':
+                continue
+            query = each_line[:each_line.find('\t')]
+            if (len(line_list) >= chunk_size) and (query != current_query):
+                yield process(line_list)
+                line_list = []
+            current_query = query
+            line_list.append(each_line if each_line.endswith('\n') else each_line + '\n')
+
+    if len(line_list) > 0:
+        yield process(line_list)
+
+
+def load_blastn_hits(pwd_blast_results, align_len_cutoff=None, cover_cutoff=None, genome_name_list=None, collapse_hsps=True, keep_text=False):
+
+    hits_list = [i for i in read_blastn_hits(pwd_blast_results, align_len_cutoff, cover_cutoff, genome_name_list, collapse_hsps, keep_text) if len(i['qseqid']) > 0]
+
+    return concatenate_blastn_hits(hits_list, keep_text)
+
+
+def write_blastn_hits(hits, output_handle):
+
+    # only available for hits read with keep_text=True
+    if len(hits['text']) > 0:
+        output_handle.write('\n'.join(['\t'.join(each_hit) for each_hit in hits['text']]) + '\n')
@@ -0,0 +1,238 @@
+import os
+import numpy as np
+from MetaCHIP.blastn_hits import read_blastn_hits
+from MetaCHIP.compressed_io import open_file
+from MetaCHIP.id_table import get_genome_ids, get_genome_of_genes, get_gene_names
+from MetaCHIP.worker_pool import get_worker_context
+
+
+# Minimizer prefilter of the all-vs-all blastn search.
+#
+# Genes are reduced to their (k, w) minimizers: of each w consecutive k-mers, the one with the smallest hash, with
+# k-mers and their reverse complement counted as one, as blastn searches both strands. Two genes of different
+# genomes are a candidate pair if they share at least min_seed_num minimizers (seeds) and the shorter gene has at
+# least min_length_ratio of the length of the longer one, as BM only uses hits covering most of both genes.
+# blastn is run for query genes with candidates only, against the db restricted to their candidate subjects.
+#
+# seed index:  seeds of all genomes sorted by hash, with their gene ids (see id_table.py), seeds of repeats
+#              (found in more genes than max(1000, 4 x genome number)) are left out.
+#
+# The recall of the prefilter is measured on sampled genomes searched without prefilter, as the fraction of their
+# gene pairs passing the default BM cutoffs which were also found with the prefilter.
+
+minimizer_k = 12
+minimizer_w = 10
+min_length_ratio = 0.5
+recall_align_len_cutoff = 200
+recall_cover_cutoff = 75
+base_code_array = np.full(256, 4, dtype=np.uint8)
+for base_index, each_base in enumerate('ACGT'):
+    base_code_array[ord(each_base)] = base_index
+    base_code_array[ord(each_base.lower())] = base_index
+
+
+def read_ffn_records(pwd_ffn_file):
+
+    # [gene id, header line, sequence], genes are kept in file order
+    ffn_record_list = []
+    with open_file(pwd_ffn_file) as ffn_handle:
+        for each_line in ffn_handle:
+            if each_line.startswith('>'):
+                ffn_record_list.append([each_line[1:].split()[0], each_line, []])
+            elif len(ffn_record_list) > 0:
+                ffn_record_list[-1][2].append(each_line.strip())
+
+    return [[i[0], i[1], ''.join(i[2])] for i in ffn_record_list]
+
+
+def get_minimizers(seq_list, k=minimizer_k, w=minimizer_w):
+
+    # returns unique (seed hash, gene index) pairs sorted by hash, genes are flanked by invalid bases,
+    # so that no window holds k-mers of two genes and windows at gene ends are shorter
+    separator = 'N' * (k + w)
+    concatenated_seq = separator + separator.join(seq_list) + separator
+    base_code = base_code_array[np.frombuffer(concatenated_seq.encode(), dtype=np.uint8)]
+    kmer_num = len(base_code) - k + 1
+    if kmer_num <= 0:
+        return np.array([], dtype=np.uint32), np.array([], dtype=np.int32)
+
+    forward_code = np.zeros(kmer_num, dtype=np.uint64)
+    reverse_code = np.zeros(kmer_num, dtype=np.uint64)
+    for position in range(k):
+        position_code = (base_code[position:(position + kmer_num)] & 3).astype(np.uint64)
+        forward_code = (forward_code << np.uint64(2)) | position_code
+        reverse_code |= (np.uint64(3) - position_code) << np.uint64(2 * position)
+    invalid_base_num = np.r_[0, np.cumsum(base_code == 4)]
+    valid_kmer = (invalid_base_num[k:] - invalid_base_num[:-k]) == 0
+
+    # canonical k-mers are mapped to 32-bit hashes, a bijection for k up to 16
+    kmer_hash = ((np.minimum(forward_code, reverse_code) * np.uint64(2654435761)) & np.uint64(0xffffffff)).astype(np.uint32)
+    kmer_hash[~valid_kmer] = np.iinfo(np.uint32).max
+
+    window_num = kmer_num - w + 1
+    window_min = kmer_hash[:window_num].copy()
+    for offset in range(1, w):
+        np.minimum(window_min, kmer_hash[offset:(offset + window_num)], out=window_min)
+    is_minimizer = np.zeros(kmer_num, dtype=bool)
+    for offset in range(w):
+        is_minimizer[offset:(offset + window_num)] |= kmer_hash[offset:(offset + window_num)] == window_min
+    is_minimizer &= valid_kmer
+
+    # gene of each k-mer, from the position of the gene starts in the concatenated sequence
+    gene_start_array = np.cumsum([len(separator)] + [len(i) + len(separator) for i in seq_list[:-1]]).astype(np.int64)
+    minimizer_position = np.flatnonzero(is_minimizer)
+    minimizer_gene = (np.searchsorted(gene_start_array, minimizer_position, side='right') - 1).astype(np.int64)
+    seed_key = np.unique((kmer_hash[minimizer_position].astype(np.uint64) << np.uint64(32)) | minimizer_gene.astype(np.uint64))
+
+    return (seed_key >> np.uint64(32)).astype(np.uint32), (seed_key & np.uint64(0xffffffff)).astype(np.int32)
+
+
+def get_minimizers_worker(argument_list):
+    pwd_ffn_file = argument_list[0]
+
+    # seeds of a genome, with gene indices within the genome and gene lengths
+    seq_list = [i[2] for i in read_ffn_records(pwd_ffn_file)]
+    seed_hash, seed_gene = get_minimizers(seq_list)
+
+    return os.path.basename(pwd_ffn_file)[:-len('.ffn')], seed_hash, seed_gene, np.array([len(i) for i in seq_list], dtype=np.int32)
+
+
+def create_prefilter_context(minimizer_output_list, id_table, genome_volume_dict):
+
+    # worker context of prefilter_query_worker and the number of letters in each blast db volume
+    minimizer_output_dict = {i[0]: i[1:] for i in minimizer_output_list}
+    genome_name_list = id_table['genome_name'].tolist()
+    seed_hash = np.concatenate([minimizer_output_dict[i][0] for i in genome_name_list])
+    seed_gene = np.concatenate([minimizer_output_dict[genome_name][1] + np.int32(id_table['genome_gene_offset'][genome_index]) for genome_index, genome_name in enumerate(genome_name_list)])
+    gene_length = np.concatenate([minimizer_output_dict[i][2] for i in genome_name_list])
+    seed_order = np.argsort(seed_hash, kind='mergesort')
+    seed_hash = seed_hash[seed_order]
+    seed_gene = seed_gene[seed_order]
+
+    # seeds of repeats, found in more genes than a gene family with a few copies in each genome
+    max_seed_gene_num = max(1000, 4 * len(genome_name_list))
+    seed_gene_num = np.unique(seed_hash, return_counts=True)[1]
+    kept_seed = np.repeat(seed_gene_num <= max_seed_gene_num, seed_gene_num)
+
+    genome_volume_array = np.array([genome_volume_dict.get(i, '') for i in genome_name_list], dtype=str)
+    volume_letter_num_dict = {}
+    for genome_name, each_volume in zip(genome_name_list, genome_volume_array.tolist()):
+        volume_letter_num_dict[each_volume] = volume_letter_num_dict.get(each_volume, 0) + int(minimizer_output_dict[genome_name][2].astype(np.int64).sum())
+
+    prefilter_context = {'seed_index':          {'seed_hash':   seed_hash[kept_seed],
+                                                 'seed_gene':   seed_gene[kept_seed],
+                                                 'gene_length': gene_length},
+                         'id_table':            id_table,
+                         'genome_volume_array': genome_volume_array}
+
+    return prefilter_context, volume_letter_num_dict
+
+
+def get_candidate_pairs(seed_index, id_table, query_seed_hash, query_seed_gene, query_genome_index, subject_genome_mask, min_seed_num, max_pair_num=5000000):
+
+    # query_seed_gene are gene ids, returns unique (query, subject) gene id pairs
+    seed_start = np.searchsorted(seed_index['seed_hash'], query_seed_hash, side='left')
+    seed_end = np.searchsorted(seed_index['seed_hash'], query_seed_hash, side='right')
+    hit_num = (seed_end - seed_start).astype(np.int64)
+
+    # queries are processed in blocks of whole genes, seeds of a gene need to be counted together
+    seed_order = np.argsort(query_seed_gene, kind='mergesort')
+    seed_start, hit_num, query_seed_gene = seed_start[seed_order], hit_num[seed_order], query_seed_gene[seed_order]
+    gene_first_seed = np.flatnonzero(np.r_[True, query_seed_gene[1:] != query_seed_gene[:-1]]) if len(query_seed_gene) > 0 else np.array([], dtype=np.int64)
+    gene_hit_cumsum = np.cumsum(hit_num)[np.r_[gene_first_seed[1:] - 1, len(hit_num) - 1].astype(np.int64)] if len(gene_first_seed) > 0 else np.array([], dtype=np.int64)
+
+    gene_num = np.int64(len(seed_index['gene_length']))
+    candidate_key_list = []
+    block_first_gene = 0
+    while block_first_gene < len(gene_first_seed):
+        block_hit_offset = gene_hit_cumsum[block_first_gene - 1] if block_first_gene > 0 else 0
+        block_end_gene = max(int(np.searchsorted(gene_hit_cumsum, block_hit_offset + max_pair_num, side='right')), block_first_gene + 1)
+        block_seed_start = gene_first_seed[block_first_gene]
+        block_seed_end = gene_first_seed[block_end_gene] if block_end_gene < len(gene_first_seed) else len(query_seed_gene)
+        block_first_gene = block_end_gene
+
+        # expand seeds to all genes sharing them
+        block_hit_num = hit_num[block_seed_start:block_seed_end]
+        if block_hit_num.sum() == 0:
+            continue
+        hit_seed = np.repeat(np.arange(block_seed_start, block_seed_end), block_hit_num)
+        hit_index = seed_start[hit_seed] + (np.arange(len(hit_seed)) - np.repeat(np.cumsum(block_hit_num) - block_hit_num, block_hit_num))
+        query_gene = query_seed_gene[hit_seed].astype(np.int64)
+        subject_gene = seed_index['seed_gene'][hit_index].astype(np.int64)
+
+        subject_genome = get_genome_of_genes(id_table, subject_gene)
+        qualified = (subject_genome != query_genome_index) & subject_genome_mask[subject_genome]
+        query_length = seed_index['gene_length'][query_gene]
+        subject_length = seed_index['gene_length'][subject_gene]
+        qualified &= np.minimum(query_length, subject_length) >= min_length_ratio * np.maximum(query_length, subject_length)
+
+        pair_key, pair_seed_num = np.unique(query_gene[qualified] * gene_num + subject_gene[qualified], return_counts=True)
+        candidate_key_list.append(pair_key[pair_seed_num >= min_seed_num])
+
+    candidate_key = np.concatenate(candidate_key_list) if len(candidate_key_list) > 0 else np.array([], dtype=np.int64)
+
+    return candidate_key // gene_num, candidate_key % gene_num
+
+
+def prefilter_query_worker(argument_list):
+    pwd_ffn_file = argument_list[0]
+    pwd_prefiltered_ffn_file = argument_list[1]
+    pwd_seqidlist_file = argument_list[2]
+    subject_volume_list = argument_list[3]
+    shard_seqidlist_file_list = argument_list[4]
+    min_seed_num = argument_list[5]
+    worker_context = get_worker_context(argument_list[6])
+    seed_index = worker_context['seed_index']
+    id_table = worker_context['id_table']
+    genome_volume_array = worker_context['genome_volume_array']
+
+    # writes query genes with candidates and their candidate subjects (one seqidlist per db shard if given),
+    # returns the prefiltered query file and [query genes, candidate query genes, candidate pairs, query letters,
+    # candidate query letters, candidate subject letters]
+    ffn_record_list = read_ffn_records(pwd_ffn_file)
+    seed_hash, seed_gene = get_minimizers([i[2] for i in ffn_record_list])
+    query_genome_index = int(get_genome_ids(id_table, [os.path.basename(pwd_ffn_file)[:-len('.ffn')]])[0])
+    query_gene_offset = int(id_table['genome_gene_offset'][query_genome_index])
+
+    subject_genome_mask = np.isin(genome_volume_array, np.array(subject_volume_list, dtype=str))
+    query_gene, subject_gene = get_candidate_pairs(seed_index, id_table, seed_hash, seed_gene.astype(np.int64) + query_gene_offset, query_genome_index, subject_genome_mask, min_seed_num)
+    candidate_query_set = set((np.unique(query_gene) - query_gene_offset).tolist())
+    candidate_subject_gene = np.unique(subject_gene)
+
+    with open(pwd_prefiltered_ffn_file, 'w') as prefiltered_ffn_handle:
+        for gene_index, ffn_record in enumerate(ffn_record_list):
+            if gene_index in candidate_query_set:
+                prefiltered_ffn_handle.write('%s%s\n' % (ffn_record[1], ffn_record[2]))
+
+    candidate_subject_name_list = get_gene_names(id_table, candidate_subject_gene)
+    with open(pwd_seqidlist_file, 'w') as seqidlist_handle:
+        seqidlist_handle.write(''.join(['%s\n' % i for i in candidate_subject_name_list]))
+    if shard_seqidlist_file_list is not None:
+        candidate_subject_volume = genome_volume_array[get_genome_of_genes(id_table, candidate_subject_gene)]
+        for subject_volume, pwd_shard_seqidlist_file in zip(subject_volume_list, shard_seqidlist_file_list):
+            with open(pwd_shard_seqidlist_file, 'w') as seqidlist_handle:
+                seqidlist_handle.write(''.join(['%s\n' % i for i, j in zip(candidate_subject_name_list, candidate_subject_volume.tolist()) if j == subject_volume]))
+
+    query_length = np.array([len(i[2]) for i in ffn_record_list], dtype=np.int64)
+    return pwd_prefiltered_ffn_file, [len(ffn_record_list),
+                                      len(candidate_query_set),
+                                      len(query_gene),
+                                      int(query_length.sum()),
+                                      int(query_length[sorted(candidate_query_set)].sum()),
+                                      int(seed_index['gene_length'][candidate_subject_gene].astype(np.int64).sum())]
+
+
+def get_qualified_gene_pairs(pwd_blast_results):
+    gene_pair_set = set()
+    for qualified_hits in read_blastn_hits(pwd_blast_results, recall_align_len_cutoff, recall_cover_cutoff):
+        gene_pair_set.update(zip(qualified_hits['qseqid'].tolist(), qualified_hits['sseqid'].tolist()))
+    return gene_pair_set
+
+
+def get_prefilter_recall(pwd_full_blast_results, pwd_prefiltered_blast_results):
+
+    # returns (qualified gene pairs found without prefilter, those also found with prefilter)
+    full_gene_pair_set = get_qualified_gene_pairs(pwd_full_blast_results)
+    prefiltered_gene_pair_set = get_qualified_gene_pairs(pwd_prefiltered_blast_results)
+
+    return len(full_gene_pair_set), len(full_gene_pair_set & prefiltered_gene_pair_set)
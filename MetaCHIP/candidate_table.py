@@ -0,0 +1,206 @@
+import numpy as np
+from MetaCHIP.id_table import get_gene_ids, get_genome_of_genes
+
+
+# HGT candidates of one or more ranks, one row per ordered pair of integer gene ids (see id_table.py).
+#
+# candidate table content:
+# gene_1, gene_2        int32, gene ids, gene_1 is the query gene of BM approach
+# identity              float64, identity of the best match
+# group_1, group_2      int32, group index of the two genes at the detection rank, -1 if unknown
+# match_category        int8, 0 normal, 1 end match, 2 full length match
+# direction             int8, 0 not validated, 1 genome of gene_1 --> genome of gene_2, 2 the opposite direction,
+#                       3 (combined tables only) both directions, validated at different ranks
+# occurrence            int16, bit n set if validated at the n-th rank in detection_rank_order
+# direction_1_num       int16, number of ranks validated with direction 1 (2 for direction_2_num)
+#
+# rows are found through a hash index of pair keys, which is rebuilt after loading.
+
+detection_rank_order = 'dpcofgs'
+match_category_list = ['normal', 'end_match', 'full_length_match']
+candidate_column_dtype_dict = {'gene_1':          np.int32,
+                               'gene_2':          np.int32,
+                               'identity':        np.float64,
+                               'group_1':         np.int32,
+                               'group_2':         np.int32,
+                               'match_category':  np.int8,
+                               'direction':       np.int8,
+                               'occurrence':      np.int16,
+                               'direction_1_num': np.int16,
+                               'direction_2_num': np.int16}
+
+
+def get_pair_keys(gene_1_array, gene_2_array):
+    return (np.asarray(gene_1_array, dtype=np.int64) << 32) | np.asarray(gene_2_array, dtype=np.int64)
+
+
+def index_candidate_table(candidate_table):
+    candidate_table['index'] = {pair_key: row for row, pair_key in enumerate(get_pair_keys(candidate_table['gene_1'], candidate_table['gene_2']).tolist())}
+
+
+def create_candidate_table(gene_1_array, gene_2_array, identity_array, group_1_array=None, group_2_array=None):
+
+    candidate_num = len(gene_1_array)
+    candidate_table = {each_column: np.zeros(candidate_num, dtype=each_dtype) for each_column, each_dtype in candidate_column_dtype_dict.items()}
+    candidate_table['gene_1'][:] = gene_1_array
+    candidate_table['gene_2'][:] = gene_2_array
+    candidate_table['identity'][:] = identity_array
+    candidate_table['group_1'][:] = -1 if group_1_array is None else group_1_array
+    candidate_table['group_2'][:] = -1 if group_2_array is None else group_2_array
+    index_candidate_table(candidate_table)
+
+    return candidate_table
+
+
+def subset_candidate_table(candidate_table, rows):
+    candidate_subset = {each_column: candidate_table[each_column][rows] for each_column in candidate_column_dtype_dict}
+    index_candidate_table(candidate_subset)
+    return candidate_subset
+
+
+def find_candidates(candidate_table, gene_1_array, gene_2_array):
+
+    # row of each pair, -1 if not in the table
+    candidate_index = candidate_table['index']
+    return np.array([candidate_index.get(i, -1) for i in get_pair_keys(gene_1_array, gene_2_array).tolist()], dtype=np.int64)
+
+
+def save_candidate_table(candidate_table, pwd_candidate_table_file):
+    with open(pwd_candidate_table_file, 'wb') as candidate_table_handle:
+        np.savez(candidate_table_handle, **{each_column: candidate_table[each_column] for each_column in candidate_column_dtype_dict})
+
+
+def load_candidate_table(pwd_candidate_table_file):
+    with np.load(pwd_candidate_table_file) as candidate_table_npz:
+        candidate_table = {each_column: candidate_table_npz[each_column] for each_column in candidate_table_npz.files}
+    index_candidate_table(candidate_table)
+    return candidate_table
+
+
+def get_bidirection_free_order(gene_1_array, gene_2_array):
+
+    # pairs also predicted in the opposite direction are kept once, at the position of the later prediction,
+    # rows of other pairs come first, both in input order
+    pair_keys = get_pair_keys(gene_1_array, gene_2_array)
+    reverse_keys = get_pair_keys(gene_2_array, gene_1_array)
+    first_row_dict = {}
+    for row, pair_key in enumerate(pair_keys.tolist()):
+        if pair_key not in first_row_dict:
+            first_row_dict[pair_key] = row
+    reverse_row = np.array([first_row_dict.get(i, -1) for i in reverse_keys.tolist()], dtype=np.int64)
+
+    row_array = np.arange(len(pair_keys))
+    bidirection = reverse_row >= 0
+    later_prediction = bidirection & (reverse_row < row_array)
+
+    return np.r_[row_array[~bidirection], row_array[later_prediction]].astype(np.int64)
+
+
+def get_rank_bit(detection_rank):
+    if detection_rank in detection_rank_order:
+        return 1 << detection_rank_order.index(detection_rank)
+    return 0
+
+
+def set_validated_direction(candidate_table, rows, direction_array, detection_rank):
+
+    # direction of candidates validated at one rank
+    candidate_table['direction'][rows] = direction_array
+    validated_rows = np.asarray(rows)[np.asarray(direction_array) > 0]
+    candidate_table['occurrence'][validated_rows] |= get_rank_bit(detection_rank)
+    candidate_table['direction_1_num'][rows] = np.asarray(direction_array) == 1
+    candidate_table['direction_2_num'][rows] = np.asarray(direction_array) == 2
+
+
+def combine_candidate_tables(candidate_table_list):
+
+    # values of a pair are taken from the first table it appears in, occurrence and direction counts are summed up
+    if len(candidate_table_list) == 0:
+        return create_candidate_table([], [], [])
+
+    stacked_table = {each_column: np.concatenate([i[each_column] for i in candidate_table_list]) for each_column in candidate_column_dtype_dict}
+    uniq_pair_keys, first_row, pair_index = np.unique(get_pair_keys(stacked_table['gene_1'], stacked_table['gene_2']), return_index=True, return_inverse=True)
+    pair_index = pair_index.reshape(-1)
+
+    combined_table = subset_candidate_table(stacked_table, first_row)
+    combined_table['occurrence'] = np.zeros(len(uniq_pair_keys), dtype=np.int16)
+    np.bitwise_or.at(combined_table['occurrence'], pair_index, stacked_table['occurrence'])
+    combined_table['direction_1_num'] = np.bincount(pair_index, weights=stacked_table['direction_1_num'], minlength=len(uniq_pair_keys)).astype(np.int16)
+    combined_table['direction_2_num'] = np.bincount(pair_index, weights=stacked_table['direction_2_num'], minlength=len(uniq_pair_keys)).astype(np.int16)
+    combined_table['direction'] = np.where(combined_table['direction_1_num'] > 0, 1, 0).astype(np.int8)
+    combined_table['direction'][combined_table['direction_2_num'] > 0] = 2
+    combined_table['direction'][(combined_table['direction_1_num'] > 0) & (combined_table['direction_2_num'] > 0)] = 3
+
+    return combined_table
+
+
+def get_occurrence_strings(candidate_table, detection_ranks):
+
+    # e.g. 0110 for ranks pcof, ranks ordered as in detection_rank_order
+    rank_list = [i for i in detection_rank_order if i in detection_ranks]
+    return [''.join(['1' if occurrence & get_rank_bit(each_rank) else '0' for each_rank in rank_list]) for occurrence in candidate_table['occurrence'].tolist()]
+
+
+def get_direction_strings(candidate_table, gene_1_genome_list, gene_2_genome_list):
+
+    # donor-->recipient, a direction supported by most ranks is reported with its frequency, 'both' if there is a tie
+    direction_string_list = []
+    for genome_1, genome_2, direction_1_num, direction_2_num in zip(gene_1_genome_list, gene_2_genome_list, candidate_table['direction_1_num'].tolist(), candidate_table['direction_2_num'].tolist()):
+        direction_1 = '%s-->%s' % (genome_1, genome_2)
+        direction_2 = '%s-->%s' % (genome_2, genome_1)
+        if (direction_1_num == 0) and (direction_2_num == 0):
+            direction_string_list.append('NA')
+        elif direction_2_num == 0:
+            direction_string_list.append(direction_1)
+        elif direction_1_num == 0:
+            direction_string_list.append(direction_2)
+        elif direction_1_num == direction_2_num:
+            direction_string_list.append('both')
+        else:
+            major_direction = direction_1 if direction_1_num > direction_2_num else direction_2
+            major_direction_freq = max(direction_1_num, direction_2_num) * 100 / float(direction_1_num + direction_2_num)
+            direction_string_list.append(major_direction + '(' + str(float("{0:.2f}".format(major_direction_freq))) + '%)')
+
+    return direction_string_list
+
+
+def read_candidate_table_txt(pwd_candidate_txt, id_table, detection_rank, column_index_list):
+
+    # for outputs produced before the candidate table was introduced,
+    # column_index_list: columns of gene_1, gene_2, identity, end_match, full_length_match and direction (None if absent)
+    gene_1_list = []
+    gene_2_list = []
+    identity_list = []
+    match_category_list = []
+    direction_list = []
+    for each_candidate in open(pwd_candidate_txt):
+        if not each_candidate.startswith('Gene_1'):
+            each_candidate_split = each_candidate.strip().split('\t')
+            gene_1_list.append(each_candidate_split[column_index_list[0]])
+            gene_2_list.append(each_candidate_split[column_index_list[1]])
+            identity_list.append(float(each_candidate_split[column_index_list[2]]))
+            match_category = 0
+            if each_candidate_split[column_index_list[3]] == 'yes':
+                match_category = 1
+            if each_candidate_split[column_index_list[4]] == 'yes':
+                match_category = 2
+            match_category_list.append(match_category)
+            direction_list.append('NA' if column_index_list[5] is None else each_candidate_split[column_index_list[5]])
+
+    gene_1_array = get_gene_ids(id_table, gene_1_list)
+    gene_2_array = get_gene_ids(id_table, gene_2_list)
+    candidate_table = create_candidate_table(gene_1_array, gene_2_array, identity_list)
+    candidate_table['match_category'][:] = match_category_list
+
+    genome_name_array = id_table['genome_name']
+    genome_1_list = genome_name_array[get_genome_of_genes(id_table, gene_1_array)].tolist() if len(gene_1_array) > 0 else []
+    genome_2_list = genome_name_array[get_genome_of_genes(id_table, gene_2_array)].tolist() if len(gene_2_array) > 0 else []
+    direction_array = np.zeros(len(direction_list), dtype=np.int8)
+    for row, (direction, genome_1, genome_2) in enumerate(zip(direction_list, genome_1_list, genome_2_list)):
+        if direction == '%s-->%s' % (genome_1, genome_2):
+            direction_array[row] = 1
+        elif direction == '%s-->%s' % (genome_2, genome_1):
+            direction_array[row] = 2
+    set_validated_direction(candidate_table, np.arange(len(direction_array)), direction_array, detection_rank)
+
+    return candidate_table
@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+
+
+# Checkpoint manifest of finished units of work (e.g. prodigal of a genome, blastn of a query genome,
+# flanking region check of a candidate, gene tree and Ranger-DTL run of a candidate), one tab separated line each:
+# unit name, hash of its inputs and parameters, result of the unit (json)
+#
+# With -resume, a unit is skipped if it was recorded before this run with the same hash and its output files
+# still exist. Workers get a manifest key (manifest file, length of the records written before this run),
+# records appended during the current run are not looked up. Units are recorded once their outputs are complete.
+
+checkpoint_manifest_dict = {}
+file_hash_dict = {}
+
+
+def open_checkpoint_manifest(pwd_manifest_file, resume, unit_type_list):
+
+    # without resume, previous records of the given unit types are dropped, as their outputs will be rewritten
+    if (resume is False) and os.path.isfile(pwd_manifest_file):
+        kept_record_list = [i for i in open(pwd_manifest_file) if i.split('\t')[0].split(':')[0] not in unit_type_list]
+        with open(pwd_manifest_file, 'w') as manifest_handle:
+            manifest_handle.writelines(kept_record_list)
+
+    if not os.path.isfile(pwd_manifest_file):
+        open(pwd_manifest_file, 'w').close()
+
+    return (pwd_manifest_file, os.path.getsize(pwd_manifest_file) if resume is True else 0)
+
+
+def get_file_hash(pwd_file):
+
+    # files are hashed once per process, unless they changed in between
+    file_stat = os.stat(pwd_file)
+    file_key = (pwd_file, file_stat.st_size, file_stat.st_mtime)
+    if file_key not in file_hash_dict:
+        file_hash = hashlib.sha1()
+        with open(pwd_file, 'rb') as file_handle:
+            for file_chunk in iter(lambda: file_handle.read(1048576), b''):
+                file_hash.update(file_chunk)
+        file_hash_dict[file_key] = file_hash.hexdigest()
+
+    return file_hash_dict[file_key]
+
+
+def get_unit_hash(parameter_list, pwd_input_file_list=()):
+
+    # missing input files are hashed as missing
+    unit_hash = hashlib.sha1()
+    unit_hash.update(json.dumps([str(i) for i in parameter_list]).encode())
+    for pwd_input_file in pwd_input_file_list:
+        unit_hash.update((get_file_hash(pwd_input_file) if os.path.isfile(pwd_input_file) else 'missing').encode())
+
+    return unit_hash.hexdigest()
+
+
+def load_checkpoint_manifest(manifest_key):
+
+    # records written before the current run, the last record of a unit is used,
+    # a record cut by a crash (without line end) is ignored
+    if manifest_key not in checkpoint_manifest_dict:
+        unit_record_dict = {}
+        if manifest_key[1] > 0:
+            with open(manifest_key[0], 'rb') as manifest_handle:
+                for unit_record in manifest_handle.read(manifest_key[1]).decode().split('\n')[:-1]:
+                    unit_record_split = unit_record.split('\t')
+                    if len(unit_record_split) == 3:
+                        unit_record_dict[unit_record_split[0]] = unit_record_split[1:]
+        checkpoint_manifest_dict.clear()
+        checkpoint_manifest_dict[manifest_key] = unit_record_dict
+
+    return checkpoint_manifest_dict[manifest_key]
+
+
+def get_finished_unit(manifest_key, unit_name, unit_hash, pwd_output_file_list=()):
+
+    # returns the recorded result, None if the unit is missing, stale or lost its outputs
+    if manifest_key is None:
+        return None
+
+    unit_record = load_checkpoint_manifest(manifest_key).get(unit_name)
+    if (unit_record is None) or (unit_record[0] != unit_hash):
+        return None
+    for pwd_output_file in pwd_output_file_list:
+        if not os.path.exists(pwd_output_file):
+            return None
+
+    return json.loads(unit_record[1])
+
+
+def record_finished_unit(manifest_key, unit_name, unit_hash, unit_result=True):
+
+    # one write per record, records of parallel workers do not interleave,
+    # the result must not be None, which get_finished_unit returns for unfinished units
+    if manifest_key is not None:
+        with open(manifest_key[0], 'a') as manifest_handle:
+            manifest_handle.write('%s\t%s\t%s\n' % (unit_name, unit_hash, json.dumps(unit_result)))
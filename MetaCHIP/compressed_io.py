@@ -0,0 +1,183 @@
+import io
+import os
+import gzip
+import shutil
+import subprocess
+from MetaCHIP.MetaCHIP_config import config_dict
+from MetaCHIP.tool_runner import run_tool
+
+
+# Intermediate files (prodigal outputs and blastn results) are optionally compressed with gzip (gz) or zstd (zst)
+# in place, without changing their names. Readers detect the compression from the first bytes of a file, so runs
+# and workspaces with different settings can be mixed. zstd streams go through the zstd executable. External tools
+# reading a compressed file get a decompressed copy (see get_plain_file).
+
+compression_magic_dict = {'gz':  b'\x1f\x8b',
+                          'zst': b'\x28\xb5\x2f\xfd'}
+gzip_level = 6
+zstd_level = 3
+
+
+class ToolStream(object):
+
+    # text stream to or from a zstd process, the exit status is checked once a read stream is exhausted and when
+    # a write stream is closed, so that truncated or corrupted input is not read as complete. Closing a read stream
+    # before its end stops the process without checking.
+    def __init__(self, cmd_list, mode):
+        if 'r' in mode:
+            self.process = subprocess.Popen(cmd_list, stdout=subprocess.PIPE)
+            self.handle = io.TextIOWrapper(self.process.stdout)
+        else:
+            self.process = subprocess.Popen(cmd_list, stdin=subprocess.PIPE)
+            self.handle = io.TextIOWrapper(self.process.stdin)
+        self.cmd_list = cmd_list
+        self.mode = mode
+        self.exhausted = False
+
+    def __iter__(self):
+        for each_line in self.handle:
+            yield each_line
+        self.check_exit_status()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def read(self, *args):
+        text = self.handle.read(*args)
+        if (len(args) == 0) or (args[0] is None) or (args[0] < 0) or (text == ''):
+            self.check_exit_status()
+        return text
+
+    def readline(self, *args):
+        text = self.handle.readline(*args)
+        if text == '':
+            self.check_exit_status()
+        return text
+
+    def write(self, text):
+        return self.handle.write(text)
+
+    def writelines(self, line_list):
+        self.handle.writelines(line_list)
+
+    def check_exit_status(self):
+        if self.exhausted is False:
+            self.exhausted = True
+            exit_status = self.process.wait()
+            if exit_status != 0:
+                raise IOError('%s exited with status %s' % (' '.join(self.cmd_list), exit_status))
+
+    def close(self):
+        if self.process is not None:
+            self.handle.close()
+            if 'r' in self.mode:
+                if self.exhausted is False:
+                    self.process.kill()
+                    self.process.wait()
+            else:
+                self.check_exit_status()
+            self.process = None
+
+
+def check_compression(compression):
+
+    # returns a message if the compression can not be used, None otherwise
+    if compression not in [None, 'gz', 'zst']:
+        return 'Unrecognized compression: %s, choose from gz and zst' % compression
+    if (compression == 'zst') and hasattr(shutil, 'which') and (shutil.which(config_dict['zstd']) is None):
+        return 'zstd executable not found: %s' % config_dict['zstd']
+    return None
+
+
+def get_file_compression(pwd_file):
+    with open(pwd_file, 'rb') as file_handle:
+        file_head = file_handle.read(4)
+    for compression, compression_magic in compression_magic_dict.items():
+        if file_head.startswith(compression_magic):
+            return compression
+    return None
+
+
+def open_file(pwd_file, mode='r', compression=None):
+
+    # text handle of a file, compressed with the given compression when writing,
+    # plain or compressed (detected) when reading
+    if 'r' in mode:
+        compression = get_file_compression(pwd_file)
+    if compression == 'gz':
+        return io.TextIOWrapper(gzip.open(pwd_file, mode[0] + 'b', compresslevel=gzip_level))
+    if compression == 'zst':
+        if 'r' in mode:
+            return ToolStream([config_dict['zstd'], '-q', '-d', '-c', pwd_file], mode)
+        return ToolStream([config_dict['zstd'], '-q', '-f', '-%s' % zstd_level, '-o', pwd_file], mode)
+    return open(pwd_file, mode)
+
+
+def compress_file(pwd_file, compression):
+
+    # compressed in place, files already compressed are kept
+    if (compression is None) or (get_file_compression(pwd_file) is not None):
+        return
+    pwd_file_tmp = '%s.tmp_%s' % (pwd_file, os.getpid())
+    if compression == 'gz':
+        with open(pwd_file, 'rb') as input_handle:
+            with gzip.open(pwd_file_tmp, 'wb', compresslevel=gzip_level) as output_handle:
+                shutil.copyfileobj(input_handle, output_handle)
+    elif run_tool([config_dict['zstd'], '-q', '-f', '-%s' % zstd_level, '-o', pwd_file_tmp, pwd_file]) != 0:
+        raise IOError('Failed to compress %s with zstd' % pwd_file)
+    os.rename(pwd_file_tmp, pwd_file)
+
+
+def decompress_file(pwd_file, pwd_output_file):
+    compression = get_file_compression(pwd_file)
+    if compression == 'gz':
+        with gzip.open(pwd_file, 'rb') as input_handle:
+            with open(pwd_output_file, 'wb') as output_handle:
+                shutil.copyfileobj(input_handle, output_handle)
+    elif compression == 'zst':
+        if run_tool([config_dict['zstd'], '-q', '-d', '-f', '-o', pwd_output_file, pwd_file]) != 0:
+            raise IOError('Failed to decompress %s with zstd' % pwd_file)
+    else:
+        shutil.copyfile(pwd_file, pwd_output_file)
+
+
+def get_plain_file(pwd_file, pwd_plain_file):
+
+    # for external tools, the file itself if not compressed, otherwise its decompressed copy
+    # (to be removed by the caller once the tool finished)
+    if get_file_compression(pwd_file) is None:
+        return pwd_file
+    decompress_file(pwd_file, pwd_plain_file)
+    return pwd_plain_file
+
+
+def concatenate_text_files(pwd_file_list, pwd_output_file, compression=None):
+
+    # compressed streams of the same compression are concatenated as they are (as gzip and zstd allow),
+    # files with other compressions are decompressed and compressed again
+    with open(pwd_output_file, 'wb') as output_handle:
+        for pwd_file in pwd_file_list:
+            if get_file_compression(pwd_file) == compression:
+                with open(pwd_file, 'rb') as input_handle:
+                    shutil.copyfileobj(input_handle, output_handle)
+            elif compression == 'zst':
+                output_handle.flush()
+                with open_file(pwd_file) as input_handle:
+                    zstd_process = subprocess.Popen([config_dict['zstd'], '-q', '-%s' % zstd_level, '-c'], stdin=subprocess.PIPE, stdout=output_handle)
+                    for each_line in input_handle:
+                        zstd_process.stdin.write(each_line.encode())
+                    zstd_process.stdin.close()
+                    if zstd_process.wait() != 0:
+                        raise IOError('Failed to compress %s with zstd' % pwd_file)
+            else:
+                with open_file(pwd_file) as input_handle:
+                    if compression == 'gz':
+                        with gzip.GzipFile(fileobj=output_handle, mode='wb', compresslevel=gzip_level) as gzip_handle:
+                            for each_line in input_handle:
+                                gzip_handle.write(each_line.encode())
+                    else:
+                        for each_line in input_handle:
+                            output_handle.write(each_line.encode())
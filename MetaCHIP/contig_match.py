@@ -0,0 +1,137 @@
+import numpy as np
+
+
+# Full length and end match check of HGT candidates, on blastn hits between the contigs of the two genes
+# (outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore qlen slen").
+# Hits of all candidates are kept in flat arrays, with the index of their candidate in "candidate" and hits of
+# each candidate in blastn output order (best hit first).
+
+contig_match_column_list = ['candidate', 'pident', 'qstart', 'qend', 'sstart', 'send', 'qlen', 'slen']
+
+
+def get_contig_match_hits(candidate_hit_list, min_align_len=100):
+
+    # candidate_hit_list: blastn hits (split into columns) of each candidate, hits shorter than min_align_len are ignored
+    candidate_column = []
+    hit_column_list = []
+    for candidate_index, hit_split_list in enumerate(candidate_hit_list):
+        for hit_split in hit_split_list:
+            if int(hit_split[3]) >= min_align_len:
+                candidate_column.append(candidate_index)
+                hit_column_list.append([hit_split[2], hit_split[6], hit_split[7], hit_split[8], hit_split[9], hit_split[12], hit_split[13]])
+
+    hit_array = np.array(hit_column_list, dtype=np.float64).reshape(-1, 7)
+    contig_match_hits = {'candidate': np.array(candidate_column, dtype=np.int64),
+                         'pident':    hit_array[:, 0]}
+    for column_index, column_name in enumerate(['qstart', 'qend', 'sstart', 'send', 'qlen', 'slen']):
+        contig_match_hits[column_name] = hit_array[:, column_index + 1].astype(np.int64)
+
+    return contig_match_hits
+
+
+def get_covered_length(candidate_array, start_array, end_array, candidate_num):
+
+    # total length of the union of matched regions (1-based, inclusive) of each candidate
+    covered_len = np.zeros(candidate_num, dtype=np.int64)
+    if len(candidate_array) == 0:
+        return covered_len
+
+    region_start = np.minimum(start_array, end_array)
+    region_end = np.maximum(start_array, end_array)
+    region_order = np.lexsort((region_start, candidate_array))
+    candidate_sorted = candidate_array[region_order]
+    region_start = region_start[region_order]
+    region_end = region_end[region_order]
+
+    # furthest end reached by previous regions of the same candidate
+    position_offset = int(region_end.max()) + 2
+    reached_end = np.maximum.accumulate(candidate_sorted * position_offset + region_end) - candidate_sorted * position_offset
+    previous_end = np.r_[-1, reached_end[:-1]]
+    previous_end[np.r_[True, candidate_sorted[1:] != candidate_sorted[:-1]]] = -1
+
+    new_len = np.maximum(region_end - np.maximum(region_start - 1, previous_end), 0)
+    covered_len += np.bincount(candidate_sorted, weights=new_len, minlength=candidate_num).astype(np.int64)
+
+    return covered_len
+
+
+def classify_contig_matches(contig_match_hits, candidate_num, identity_cutoff, coverage_cutoff=0.9, end_gap_len=200, concatenate_gap_len=300, identity_window=6):
+
+    # returns match category (normal, end_match or full_length_match) and covered query/subject length of each candidate
+    match_category = np.full(candidate_num, 'normal', dtype='<U17')
+    candidate_array = contig_match_hits['candidate']
+    query_covered_len = get_covered_length(candidate_array, contig_match_hits['qstart'], contig_match_hits['qend'], candidate_num)
+    subject_covered_len = get_covered_length(candidate_array, contig_match_hits['sstart'], contig_match_hits['send'], candidate_num)
+    if len(candidate_array) == 0:
+        return match_category, query_covered_len, subject_covered_len
+
+    # hits are grouped by candidate with the best hit first
+    hit_order = np.argsort(candidate_array, kind='mergesort')
+    hits = {each_column: contig_match_hits[each_column][hit_order] for each_column in contig_match_column_list}
+    candidate_array = hits['candidate']
+    hit_starts = np.flatnonzero(np.r_[True, candidate_array[1:] != candidate_array[:-1]])
+    hit_num = np.diff(np.r_[hit_starts, len(candidate_array)])
+    matched_candidate = candidate_array[hit_starts]
+
+    # full length match: query or subject contig covered by matched regions
+    query_len = hits['qlen'][hit_starts]
+    subject_len = hits['slen'][hit_starts]
+    full_length_match = (query_covered_len[matched_candidate] / query_len.astype(np.float64) >= coverage_cutoff) | (subject_covered_len[matched_candidate] / subject_len.astype(np.float64) >= coverage_cutoff)
+
+    # best hit of each candidate
+    query_direction = hits['qend'] - hits['qstart']
+    subject_direction = hits['send'] - hits['sstart']
+    same_direction = ~(((query_direction > 0) & (subject_direction < 0)) | ((query_direction < 0) & (subject_direction > 0)))
+    best_identity = hits['pident'][hit_starts]
+    best_same_direction = same_direction[hit_starts]
+    block_query_start = hits['qstart'][hit_starts].copy()
+    block_query_end = hits['qend'][hit_starts].copy()
+    block_subject_start = hits['sstart'][hit_starts].copy()
+    block_subject_end = hits['send'][hit_starts].copy()
+
+    # concatenate blocks continuously matched with the best hit, the n-th hits of all candidates are processed together
+    for hit_rank in range(1, int(hit_num.max())):
+        active = np.flatnonzero((hit_num > hit_rank) & (best_identity >= identity_cutoff))
+        if len(active) == 0:
+            continue
+        current_hit = hit_starts[active] + hit_rank
+
+        same = best_same_direction[active]
+        qualified = (np.abs(best_identity[active] - hits['pident'][current_hit]) <= identity_window) & (same_direction[current_hit] == same)
+        current_query_start = hits['qstart'][current_hit]
+        current_query_end = hits['qend'][current_hit]
+        current_subject_start = hits['sstart'][current_hit]
+        current_subject_end = hits['send'][current_hit]
+        query_start = block_query_start[active]
+        query_end = block_query_end[active]
+        subject_start = block_subject_start[active]
+        subject_end = block_subject_end[active]
+
+        # extended at the end of query
+        extend_end = qualified & (current_query_start > query_start) & (current_query_end > query_end) & (np.abs(current_query_start - query_end) <= concatenate_gap_len)
+        extend_end &= np.where(same,
+                               (current_subject_start > subject_start) & (current_subject_end > subject_end) & (np.abs(current_subject_start - subject_end) <= concatenate_gap_len),
+                               (current_subject_start < subject_start) & (current_subject_end < subject_end) & (np.abs(subject_end - current_subject_start) <= concatenate_gap_len))
+
+        # extended at the start of query
+        extend_start = qualified & ~extend_end & (current_query_start < query_start) & (current_query_end < query_end) & (np.abs(query_start - current_query_end) <= concatenate_gap_len)
+        extend_start &= np.where(same,
+                                 (current_subject_start < subject_start) & (current_subject_end < subject_end) & (np.abs(subject_start - current_subject_end) <= concatenate_gap_len),
+                                 (current_subject_start > subject_start) & (current_subject_end > subject_end) & (np.abs(current_subject_end - subject_start) <= concatenate_gap_len))
+
+        block_query_end[active] = np.where(extend_end, current_query_end, query_end)
+        block_subject_end[active] = np.where(extend_end, current_subject_end, subject_end)
+        block_query_start[active] = np.where(extend_start, current_query_start, query_start)
+        block_subject_start[active] = np.where(extend_start, current_subject_start, subject_start)
+
+    # end match: concatenated block reaches the ends of both contigs
+    end_match = (best_identity >= identity_cutoff) & np.where(best_same_direction,
+                                                              ((query_len - block_query_end <= end_gap_len) & (block_subject_start <= end_gap_len)) |
+                                                              ((block_query_start <= end_gap_len) & (subject_len - block_subject_end <= end_gap_len)),
+                                                              ((query_len - block_query_end <= end_gap_len) & (subject_len - block_subject_start <= end_gap_len)) |
+                                                              ((block_query_start <= end_gap_len) & (block_subject_end <= end_gap_len)))
+
+    match_category[matched_candidate[end_match]] = 'end_match'
+    match_category[matched_candidate[full_length_match]] = 'full_length_match'
+
+    return match_category, query_covered_len, subject_covered_len
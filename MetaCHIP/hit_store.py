@@ -0,0 +1,213 @@
+import os
+import shutil
+import numpy as np
+from MetaCHIP.blastn_hits import read_blastn_hits
+from MetaCHIP.id_table import get_gene_ids, get_genome_ids, get_genome_of_genes
+
+
+# Columnar store of blastn hits in the MetaCHIP working directory (<prefix>_all_blastn_hits), converted once
+# from the text results of each query genome, so that BM reads typed columns instead of parsing text again.
+#
+# genomes.txt           genome name and gene number of each genome in the order they were added to the store,
+#                       gene <n> of a genome is stored as the gene offset of its genome plus n - 1, store ids do
+#                       not change when genomes are added (unlike ids of the id table, see id_table.py)
+# <genome>/             hits of the query genome, sorted by query gene, HSPs of a query in blastn order
+#   query_offset.npy    int64, hits of query gene n are rows query_offset[n - 1] to query_offset[n]
+#   query_length.npy    int32, length of each query gene (0 for genes without hits), qlen of its hits
+#   subject.npy         int32, store id of subject genes
+#   pident.npy          int32, identity in 1/1000 percent (blastn reports 3 decimals)
+#   length.npy, slen.npy
+#   columns.npz         other columns, compressed
+#
+# Columns in npy files are memory-mapped. Partitions are written to a temporary folder first and renamed into
+# place, a partition older than the blastn results of its genome is converted again.
+
+hit_store_mapped_column_list = ['subject', 'pident', 'length', 'slen']
+hit_store_compressed_column_list = ['mismatch', 'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore']
+
+
+def load_hit_store_genomes(pwd_hit_store_folder):
+
+    # genomes of the store, with the layout of the id table, but genomes in the order they were added
+    genome_name_list = []
+    gene_num_list = []
+    pwd_genome_file = '%s/genomes.txt' % pwd_hit_store_folder
+    if os.path.isfile(pwd_genome_file):
+        for each_line in open(pwd_genome_file):
+            each_line_split = each_line.strip().split('\t')
+            if len(each_line_split) == 2:
+                genome_name_list.append(each_line_split[0])
+                gene_num_list.append(int(each_line_split[1]))
+
+    return {'genome_name':        np.array(genome_name_list, dtype=str),
+            'genome_gene_offset': np.r_[0, np.cumsum(np.array(gene_num_list, dtype=np.int64))].astype(np.int64)}
+
+
+def update_hit_store_genomes(pwd_hit_store_folder, id_table):
+
+    # genomes of the id table missing in the store are added, the store is emptied if genes of
+    # a genome changed (e.g. genomes annotated again), returns the genomes of the store
+    store_genome_table = load_hit_store_genomes(pwd_hit_store_folder)
+    store_gene_num_dict = dict(zip(store_genome_table['genome_name'].tolist(), np.diff(store_genome_table['genome_gene_offset']).tolist()))
+    id_gene_num_dict = dict(zip(id_table['genome_name'].tolist(), np.diff(id_table['genome_gene_offset']).tolist()))
+    if len([i for i in id_gene_num_dict if store_gene_num_dict.get(i, id_gene_num_dict[i]) != id_gene_num_dict[i]]) > 0:
+        shutil.rmtree(pwd_hit_store_folder, ignore_errors=True)
+        store_gene_num_dict = {}
+    if not os.path.isdir(pwd_hit_store_folder):
+        os.makedirs(pwd_hit_store_folder)
+
+    added_genome_list = [i for i in sorted(id_gene_num_dict) if i not in store_gene_num_dict]
+    if len(added_genome_list) > 0:
+        with open('%s/genomes.txt' % pwd_hit_store_folder, 'a') as genome_file_handle:
+            genome_file_handle.write(''.join(['%s\t%s\n' % (i, id_gene_num_dict[i]) for i in added_genome_list]))
+
+    return load_hit_store_genomes(pwd_hit_store_folder)
+
+
+def get_store_gene_ids(store_genome_table, gene_name_array):
+
+    # -1 for genes not in the store, names are looked up in a copy of the store with sorted genomes
+    genome_order = np.argsort(store_genome_table['genome_name'], kind='mergesort')
+    gene_num_array = np.diff(store_genome_table['genome_gene_offset'])[genome_order]
+    sorted_genome_table = {'genome_name':        store_genome_table['genome_name'][genome_order],
+                           'genome_gene_offset': np.r_[0, np.cumsum(gene_num_array)].astype(np.int64)}
+    sorted_gene_id = get_gene_ids(sorted_genome_table, gene_name_array).astype(np.int64)
+    sorted_genome_index = get_genome_of_genes(sorted_genome_table, np.maximum(sorted_gene_id, 0))
+    store_gene_id = store_genome_table['genome_gene_offset'][genome_order[sorted_genome_index]] + sorted_gene_id - sorted_genome_table['genome_gene_offset'][sorted_genome_index]
+
+    return np.where(sorted_gene_id >= 0, store_gene_id, -1).astype(np.int32)
+
+
+def get_id_table_gene_ids(store_genome_table, id_table, store_gene_id_array):
+
+    # store ids --> gene ids of the id table, -1 for genes not in the id table
+    store_gene_id_array = np.asarray(store_gene_id_array, dtype=np.int64)
+    genome_index_array = get_genome_ids(id_table, store_genome_table['genome_name'])
+    store_genome = get_genome_of_genes(store_genome_table, np.maximum(store_gene_id_array, 0))
+    id_table_genome = genome_index_array[store_genome] if len(genome_index_array) > 0 else np.zeros(len(store_gene_id_array), dtype=np.int32)
+    gene_number = store_gene_id_array - store_genome_table['genome_gene_offset'][store_genome]
+    genome_gene_offset = id_table['genome_gene_offset']
+    found = (store_gene_id_array >= 0) & (id_table_genome >= 0)
+    found &= gene_number < (genome_gene_offset[id_table_genome + 1] - genome_gene_offset[id_table_genome])
+
+    return np.where(found, genome_gene_offset[id_table_genome] + gene_number, -1).astype(np.int32)
+
+
+def get_store_genome_genes(store_genome_table, genome_name):
+
+    # store id of the first gene and gene number of a genome
+    store_genome_list = store_genome_table['genome_name'].tolist()
+    if genome_name not in store_genome_list:
+        raise RuntimeError('Genome %s not in hit store' % genome_name)
+    genome_index = store_genome_list.index(genome_name)
+    genome_gene_offset = store_genome_table['genome_gene_offset']
+
+    return int(genome_gene_offset[genome_index]), int(genome_gene_offset[genome_index + 1] - genome_gene_offset[genome_index])
+
+
+def is_current_hit_store_partition(pwd_partition_folder, pwd_blast_results):
+    pwd_query_offset_file = '%s/query_offset.npy' % pwd_partition_folder
+    return os.path.isfile(pwd_query_offset_file) and (os.path.getmtime(pwd_query_offset_file) >= os.path.getmtime(pwd_blast_results))
+
+
+def write_hit_store_partition(pwd_blast_results, pwd_partition_folder, store_genome_table, genome_name):
+
+    # all hits are kept, including hits within the genome and duplicate HSPs, cutoffs are applied when reading
+    hits_list = [i for i in read_blastn_hits(pwd_blast_results, collapse_hsps=False) if len(i['qseqid']) > 0]
+    query_gene_offset, gene_num = get_store_genome_genes(store_genome_table, genome_name)
+
+    column_dict = {'query': np.concatenate([get_store_gene_ids(store_genome_table, i['qseqid']) for i in hits_list]) if len(hits_list) > 0 else np.array([], dtype=np.int32),
+                   'subject': np.concatenate([get_store_gene_ids(store_genome_table, i['sseqid']) for i in hits_list]) if len(hits_list) > 0 else np.array([], dtype=np.int32)}
+    for each_column in ['pident', 'length', 'qlen', 'slen'] + hit_store_compressed_column_list:
+        column_dict[each_column] = np.concatenate([i[each_column] for i in hits_list]) if len(hits_list) > 0 else np.array([])
+
+    # hits of queries in other genomes (not expected) are dropped, hits of each query keep their order
+    query_number = column_dict['query'].astype(np.int64) - query_gene_offset
+    kept_hit = np.flatnonzero((column_dict['query'] >= 0) & (query_number >= 0) & (query_number < gene_num))
+    kept_hit = kept_hit[np.argsort(query_number[kept_hit], kind='mergesort')]
+    query_number = query_number[kept_hit]
+    query_length = np.zeros(gene_num, dtype=np.int32)
+    query_length[query_number] = column_dict['qlen'][kept_hit]
+
+    pwd_partition_folder_tmp = '%s.tmp_%s' % (pwd_partition_folder, os.getpid())
+    shutil.rmtree(pwd_partition_folder_tmp, ignore_errors=True)
+    os.makedirs(pwd_partition_folder_tmp)
+    np.save('%s/query_offset.npy' % pwd_partition_folder_tmp, np.r_[0, np.cumsum(np.bincount(query_number, minlength=gene_num))].astype(np.int64))
+    np.save('%s/query_length.npy' % pwd_partition_folder_tmp, query_length)
+    np.save('%s/subject.npy' % pwd_partition_folder_tmp, column_dict['subject'][kept_hit].astype(np.int32))
+    np.save('%s/pident.npy' % pwd_partition_folder_tmp, np.round(column_dict['pident'][kept_hit].astype(np.float64) * 1000).astype(np.int32))
+    np.save('%s/length.npy' % pwd_partition_folder_tmp, column_dict['length'][kept_hit].astype(np.int32))
+    np.save('%s/slen.npy' % pwd_partition_folder_tmp, column_dict['slen'][kept_hit].astype(np.int32))
+    np.savez_compressed('%s/columns.npz' % pwd_partition_folder_tmp,
+                        **{i: column_dict[i][kept_hit].astype(np.float64 if i in ['evalue', 'bitscore'] else np.int32) for i in hit_store_compressed_column_list})
+
+    # the partition may have been written by another process in between
+    shutil.rmtree(pwd_partition_folder, ignore_errors=True)
+    try:
+        os.rename(pwd_partition_folder_tmp, pwd_partition_folder)
+    except OSError:
+        shutil.rmtree(pwd_partition_folder_tmp, ignore_errors=True)
+
+
+def write_hit_store_partition_worker(argument_list):
+    pwd_blast_results = argument_list[0]
+    pwd_hit_store_folder = argument_list[1]
+    genome_name = argument_list[2]
+
+    pwd_partition_folder = '%s/%s' % (pwd_hit_store_folder, genome_name)
+    if not is_current_hit_store_partition(pwd_partition_folder, pwd_blast_results):
+        write_hit_store_partition(pwd_blast_results, pwd_partition_folder, load_hit_store_genomes(pwd_hit_store_folder), genome_name)
+
+
+def load_hit_store_columns(pwd_partition_folder, column_list):
+
+    # typed columns of a partition, pident in percent, query as gene number - 1 within the query genome
+    query_offset = np.load('%s/query_offset.npy' % pwd_partition_folder, mmap_mode='r')
+    query_number = np.repeat(np.arange(len(query_offset) - 1, dtype=np.int32), np.diff(query_offset))
+    column_dict = {}
+    compressed_columns = None
+    for each_column in column_list:
+        if each_column == 'query':
+            column_dict['query'] = query_number
+        elif each_column == 'qlen':
+            column_dict['qlen'] = np.load('%s/query_length.npy' % pwd_partition_folder)[query_number]
+        elif each_column == 'pident':
+            column_dict['pident'] = np.load('%s/pident.npy' % pwd_partition_folder, mmap_mode='r') / 1000.0
+        elif each_column in hit_store_mapped_column_list:
+            column_dict[each_column] = np.load('%s/%s.npy' % (pwd_partition_folder, each_column), mmap_mode='r')
+        else:
+            if compressed_columns is None:
+                compressed_columns = np.load('%s/columns.npz' % pwd_partition_folder)
+            column_dict[each_column] = compressed_columns[each_column]
+
+    return column_dict
+
+
+def read_qualified_hits(pwd_hit_store_folder, genome_name, store_genome_table, id_table, align_len_cutoff, cover_cutoff):
+
+    # hits passing the cutoffs as in read_blastn_hits, with query and subject as gene ids of the id table
+    # (-1 for genes not in it), only the first HSP of each query-subject pair is kept
+    hits = load_hit_store_columns('%s/%s' % (pwd_hit_store_folder, genome_name), ['query', 'subject', 'pident', 'length', 'qlen', 'slen'])
+    query_gene_offset, gene_num = get_store_genome_genes(store_genome_table, genome_name)
+    align_len = hits['length']
+
+    qualified_mask = align_len >= int(align_len_cutoff)
+    qualified_mask &= (hits['subject'] < query_gene_offset) | (hits['subject'] >= query_gene_offset + gene_num)
+    qualified_mask &= (align_len * 100.0 / hits['qlen']) >= int(cover_cutoff)
+    qualified_mask &= (align_len * 100.0 / hits['slen']) >= int(cover_cutoff)
+    qualified_hit = np.flatnonzero(qualified_mask)
+
+    # hits are sorted by query, the first hit of each pair is found within its query
+    query_array = hits['query'][qualified_hit]
+    subject_array = np.asarray(hits['subject'][qualified_hit])
+    if len(qualified_hit) > 1:
+        pair_key = query_array.astype(np.int64) * (int(store_genome_table['genome_gene_offset'][-1]) + 1) + subject_array + 1
+        first_hit = np.sort(np.unique(pair_key, return_index=True)[1])
+        qualified_hit = qualified_hit[first_hit]
+        query_array = query_array[first_hit]
+        subject_array = subject_array[first_hit]
+
+    query_id_offset = get_id_table_gene_ids(store_genome_table, id_table, [query_gene_offset])[0]
+    return {'query':   np.where(query_id_offset >= 0, query_id_offset + query_array, -1).astype(np.int32),
+            'subject': get_id_table_gene_ids(store_genome_table, id_table, subject_array),
+            'pident':  hits['pident'][qualified_hit]}
@@ -0,0 +1,158 @@
+import os
+import glob
+import numpy as np
+from MetaCHIP.compressed_io import open_file
+
+
+# Genes are identified by the locus tags assigned in prodigal_parser (genome_00001, genome_00002, ...),
+# which are numbered consecutively within each genome. A gene is therefore encoded as the gene offset of its
+# genome plus its locus tag number minus 1, genomes are kept in alphabet order.
+#
+# id table content:
+# genome_name               genome names, sorted
+# genome_gene_offset        int64, gene id of the first gene of each genome (length = genome number + 1)
+# group_name_<key>          group names (A, B, ...) of grouping <key> (e.g. c12), sorted
+# genome_group_<key>        int32, group index of each genome, -1 for genomes not in the grouping
+
+
+def create_id_table(genome_to_gene_num_dict):
+
+    genome_name_list = sorted(genome_to_gene_num_dict)
+    gene_num_array = np.array([genome_to_gene_num_dict[i] for i in genome_name_list], dtype=np.int64)
+
+    id_table = {'genome_name':        np.array(genome_name_list, dtype=str),
+                'genome_gene_offset': np.r_[0, np.cumsum(gene_num_array)].astype(np.int64)}
+
+    return id_table
+
+
+def get_gene_num_from_ffn(pwd_ffn_file):
+
+    gene_num = 0
+    with open_file(pwd_ffn_file) as ffn_handle:
+        for each_line in ffn_handle:
+            if each_line.startswith('>'):
+                gene_num += 1
+
+    return gene_num
+
+
+def get_genome_gene_num_dict(id_table):
+    return dict(zip(id_table['genome_name'].tolist(), np.diff(id_table['genome_gene_offset']).tolist()))
+
+
+def create_id_table_from_prodigal_output(pwd_prodigal_output_folder):
+
+    genome_to_gene_num_dict = {}
+    for pwd_ffn_file in glob.glob('%s/*.ffn' % pwd_prodigal_output_folder):
+        genome_name = os.path.splitext(os.path.basename(pwd_ffn_file))[0]
+        genome_to_gene_num_dict[genome_name] = get_gene_num_from_ffn(pwd_ffn_file)
+
+    return create_id_table(genome_to_gene_num_dict)
+
+
+def save_id_table(id_table, pwd_id_table_file):
+    with open(pwd_id_table_file, 'wb') as id_table_handle:
+        np.savez(id_table_handle, **id_table)
+
+
+def load_id_table(pwd_id_table_file):
+    with np.load(pwd_id_table_file) as id_table_npz:
+        id_table = {each_key: id_table_npz[each_key] for each_key in id_table_npz.files}
+    return id_table
+
+
+def get_id_table(pwd_id_table_file, pwd_prodigal_output_folder, genome_name_list):
+
+    # the id table is rebuilt from prodigal outputs if missing or genomes were added after it was written
+    if os.path.isfile(pwd_id_table_file):
+        id_table = load_id_table(pwd_id_table_file)
+        if len(set(genome_name_list) - set(id_table['genome_name'].tolist())) == 0:
+            return id_table
+
+    id_table = create_id_table_from_prodigal_output(pwd_prodigal_output_folder)
+    save_id_table(id_table, pwd_id_table_file)
+
+    return id_table
+
+
+def add_grouping_to_id_table(id_table, grouping_key, grouping_file):
+
+    # grouping file format: group,genome[,taxon] or group_index,genome (e.g. A_1,genome)
+    genome_to_group_dict = {}
+    for each_line in open(grouping_file):
+        each_line_split = each_line.strip().split(',')
+        if len(each_line_split) > 1:
+            genome_to_group_dict[each_line_split[1]] = each_line_split[0].split('_')[0]
+
+    group_name_array = np.array(sorted(set(genome_to_group_dict.values())), dtype=str)
+    group_index_dict = {each_group: group_index for group_index, each_group in enumerate(group_name_array.tolist())}
+
+    genome_group_array = np.full(len(id_table['genome_name']), -1, dtype=np.int32)
+    for genome_index, genome_name in enumerate(id_table['genome_name'].tolist()):
+        if genome_name in genome_to_group_dict:
+            genome_group_array[genome_index] = group_index_dict[genome_to_group_dict[genome_name]]
+
+    id_table['group_name_%s' % grouping_key] = group_name_array
+    id_table['genome_group_%s' % grouping_key] = genome_group_array
+
+
+def get_genome_group_array(id_table, grouping_key):
+    return id_table['genome_group_%s' % grouping_key], id_table['group_name_%s' % grouping_key]
+
+
+def get_genome_ids(id_table, genome_name_array):
+
+    # -1 for genomes not in id table
+    genome_name_array = np.asarray(genome_name_array, dtype=str)
+    if len(genome_name_array) == 0:
+        return np.array([], dtype=np.int32)
+
+    genome_index = np.searchsorted(id_table['genome_name'], genome_name_array)
+    genome_index_clipped = np.minimum(genome_index, len(id_table['genome_name']) - 1)
+    found = id_table['genome_name'][genome_index_clipped] == genome_name_array
+
+    return np.where(found, genome_index_clipped, -1).astype(np.int32)
+
+
+def get_gene_ids(id_table, gene_name_array):
+
+    # -1 for genes not in id table, each unique gene name is parsed only once
+    gene_name_array = np.asarray(gene_name_array, dtype=str)
+    if len(gene_name_array) == 0:
+        return np.array([], dtype=np.int32)
+
+    uniq_gene_array, uniq_gene_index = np.unique(gene_name_array, return_inverse=True)
+    uniq_gene_split = np.char.rpartition(uniq_gene_array, '_')
+    genome_index = get_genome_ids(id_table, uniq_gene_split[:, 0])
+    gene_number = np.array([int(i) if i.isdigit() else 0 for i in uniq_gene_split[:, 2].tolist()], dtype=np.int64)
+
+    genome_gene_offset = id_table['genome_gene_offset']
+    gene_num = genome_gene_offset[genome_index + 1] - genome_gene_offset[genome_index]
+    qualified = (genome_index >= 0) & (gene_number >= 1) & (gene_number <= gene_num)
+    uniq_gene_id = np.where(qualified, genome_gene_offset[genome_index] + gene_number - 1, -1).astype(np.int32)
+
+    return uniq_gene_id[uniq_gene_index.reshape(-1)]
+
+
+def get_genome_of_genes(id_table, gene_id_array):
+    return (np.searchsorted(id_table['genome_gene_offset'], np.asarray(gene_id_array), side='right') - 1).astype(np.int32)
+
+
+def get_gene_names(id_table, gene_id_array):
+
+    # convert back to locus tags, for output only
+    gene_id_array = np.asarray(gene_id_array, dtype=np.int64)
+    if len(gene_id_array) == 0:
+        return []
+
+    uniq_gene_id, uniq_gene_index = np.unique(gene_id_array, return_inverse=True)
+    genome_index = get_genome_of_genes(id_table, uniq_gene_id)
+    gene_number = uniq_gene_id - id_table['genome_gene_offset'][genome_index] + 1
+    uniq_gene_name = ['%s_%s' % (genome_name, "{:0>5}".format(number)) for genome_name, number in zip(id_table['genome_name'][genome_index].tolist(), gene_number.tolist())]
+
+    return [uniq_gene_name[i] for i in uniq_gene_index.reshape(-1).tolist()]
+
+
+def get_gene_name(id_table, gene_id):
+    return get_gene_names(id_table, [gene_id])[0]
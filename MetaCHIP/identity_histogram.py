@@ -0,0 +1,96 @@
+import numpy as np
+
+
+# identities (0-100) are counted in fixed-width bins, bins are centered on multiples of the resolution
+identity_resolution = 0.01
+identity_bin_num = int(round(100 / identity_resolution)) + 1
+
+
+def get_identity_bins(identity_array):
+    bin_index = np.rint(np.asarray(identity_array, dtype=np.float64) / identity_resolution).astype(np.int64)
+    return np.clip(bin_index, 0, identity_bin_num - 1)
+
+
+def get_identity_histograms(group_pair_array, identity_array):
+
+    # partial histograms of one batch of hits, only observed group pairs are kept
+    identity_histogram_dict = {}
+    if len(group_pair_array) == 0:
+        return identity_histogram_dict
+
+    uniq_group_pair_array, group_pair_index = np.unique(group_pair_array, return_inverse=True)
+    flat_bin_index = group_pair_index.reshape(-1).astype(np.int64) * identity_bin_num + get_identity_bins(identity_array)
+    bin_count_matrix = np.bincount(flat_bin_index, minlength=len(uniq_group_pair_array) * identity_bin_num).reshape(len(uniq_group_pair_array), identity_bin_num)
+    for group_pair, bin_count in zip(uniq_group_pair_array.tolist(), bin_count_matrix):
+        identity_histogram_dict[group_pair] = bin_count
+
+    return identity_histogram_dict
+
+
+def merge_identity_histograms(identity_histogram_dict_list):
+
+    # partial histograms merge by summing bin counts
+    merged_histogram_dict = {}
+    for identity_histogram_dict in identity_histogram_dict_list:
+        for group_pair in identity_histogram_dict:
+            if group_pair not in merged_histogram_dict:
+                merged_histogram_dict[group_pair] = np.array(identity_histogram_dict[group_pair], dtype=np.int64)
+            else:
+                merged_histogram_dict[group_pair] += identity_histogram_dict[group_pair]
+
+    return merged_histogram_dict
+
+
+def save_identity_histograms(identity_histogram_dict, output_file):
+
+    group_pair_list = sorted(identity_histogram_dict)
+    bin_count_matrix = np.zeros((len(group_pair_list), identity_bin_num), dtype=np.int64)
+    for group_pair_index, group_pair in enumerate(group_pair_list):
+        bin_count_matrix[group_pair_index] = identity_histogram_dict[group_pair]
+
+    # write through a handle so the file name is kept as provided
+    with open(output_file, 'wb') as output_file_handle:
+        np.savez_compressed(output_file_handle,
+                            group_pair=np.array(group_pair_list, dtype=str),
+                            bin_count=bin_count_matrix,
+                            resolution=np.array([identity_resolution]))
+
+
+def load_identity_histograms(histogram_file):
+
+    identity_histogram_dict = {}
+    with np.load(histogram_file) as histogram_npz:
+        if float(histogram_npz['resolution'][0]) != identity_resolution:
+            print('Resolution of identity histograms in %s is different from %s, program exited!' % (histogram_file, identity_resolution))
+            exit()
+        for group_pair, bin_count in zip(histogram_npz['group_pair'].tolist(), histogram_npz['bin_count']):
+            identity_histogram_dict[group_pair] = bin_count
+
+    return identity_histogram_dict
+
+
+def merge_identity_histogram_files(histogram_file_list):
+    return merge_identity_histograms([load_identity_histograms(i) for i in histogram_file_list])
+
+
+def get_histogram_percentile(bin_count, percentile):
+
+    # same linear interpolation as np.percentile, on identities rounded to the histogram resolution
+    total_num = int(bin_count.sum())
+    if total_num == 0:
+        return float('nan')
+
+    cumulative_count = np.cumsum(bin_count)
+    position = (total_num - 1) * percentile / 100.0
+    lower_rank = int(np.floor(position))
+    upper_rank = min(lower_rank + 1, total_num - 1)
+    lower_value = np.searchsorted(cumulative_count, lower_rank, side='right') * identity_resolution
+    upper_value = np.searchsorted(cumulative_count, upper_rank, side='right') * identity_resolution
+
+    return float(lower_value + (upper_value - lower_value) * (position - lower_rank))
+
+
+def get_histogram_identities(bin_count):
+
+    # expand histogram to a sorted identity array, only needed for plotting
+    return np.repeat(np.arange(identity_bin_num) * identity_resolution, bin_count)
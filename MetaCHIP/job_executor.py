@@ -0,0 +1,233 @@
+import os
+import sys
+import time
+import pickle
+import shlex
+import threading
+import traceback
+from MetaCHIP.tool_runner import get_tool_runner_settings, load_tool_runner_settings, run_tool, remove_path
+from MetaCHIP.result_cache import get_result_cache_settings, load_result_cache_settings
+from MetaCHIP.thread_budget import start_thread_budget
+from MetaCHIP.worker_pool import get_worker_pool
+
+
+# Executors run the tasks of a stage (worker function and its argument lists, as for pool.map):
+#
+# local:        on the persistent worker pool of this process (see worker_pool.py)
+# batch:        as jobs of a batch scheduler, submitted with the submit command (e.g. qsub or sbatch)
+# local_batch:  job scripts of the batch executor run one after another by local processes, standing in for
+#               a scheduler to test job scripts and headers without a cluster
+#
+# Batch tasks are pickled to <job folder>/<stage>/tasks.pkl with the tool runner and result cache settings of the
+# parent, and split into chunks. Each chunk is run on a node by "python -m MetaCHIP.job_executor <task file> <chunk>"
+# with a worker pool of its own, which writes chunk<i>.done (results of its tasks) once all tasks finished, the job
+# script writes chunk<i>.failed if it did not. While running, a chunk touches chunk<i>.running every
+# chunk_heartbeat_interval seconds, jobs killed by the scheduler (e.g. walltime, memory, node loss) stop doing so
+# without writing a sentinel. The parent polls these files, a running chunk without heartbeat for
+# chunk_heartbeat_timeout seconds, or a chunk not finished within the job timeout after its submission (if set,
+# e.g. for jobs deleted while queued), counts as failed. Failed chunks are resubmitted up to max_chunk_retry_num times. Job script headers are templates, {job_name}, {cores} and {array} (e.g. 1-20)
+# are replaced. Chunks are submitted as one array job if the header has {array}, as one job each otherwise.
+
+max_chunk_retry_num = 2
+sentinel_check_interval = 30
+chunk_heartbeat_interval = 60
+chunk_heartbeat_timeout = 600
+array_index_str = '${MetaCHIP_JOB_INDEX:-${SLURM_ARRAY_TASK_ID:-${PBS_ARRAYID:-${PBS_ARRAY_INDEX:-${SGE_TASK_ID:-${LSB_JOBINDEX}}}}}}'
+
+
+def get_executor_settings(executor, pwd_js_header, submit_cmd, chunk_num, num_threads, job_name_prefix, job_timeout=None):
+    return {'executor':  executor,
+            'js_header': pwd_js_header,
+            'submit':    submit_cmd,
+            'chunks':    chunk_num,
+            'cores':     num_threads,
+            'job_name':  job_name_prefix,
+            'timeout':   job_timeout}
+
+
+def check_executor_settings(executor_setting_dict):
+
+    # returns a message if the settings can not be used, None otherwise
+    if executor_setting_dict['executor'] not in ['local', 'batch', 'local_batch']:
+        return 'Unrecognized executor: %s, choose from local, batch and local_batch' % executor_setting_dict['executor']
+    if (executor_setting_dict['executor'] == 'batch') and (executor_setting_dict['js_header'] is None):
+        return 'The batch executor needs a job script header'
+    if (executor_setting_dict['js_header'] is not None) and (not os.path.isfile(executor_setting_dict['js_header'])):
+        return 'Job script header not found: %s' % executor_setting_dict['js_header']
+    if executor_setting_dict['chunks'] < 1:
+        return 'Number of jobs needs to be at least 1'
+    if (executor_setting_dict['timeout'] is not None) and (executor_setting_dict['timeout'] <= 0):
+        return 'Job timeout needs to be positive'
+
+    return None
+
+
+def run_tasks(stage_name, worker_function, argument_list_list, pwd_job_folder, executor_setting_dict):
+
+    # returns results of the tasks in their order
+    if executor_setting_dict['executor'] == 'local':
+        pool = get_worker_pool(executor_setting_dict['cores'])
+        start_thread_budget(executor_setting_dict['cores'], len(argument_list_list))
+        return pool.map(worker_function, argument_list_list)
+
+    if len(argument_list_list) == 0:
+        return []
+
+    # tasks are assigned to chunks in turn, the first tasks (e.g. the largest) go to different chunks
+    pwd_stage_folder = '%s/%s' % (os.path.abspath(pwd_job_folder), stage_name)
+    remove_path(pwd_stage_folder)
+    os.makedirs(pwd_stage_folder)
+    chunk_num = min(executor_setting_dict['chunks'], len(argument_list_list))
+    chunk_task_list = [list(range(len(argument_list_list)))[i::chunk_num] for i in range(chunk_num)]
+    with open('%s/tasks.pkl' % pwd_stage_folder, 'wb') as task_file_handle:
+        pickle.dump({'function':              worker_function,
+                     'arguments':             argument_list_list,
+                     'chunks':                chunk_task_list,
+                     'cores':                 executor_setting_dict['cores'],
+                     'tool_runner_settings':  get_tool_runner_settings(),
+                     'result_cache_settings': get_result_cache_settings()}, task_file_handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    submission_num_dict = {}
+    submission_time_dict = {}
+    submit_chunks(stage_name, list(range(chunk_num)), pwd_stage_folder, executor_setting_dict, submission_num_dict, submission_time_dict)
+    while True:
+        finished_chunk_list = [i for i in range(chunk_num) if os.path.isfile('%s/chunk%s.done' % (pwd_stage_folder, i))]
+
+        # jobs that disappeared (no heartbeat) or exceeded the job timeout, without a sentinel
+        if executor_setting_dict['executor'] == 'batch':
+            for lost_chunk, lost_reason in get_lost_chunks(chunk_num, pwd_stage_folder, executor_setting_dict['timeout'], submission_time_dict):
+                with open('%s/chunk%s.failed' % (pwd_stage_folder, lost_chunk), 'w') as sentinel_handle:
+                    sentinel_handle.write('%s\n' % lost_reason)
+        failed_chunk_list = [i for i in range(chunk_num) if os.path.isfile('%s/chunk%s.failed' % (pwd_stage_folder, i)) and (i not in finished_chunk_list)]
+
+        # job scripts run by local_batch are finished, chunks without a sentinel failed before starting
+        if executor_setting_dict['executor'] == 'local_batch':
+            failed_chunk_list = [i for i in range(chunk_num) if i not in finished_chunk_list]
+        if len(finished_chunk_list) == chunk_num:
+            break
+
+        if len(failed_chunk_list) > 0:
+            given_up_chunk_list = [i for i in failed_chunk_list if submission_num_dict[i] > max_chunk_retry_num]
+            if len(given_up_chunk_list) > 0:
+                failed_reason_list = [open('%s/chunk%s.failed' % (pwd_stage_folder, i)).read().strip() if os.path.isfile('%s/chunk%s.failed' % (pwd_stage_folder, i)) else 'no sentinel' for i in given_up_chunk_list]
+                raise RuntimeError('Jobs of %s failed %s times, see %s' % (stage_name, max_chunk_retry_num + 1, ', '.join(['%s/chunk%s.log (%s)' % (pwd_stage_folder, i, j) for i, j in zip(given_up_chunk_list, failed_reason_list)])))
+            for failed_chunk in failed_chunk_list:
+                remove_path('%s/chunk%s.failed' % (pwd_stage_folder, failed_chunk))
+                remove_path('%s/chunk%s.running' % (pwd_stage_folder, failed_chunk))
+            submit_chunks(stage_name, failed_chunk_list, pwd_stage_folder, executor_setting_dict, submission_num_dict, submission_time_dict)
+        elif executor_setting_dict['executor'] == 'batch':
+            time.sleep(sentinel_check_interval)
+
+    result_list = [None] * len(argument_list_list)
+    for chunk_index in range(chunk_num):
+        with open('%s/chunk%s.done' % (pwd_stage_folder, chunk_index), 'rb') as sentinel_handle:
+            for task_index, task_result in pickle.load(sentinel_handle):
+                result_list[task_index] = task_result
+    remove_path(pwd_stage_folder)
+
+    return result_list
+
+
+def run_tasks_worker(argument_list):
+
+    # runs a stage of batch jobs as a task of the persistent pool (e.g. in a task graph), polling in a worker
+    return run_tasks(argument_list[0], argument_list[1], argument_list[2], argument_list[3], argument_list[4])
+
+
+def get_lost_chunks(chunk_num, pwd_stage_folder, job_timeout, submission_time_dict):
+
+    # unfinished chunks without a sentinel whose heartbeat stopped or which exceeded the job timeout, with the reason
+    lost_chunk_list = []
+    for chunk_index in range(chunk_num):
+        if os.path.isfile('%s/chunk%s.done' % (pwd_stage_folder, chunk_index)) or os.path.isfile('%s/chunk%s.failed' % (pwd_stage_folder, chunk_index)):
+            continue
+        pwd_heartbeat_file = '%s/chunk%s.running' % (pwd_stage_folder, chunk_index)
+        if os.path.isfile(pwd_heartbeat_file) and (time.time() - os.path.getmtime(pwd_heartbeat_file) > chunk_heartbeat_timeout):
+            lost_chunk_list.append([chunk_index, 'no heartbeat for %s seconds, job killed or lost' % chunk_heartbeat_timeout])
+        elif (job_timeout is not None) and (time.time() - submission_time_dict[chunk_index] > job_timeout):
+            lost_chunk_list.append([chunk_index, 'not finished within %s seconds after submission' % job_timeout])
+
+    return lost_chunk_list
+
+
+def submit_chunks(stage_name, chunk_list, pwd_stage_folder, executor_setting_dict, submission_num_dict, submission_time_dict):
+
+    job_script_header = ''
+    if executor_setting_dict['js_header'] is not None:
+        job_script_header = open(executor_setting_dict['js_header']).read().rstrip('\n') + '\n'
+    job_script_header = job_script_header.replace('{job_name}', '%s_%s' % (executor_setting_dict['job_name'], stage_name))
+    job_script_header = job_script_header.replace('{cores}', str(executor_setting_dict['cores']))
+    as_array_job = '{array}' in job_script_header
+    job_script_header = job_script_header.replace('{array}', '1-%s' % len(chunk_list))
+
+    # scripts of earlier submissions may still be running and are not overwritten
+    for chunk_index in chunk_list:
+        submission_num_dict[chunk_index] = submission_num_dict.get(chunk_index, 0) + 1
+        submission_time_dict[chunk_index] = time.time()
+    submission_str = 'submission%s' % sum(submission_num_dict.values())
+
+    # array index (from 1) --> chunk
+    job_script_list = []
+    if as_array_job is True:
+        job_script_list.append(['%s/%s.sh' % (pwd_stage_folder, submission_str), ['CHUNK_LIST=(- %s)' % ' '.join([str(i) for i in chunk_list]), 'CHUNK=${CHUNK_LIST[%s]}' % array_index_str], len(chunk_list)])
+    else:
+        for chunk_index in chunk_list:
+            job_script_list.append(['%s/%s_chunk%s.sh' % (pwd_stage_folder, submission_str, chunk_index), ['CHUNK=%s' % chunk_index], 1])
+
+    for pwd_job_script, chunk_lines, array_size in job_script_list:
+        with open(pwd_job_script, 'w') as job_script_handle:
+            job_script_handle.write(job_script_header)
+            job_script_handle.write('cd %s\n' % os.getcwd())
+            job_script_handle.write('\n'.join(chunk_lines) + '\n')
+            job_script_handle.write('%s -m MetaCHIP.job_executor %s/tasks.pkl $CHUNK > %s/chunk$CHUNK.log 2>&1 || echo $? > %s/chunk$CHUNK.failed\n' % (sys.executable, pwd_stage_folder, pwd_stage_folder, pwd_stage_folder))
+
+        if executor_setting_dict['executor'] == 'local_batch':
+            for array_index in range(1, array_size + 1):
+                run_tool(['bash', pwd_job_script], env={'MetaCHIP_JOB_INDEX': str(array_index)})
+        elif run_tool(shlex.split(executor_setting_dict['submit']) + [pwd_job_script], cwd=pwd_stage_folder) != 0:
+            raise RuntimeError('Failed to submit %s with %s' % (pwd_job_script, executor_setting_dict['submit']))
+
+
+def run_chunk(pwd_task_file, chunk_index):
+
+    # run on a node by the job script of a chunk
+    with open(pwd_task_file, 'rb') as task_file_handle:
+        task_dict = pickle.load(task_file_handle)
+    load_tool_runner_settings(task_dict['tool_runner_settings'])
+    load_result_cache_settings(task_dict['result_cache_settings'])
+
+    # heartbeat of the running chunk, see get_lost_chunks
+    pwd_heartbeat_file = '%s/chunk%s.running' % (os.path.dirname(pwd_task_file), chunk_index)
+    chunk_finished = threading.Event()
+
+    def touch_heartbeat_file():
+        while True:
+            with open(pwd_heartbeat_file, 'a'):
+                os.utime(pwd_heartbeat_file, None)
+            if chunk_finished.wait(chunk_heartbeat_interval) is True:
+                break
+
+    heartbeat_thread = threading.Thread(target=touch_heartbeat_file)
+    heartbeat_thread.daemon = True
+    heartbeat_thread.start()
+
+    task_index_list = task_dict['chunks'][chunk_index]
+    pool = get_worker_pool(task_dict['cores'])
+    start_thread_budget(task_dict['cores'], len(task_index_list))
+    task_result_list = pool.map(task_dict['function'], [task_dict['arguments'][i] for i in task_index_list])
+    chunk_finished.set()
+    heartbeat_thread.join()
+
+    pwd_sentinel_file = '%s/chunk%s.done' % (os.path.dirname(pwd_task_file), chunk_index)
+    with open('%s.tmp' % pwd_sentinel_file, 'wb') as sentinel_handle:
+        pickle.dump(list(zip(task_index_list, task_result_list)), sentinel_handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename('%s.tmp' % pwd_sentinel_file, pwd_sentinel_file)
+
+
+if __name__ == '__main__':
+
+    try:
+        run_chunk(sys.argv[1], int(sys.argv[2]))
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
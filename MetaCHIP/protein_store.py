@@ -0,0 +1,89 @@
+import os
+import numpy as np
+from Bio import SeqIO
+from MetaCHIP.id_table import get_gene_ids
+from MetaCHIP.compressed_io import open_file
+
+
+# Protein sequences of all genes in two files in the MetaCHIP working directory:
+# <prefix>_protein_store.seq  sequences concatenated without separators
+# <prefix>_protein_store.idx  npy array (gene number x 2) with the offset and length of each gene, rows are gene ids
+# Both files are memory-mapped, workers slice the sequences of the genes they need without reading the whole file.
+
+opened_protein_store_dict = {}
+
+
+def build_protein_store(pwd_prodigal_output_folder, id_table, pwd_store_seq_file, pwd_store_index_file):
+
+    gene_num = int(id_table['genome_gene_offset'][-1])
+    seq_index = np.zeros((gene_num, 2), dtype=np.int64)
+    seq_offset = 0
+    with open(pwd_store_seq_file, 'wb') as store_seq_handle:
+        for genome_name in id_table['genome_name'].tolist():
+            pwd_faa_file = '%s/%s.faa' % (pwd_prodigal_output_folder, genome_name)
+            if not os.path.isfile(pwd_faa_file):
+                continue
+
+            gene_name_list = []
+            gene_seq_list = []
+            with open_file(pwd_faa_file) as faa_handle:
+                for seq_record in SeqIO.parse(faa_handle, 'fasta'):
+                    gene_name_list.append(seq_record.id)
+                    gene_seq_list.append(str(seq_record.seq).encode())
+
+            for gene_id, gene_seq in zip(get_gene_ids(id_table, gene_name_list).tolist(), gene_seq_list):
+                if gene_id >= 0:
+                    seq_index[gene_id] = [seq_offset, len(gene_seq)]
+                    store_seq_handle.write(gene_seq)
+                    seq_offset += len(gene_seq)
+
+    with open(pwd_store_index_file, 'wb') as store_index_handle:
+        np.save(store_index_handle, seq_index)
+
+
+def get_protein_store(pwd_prodigal_output_folder, id_table, pwd_id_table_file, pwd_store_seq_file, pwd_store_index_file):
+
+    # the store is rebuilt if missing or older than the id table
+    if os.path.isfile(pwd_store_seq_file) and os.path.isfile(pwd_store_index_file):
+        if os.path.getmtime(pwd_store_index_file) >= os.path.getmtime(pwd_id_table_file):
+            if np.load(pwd_store_index_file, mmap_mode='r').shape[0] == int(id_table['genome_gene_offset'][-1]):
+                return
+    build_protein_store(pwd_prodigal_output_folder, id_table, pwd_store_seq_file, pwd_store_index_file)
+
+
+def open_protein_store(pwd_store_seq_file, pwd_store_index_file):
+
+    # opened once per process, again if the store was rebuilt after it was opened by a persistent worker
+    store_key = (pwd_store_seq_file, pwd_store_index_file, os.path.getmtime(pwd_store_index_file))
+    if store_key not in opened_protein_store_dict:
+        if os.path.getsize(pwd_store_seq_file) == 0:
+            store_seq = np.zeros(0, dtype=np.uint8)
+        else:
+            store_seq = np.memmap(pwd_store_seq_file, dtype=np.uint8, mode='r')
+        opened_protein_store_dict[store_key] = {'seq': store_seq, 'index': np.load(pwd_store_index_file, mmap_mode='r')}
+
+    return opened_protein_store_dict[store_key]
+
+
+def get_protein_sequence(protein_store, gene_id):
+
+    # None for genes without sequence
+    seq_offset, seq_len = protein_store['index'][gene_id].tolist()
+    if seq_len == 0:
+        return None
+    return protein_store['seq'][seq_offset:(seq_offset + seq_len)].tobytes().decode()
+
+
+def write_protein_sequences(protein_store, gene_id_list, gene_name_list, output_file):
+
+    # genes without sequence are skipped, returns ids of written genes
+    written_gene_id_list = []
+    output_handle = open(output_file, 'w')
+    for gene_id, gene_name in zip(gene_id_list, gene_name_list):
+        gene_seq = get_protein_sequence(protein_store, gene_id)
+        if gene_seq is not None:
+            output_handle.write('>%s\n%s\n' % (gene_name, gene_seq))
+            written_gene_id_list.append(gene_id)
+    output_handle.close()
+
+    return written_gene_id_list
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import shutil
+from MetaCHIP.MetaCHIP_config import config_file_path
+from MetaCHIP.checkpoint_manifest import get_file_hash, get_unit_hash
+
+
+# Content-addressed cache of external tool outputs, shared by runs and projects.
+#
+# Entries are keyed by the hash of the tool executable, MetaCHIP version, parameters and input files, and
+# kept in <cache folder>/<first 2 characters of key>/<key>/, holding a copy of each output file and the result
+# of the unit (result.json). Entries are written to a temporary folder first and renamed into place, the
+# modification time of an entry is its last use. Entries used least recently are removed by trim_result_cache
+# once the cache grows over its size limit. Cache settings are copied to the workers of the persistent pool.
+# The same layout is used by the gene tree store of a project (see BP.py), which is not size limited.
+
+result_cache_setting_dict = {'folder': None, 'max_size': 0}
+
+
+def set_result_cache_settings(pwd_cache_folder, max_size_gb):
+    if (pwd_cache_folder is not None) and (not os.path.isdir(pwd_cache_folder)):
+        os.makedirs(pwd_cache_folder)
+    load_result_cache_settings({'folder': None if pwd_cache_folder is None else os.path.abspath(pwd_cache_folder),
+                                'max_size': int(float(max_size_gb) * 1024 * 1024 * 1024)})
+
+
+def load_result_cache_settings(setting_dict):
+    result_cache_setting_dict['folder'] = setting_dict['folder']
+    result_cache_setting_dict['max_size'] = setting_dict['max_size']
+
+
+def get_result_cache_settings():
+    return dict(result_cache_setting_dict)
+
+
+def get_tool_unit_hash(pwd_exe_list, parameter_list, pwd_input_file_list):
+
+    # tools are identified by the content of their executable
+    exe_hash_list = [open('%s/VERSION' % config_file_path).readline().strip()]
+    for pwd_exe in pwd_exe_list:
+        pwd_exe_found = shutil.which(pwd_exe) if hasattr(shutil, 'which') else None
+        exe_hash_list.append(get_file_hash(pwd_exe_found) if pwd_exe_found is not None else os.path.basename(pwd_exe))
+
+    return get_unit_hash(exe_hash_list + list(parameter_list), pwd_input_file_list)
+
+
+def get_cache_key(pwd_exe_list, parameter_list, pwd_input_file_list):
+
+    # returns None if the cache is disabled
+    if result_cache_setting_dict['folder'] is None:
+        return None
+
+    return get_tool_unit_hash(pwd_exe_list, parameter_list, pwd_input_file_list)
+
+
+def get_cached_result(cache_key, pwd_output_file_dict, pwd_cache_folder=None):
+
+    # copies cached files to their destination (cached file name --> destination), None if not cached,
+    # entries are read from the shared cache unless another folder with the same layout is given
+    if pwd_cache_folder is None:
+        pwd_cache_folder = result_cache_setting_dict['folder']
+    if (cache_key is None) or (pwd_cache_folder is None):
+        return None
+
+    pwd_cache_entry = '%s/%s/%s' % (pwd_cache_folder, cache_key[:2], cache_key)
+    try:
+        with open('%s/result.json' % pwd_cache_entry) as result_handle:
+            cached_result = json.load(result_handle)
+        for cached_file_name, pwd_output_file in pwd_output_file_dict.items():
+            shutil.copyfile('%s/%s' % (pwd_cache_entry, cached_file_name), pwd_output_file)
+        os.utime(pwd_cache_entry, None)
+    except (IOError, OSError, ValueError):
+
+        # entry missing, incomplete or removed by another run while reading
+        return None
+
+    return cached_result
+
+
+def store_cached_result(cache_key, pwd_output_file_dict, unit_result=True, pwd_cache_folder=None):
+
+    # outputs are copied, as MetaCHIP may rewrite its own files in place
+    if pwd_cache_folder is None:
+        pwd_cache_folder = result_cache_setting_dict['folder']
+    if (cache_key is None) or (pwd_cache_folder is None):
+        return
+
+    pwd_cache_entry = '%s/%s/%s' % (pwd_cache_folder, cache_key[:2], cache_key)
+    pwd_cache_entry_tmp = '%s.tmp_%s' % (pwd_cache_entry, os.getpid())
+    if os.path.isdir(pwd_cache_entry):
+        return
+    try:
+        os.makedirs(pwd_cache_entry_tmp)
+        for cached_file_name, pwd_output_file in pwd_output_file_dict.items():
+            shutil.copyfile(pwd_output_file, '%s/%s' % (pwd_cache_entry_tmp, cached_file_name))
+        with open('%s/result.json' % pwd_cache_entry_tmp, 'w') as result_handle:
+            json.dump(unit_result, result_handle)
+        os.rename(pwd_cache_entry_tmp, pwd_cache_entry)
+    except (IOError, OSError):
+
+        # e.g. stored by another worker in between or cache folder not writable, the cache is optional
+        shutil.rmtree(pwd_cache_entry_tmp, ignore_errors=True)
+
+
+def trim_result_cache():
+
+    # remove least recently used entries until the cache fits into its size limit, returns (entries, bytes) removed
+    pwd_cache_folder = result_cache_setting_dict['folder']
+    if pwd_cache_folder is None:
+        return 0, 0
+
+    cache_entry_list = []
+    cache_size = 0
+    for key_prefix in os.listdir(pwd_cache_folder):
+        pwd_key_prefix_folder = '%s/%s' % (pwd_cache_folder, key_prefix)
+        if not os.path.isdir(pwd_key_prefix_folder):
+            continue
+        for cache_key in os.listdir(pwd_key_prefix_folder):
+            pwd_cache_entry = '%s/%s' % (pwd_key_prefix_folder, cache_key)
+            try:
+                entry_size = sum([os.path.getsize('%s/%s' % (pwd_cache_entry, i)) for i in os.listdir(pwd_cache_entry)])
+                entry_time = os.path.getmtime(pwd_cache_entry)
+            except OSError:
+                continue
+
+            # temporary folders of interrupted runs are removed after a day
+            if '.tmp_' in cache_key:
+                if entry_time < time.time() - 86400:
+                    shutil.rmtree(pwd_cache_entry, ignore_errors=True)
+                continue
+            cache_entry_list.append((entry_time, entry_size, pwd_cache_entry))
+            cache_size += entry_size
+
+    removed_entry_num = 0
+    removed_size = 0
+    for entry_time, entry_size, pwd_cache_entry in sorted(cache_entry_list):
+        if cache_size - removed_size <= result_cache_setting_dict['max_size']:
+            break
+        shutil.rmtree(pwd_cache_entry, ignore_errors=True)
+        removed_entry_num += 1
+        removed_size += entry_size
+
+    return removed_entry_num, removed_size
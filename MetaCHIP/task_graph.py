@@ -0,0 +1,73 @@
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+# Tasks of a stage are run on the persistent worker pool (see worker_pool.py) as soon as their dependencies
+# are finished, instead of waiting for all tasks of the previous step.
+#
+# task: name --> worker function (None for tasks only used to wait for their dependencies), argument list,
+#                names of dependencies and a callback run in the parent with the result of the task.
+# Callbacks may add tasks to the graph while it is running.
+
+
+def create_task_graph():
+    return {'task': {}, 'dependent': {}, 'waiting_num': {}, 'finished': set(), 'ready': []}
+
+
+def add_task(task_graph, task_name, worker_function, argument_list, dependency_list=(), callback=None):
+
+    if task_name in task_graph['task']:
+        raise ValueError('Task %s was added twice' % task_name)
+
+    task_graph['task'][task_name] = [worker_function, argument_list, callback]
+    waiting_num = 0
+    for dependency in dependency_list:
+        if dependency not in task_graph['finished']:
+            task_graph['dependent'].setdefault(dependency, []).append(task_name)
+            waiting_num += 1
+    task_graph['waiting_num'][task_name] = waiting_num
+    if waiting_num == 0:
+        task_graph['ready'].append(task_name)
+
+
+def run_task_graph(task_graph, pool):
+
+    finished_queue = queue.Queue()
+    running_num = 0
+    while True:
+
+        # submit tasks with finished dependencies
+        while len(task_graph['ready']) > 0:
+            task_name = task_graph['ready'].pop(0)
+            worker_function, argument_list, callback = task_graph['task'][task_name]
+            if worker_function is None:
+                finished_queue.put((task_name, None, None))
+            else:
+                pool.apply_async(worker_function, (argument_list,),
+                                 callback=lambda result, task_name=task_name: finished_queue.put((task_name, result, None)),
+                                 error_callback=lambda error, task_name=task_name: finished_queue.put((task_name, None, error)))
+            running_num += 1
+
+        if running_num == 0:
+            break
+
+        task_name, result, error = finished_queue.get()
+        running_num -= 1
+        if error is not None:
+            raise error
+
+        task_graph['finished'].add(task_name)
+        callback = task_graph['task'][task_name][2]
+        if callback is not None:
+            callback(result)
+        for dependent in task_graph['dependent'].pop(task_name, []):
+            task_graph['waiting_num'][dependent] -= 1
+            if task_graph['waiting_num'][dependent] == 0:
+                task_graph['ready'].append(dependent)
+
+    # tasks depending on missing tasks would never start
+    unfinished_task_list = sorted(set(task_graph['task']) - task_graph['finished'])
+    if len(unfinished_task_list) > 0:
+        raise RuntimeError('Tasks with unfinished dependencies: %s' % ','.join(unfinished_task_list[:10]))
@@ -0,0 +1,76 @@
+import multiprocessing as mp
+
+
+# Core budget shared by the parent and the workers of the persistent pool (see worker_pool.py), for external tools
+# able to use multiple threads (blastn -num_threads, hmmsearch --cpu, mafft --thread, FastTreeMP).
+#
+# thread_budget_array: [cores of the current stage, cores in use, jobs not started yet]
+#
+# Threads are assigned when a job starts: one thread while more jobs are waiting than cores are free, the free
+# cores are shared by the remaining jobs as the queue drains. Jobs not calling acquire_threads (e.g. skipped
+# candidates) are counted as waiting until the end of the stage, which only makes the assignment conservative.
+
+thread_budget_dict = {'array': None}
+
+
+def create_thread_budget():
+    return mp.Array('l', 3)
+
+
+def load_thread_budget(thread_budget_array):
+    thread_budget_dict['array'] = thread_budget_array
+
+
+def start_thread_budget(core_num, job_num):
+
+    # called by the parent before submitting the jobs of a stage
+    thread_budget_array = thread_budget_dict['array']
+    if thread_budget_array is not None:
+        with thread_budget_array.get_lock():
+            thread_budget_array[0] = core_num
+            thread_budget_array[1] = 0
+            thread_budget_array[2] = job_num
+
+
+def add_thread_budget_jobs(job_num):
+
+    # for jobs added to the current stage while it is running
+    thread_budget_array = thread_budget_dict['array']
+    if thread_budget_array is not None:
+        with thread_budget_array.get_lock():
+            thread_budget_array[2] += job_num
+
+
+def acquire_threads(max_thread_num=None):
+
+    # one thread if no budget was started in this process
+    thread_budget_array = thread_budget_dict['array']
+    if thread_budget_array is None:
+        return 1
+
+    with thread_budget_array.get_lock():
+        thread_budget_array[2] = max(thread_budget_array[2] - 1, 0)
+        free_core_num = thread_budget_array[0] - thread_budget_array[1]
+        thread_num = 1
+        if free_core_num > 1:
+            thread_num = max(1, free_core_num // min(thread_budget_array[2] + 1, free_core_num))
+        if max_thread_num is not None:
+            thread_num = min(thread_num, max_thread_num)
+        thread_budget_array[1] += thread_num
+
+    return thread_num
+
+
+def release_threads(thread_num):
+    thread_budget_array = thread_budget_dict['array']
+    if thread_budget_array is not None:
+        with thread_budget_array.get_lock():
+            thread_budget_array[1] -= thread_num
+
+
+def get_fasttree_env(pwd_fasttree_exe, thread_num):
+
+    # FastTreeMP takes the number of threads from OMP_NUM_THREADS, the single-threaded FastTree ignores it
+    if 'MP' in pwd_fasttree_exe.split('/')[-1]:
+        return {'OMP_NUM_THREADS': str(thread_num)}
+    return None
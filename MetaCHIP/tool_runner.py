@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+import shutil
+import threading
+import subprocess
+
+
+# External tools are started from argument lists without a shell. Wall time, CPU time, peak RSS and exit status
+# of each invocation are appended to the tool run log (if set), together with whether it was killed by its timeout.
+# Runner settings are copied to the workers of the persistent pool (see worker_pool.py).
+
+tool_run_log_header = 'Tool\tExit_status\tWall_time(s)\tCPU_time(s)\tPeak_RSS(MB)\tTimed_out\tCommand\n'
+tool_runner_setting_dict = {'log': None, 'timeout': {}}
+
+
+def parse_tool_timeouts(tool_timeout_str):
+
+    # e.g. "blastn=86400,mafft=3600", in seconds
+    tool_timeout_dict = {}
+    if tool_timeout_str is not None:
+        for each_timeout in tool_timeout_str.split(','):
+            each_timeout_split = each_timeout.strip().split('=')
+            if len(each_timeout_split) != 2:
+                print('Unrecognized tool timeout: %s, should be in format of tool=seconds' % each_timeout)
+                exit()
+            tool_timeout_dict[each_timeout_split[0].strip()] = float(each_timeout_split[1])
+    return tool_timeout_dict
+
+
+def set_tool_runner_settings(pwd_tool_run_log, tool_timeout_dict):
+    if (pwd_tool_run_log is not None) and (not os.path.isfile(pwd_tool_run_log)):
+        with open(pwd_tool_run_log, 'w') as tool_run_log_handle:
+            tool_run_log_handle.write(tool_run_log_header)
+    load_tool_runner_settings({'log': pwd_tool_run_log, 'timeout': dict(tool_timeout_dict)})
+
+
+def load_tool_runner_settings(setting_dict):
+    tool_runner_setting_dict['log'] = setting_dict['log']
+    tool_runner_setting_dict['timeout'] = dict(setting_dict['timeout'])
+
+
+def get_tool_runner_settings():
+    return {'log': tool_runner_setting_dict['log'], 'timeout': dict(tool_runner_setting_dict['timeout'])}
+
+
+def get_exit_status(wait_status):
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+def run_tool(cmd_list, pwd_stdout_file=None, pwd_stderr_file=None, timeout=None, cwd=None, env=None):
+
+    # stdout/stderr are inherited if no file provided, env: variables added to the environment,
+    # returns exit status (negative if killed by a signal)
+    cmd_list = [str(i) for i in cmd_list]
+    tool_name = os.path.basename(cmd_list[0])
+    if timeout is None:
+        timeout = tool_runner_setting_dict['timeout'].get(tool_name)
+
+    stdout_handle = None if pwd_stdout_file is None else open(pwd_stdout_file, 'w')
+    stderr_handle = None if pwd_stderr_file is None else open(pwd_stderr_file, 'w')
+    start_time = time.time()
+    timed_out = []
+    tool_env = None
+    if env is not None:
+        tool_env = dict(os.environ)
+        tool_env.update(env)
+    try:
+        tool_process = subprocess.Popen(cmd_list, stdout=stdout_handle, stderr=stderr_handle, cwd=cwd, env=tool_env)
+    except OSError:
+        exit_status, cpu_time, peak_rss = 127, 0.0, 0.0
+    else:
+        def kill_timed_out_process():
+            timed_out.append(True)
+            tool_process.kill()
+
+        timeout_timer = None
+        if timeout is not None:
+            timeout_timer = threading.Timer(timeout, kill_timed_out_process)
+            timeout_timer.start()
+
+        if hasattr(os, 'wait4'):
+            wait_status, tool_rusage = os.wait4(tool_process.pid, 0)[1:]
+            exit_status = get_exit_status(wait_status)
+            tool_process.returncode = exit_status
+            cpu_time = tool_rusage.ru_utime + tool_rusage.ru_stime
+
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS, it may include the forking process before exec
+            peak_rss = tool_rusage.ru_maxrss / 1024.0
+            if sys.platform == 'darwin':
+                peak_rss = peak_rss / 1024.0
+        else:
+            exit_status, cpu_time, peak_rss = tool_process.wait(), float('nan'), float('nan')
+
+        if timeout_timer is not None:
+            timeout_timer.cancel()
+    wall_time = time.time() - start_time
+
+    for each_handle in [stdout_handle, stderr_handle]:
+        if each_handle is not None:
+            each_handle.close()
+
+    if tool_runner_setting_dict['log'] is not None:
+        with open(tool_runner_setting_dict['log'], 'a') as tool_run_log_handle:
+            tool_run_log_handle.write('%s\t%s\t%.2f\t%.2f\t%.1f\t%s\t%s\n' % (tool_name, exit_status, wall_time, cpu_time, peak_rss, 'yes' if timed_out else 'no', ' '.join(cmd_list)))
+
+    return exit_status
+
+
+def run_required_tool(cmd_list, pwd_stdout_file=None, pwd_stderr_file=None, timeout=None, cwd=None, env=None):
+
+    # for tools the stage can not continue without, a failure stops the stage with the failed command
+    exit_status = run_tool(cmd_list, pwd_stdout_file=pwd_stdout_file, pwd_stderr_file=pwd_stderr_file, timeout=timeout, cwd=cwd, env=env)
+    if exit_status != 0:
+        raise RuntimeError('%s exited with status %s: %s' % (os.path.basename(str(cmd_list[0])), exit_status, ' '.join([str(i) for i in cmd_list])))
+
+
+def get_tool_run_summary(pwd_tool_run_log):
+
+    # number of runs, failed runs, total wall and CPU time and the highest peak RSS of each tool
+    tool_summary_dict = {}
+    tool_list = []
+    for tool_run in open(pwd_tool_run_log):
+        if not tool_run.startswith('Tool\t'):
+            tool_run_split = tool_run.rstrip('\n').split('\t')
+            tool_name = tool_run_split[0]
+            if tool_name not in tool_summary_dict:
+                tool_summary_dict[tool_name] = [0, 0, 0.0, 0.0, 0.0]
+                tool_list.append(tool_name)
+            tool_summary = tool_summary_dict[tool_name]
+            tool_summary[0] += 1
+            tool_summary[1] += int(tool_run_split[1]) != 0
+            tool_summary[2] += float(tool_run_split[2])
+            tool_summary[3] += float(tool_run_split[3])
+            tool_summary[4] = max(tool_summary[4], float(tool_run_split[4]))
+
+    return ['%s: %s runs (%s failed), wall time %.1fs, CPU time %.1fs, peak RSS %.1fMB' % tuple([i] + tool_summary_dict[i]) for i in tool_list]
+
+
+############################################ in-process file operations #############################################
+
+def concatenate_files(pwd_file_list, pwd_output_file):
+    with open(pwd_output_file, 'wb') as output_handle:
+        for pwd_file in pwd_file_list:
+            with open(pwd_file, 'rb') as input_handle:
+                shutil.copyfileobj(input_handle, output_handle)
+
+
+def sort_file_lines(pwd_input_file, pwd_output_file):
+
+    # replaces "cat file | sort > file_sorted", lines are sorted by code point
+    with open(pwd_input_file) as input_handle:
+        line_list = [i if i.endswith('\n') else i + '\n' for i in input_handle]
+    line_list.sort()
+    with open(pwd_output_file, 'w') as output_handle:
+        output_handle.writelines(line_list)
+
+
+def copy_to_folder(pwd_file, pwd_folder):
+
+    # missing files are skipped, as with the cp/mv commands replaced by these functions
+    if os.path.isfile(pwd_file):
+        shutil.copy(pwd_file, '%s/%s' % (pwd_folder, os.path.basename(pwd_file)))
+
+
+def move_to_folder(pwd_file, pwd_folder):
+    if os.path.exists(pwd_file):
+        shutil.move(pwd_file, '%s/%s' % (pwd_folder, os.path.basename(pwd_file)))
+
+
+def remove_path(target):
+    if os.path.isdir(target) and (not os.path.islink(target)):
+        shutil.rmtree(target, ignore_errors=True)
+    elif os.path.lexists(target):
+        os.remove(target)
@@ -1,206 +1,73 @@
+import argparse
+from MetaCHIP.contig_match import get_contig_match_hits, classify_contig_matches
 
 
-def check_match_direction(blast_hit_splitted):
-    query_start = int(blast_hit_splitted[6])
-    query_end = int(blast_hit_splitted[7])
-    subject_start = int(blast_hit_splitted[8])
-    subject_end = int(blast_hit_splitted[9])
-    query_direction = query_end - query_start
-    subject_direction = subject_end - subject_start
+tuning_usage = '''
+=================================== tuning_full_length_and_end_match example commands ===================================
 
-    same_match_direction = True
-    if ((query_direction > 0) and (subject_direction < 0)) or ((query_direction < 0) and (subject_direction > 0)):
-        same_match_direction = False
+# re-compute match categories of BM candidates with different cutoffs, without running blastn again
+python3 tuning_full_length_and_end_match.py -i NorthSea_c5_contig_match_hits.txt -ei 90 -cov 0.85
+python3 tuning_full_length_and_end_match.py -i NorthSea_c5_contig_match_hits.txt -end_gap 300 -o NorthSea_c5_match_category.txt
 
-    return same_match_direction
+# input file: [prefix]_[rank]_contig_match_hits.txt in the BM output folder
 
+=========================================================================================================================
+'''
 
-def check_full_length_and_end_match(qualified_ctg_match_list, identity_cutoff):
 
-    ######################################## check full length match ########################################
+def read_contig_match_hits(pwd_contig_match_hits_file):
 
-    query_len = int(qualified_ctg_match_list[0][12])
-    subject_len = int(qualified_ctg_match_list[0][13])
+    candidate_list = []
+    candidate_hit_list = []
+    candidate_index_dict = {}
+    for contig_hit in open(pwd_contig_match_hits_file):
+        if not contig_hit.startswith('Gene_1\t'):
+            contig_hit_split = contig_hit.strip().split('\t')
+            gene_pair = (contig_hit_split[0], contig_hit_split[1])
+            if gene_pair not in candidate_index_dict:
+                candidate_index_dict[gene_pair] = len(candidate_list)
+                candidate_list.append(gene_pair)
+                candidate_hit_list.append([])
+            candidate_hit_list[candidate_index_dict[gene_pair]].append(contig_hit_split[2:])
 
-    # get position list of matched regions
-    query_matched_region_list = []
-    subject_matched_region_list = []
-    for ctg_match in qualified_ctg_match_list:
-        query_start = int(ctg_match[6])
-        query_end = int(ctg_match[7])
-        subject_start = int(ctg_match[8])
-        subject_end = int(ctg_match[9])
-        query_matched_region = sorted([query_start, query_end])
-        subject_matched_region = sorted([subject_start, subject_end])
-        query_matched_region_list.append(query_matched_region)
-        subject_matched_region_list.append(subject_matched_region)
+    return candidate_list, candidate_hit_list
 
-    # get total length of query matched regions
-    query_matched_len_total = 0
-    current_query_end = 0
-    for query_matched in sorted(query_matched_region_list):
 
-        if query_matched_len_total == 0:
-            query_matched_len_total = query_matched[1] - query_matched[0] + 1
-            current_query_end = query_matched[1]
+def tuning_full_length_and_end_match(args):
 
-        elif query_matched[0] > current_query_end:
-            query_matched_len_total += query_matched[1] - query_matched[0] + 1
+    pwd_contig_match_hits_file = args['i']
+    output_file =                args['o']
 
-        elif query_matched[0] < current_query_end:
-            if query_matched[1] > current_query_end:
-                query_matched_len_total += query_matched[1] - current_query_end
+    candidate_list, candidate_hit_list = read_contig_match_hits(pwd_contig_match_hits_file)
+    contig_match_hits = get_contig_match_hits(candidate_hit_list, min_align_len=args['al'])
+    match_category, query_covered_len, subject_covered_len = classify_contig_matches(contig_match_hits, len(candidate_list), args['ei'],
+                                                                                     coverage_cutoff=args['cov'],
+                                                                                     end_gap_len=args['end_gap'],
+                                                                                     concatenate_gap_len=args['concat_gap'],
+                                                                                     identity_window=args['iden_window'])
 
-        elif query_matched[0] == current_query_end:
-            query_matched_len_total += query_matched[1] - current_query_end
+    # candidates without qualified contig match hits are not in the input file and are always normal
+    for each_category in ['normal', 'end_match', 'full_length_match']:
+        print('%s\t%s' % (each_category, int((match_category == each_category).sum())))
 
-    # get total length of subject matched regions
-    subject_matched_len_total = 0
-    current_subject_end = 0
-    for subject_matched in sorted(subject_matched_region_list):
+    if output_file is not None:
+        output_file_handle = open(output_file, 'w')
+        output_file_handle.write('Gene_1\tGene_2\tMatch_category\tQuery_covered_len\tSubject_covered_len\n')
+        for gene_pair, category, query_len, subject_len in zip(candidate_list, match_category.tolist(), query_covered_len.tolist(), subject_covered_len.tolist()):
+            output_file_handle.write('%s\t%s\t%s\t%s\t%s\n' % (gene_pair[0], gene_pair[1], category, query_len, subject_len))
+        output_file_handle.close()
 
-        if subject_matched_len_total == 0:
-            subject_matched_len_total = subject_matched[1] - subject_matched[0] + 1
-            current_subject_end = subject_matched[1]
 
-        elif subject_matched[0] > current_subject_end:
-            subject_matched_len_total += subject_matched[1] - subject_matched[0] + 1
+if __name__ == '__main__':
 
-        elif subject_matched[0] < current_subject_end:
-            if subject_matched[1] > current_subject_end:
-                subject_matched_len_total += subject_matched[1] - current_subject_end
-
-        elif subject_matched[0] == current_subject_end:
-            subject_matched_len_total += subject_matched[1] - current_subject_end
-
-
-    # get total coverage for query and subject
-    query_cov_total = query_matched_len_total/query_len
-    subject_cov_total = subject_matched_len_total/subject_len
-
-    # get match category
-    match_category = 'normal'
-    best_hit_end_gap_len = 200
-    gap_cutoff_for_concatenating = 300
-
-    # full length match: coverage cutoff 90%
-    if (query_cov_total >= 0.90) or (subject_cov_total >= 0.90):
-        match_category = 'full_length_match'
-
-
-    ######################################## check end match ########################################
-
-    else:
-
-        # read in best hit information
-        best_hit = qualified_ctg_match_list[0]
-        best_hit_identity = float(best_hit[2])
-        best_hit_query_start = int(best_hit[6])
-        best_hit_query_end = int(best_hit[7])
-        best_hit_subject_start = int(best_hit[8])
-        best_hit_subject_end = int(best_hit[9])
-        query_len = int(best_hit[12])
-        subject_len = int(best_hit[13])
-        best_hit_same_direction = check_match_direction(best_hit)
-
-        # concatenate continuously matched blocks with gap less than 200bp
-        matched_block_query_start = best_hit_query_start
-        matched_block_query_end = best_hit_query_end
-        matched_block_subject_start = best_hit_subject_start
-        matched_block_subject_end = best_hit_subject_end
-
-        if best_hit_identity >= identity_cutoff:
-
-            for matched_block in qualified_ctg_match_list[1:]:
-
-                current_block_identity = float(matched_block[2])
-                current_block_direction = check_match_direction(matched_block)
-
-                # if identity difference <= 1 and has same match direction with the best hit
-                if (-6 <= (best_hit_identity - current_block_identity) <= 6) and (current_block_direction == best_hit_same_direction):
-
-                    current_query_start = int(matched_block[6])
-                    current_query_end = int(matched_block[7])
-                    current_subject_start = int(matched_block[8])
-                    current_subject_end = int(matched_block[9])
-
-                    if best_hit_same_direction is True:
-
-                        # situation 1
-                        if ((current_query_start >= matched_block_query_start) and (current_query_end <= matched_block_query_end)) and ((current_subject_start >= matched_block_subject_start) and (current_subject_end <= matched_block_subject_end)):
-                            pass  # do nothing
-
-                        # situation 2
-                        if ((current_query_start > matched_block_query_start) and (current_query_end > matched_block_query_end)) and ((current_subject_start > matched_block_subject_start) and (current_subject_end > matched_block_subject_end)) and (-gap_cutoff_for_concatenating <= (current_query_start - matched_block_query_end) <= gap_cutoff_for_concatenating) and (-gap_cutoff_for_concatenating <= (current_subject_start - matched_block_subject_end) <= gap_cutoff_for_concatenating):
-                            matched_block_query_end = current_query_end
-                            matched_block_subject_end = current_subject_end
-
-                        # situation 3
-                        if ((current_query_start < matched_block_query_start) and (current_query_end < matched_block_query_end)) and ((current_subject_start < matched_block_subject_start) and (current_subject_end < matched_block_subject_end)) and (-gap_cutoff_for_concatenating <= (matched_block_query_start - current_query_end) <= gap_cutoff_for_concatenating) and (-gap_cutoff_for_concatenating <= (matched_block_subject_start - current_subject_end) <= gap_cutoff_for_concatenating):
-                            matched_block_query_start = current_query_start
-                            matched_block_subject_start = current_subject_start
-
-                    if best_hit_same_direction is False:
-
-                        # situation 1
-                        if ((current_query_start >= matched_block_query_start) and (current_query_end <= matched_block_query_end)) and ((current_subject_start <= matched_block_subject_start) and (current_subject_end >= matched_block_subject_end)):
-                            pass
-
-                        # situation 2
-                        if ((current_query_start > matched_block_query_start) and (current_query_end > matched_block_query_end)) and ((current_subject_start < matched_block_subject_start) and (current_subject_end < matched_block_subject_end)) and (-gap_cutoff_for_concatenating <= (current_query_start - matched_block_query_end) <= gap_cutoff_for_concatenating) and (-gap_cutoff_for_concatenating <= (matched_block_subject_end - current_subject_start) <= gap_cutoff_for_concatenating):
-                            matched_block_query_end = current_query_end
-                            matched_block_subject_end = current_subject_end
-
-                        # situation 3
-                        if ((current_query_start < matched_block_query_start) and (current_query_end < matched_block_query_end)) and ((current_subject_start > matched_block_subject_start) and (current_subject_end > matched_block_subject_end)) and (-gap_cutoff_for_concatenating <= (matched_block_query_start - current_query_end) <= gap_cutoff_for_concatenating) and (-gap_cutoff_for_concatenating <= (current_subject_end - matched_block_subject_start) <= gap_cutoff_for_concatenating):
-                            matched_block_query_start = current_query_start
-                            matched_block_subject_start = current_subject_start
-
-
-            ######################################## check end_match ########################################
-
-            # situation 1
-            if (best_hit_same_direction is True) and (query_len - matched_block_query_end <= best_hit_end_gap_len) and (matched_block_subject_start <= best_hit_end_gap_len):
-                match_category = 'end_match'
-
-            # situation 2
-            elif (best_hit_same_direction is True) and (matched_block_query_start <= best_hit_end_gap_len) and (subject_len - matched_block_subject_end <= best_hit_end_gap_len):
-                match_category = 'end_match'
-
-            # situation 3
-            elif (best_hit_same_direction is False) and (query_len - matched_block_query_end <= best_hit_end_gap_len) and (subject_len - matched_block_subject_start <= best_hit_end_gap_len):
-                match_category = 'end_match'
-
-            # situation 4
-            elif (best_hit_same_direction is False) and (matched_block_query_start <= best_hit_end_gap_len) and (matched_block_subject_end <= best_hit_end_gap_len):
-                match_category = 'end_match'
-
-    return match_category
-
-
-#output_c_full_len = '/Users/songweizhi/Desktop/000/RHO2_bin_73_00772___RHO3_bin_59_01813/RHO2_bin_73_00772___RHO3_bin_59_01813_full_length.txt'
-
-#output_c_full_len = '/Users/songweizhi/Desktop/000/COS2_bin_21_00105___APA_bin_43_02125/COS2_bin_21_00105___APA_bin_43_02125_full_length.txt'
-
-output_c_full_len = '/Users/songweizhi/Desktop/000/COS3_bin_21_01438___IRC_PAM_SB0661_bin_58_00227/COS3_bin_21_01438___IRC_PAM_SB0661_bin_58_00227_full_length.txt'
-
-#output_c_full_len = '/Users/songweizhi/Desktop/000/COS4_bin_26_02662___IRC_PAM_SB0668_bin_42_00545/COS4_bin_26_02662___IRC_PAM_SB0668_bin_42_00545_full_length.txt'
-
-
-
-# get qualified_ctg_match_list
-min_ctg_match_aln_len = 100
-qualified_ctg_match_list = []
-for blast_hit in open(output_c_full_len):
-    blast_hit_split = blast_hit.strip().split('\t')
-    align_len = int(blast_hit_split[3])
-    if align_len >= min_ctg_match_aln_len:
-        qualified_ctg_match_list.append(blast_hit_split)
-
-if len(qualified_ctg_match_list) == 0:
-    match_category = 'normal'
-else:
-    match_category = check_full_length_and_end_match(qualified_ctg_match_list, 90)
-
-
-print(match_category)
+    parser = argparse.ArgumentParser(usage=tuning_usage)
+    parser.add_argument('-i',           required=True,                              help='contig match hits file from BM, e.g. [prefix]_[rank]_contig_match_hits.txt')
+    parser.add_argument('-o',           required=False, default=None,               help='output match category of each candidate')
+    parser.add_argument('-ei',          required=False, type=float, default=80,    help='end match identity cutoff, default: 80')
+    parser.add_argument('-al',          required=False, type=int,   default=100,    help='minimum alignment length of contig match hits, default: 100')
+    parser.add_argument('-cov',         required=False, type=float, default=0.9,    help='contig coverage cutoff for full length match, default: 0.9')
+    parser.add_argument('-end_gap',     required=False, type=int,   default=200,    help='maximum distance to contig ends for end match (bp), default: 200')
+    parser.add_argument('-concat_gap',  required=False, type=int,   default=300,    help='maximum gap between concatenated blocks (bp), default: 300')
+    parser.add_argument('-iden_window', required=False, type=float, default=6,      help='maximum identity difference to the best hit for concatenated blocks, default: 6')
+    args = vars(parser.parse_args())
+    tuning_full_length_and_end_match(args)
@@ -0,0 +1,98 @@
+import os
+import gc
+import atexit
+import pickle
+import multiprocessing as mp
+from MetaCHIP.tool_runner import get_tool_runner_settings, load_tool_runner_settings
+from MetaCHIP.thread_budget import create_thread_budget, load_thread_budget
+from MetaCHIP.result_cache import get_result_cache_settings, load_result_cache_settings
+
+
+# Persistent worker pool and read-only context shared by its workers.
+#
+# One pool is reused by all stages of a run. Large read-only objects of a stage (id table, group arrays,
+# query to subjects dict ...) are published once as a worker context instead of being pickled into the
+# arguments of every task, tasks only carry the context key. Workers forked after a context was published
+# inherit it, other workers load it once from its pickle file and keep it until another context is requested.
+# Workers get the tool runner settings (tool run log and timeouts, see tool_runner.py) and result cache settings
+# (see result_cache.py) of the parent and the shared core budget (see thread_budget.py) when the pool is created.
+
+worker_pool_dict = {'pool': None, 'processes': 0, 'tool_runner_settings': None, 'result_cache_settings': None}
+worker_context_dict = {}
+published_context_num_dict = {'num': 0}
+
+
+def init_worker(tool_runner_settings, result_cache_settings, thread_budget_array):
+    load_tool_runner_settings(tool_runner_settings)
+    load_result_cache_settings(result_cache_settings)
+    load_thread_budget(thread_budget_array)
+
+
+def get_worker_pool(num_threads):
+
+    # the pool is recreated if the number of threads, tool runner or result cache settings changed
+    tool_runner_settings = get_tool_runner_settings()
+    result_cache_settings = get_result_cache_settings()
+    if (worker_pool_dict['pool'] is not None) and ((worker_pool_dict['processes'] != num_threads) or (worker_pool_dict['tool_runner_settings'] != tool_runner_settings) or (worker_pool_dict['result_cache_settings'] != result_cache_settings)):
+        close_worker_pool()
+
+    if worker_pool_dict['pool'] is None:
+
+        # objects of the parent are moved out of gc tracking while forking, so forked workers share
+        # their pages instead of copying them when the garbage collector walks through them
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        thread_budget_array = create_thread_budget()
+        load_thread_budget(thread_budget_array)
+        worker_pool_dict['pool'] = mp.Pool(processes=num_threads, initializer=init_worker, initargs=(tool_runner_settings, result_cache_settings, thread_budget_array))
+        worker_pool_dict['processes'] = num_threads
+        worker_pool_dict['tool_runner_settings'] = tool_runner_settings
+        worker_pool_dict['result_cache_settings'] = result_cache_settings
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+
+    return worker_pool_dict['pool']
+
+
+def close_worker_pool():
+    if worker_pool_dict['pool'] is not None:
+        worker_pool_dict['pool'].close()
+        worker_pool_dict['pool'].join()
+        worker_pool_dict['pool'] = None
+        worker_pool_dict['processes'] = 0
+
+
+atexit.register(close_worker_pool)
+
+
+def publish_worker_context(worker_context, pwd_context_file):
+
+    # returns the context key to be passed to workers
+    published_context_num_dict['num'] += 1
+    context_key = (pwd_context_file, os.getpid(), published_context_num_dict['num'])
+    with open(pwd_context_file, 'wb') as context_file_handle:
+        pickle.dump((context_key, worker_context), context_file_handle, protocol=pickle.HIGHEST_PROTOCOL)
+    worker_context_dict[context_key] = worker_context
+
+    return context_key
+
+
+def get_worker_context(context_key):
+
+    if context_key not in worker_context_dict:
+        with open(context_key[0], 'rb') as context_file_handle:
+            stored_context_key, worker_context = pickle.load(context_file_handle)
+        if stored_context_key != context_key:
+            raise RuntimeError('Worker context %s was overwritten' % context_key[0])
+
+        # contexts of previous stages are not needed anymore
+        worker_context_dict.clear()
+        worker_context_dict[context_key] = worker_context
+
+    return worker_context_dict[context_key]
+
+
+def release_worker_context(context_key):
+    worker_context_dict.pop(context_key, None)
+    if os.path.isfile(context_key[0]):
+        os.remove(context_key[0])